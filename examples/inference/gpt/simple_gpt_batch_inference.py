@@ -40,6 +40,17 @@ def add_text_generate_args(parser):
                        help='Input prompts with each prompt within quotes and seperated by space')
     group.add_argument("--max-batch-size", type=int, default=1,
                        help='Max number of prompts to process at once')
+    group.add_argument("--dynamic-batching", action='store_true', default=False,
+                       help='Let prompts join and leave the batch after every generated token. '
+                       'Requires --transformer-impl local, as the Transformer Engine attention '
+                       'does not support the per-token attention mask of dynamic batches')
+    group.add_argument("--kv-block-size", type=int, default=16,
+                       help='Number of tokens per block of the key-value memory with dynamic batching')
+    group.add_argument("--num-kv-blocks", type=int, default=None,
+                       help='Number of blocks of the key-value memory with dynamic batching. '
+                       'Defaults to enough blocks for max batch size prompts of the longest length')
+    group.add_argument("--enable-prefix-caching", action='store_true', default=False,
+                       help='Share the key-value memory of common prompt prefixes across requests')
     return parser
 
 
@@ -67,7 +78,13 @@ def get_inference_engine(args: Namespace, model: MegatronModule) -> AbstractEngi
 
     inference_wrapped_model = GPTInferenceWrapper(model, inference_wrapper_config)
     text_generation_controller = SimpleTextGenerationController(inference_wrapped_model=inference_wrapped_model, tokenizer=tokenizer)
-    return MCoreEngine(text_generation_controller=text_generation_controller, max_batch_size=args.max_batch_size)
+    return MCoreEngine(
+        text_generation_controller=text_generation_controller,
+        max_batch_size=args.max_batch_size,
+        kv_block_size=args.kv_block_size,
+        num_kv_blocks=args.num_kv_blocks,
+        enable_prefix_caching=args.enable_prefix_caching,
+    )
             
 def main():
     """Main program."""
@@ -97,7 +114,9 @@ def main():
         num_tokens_to_generate=args.num_tokens_to_generate)
 
     results: List[InferenceRequest] = inference_engine.generate(
-        prompts=args.prompts, common_inference_params=common_inference_params
+        prompts=args.prompts,
+        common_inference_params=common_inference_params,
+        dynamic_generation=args.dynamic_batching,
     )
     
     if torch.distributed.get_rank() == 0:
@@ -21,8 +21,7 @@ class BERTMaskedWordPieceDatasetConfig(MaskedWordPieceDatasetConfig):
     """Option to perform the next sequence prediction during sampling"""
 
     def __post_init__(self) -> None:
-        """Do asserts and set fields post init
-        """
+        """Do asserts and set fields post init"""
         super().__post_init__()
 
         assert self.classification_head is not None
@@ -73,22 +72,26 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
         """
         return super(
             BERTMaskedWordPieceDataset, BERTMaskedWordPieceDataset
-        )._key_config_attributes() + ["classification_head",]
+        )._key_config_attributes() + [
+            "classification_head",
+        ]
 
     def __getitem__(self, idx: int) -> Dict[str, Union[int, numpy.ndarray]]:
         """Abstract method implementation
- 
+
         Args:
             idx (int): The index into the dataset
 
         Returns:
-            Dict[str, Union[int, numpy.ndarray]]: The 
+            Dict[str, Union[int, numpy.ndarray]]: The
         """
         idx_beg, idx_end, target_sequence_length = self.sample_index[idx]
         sample = [self.dataset[i] for i in range(idx_beg, idx_end)]
-        numpy_random_state = numpy.random.RandomState(
-            seed=(self.config.random_seed + idx) % 2 ** 32
-        )
+        sample_word_starts = [
+            self._get_sequence_word_starts(i, sequence)
+            for i, sequence in zip(range(idx_beg, idx_end), sample)
+        ]
+        numpy_random_state = numpy.random.RandomState(seed=(self.config.random_seed + idx) % 2**32)
 
         assert target_sequence_length <= self.config.sequence_length
 
@@ -102,13 +105,18 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
                 pivot = numpy_random_state.randint(low=1, high=len(sample))
             is_next_random = numpy_random_state.random() < 0.5
         split_A = []
-        for sample_a in sample[:pivot]:
+        word_starts_A = []
+        for sample_a, word_starts_a in zip(sample[:pivot], sample_word_starts[:pivot]):
             split_A.extend(sample_a)
+            word_starts_A.extend(word_starts_a)
         split_B = []
-        for sample_b in sample[pivot:]:
+        word_starts_B = []
+        for sample_b, word_starts_b in zip(sample[pivot:], sample_word_starts[pivot:]):
             split_B.extend(sample_b)
+            word_starts_B.extend(word_starts_b)
         if is_next_random:
             split_A, split_B = split_B, split_A
+            word_starts_A, word_starts_B = word_starts_B, word_starts_A
 
         # Trim the subsegments from either end to a desired joint length
         length_A = len(split_A)
@@ -117,11 +125,16 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
             truncated = False
         else:
             while length_A + length_B > target_sequence_length:
-                split = split_A if length_A > length_B else split_B
+                if length_A > length_B:
+                    split, word_starts = split_A, word_starts_A
+                else:
+                    split, word_starts = split_B, word_starts_B
                 if numpy_random_state.random() < 0.5:
                     del split[0]
+                    del word_starts[0]
                 else:
                     del split[-1]
+                    del word_starts[-1]
                 length_A = len(split_A)
                 length_B = len(split_B)
             truncated = True
@@ -132,14 +145,16 @@ class BERTMaskedWordPieceDataset(MaskedWordPieceDataset):
             *split_A,
             self.config.tokenizer.sep,
         ]
+        word_starts = [True, *word_starts_A, True]
         assignments = [0 for _ in range(1 + len(split_A) + 1)]
         if split_B:
             tokens += [*split_B, self.config.tokenizer.sep]
+            word_starts += [*word_starts_B, True]
             assignments += [1 for _ in range(len(split_B) + 1)]
 
         # Masking
         tokens, masked_positions, masked_labels, _, _ = self._create_masked_lm_predictions(
-            tokens, target_sequence_length, numpy_random_state
+            tokens, target_sequence_length, numpy_random_state, word_starts
         )
 
         # Pad the sequences and convert to NumPy
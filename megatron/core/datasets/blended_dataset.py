@@ -3,6 +3,7 @@
 import hashlib
 import json
 import logging
+import math
 import os
 import time
 from collections import OrderedDict
@@ -13,7 +14,7 @@ import torch
 
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
 from megatron.core.datasets.megatron_dataset import MegatronDataset
-from megatron.core.datasets.utils import normalize
+from megatron.core.datasets.utils import RankPrefetchWindow, Split, normalize
 from megatron.core.utils import log_single_rank
 
 logger = logging.getLogger(__name__)
@@ -31,10 +32,10 @@ class BlendedDataset(torch.utils.data.Dataset):
 
         size (Optional[int]): The number of samples to draw from the blend. If None, for each dataset index idx draw exactly weights[idx] samples from datasets[idx].
 
-        config (BlendedMegatronDatasetConfig): The config
+        config (BlendedMegatronDatasetConfig): The config. For the train split, its blend_schedule, if any, replaces the weights.
 
     Raises:
-        RuntimeError: When the dataset has fewer or more samples than 'size' post-initialization
+        RuntimeError: When the dataset has fewer or more samples than 'size' post-initialization, or when the blend schedule draws more samples from a dataset than it has
     """
 
     def __init__(
@@ -68,12 +69,37 @@ class BlendedDataset(torch.utils.data.Dataset):
         self.size = size
         self.config = config
 
+        self.blend_schedule = None
+        if self.config.blend_schedule is not None and self.split == Split.train:
+            assert self.size is not None, "a blend schedule requires a size"
+            assert all(len(weights) == len(self.datasets) for _, weights in config.blend_schedule)
+            self.blend_schedule = [
+                [int(sample), normalize(weights)] for sample, weights in config.blend_schedule
+            ]
+        elif self.config.compact_blending_indices and self.size is not None:
+            # Fixed weights are a schedule of one breakpoint, which draws the same indices
+            self.blend_schedule = [[0, self.weights]]
+
+        # Whether to keep only the number of samples drawn from each dataset before each block
+        self.compact = self.config.compact_blending_indices and self.blend_schedule is not None
+
         unique_identifiers = OrderedDict()
         unique_identifiers["class"] = type(self).__name__
         unique_identifiers["datasets"] = [dataset.unique_identifiers for dataset in self.datasets]
+        if self.config.blend_schedule is not None and self.split == Split.train:
+            # The datasets are sized to the schedule, so that their sizes change along with it
+            unique_identifiers["datasets"] = [
+                {key: value for key, value in identifiers.items() if key != "num_samples"}
+                for identifiers in unique_identifiers["datasets"]
+            ]
         unique_identifiers["split"] = self.split.name
         unique_identifiers["weights"] = self.weights
         unique_identifiers["size"] = self.size
+        if self.blend_schedule is not None:
+            # The schedule itself is cached with the indices, which are rebuilt on its change
+            unique_identifiers["blend_block_size"] = self.config.blend_block_size
+        if self.compact:
+            unique_identifiers["compact_blending_indices"] = True
 
         self.unique_description = json.dumps(
             unique_identifiers, indent=4, default=lambda obj: obj.unique_identifiers
@@ -84,19 +110,63 @@ class BlendedDataset(torch.utils.data.Dataset):
 
         self.built_anew_on_cache_miss = False
 
+        # The phases and the block samples of the blend schedule, set if compact
+        self.phases = None
+        self.block_samples = None
+        # The blocks drawn on access, least recently used first, set if compact
+        self.cached_blocks = OrderedDict()
+
         self.dataset_index, self.dataset_sample_index = self._build_indices()
 
+        # The order in which this rank reads the samples of each dataset is that of the blend, so
+        # the blend prefetches the upcoming samples of this rank in place of the datasets
+        self.prefetch_window = None
+        if all(getattr(dataset, "prefetch_window", None) is not None for dataset in self.datasets):
+            prefetch_window = self.datasets[0].prefetch_window
+            self.prefetch_window = RankPrefetchWindow(
+                prefetch_window.num_samples,
+                prefetch_window.micro_batch_size,
+                prefetch_window.data_parallel_size,
+            )
+            for dataset in self.datasets:
+                dataset.prefetch_window = None
+
     def __len__(self) -> int:
+        if self.compact:
+            return self.size
         return self.dataset_index.shape[0]
 
     def __getitem__(self, idx: int) -> Dict[str, Union[int, numpy.ndarray]]:
-        dataset_id = self.dataset_index[idx]
-        dataset_sample_id = self.dataset_sample_index[idx]
+        if self.prefetch_window is not None:
+            self._prefetch(self.prefetch_window.advance(idx, len(self)))
+        if self.compact:
+            dataset_id, dataset_sample_id = self._query_compact_indices(idx)
+        else:
+            dataset_id = self.dataset_index[idx]
+            dataset_sample_id = self.dataset_sample_index[idx]
         return {
             "dataset_id": dataset_id,
             **self.datasets[dataset_id][dataset_sample_id],
         }
 
+    def _prefetch(self, indices: numpy.ndarray) -> None:
+        """Hint to the datasets that the samples at the given indices will be read soon
+
+        Args:
+            indices (numpy.ndarray): The indices into the blend
+        """
+        if len(indices) == 0:
+            return
+        if self.compact:
+            dataset_ids, dataset_sample_ids = numpy.array(
+                [self._query_compact_indices(idx) for idx in indices]
+            ).T
+        else:
+            dataset_ids = self.dataset_index[indices]
+            dataset_sample_ids = self.dataset_sample_index[indices]
+        for dataset_id in numpy.unique(dataset_ids):
+            self.datasets[dataset_id].prefetch(dataset_sample_ids[dataset_ids == dataset_id])
+
     def _build_indices(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
         """Build and optionally cache the dataset index and the dataset sample index
 
@@ -104,6 +174,9 @@ class BlendedDataset(torch.utils.data.Dataset):
         sample index is a 1-D mapping which determines the sample to request from the queried
         dataset.
 
+        If compact, only the phases and the block samples of the blend schedule are built, and both
+        indices are None.
+
         Returns:
             Tuple[numpy.ndarray, numpy.ndarray]: The dataset index and the dataset sample index
         """
@@ -117,15 +190,24 @@ class BlendedDataset(torch.utils.data.Dataset):
             path_to_description = get_path_to("description.txt")
             path_to_dataset_index = get_path_to("dataset_index.npy")
             path_to_dataset_sample_index = get_path_to("dataset_sample_index.npy")
-            cache_hit = all(
-                map(
-                    os.path.isfile,
-                    [path_to_description, path_to_dataset_index, path_to_dataset_sample_index],
-                )
-            )
+            path_to_blend_schedule = get_path_to("blend_schedule.json")
+            path_to_block_samples = get_path_to("block_samples.npy")
+            paths = [path_to_description]
+            if not self.compact:
+                paths += [path_to_dataset_index, path_to_dataset_sample_index]
+            if self.blend_schedule is not None:
+                paths += [path_to_blend_schedule, path_to_block_samples]
+            cache_hit = all(map(os.path.isfile, paths))
         else:
             cache_hit = False
 
+        # A cache built with another blend schedule is reused up to the consumed samples
+        cache_phases = None
+        if cache_hit and self.blend_schedule is not None:
+            with open(path_to_blend_schedule, "rt") as reader:
+                cache_phases = json.load(reader)
+            cache_hit = cache_phases[-1]["blend_schedule"] == self.blend_schedule
+
         if not path_to_cache or (not cache_hit and torch.distributed.get_rank() == 0):
             log_single_rank(
                 logger,
@@ -141,7 +223,23 @@ class BlendedDataset(torch.utils.data.Dataset):
             t_beg = time.time()
             from megatron.core.datasets import helpers
 
-            if self.size is not None:
+            if self.blend_schedule is not None:
+                cache = None
+                if cache_phases is not None and self.compact:
+                    cache = (cache_phases, None, None, numpy.load(path_to_block_samples))
+                elif cache_phases is not None:
+                    cache = (
+                        cache_phases,
+                        numpy.load(path_to_dataset_index, mmap_mode='r'),
+                        numpy.load(path_to_dataset_sample_index, mmap_mode='r'),
+                        numpy.load(path_to_block_samples),
+                    )
+                dataset_index, dataset_sample_index, phases, block_samples = (
+                    self._build_scheduled_indices(cache)
+                )
+                # Release the memory maps of the cached indices before they are overwritten
+                del cache
+            elif self.size is not None:
                 dataset_index = numpy.zeros(self.size, dtype=numpy.int16)
                 dataset_sample_index = numpy.zeros(self.size, dtype=numpy.int64)
                 helpers.build_blending_indices(
@@ -166,8 +264,16 @@ class BlendedDataset(torch.utils.data.Dataset):
                 with open(path_to_description, "wt") as writer:
                     writer.write(self.unique_description)
                 # Save the indexes
-                numpy.save(path_to_dataset_index, dataset_index, allow_pickle=True)
-                numpy.save(path_to_dataset_sample_index, dataset_sample_index, allow_pickle=True)
+                if not self.compact:
+                    numpy.save(path_to_dataset_index, dataset_index, allow_pickle=True)
+                    numpy.save(
+                        path_to_dataset_sample_index, dataset_sample_index, allow_pickle=True
+                    )
+                if self.blend_schedule is not None:
+                    numpy.save(path_to_block_samples, block_samples, allow_pickle=True)
+                    # Written last, as it marks the other files as built with the schedule
+                    with open(path_to_blend_schedule, "wt") as writer:
+                        json.dump(phases, writer, indent=4)
             else:
                 log_single_rank(
                     logger,
@@ -178,10 +284,20 @@ class BlendedDataset(torch.utils.data.Dataset):
             t_end = time.time()
             log_single_rank(logger, logging.DEBUG, f"\t> time elapsed: {t_end - t_beg:4f} seconds")
 
+            if self.compact:
+                self.phases, self.block_samples = phases, block_samples
             return dataset_index, dataset_sample_index
 
         log_single_rank(logger, logging.INFO, f"Load the {type(self).__name__} indices")
 
+        if self.compact:
+            log_single_rank(
+                logger, logging.INFO, f"\tLoad the block samples from {path_to_block_samples}"
+            )
+            self.phases = cache_phases
+            self.block_samples = numpy.load(path_to_block_samples, allow_pickle=True, mmap_mode='r')
+            return None, None
+
         log_single_rank(
             logger, logging.INFO, f"\tLoad the dataset index from {path_to_dataset_index}"
         )
@@ -203,3 +319,208 @@ class BlendedDataset(torch.utils.data.Dataset):
         log_single_rank(logger, logging.DEBUG, f"\t> time elapsed: {t_end - t_beg:4f} seconds")
 
         return dataset_index, dataset_sample_index
+
+    def _build_scheduled_indices(
+        self, cache: Optional[Tuple[List[dict], numpy.ndarray, numpy.ndarray, numpy.ndarray]]
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, List[dict], numpy.ndarray]:
+        """Build the dataset index and the dataset sample index with the blend schedule
+
+        The indices are built in blocks of blend_block_size samples. Each run of blocks built with
+        one schedule is a phase, whose targets start from the number of samples drawn from each
+        dataset before it. When the indices were cached with another schedule, the blocks before
+        the consumed samples are kept and a new phase starts at the first block after them. If
+        compact, both indices returned are None.
+
+        Args:
+            cache (Optional[Tuple[List[dict], numpy.ndarray, numpy.ndarray, numpy.ndarray]]): The cached phases, dataset index, dataset sample index, and block samples, if the indices were cached with another schedule
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, List[dict], numpy.ndarray]: The dataset index, the dataset sample index, the phases, and the number of samples drawn from each dataset before each block
+        """
+        from megatron.core.datasets import helpers
+
+        block_size = self.config.blend_block_size
+        num_blocks = math.ceil(self.size / block_size)
+
+        size = min(block_size, self.size) if self.compact else self.size
+        dataset_index = numpy.zeros(size, dtype=numpy.int16)
+        dataset_sample_index = numpy.zeros(size, dtype=numpy.int64)
+        block_samples = numpy.zeros((num_blocks + 1, len(self.datasets)), dtype=numpy.int64)
+        phases = []
+        block_beg = 0
+        if cache is not None:
+            cache_phases, cache_dataset_index, cache_dataset_sample_index, cache_block_samples = (
+                cache
+            )
+            block_beg = min(
+                math.ceil(self.config.blend_schedule_consumed_samples / block_size), num_blocks
+            )
+            sample_beg = block_beg * block_size
+            phases = [phase for phase in cache_phases if phase["start"] < sample_beg]
+            if not self.compact:
+                dataset_index[:sample_beg] = cache_dataset_index[:sample_beg]
+                dataset_sample_index[:sample_beg] = cache_dataset_sample_index[:sample_beg]
+            block_samples[: block_beg + 1] = cache_block_samples[: block_beg + 1]
+            log_single_rank(
+                logger,
+                logging.INFO,
+                f"\tKeep the first {block_beg} of {num_blocks} blocks, built with another schedule",
+            )
+            # The kept blocks refer to the samples of each dataset by their index, which change
+            # along with the size of a dataset without a lazy index
+            cache_dataset_sizes = cache_phases[-1].get("dataset_sizes")
+            for i, dataset in enumerate(self.datasets):
+                if (
+                    block_beg > 0
+                    and cache_dataset_sizes is not None
+                    and cache_dataset_sizes[i] != len(dataset)
+                    and not getattr(dataset.config, "lazy_index", False)
+                ):
+                    log_single_rank(
+                        logger,
+                        logging.WARNING,
+                        f"The size of dataset {i} changed from {cache_dataset_sizes[i]} to "
+                        f"{len(dataset)} samples since the kept blocks were built, so that the "
+                        f"samples it draws may repeat or be skipped. Set lazy_index so that its "
+                        f"samples do not depend on its size.",
+                    )
+
+        sample_beg = block_beg * block_size
+        current_samples = block_samples[block_beg].copy()
+        if sample_beg > 0:
+            target_offsets = current_samples - get_blend_schedule_targets(
+                self.blend_schedule, sample_beg
+            )
+        else:
+            target_offsets = numpy.zeros(len(self.datasets), dtype=numpy.float64)
+        phases.append(
+            {
+                "start": sample_beg,
+                "blend_schedule": self.blend_schedule,
+                "target_offsets": target_offsets.tolist(),
+                "dataset_sizes": [len(dataset) for dataset in self.datasets],
+            }
+        )
+
+        for block in range(block_beg, num_blocks):
+            beg = block * block_size
+            end = min(beg + block_size, self.size)
+            # If compact, each block is drawn into the same buffer
+            offset = 0 if self.compact else beg
+            _draw_blend_schedule_samples(
+                phases[-1],
+                current_samples,
+                dataset_index[offset : offset + end - beg],
+                dataset_sample_index[offset : offset + end - beg],
+                beg,
+            )
+            block_samples[block + 1] = current_samples
+
+        for dataset, num_samples in zip(self.datasets, block_samples[-1]):
+            if num_samples > len(dataset):
+                raise RuntimeError(
+                    f"The blend schedule draws {num_samples} samples from a dataset of "
+                    f"{len(dataset)} samples"
+                )
+
+        if self.compact:
+            return None, None, phases, block_samples
+        return dataset_index, dataset_sample_index, phases, block_samples
+
+    def _query_compact_indices(self, idx: int) -> Tuple[int, int]:
+        """Get the dataset index and the dataset sample index of a sample, if compact
+
+        The block of the sample is redrawn from the number of samples drawn from each dataset
+        before it, and kept among the compact_blending_cache_size blocks last queried.
+
+        Args:
+            idx (int): The index into the blend
+
+        Returns:
+            Tuple[int, int]: The dataset index and the dataset sample index
+        """
+        block_size = self.config.blend_block_size
+        block = idx // block_size
+        if block in self.cached_blocks:
+            self.cached_blocks.move_to_end(block)
+        else:
+            if len(self.cached_blocks) >= self.config.compact_blending_cache_size:
+                self.cached_blocks.popitem(last=False)
+            beg = block * block_size
+            end = min(beg + block_size, self.size)
+            phase = [phase for phase in self.phases if phase["start"] <= beg][-1]
+            dataset_index = numpy.zeros(end - beg, dtype=numpy.int16)
+            dataset_sample_index = numpy.zeros(end - beg, dtype=numpy.int64)
+            _draw_blend_schedule_samples(
+                phase,
+                numpy.array(self.block_samples[block]),
+                dataset_index,
+                dataset_sample_index,
+                beg,
+            )
+            self.cached_blocks[block] = (dataset_index, dataset_sample_index)
+        dataset_index, dataset_sample_index = self.cached_blocks[block]
+        return dataset_index[idx % block_size], dataset_sample_index[idx % block_size]
+
+
+def _draw_blend_schedule_samples(
+    phase: dict,
+    current_samples: numpy.ndarray,
+    dataset_index: numpy.ndarray,
+    dataset_sample_index: numpy.ndarray,
+    start: int,
+) -> None:
+    """Draw the samples [start, start + len(dataset_index)) of a phase of the blend schedule
+
+    Args:
+        phase (dict): The phase, with its blend schedule and target offsets
+
+        current_samples (numpy.ndarray): The number of samples drawn from each dataset before start, updated in place
+
+        dataset_index (numpy.ndarray): The dataset index of the samples, populated in place
+
+        dataset_sample_index (numpy.ndarray): The dataset sample index of the samples, populated in place
+
+        start (int): The first sample
+    """
+    from megatron.core.datasets import helpers
+
+    blend_schedule = phase["blend_schedule"]
+    helpers.build_scheduled_blending_indices(
+        dataset_index,
+        dataset_sample_index,
+        current_samples,
+        numpy.array([sample for sample, _ in blend_schedule], dtype=numpy.int64),
+        numpy.array([weights for _, weights in blend_schedule], dtype=numpy.float64),
+        numpy.array(phase["target_offsets"], dtype=numpy.float64),
+        len(current_samples),
+        start,
+        len(dataset_index),
+    )
+
+
+def get_blend_schedule_targets(
+    blend_schedule: List[Tuple[int, List[float]]], sample: int
+) -> numpy.ndarray:
+    """Get the integral of the blend schedule weights up to a sample
+
+    Args:
+        blend_schedule (List[Tuple[int, List[float]]]): The (sample, weights) breakpoints of the piecewise-linear schedule, see BlendedMegatronDatasetConfig.blend_schedule
+
+        sample (int): The sample
+
+    Returns:
+        numpy.ndarray: The target number of samples per dataset before the sample
+    """
+    samples = [breakpoint_sample for breakpoint_sample, _ in blend_schedule]
+    weights = numpy.array([weights for _, weights in blend_schedule], dtype=numpy.float64)
+    if sample <= samples[0]:
+        return weights[0] * sample
+    target = weights[0] * samples[0]
+    for i in range(1, len(samples)):
+        if sample <= samples[i]:
+            offset = sample - samples[i - 1]
+            slope = (weights[i] - weights[i - 1]) / (samples[i] - samples[i - 1])
+            return target + offset * (weights[i - 1] + 0.5 * slope * offset)
+        target = target + (samples[i] - samples[i - 1]) * 0.5 * (weights[i - 1] + weights[i])
+    return target + weights[-1] * (sample - samples[-1])
@@ -2,8 +2,10 @@
 
 import logging
 import math
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Callable, Iterable, List, Optional, Type, Union
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
 
 import numpy
 import torch
@@ -11,7 +13,7 @@ import torch
 from megatron.core.datasets.blended_dataset import BlendedDataset
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
 from megatron.core.datasets.megatron_dataset import LowLevelDataset, MegatronDataset
-from megatron.core.datasets.utils import Split, normalize
+from megatron.core.datasets.utils import Split, build_cache_on_this_rank, normalize
 from megatron.core.parallel_state import get_virtual_pipeline_model_parallel_rank
 from megatron.core.utils import log_single_rank
 
@@ -144,9 +146,12 @@ class BlendedMegatronDatasetBuilder(object):
                         )
                         continue
                     # Check blend size
-                    assert dataset.size is None or dataset.size == dataset.dataset_index.shape[0]
+                    assert dataset.size is None or dataset.size == len(dataset)
                     # Check blend access of mid-level datasets
-                    _, sizes = numpy.unique(dataset.dataset_index, return_counts=True)
+                    if dataset.compact:
+                        sizes = dataset.block_samples[-1]
+                    else:
+                        _, sizes = numpy.unique(dataset.dataset_index, return_counts=True)
                     for i, dataset_and_size in enumerate(zip(dataset.datasets, sizes)):
                         if len(dataset_and_size[0]) < dataset_and_size[1]:
                             raise IndexError(
@@ -196,6 +201,8 @@ class BlendedMegatronDatasetBuilder(object):
                 sizes_per_dataset = [[None for split in Split] for prefix in prefixes]
             else:
                 sizes_per_dataset = _get_size_per_split_per_dataset(weights, self.sizes)
+                size_per_split = list(map(sum, zip(*sizes_per_dataset)))
+                self._size_train_split_for_blend_schedule(sizes_per_dataset, size_per_split)
 
             # build each dataset in parallel
             megatron_datasets = self._build_megatron_datasets_parallel(
@@ -208,7 +215,7 @@ class BlendedMegatronDatasetBuilder(object):
                 if split[i] is not None:
                     weights_i = weights
                     if weights_i is not None and self.sizes[i] is not None:
-                        size_i = sum(list(zip(*sizes_per_dataset))[i])
+                        size_i = size_per_split[i]
                     elif weights_i is None:
                         try:
                             weights_i = [
@@ -264,6 +271,8 @@ class BlendedMegatronDatasetBuilder(object):
                         sizes_per_dataset = [[None for split in Split] for prefix in prefixes]
                     else:
                         sizes_per_dataset = _get_size_per_split_per_dataset(weights, sizes_spoof)
+                        size_per_split = list(map(sum, zip(*sizes_per_dataset)))
+                        self._size_train_split_for_blend_schedule(sizes_per_dataset, size_per_split)
 
                     # build each dataset in parallel
                     megatron_datasets = self._build_megatron_datasets_parallel(
@@ -272,7 +281,7 @@ class BlendedMegatronDatasetBuilder(object):
 
                     # Build top-level dataset
                     if weights is not None and self.sizes[i] is not None:
-                        size = list(map(sum, zip(*sizes_per_dataset)))[i]
+                        size = size_per_split[i]
                     elif weights is None:
                         try:
                             weights = [
@@ -298,6 +307,31 @@ class BlendedMegatronDatasetBuilder(object):
 
             return blended_datasets
 
+    def _size_train_split_for_blend_schedule(
+        self, sizes_per_dataset: List[List[int]], size_per_split: List[int]
+    ) -> None:
+        """Size the train split of each mid-level dataset for the blend schedule, if any
+
+        Each dataset is sized to the whole blend, with the usual margin, whatever the schedule.
+        The blending indices kept across a change of the schedule refer to the samples of each
+        dataset by their index, and may draw more samples from a dataset than the new schedule
+        would, so neither the size nor thus the samples of a dataset may depend on the schedule.
+
+        Args:
+            sizes_per_dataset (List[List[int]]): The number of samples to request per MegatronDataset per split, modified in place
+
+            size_per_split (List[int]): The number of samples to draw from the blend per split
+        """
+        size = size_per_split[Split.train.value]
+        if self.config.blend_schedule is None or not size:
+            return
+        assert len(self.config.blend_schedule[0][1]) == len(
+            sizes_per_dataset
+        ), "blend_schedule weights and blend prefixes must be equal in number"
+        for sizes in sizes_per_dataset:
+            # Use 0.5% target margin to ensure we satiate the request
+            sizes[Split.train.value] = int(math.ceil(size * 1.005))
+
     def _build_megatron_datasets_parallel(
         self,
         prefixes: List[str],
@@ -319,77 +353,100 @@ class BlendedMegatronDatasetBuilder(object):
             MegatronDataset per prefix
         """
 
+        # Helper function to build and time a single prefix
+        def _timing_helper(
+            i: int, build_on_cache_miss: bool
+        ) -> Tuple[List[Optional[MegatronDataset]], float]:
+            t_beg = time.time()
+            with build_cache_on_this_rank() if build_on_cache_miss else nullcontext():
+                megatron_datasets_split = self._build_megatron_dataset_splits(
+                    prefixes[i],
+                    split,
+                    sizes_per_dataset[i],
+                    False,  # synchronize_ranks, barrier is called in this function
+                )
+            return megatron_datasets_split, time.time() - t_beg
+
         # Helper function to wrap the threading logic
         def _threading_helper(
-            megatron_datasets: List[List[Optional[MegatronDataset]]],
+            megatron_datasets: Dict[int, List[Optional[MegatronDataset]]],
             num_workers: int,
-            prefixes: List[str],
-            split: List[float],
-            sizes_per_dataset: List[List[int]],
+            prefix_indices: List[int],
+            build_on_cache_miss: bool,
         ) -> None:
             with ThreadPoolExecutor(max_workers=num_workers) as executor:
                 all_futures = []
-                for i in range(len(prefixes)):
-                    all_futures.append(
-                        executor.submit(
-                            self._build_megatron_dataset_splits,
-                            prefixes[i],
-                            split,
-                            sizes_per_dataset[i],
-                            False,  # synchronize_ranks, barrier is called in this function
+                for i in prefix_indices:
+                    all_futures.append(executor.submit(_timing_helper, i, build_on_cache_miss))
+                for i, future in zip(prefix_indices, all_futures):
+                    megatron_datasets_split, elapsed = future.result()
+                    megatron_datasets[i] = megatron_datasets_split
+                    if any(
+                        megatron_dataset is not None and megatron_dataset.built_anew_on_cache_miss
+                        for megatron_dataset in megatron_datasets_split
+                    ):
+                        logger.info(
+                            f"Built the {self.cls.__name__} indices for {prefixes[i]} in "
+                            f"{elapsed:4f} seconds on rank {_get_rank()}"
                         )
-                    )
-                for future in all_futures:
-                    try:
-                        megatron_datasets_split = future.result()
-                        for j in range(len(megatron_datasets_split)):
-                            megatron_datasets[j].append(megatron_datasets_split[j])
-                    except Exception as err:
-                        raise err
-
-        megatron_datasets = [[] for _ in range(len(Split))]
+                    else:
+                        logger.debug(
+                            f"Loaded the {self.cls.__name__} indices for {prefixes[i]} in "
+                            f"{elapsed:4f} seconds on rank {_get_rank()}"
+                        )
+
+        megatron_datasets = {}
         num_dataset_builder_threads = self.config.num_dataset_builder_threads
 
         if torch.distributed.is_initialized():
             rank = torch.distributed.get_rank()
-            # First, build on rank 0
-            if rank == 0:
+
+            # Determine the ranks which build on cache miss
+            if self.config.num_dataset_builder_ranks > 1:
+                is_builder_rank = [None] * torch.distributed.get_world_size()
+                torch.distributed.all_gather_object(
+                    is_builder_rank,
+                    rank < self.config.num_dataset_builder_ranks and self.is_built_on_rank(),
+                )
+                builder_ranks = [i for i, is_builder in enumerate(is_builder_rank) if is_builder]
+            else:
+                builder_ranks = [0]
+
+            # First, build on the builder ranks, each a disjoint subset of the prefixes
+            if rank in builder_ranks:
                 num_workers = num_dataset_builder_threads
-                if num_workers > 1:
+                if num_workers > 1 and len(builder_ranks) == 1:
                     # since only rank 0 is running, scale up the thread count
                     # but not too much to avoid overloading storage on miss path.
                     # if user set num_dataset_builder_threads to 1,
                     # i.e. meant for serial build, do not scale up.
                     num_workers *= min(2, max(1, torch.cuda.device_count()))
-                _threading_helper(
-                    megatron_datasets,
-                    num_workers,
-                    prefixes,
-                    split,
-                    sizes_per_dataset,
+                prefix_indices = list(range(len(prefixes)))[
+                    builder_ranks.index(rank) :: len(builder_ranks)
+                ]
+                t_beg = time.time()
+                _threading_helper(megatron_datasets, num_workers, prefix_indices, True)
+                logger.info(
+                    f"Built or loaded the {self.cls.__name__} indices for {len(prefix_indices)} "
+                    f"of {len(prefixes)} prefixes in {time.time() - t_beg:4f} seconds on rank "
+                    f"{rank}"
                 )
 
             torch.distributed.barrier()
 
-            # Then, build on other ranks; guaranteed to be data_cache hit
-            if rank != 0:
-                _threading_helper(
-                    megatron_datasets,
-                    num_dataset_builder_threads,
-                    prefixes,
-                    split,
-                    sizes_per_dataset,
-                )
-        else:
+            # Then, build the rest on all ranks; guaranteed to be data_cache hit
             _threading_helper(
                 megatron_datasets,
                 num_dataset_builder_threads,
-                prefixes,
-                split,
-                sizes_per_dataset,
+                [i for i in range(len(prefixes)) if i not in megatron_datasets],
+                False,
+            )
+        else:
+            _threading_helper(
+                megatron_datasets, num_dataset_builder_threads, list(range(len(prefixes))), False
             )
 
-        return megatron_datasets
+        return [[megatron_datasets[i][j] for i in range(len(prefixes))] for j in range(len(Split))]
 
     def _build_megatron_dataset_splits(
         self,
@@ -510,6 +567,17 @@ class BlendedMegatronDatasetBuilder(object):
         return cls(*args)
 
 
+def _get_rank() -> int:
+    """Get the global rank, or 0 when torch.distributed is not initialized
+
+    Returns:
+        int: The global rank
+    """
+    if torch.distributed.is_initialized():
+        return torch.distributed.get_rank()
+    return 0
+
+
 def _get_size_per_split_per_dataset(
     normalized_weights: List[float], target_size_per_split: List[int]
 ) -> List[List[int]]:
@@ -34,6 +34,44 @@ class BlendedMegatronDatasetConfig:
        'blend'. Defauls to None.
     """
 
+    blend_schedule: Optional[List[Tuple[int, List[float]]]] = None
+    """A piecewise-linear schedule of the train split blend weights over the train samples, as a
+       list of (sample, weights) breakpoints in non-decreasing order of sample, with one weight per
+       dataset of the train split blend. The weights are constant before the first and after the
+       last breakpoint, and two breakpoints at the same sample make a step. Replaces the weights of
+       the train split blend, whose datasets are then each sized to the whole blend, so that a
+       change of the schedule does not change their samples, which the blending indices before
+       blend_schedule_consumed_samples refer to. Their indices thus cost N times those of a
+       fixed-weight blend of N datasets, unless built on demand with GPTDatasetConfig.lazy_index,
+       whose cost does not depend on the size. Defaults to None.
+    """
+
+    blend_schedule_consumed_samples: int = 0
+    """The number of train samples consumed so far. When the blend_schedule differs from the one
+       the cached train split blending indices were built with, only the blocks of
+       blend_block_size samples from this sample on are rebuilt with the new schedule, e.g. to
+       change the curriculum on restart.
+    """
+
+    blend_block_size: int = 1 << 16
+    """The number of samples per block of the blending indices built with a blend_schedule or
+       compact_blending_indices.
+    """
+
+    compact_blending_indices: bool = False
+    """Whether to store the blending indices of each blend with a size as the number of samples
+       drawn from each dataset before each block of blend_block_size samples, rather than as one
+       entry per sample. The entries of a block are redrawn on access with the same rule, in the
+       same order, and the last compact_blending_cache_size blocks drawn are kept. The samples
+       must then be accessed mostly in order, e.g. with MegatronPretrainingSampler: with a random
+       sampler, nearly every access draws a whole block. Defaults to False.
+    """
+
+    compact_blending_cache_size: int = 8
+    """The number of blocks of compact_blending_indices drawn on access to keep, least recently
+       used first out. Defaults to 8.
+    """
+
     split: Optional[str] = None
     """The split string, a comma separated weighting for the dataset splits when drawing samples
        from a single distribution. Not to be used with 'blend_per_split'.  Defaults to None.
@@ -48,6 +86,14 @@ class BlendedMegatronDatasetConfig:
     num_dataset_builder_threads: int = 1
     """The number of threads to use for dataset building."""
 
+    num_dataset_builder_ranks: int = 1
+    """The number of ranks, counting up from rank 0, across which to spread the building of the
+       blended mid-level dataset indices on cache miss. Each rank builds a disjoint subset of the
+       blend, after which all ranks load the remainder from the cache, so path_to_cache must be on
+       a filesystem shared by all ranks. Set to the number of ranks per node to confine the build
+       to the first node.
+    """
+
     path_to_cache: Optional[str] = None
     """Where all re-useable dataset indices are to be cached."""
 
@@ -64,8 +110,7 @@ class BlendedMegatronDatasetConfig:
     """The MegatronTokenizer instance or None. Required for datasets which do online tokenization."""
 
     def __post_init__(self) -> None:
-        """Do asserts and set fields post init
-        """
+        """Do asserts and set fields post init"""
         if self.blend_per_split is not None and any(self.blend_per_split):
             assert self.blend is None, "blend and blend_per_split are incompatible"
             assert self.split is None, "split and blend_per_split are incompatible"
@@ -106,6 +151,26 @@ class BlendedMegatronDatasetConfig:
             self.split_matrix = convert_split_vector_to_split_matrix(split_vector)
             log_single_rank(logger, logging.INFO, f"Let split_matrix = {self.split_matrix}")
 
+        if self.blend_schedule is not None:
+            assert not self.mock, "blend_schedule requires a blend"
+            assert len(self.blend_schedule) > 0, "blend_schedule must not be empty"
+            samples = [sample for sample, _ in self.blend_schedule]
+            assert (
+                samples == sorted(samples) and samples[0] >= 0
+            ), "blend_schedule samples must be non-negative and in non-decreasing order"
+            num_datasets = len(self.blend_schedule[0][1])
+            for _, weights in self.blend_schedule:
+                assert (
+                    len(weights) == num_datasets
+                ), "blend_schedule weights must be equal in number"
+                assert (
+                    all(weight >= 0 for weight in weights) and sum(weights) > 0
+                ), "blend_schedule weights must be non-negative and not all zero"
+            assert self.blend_block_size > 0
+
+        if self.compact_blending_indices:
+            assert self.compact_blending_cache_size > 0
+
 
 def parse_and_normalize_split(split: str) -> List[float]:
     """Parse the dataset split ratios from a string
@@ -3,8 +3,9 @@
 import logging
 import os
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy
 import torch
@@ -13,14 +14,19 @@ from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatr
 from megatron.core.datasets.indexed_dataset import IndexedDataset
 from megatron.core.datasets.megatron_dataset import MegatronDataset
 from megatron.core.datasets.megatron_tokenizer import MegatronTokenizer
-from megatron.core.datasets.utils import Split
+from megatron.core.datasets.utils import RankPrefetchWindow, Split, is_cache_builder
 from megatron.core.datasets.utils_s3 import S3Config, is_s3_path
+from megatron.core.packed_seq_params import PackedSeqParams
 from megatron.core.utils import log_single_rank
 
 logger = logging.getLogger(__name__)
 
 _PAD_TOKEN_ID = -1
 
+_FEISTEL_ROUNDS = 4
+
+_LAZY_INDEX_NUM_CACHED_EPOCHS = 2
+
 
 @dataclass
 class GPTDatasetConfig(BlendedMegatronDatasetConfig):
@@ -48,9 +54,60 @@ class GPTDatasetConfig(BlendedMegatronDatasetConfig):
        output tokens are both of the desired sequence length
     """
 
+    packed_sequences: bool = False
+    """Option to emit, per sample, the cumulative lengths of the documents which make up the sample
+       as "cu_seqlens", for use with the packed sequence (THD) attention format, and to derive the
+       reset position IDs and attention mask from the document boundaries rather than scan the
+       tokens for EOD.
+    """
+
+    fused_index_build: bool = False
+    """Option to build the document, sample, and shuffle indices with a single multithreaded C++
+       routine which writes them straight into the cached .npy files. The documents are shuffled
+       per epoch rather than across all epochs, so the indices differ from the default build.
+    """
+
+    lazy_index: bool = False
+    """Option to compute the sample bounds and the shuffle mapping on demand rather than build and
+       cache the document, sample, and shuffle indices. Documents and samples are shuffled per
+       epoch with pseudorandom permutations, so the samples differ from those of the default
+       build, and samples which would span two epochs are dropped.
+    """
+
+    bin_packing_window: int = 0
+    """The number of consecutive documents, in document index order, within which to pack whole
+       documents into samples with the best-fit decreasing heuristic rather than cut the
+       concatenated documents into samples. Samples are padded as necessary, and documents longer
+       than a sample are split, so the samples differ from those of the default build. Disabled
+       when 0.
+    """
+
     s3_cache_path: str = None
     """Path for caching indices for s3 dataloading."""
 
+    s3_bin_chunk_cache_size: int = 1
+    """The number of data (.bin) file chunks to hold in memory per dataset for s3 dataloading."""
+
+    s3_bin_prefetch_threads: int = 0
+    """The number of background threads per dataset which prefetch data (.bin) file chunks for s3
+       dataloading. Disabled when 0.
+    """
+
+    s3_prefetch_samples: int = 0
+    """The number of upcoming samples of this rank whose data to prefetch on each sample access for
+       s3 dataloading. Has no effect when s3_bin_prefetch_threads is 0.
+    """
+
+    s3_prefetch_micro_batch_size: int = 1
+    """The micro batch size, which determines along with s3_prefetch_data_parallel_size the
+       upcoming samples of this rank under the pretraining sampler.
+    """
+
+    s3_prefetch_data_parallel_size: int = 1
+    """The data parallel size, which determines along with s3_prefetch_micro_batch_size the
+       upcoming samples of this rank under the pretraining sampler.
+    """
+
     def __post_init__(self) -> None:
         """Do asserts and set fields post init"""
         super().__post_init__()
@@ -61,6 +118,16 @@ class GPTDatasetConfig(BlendedMegatronDatasetConfig):
         assert self.reset_attention_mask is not None
         assert self.eod_mask_loss is not None
 
+        assert not (
+            self.fused_index_build and self.lazy_index
+        ), "fused_index_build and lazy_index are incompatible"
+
+        assert self.bin_packing_window >= 0
+        if self.bin_packing_window > 0:
+            assert not (
+                self.fused_index_build or self.lazy_index
+            ), "bin_packing_window is incompatible with fused_index_build and lazy_index"
+
 
 class GPTDataset(MegatronDataset):
     """The base GPT dataset
@@ -103,16 +170,31 @@ class GPTDataset(MegatronDataset):
         self.cached_loss_mask = None
         self.cached_position_ids = None
 
+        # The upcoming samples of this rank whose data to prefetch, unset when a BlendedDataset
+        # prefetches the samples in its own order instead
+        self.prefetch_window = None
+        if self.config.s3_prefetch_samples > 0 and self.config.s3_bin_prefetch_threads > 0:
+            self.prefetch_window = RankPrefetchWindow(
+                self.config.s3_prefetch_samples,
+                self.config.s3_prefetch_micro_batch_size,
+                self.config.s3_prefetch_data_parallel_size,
+            )
+
         try:
             self._pad_token_id = self.config.tokenizer.pad
         except:
             self._pad_token_id = _PAD_TOKEN_ID
 
-        (
-            self.document_index,
-            self.sample_index,
-            self.shuffle_index,
-        ) = self._build_document_sample_shuffle_indices()
+        if self.config.lazy_index:
+            self.lazy_index = self._build_lazy_index()
+            self.document_index, self.sample_index, self.shuffle_index = None, None, None
+        else:
+            self.lazy_index = None
+            (
+                self.document_index,
+                self.sample_index,
+                self.shuffle_index,
+            ) = self._build_document_sample_shuffle_indices()
 
     @staticmethod
     def numel_low_level_dataset(low_level_dataset: IndexedDataset) -> int:
@@ -146,16 +228,35 @@ class GPTDataset(MegatronDataset):
                 dataset_path,
                 multimodal=False,
                 mmap=config.mmap_bin_files,
-                s3_config=S3Config(path_to_idx_cache=config.s3_cache_path),
+                s3_config=S3Config(
+                    path_to_idx_cache=config.s3_cache_path,
+                    bin_chunk_cache_size=config.s3_bin_chunk_cache_size,
+                    bin_prefetch_threads=config.s3_bin_prefetch_threads,
+                ),
             )
         return IndexedDataset(dataset_path, multimodal=False, mmap=config.mmap_bin_files)
 
+    @staticmethod
+    def _optional_key_config_attributes() -> List[str]:
+        """Inherited method implementation
+
+        Returns:
+            List[str]: The optional key config attributes
+        """
+        return super(GPTDataset, GPTDataset)._optional_key_config_attributes() + [
+            "fused_index_build",
+            "lazy_index",
+            "bin_packing_window",
+        ]
+
     def __len__(self) -> int:
         """Abstract method implementation
 
         Returns:
             int: The length of the dataset
         """
+        if self.lazy_index is not None:
+            return len(self.lazy_index)
         return self.sample_index.shape[0] - 1
 
     def __getitem__(self, idx: Optional[int]) -> Dict[str, torch.Tensor]:
@@ -169,9 +270,15 @@ class GPTDataset(MegatronDataset):
         """
         if idx is None:
             # Batch padding sequence so the index does not matter
-            text, _ = self._query_document_sample_shuffle_indices(0)
+            sample_parts = self._get_shuffled_sample_parts(0)
         else:
-            text, _ = self._query_document_sample_shuffle_indices(idx)
+            if self.prefetch_window is not None:
+                self.prefetch(self.prefetch_window.advance(idx, len(self)))
+            sample_parts = self._get_shuffled_sample_parts(idx)
+        text = self._read_sample_parts(*sample_parts)
+
+        if self.config.packed_sequences:
+            cu_seqlens = self._get_cu_seqlens(*sample_parts)
 
         text = torch.from_numpy(text).long()
         if self.config.add_extra_token_to_sequence:
@@ -186,14 +293,25 @@ class GPTDataset(MegatronDataset):
             not self.masks_and_position_ids_are_cacheable
             or not self.masks_and_position_ids_are_cached
         ):
-            attention_mask, loss_mask, position_ids = _get_ltor_masks_and_position_ids(
-                tokens,
-                self.config.tokenizer.eod,
-                self.config.reset_position_ids,
-                self.config.reset_attention_mask,
-                self.config.eod_mask_loss,
-                self.config.create_attention_mask,
-            )
+            if self.config.packed_sequences:
+                attention_mask, loss_mask, position_ids = _get_packed_masks_and_position_ids(
+                    tokens,
+                    cu_seqlens,
+                    self.config.tokenizer.eod,
+                    self.config.reset_position_ids,
+                    self.config.reset_attention_mask,
+                    self.config.eod_mask_loss,
+                    self.config.create_attention_mask,
+                )
+            else:
+                attention_mask, loss_mask, position_ids = _get_ltor_masks_and_position_ids(
+                    tokens,
+                    self.config.tokenizer.eod,
+                    self.config.reset_position_ids,
+                    self.config.reset_attention_mask,
+                    self.config.eod_mask_loss,
+                    self.config.create_attention_mask,
+                )
             if self.masks_and_position_ids_are_cacheable:
                 self.cached_attention_mask = attention_mask
                 self.cached_loss_mask = loss_mask
@@ -216,7 +334,7 @@ class GPTDataset(MegatronDataset):
             loss_mask = torch.zeros_like(loss_mask)
 
         if self.config.create_attention_mask:
-            return {
+            sample = {
                 "tokens": tokens,
                 "labels": labels,
                 "attention_mask": attention_mask,
@@ -224,13 +342,18 @@ class GPTDataset(MegatronDataset):
                 "position_ids": position_ids,
             }
         else:
-            return {
+            sample = {
                 "tokens": tokens,
                 "labels": labels,
                 "loss_mask": loss_mask,
                 "position_ids": position_ids,
             }
 
+        if self.config.packed_sequences:
+            sample["cu_seqlens"] = cu_seqlens
+
+        return sample
+
     def _query_document_sample_shuffle_indices(
         self, idx: int
     ) -> Tuple[numpy.ndarray, numpy.ndarray]:
@@ -242,65 +365,131 @@ class GPTDataset(MegatronDataset):
         Returns:
             Tuple[numpy.ndarray, numpy.ndarray]: The text ids and document ids
         """
+        document_ids, offsets, lengths = self._get_shuffled_sample_parts(idx)
+        return self._read_sample_parts(document_ids, offsets, lengths), document_ids
+
+    def _read_sample_parts(
+        self, document_ids: numpy.ndarray, offsets: numpy.ndarray, lengths: numpy.ndarray
+    ) -> numpy.ndarray:
+        """Read the sample parts back-to-back into a sample, which is pre-padded as necessary
+
+        Args:
+            document_ids (numpy.ndarray): The document ids
+
+            offsets (numpy.ndarray): The token offset into each document
+
+            lengths (numpy.ndarray): The number of tokens to read from each document
+
+        Returns:
+            numpy.ndarray: The text ids
+        """
+        sample = numpy.full(
+            self.config.sequence_length + self.config.add_extra_token_to_sequence,
+            self._pad_token_id,
+            dtype=numpy.int64,
+        )
+        self.dataset.get_many(document_ids, offsets, lengths, out=sample)
+        return sample
+
+    def _get_shuffled_sample_parts(
+        self, idx: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Get the document ids and, per document, the token offset and length of a sample
+
+        Args:
+            idx (int): The index into the dataset
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The document ids, offsets, and lengths
+        """
+        if self.lazy_index is not None:
+            return self.lazy_index.get_sample_parts(idx)
+
         # Do the shuffle mapping
-        idx = self.shuffle_index[idx]
+        return self._get_sample_parts(self.shuffle_index[idx])
+
+    def _get_sample_parts(self, idx: int) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Get the document ids and, per document, the token offset and length of a sample
+
+        Args:
+            idx (int): The index into the sample index, i.e. after the shuffle mapping
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The document ids, offsets, and lengths
+        """
+        if self.config.bin_packing_window > 0:
+            # The sample is a run of pieces in the packed document index
+            pieces = self.document_index[self.sample_index[idx] : self.sample_index[idx + 1]]
+            document_ids = numpy.array(pieces[:, 0], dtype=numpy.int64)
+            offsets = numpy.array(pieces[:, 1], dtype=numpy.int64)
+            lengths = numpy.minimum(
+                self.config.sequence_length + self.config.add_extra_token_to_sequence,
+                self.dataset.sequence_lengths[document_ids] - offsets,
+            )
+            return document_ids, offsets, lengths
 
         # Get the beginning and end documents and offsets
         doc_index_beg, doc_index_beg_offset = self.sample_index[idx]
         doc_index_end, doc_index_end_offset = self.sample_index[idx + 1]
 
-        document_ids = []
-        sample_parts = []
-
-        # Sample spans a single document
-        if doc_index_beg == doc_index_end:
-            # Add the document id
-            document_ids.append(self.document_index[doc_index_beg])
-
-            # Add the entire sample
-            sample_parts.append(
-                self.dataset.get(
-                    self.document_index[doc_index_beg],
-                    offset=doc_index_beg_offset,
-                    length=doc_index_end_offset
-                    - doc_index_beg_offset
-                    + self.config.add_extra_token_to_sequence,
-                )
-            )
+        document_ids = numpy.array(
+            self.document_index[doc_index_beg : doc_index_end + 1], dtype=numpy.int64
+        )
 
-        # Sample spans multiple documents
-        else:
-            for i in range(doc_index_beg, doc_index_end + 1):
-                # Add the document id
-                document_ids.append(self.document_index[i])
-
-                # Add the sample part
-                offset = 0 if i > doc_index_beg else doc_index_beg_offset
-                length = (
-                    None
-                    if i < doc_index_end
-                    else doc_index_end_offset + self.config.add_extra_token_to_sequence
-                )
-                sample_parts.append(
-                    self.dataset.get(self.document_index[i], offset=offset, length=length)
-                )
-        assert len(document_ids) == len(
-            sample_parts
-        ), f"len(document_ids) ({len(document_ids)}) != len(sample_parts) ({len(sample_parts)})"
+        # Get the offset into and the length of each sample part, one per document
+        offsets = numpy.zeros(document_ids.shape[0], dtype=numpy.int64)
+        offsets[0] = doc_index_beg_offset
+        lengths = self.dataset.sequence_lengths[document_ids] - offsets
+        lengths[-1] = doc_index_end_offset + self.config.add_extra_token_to_sequence - offsets[-1]
 
-        length = sum(map(len, sample_parts))
+        return document_ids, offsets, lengths
 
-        # Pad the sample if necessary
-        if length < (self.config.sequence_length + self.config.add_extra_token_to_sequence):
-            sample_parts.append(
-                [self._pad_token_id]
-                * (self.config.sequence_length + self.config.add_extra_token_to_sequence - length)
-            )
+    def _get_cu_seqlens(
+        self, document_ids: numpy.ndarray, offsets: numpy.ndarray, lengths: numpy.ndarray
+    ) -> torch.Tensor:
+        """Get the cumulative lengths of the documents which make up a sample
 
-        return (
-            numpy.concatenate(sample_parts, dtype=numpy.int64),
-            numpy.array(document_ids, dtype=numpy.int64),
-        )
+        The document boundaries follow from the sample parts, one per document, so this takes time
+        proportional to the number of documents in the sample rather than to its length.
+
+        Args:
+            document_ids (numpy.ndarray): The document ids of the sample parts
+
+            offsets (numpy.ndarray): The token offset into each document
+
+            lengths (numpy.ndarray): The number of tokens of each sample part
+
+        Returns:
+            torch.Tensor: The cumulative document lengths, from 0 to the sequence length, padded
+            with -1 to a fixed length of the sequence length + 1
+        """
+        # A sample part ends a document when it reaches the end of a sequence which ends one
+        is_document_end = offsets + lengths == self.dataset.sequence_lengths[document_ids]
+        document_indices = getattr(self.dataset, "document_indices", None)
+        if document_indices is not None:
+            positions = numpy.searchsorted(document_indices, document_ids + 1)
+            positions = numpy.minimum(positions, document_indices.shape[0] - 1)
+            is_document_end &= document_indices[positions] == document_ids + 1
+
+        boundaries = numpy.cumsum(lengths)[is_document_end]
+        boundaries = boundaries[(boundaries > 0) & (boundaries < self.config.sequence_length)]
+
+        cu_seqlens = torch.full((self.config.sequence_length + 1,), -1, dtype=torch.int32)
+        cu_seqlens[0] = 0
+        cu_seqlens[1 : boundaries.shape[0] + 1] = torch.from_numpy(boundaries)
+        cu_seqlens[boundaries.shape[0] + 1] = self.config.sequence_length
+        return cu_seqlens
+
+    def prefetch(self, indices: numpy.ndarray) -> None:
+        """Hint that the samples at the given indices will be read soon
+
+        Args:
+            indices (numpy.ndarray): The indices into the dataset
+        """
+        if len(indices) == 0:
+            return
+        parts = [self._get_shuffled_sample_parts(idx) for idx in indices]
+        self.dataset.prefetch(*map(numpy.concatenate, zip(*parts)))
 
     def _build_document_sample_shuffle_indices(
         self,
@@ -351,10 +540,7 @@ class GPTDataset(MegatronDataset):
         else:
             cache_hit = False
 
-        if not path_to_cache or (
-            not cache_hit
-            and (not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0)
-        ):
+        if not path_to_cache or (not cache_hit and is_cache_builder()):
 
             log_single_rank(
                 logger,
@@ -407,64 +593,81 @@ class GPTDataset(MegatronDataset):
                 logger, logging.DEBUG, f"> separate_final_epoch: {separate_final_epoch}"
             )
 
-            numpy_random_state = numpy.random.RandomState(self.config.random_seed)
-
-            # Build the document index
-            document_index = _build_document_index(
-                self.indices, num_epochs, numpy_random_state, separate_final_epoch
-            )
-
-            drop_last_partial_sequence = True
-            if self.index_split == Split.valid:
-                drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
-
-            # Build the sample index
-            from megatron.core.datasets import helpers
-
-            if self.index_split == Split.valid:
-                drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
-            else:
-                drop_last_partial_sequence = True
-
-            assert document_index.dtype == numpy.int32
-            assert self.dataset.sequence_lengths.dtype == numpy.int32
-            if len(document_index) * 2 > len(self.dataset.sequence_lengths):
-                # Heuristic: if "access density" of sequence_lengths is relatively high,
-                # force loading the mmap-ed array into memory by taking a copy.
-                # System performance benefits come from two aspects:
-                # 1. **sequentially** pre-loading the whole file if we're gonna read a large fraction anyways.
-                # 2. GIL is held when calling into c++ code; making the c++ func faster improves parallelism.
-                sequence_lengths_for_cpp = self.dataset.sequence_lengths.copy()
+            if self.config.fused_index_build:
+                document_index, sample_index, shuffle_index = self._build_indices_in_place(
+                    num_epochs,
+                    num_tokens_per_epoch,
+                    num_samples_sans_final_epoch if separate_final_epoch else None,
+                    (
+                        (path_to_document_index, path_to_sample_index, path_to_shuffle_index)
+                        if path_to_cache
+                        else None
+                    ),
+                )
+            elif self.config.bin_packing_window > 0:
+                document_index, sample_index, shuffle_index, num_epochs = (
+                    self._build_packed_indices(num_epochs)
+                )
             else:
-                sequence_lengths_for_cpp = self.dataset.sequence_lengths
-            sample_index = helpers.build_sample_idx(
-                sequence_lengths_for_cpp,
-                document_index,
-                sequence_length,
-                num_epochs,
-                num_tokens_per_epoch,
-                drop_last_partial_sequence,
-                self.config.add_extra_token_to_sequence,
-            )
+                numpy_random_state = numpy.random.RandomState(self.config.random_seed)
 
-            # Build the shuffle index
-            if separate_final_epoch:
-                shuffle_index = _build_shuffle_index(
-                    num_samples_sans_final_epoch, sample_index.shape[0] - 1, numpy_random_state
+                # Build the document index
+                document_index = _build_document_index(
+                    self.indices, num_epochs, numpy_random_state, separate_final_epoch
                 )
-            else:
-                shuffle_index = _build_shuffle_index(
-                    sample_index.shape[0] - 1, sample_index.shape[0] - 1, numpy_random_state
+
+                drop_last_partial_sequence = True
+                if self.index_split == Split.valid:
+                    drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+
+                # Build the sample index
+                from megatron.core.datasets import helpers
+
+                if self.index_split == Split.valid:
+                    drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+                else:
+                    drop_last_partial_sequence = True
+
+                assert document_index.dtype == numpy.int32
+                assert self.dataset.sequence_lengths.dtype == numpy.int32
+                if len(document_index) * 2 > len(self.dataset.sequence_lengths):
+                    # Heuristic: if "access density" of sequence_lengths is relatively high,
+                    # force loading the mmap-ed array into memory by taking a copy.
+                    # System performance benefits come from two aspects:
+                    # 1. **sequentially** pre-loading the whole file if we're gonna read a large fraction anyways.
+                    # 2. GIL is held when calling into c++ code; making the c++ func faster improves parallelism.
+                    sequence_lengths_for_cpp = self.dataset.sequence_lengths.copy()
+                else:
+                    sequence_lengths_for_cpp = self.dataset.sequence_lengths
+                sample_index = helpers.build_sample_idx(
+                    sequence_lengths_for_cpp,
+                    document_index,
+                    sequence_length,
+                    num_epochs,
+                    num_tokens_per_epoch,
+                    drop_last_partial_sequence,
+                    self.config.add_extra_token_to_sequence,
                 )
 
+                # Build the shuffle index
+                if separate_final_epoch:
+                    shuffle_index = _build_shuffle_index(
+                        num_samples_sans_final_epoch, sample_index.shape[0] - 1, numpy_random_state
+                    )
+                else:
+                    shuffle_index = _build_shuffle_index(
+                        sample_index.shape[0] - 1, sample_index.shape[0] - 1, numpy_random_state
+                    )
+
             if path_to_cache:
                 os.makedirs(path_to_cache, exist_ok=True)
                 # Write the description
                 with open(path_to_description, "wt") as writer:
                     writer.write(self.unique_description)
-                numpy.save(path_to_document_index, document_index, allow_pickle=True)
-                numpy.save(path_to_sample_index, sample_index, allow_pickle=True)
-                numpy.save(path_to_shuffle_index, shuffle_index, allow_pickle=True)
+                if not self.config.fused_index_build:
+                    numpy.save(path_to_document_index, document_index, allow_pickle=True)
+                    numpy.save(path_to_sample_index, sample_index, allow_pickle=True)
+                    numpy.save(path_to_shuffle_index, shuffle_index, allow_pickle=True)
             else:
                 log_single_rank(
                     logger,
@@ -522,6 +725,237 @@ class GPTDataset(MegatronDataset):
 
         return document_index, sample_index, shuffle_index
 
+    def _build_lazy_index(self) -> "_LazyIndex":
+        """Build the lazy stand-in for the document index, the sample index, and the shuffle index
+
+        Returns:
+            _LazyIndex: The lazy index
+        """
+        if self.index_split == Split.valid:
+            drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+        else:
+            drop_last_partial_sequence = True
+
+        lazy_index = _LazyIndex(
+            self.dataset.sequence_lengths,
+            self.indices,
+            self.config.sequence_length,
+            self.config.add_extra_token_to_sequence,
+            drop_last_partial_sequence,
+            self.num_samples,
+            self.config.random_seed,
+        )
+
+        log_single_rank(logger, logging.INFO, f"> total number of samples: {len(lazy_index)}")
+        log_single_rank(
+            logger,
+            logging.INFO,
+            f"> number of samples per epoch: {lazy_index.num_samples_per_epoch}",
+        )
+
+        return lazy_index
+
+    def _build_packed_indices(
+        self, num_epochs: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, int]:
+        """Build the packed document index, the sample index, and the shuffle index
+
+        The packed document index:
+            -- 2-D
+            -- The document ids and starting token offsets of the pieces of every sample, grouped
+               by sample
+
+        The sample index:
+            -- 1-D
+            -- The bounds of every sample in the packed document index
+
+        Padding leaves fewer samples than tokens would suggest, so the number of epochs is
+        estimated from the number of samples of one packed epoch. As in the default build, the
+        final epoch is excluded from the global shuffle if it contributes less than 80% of an
+        epoch of samples. Should the packed epochs still fall short, one more epoch at a time is
+        packed and appended to the final samples.
+
+        Args:
+            num_epochs (int): The number of epochs from which to start
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, int]: The packed document index, the
+            sample index, the shuffle index, and the number of epochs
+        """
+        from megatron.core.datasets import helpers
+
+        assert self.dataset.sequence_lengths.dtype == numpy.int32
+        sequence_lengths = self.dataset.sequence_lengths
+        sample_length = self.config.sequence_length + self.config.add_extra_token_to_sequence
+
+        def pack(document_index: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+            return helpers.build_packed_sample_idx(
+                sequence_lengths,
+                document_index,
+                self.config.sequence_length,
+                self.config.add_extra_token_to_sequence,
+                self.config.bin_packing_window,
+            )
+
+        separate_final_epoch = False
+        if self.num_samples is not None:
+            # Measure the packing efficiency on one epoch
+            _, sample_index = pack(
+                _build_document_index(
+                    self.indices, 1, numpy.random.RandomState(self.config.random_seed), False
+                )
+            )
+            num_samples_per_epoch = max(sample_index.shape[0] - 1, 1)
+            num_epochs = max(num_epochs, -(-self.num_samples // num_samples_per_epoch))
+            num_samples_from_final_epoch = (
+                self.num_samples - (num_epochs - 1) * num_samples_per_epoch
+            )
+            separate_final_epoch = num_epochs > 1 and num_samples_from_final_epoch < int(
+                0.80 * num_samples_per_epoch
+            )
+        log_single_rank(logger, logging.DEBUG, f"> separate_final_epoch: {separate_final_epoch}")
+
+        numpy_random_state = numpy.random.RandomState(self.config.random_seed)
+        document_index = _build_document_index(
+            self.indices, num_epochs, numpy_random_state, separate_final_epoch
+        )
+        if separate_final_epoch:
+            num_documents_sans_final_epoch = (num_epochs - 1) * len(self.indices)
+            packed_parts = [
+                pack(document_index[:num_documents_sans_final_epoch]),
+                pack(document_index[num_documents_sans_final_epoch:]),
+            ]
+        else:
+            packed_parts = [pack(document_index)]
+        num_samples_sans_final_epoch = packed_parts[0][1].shape[0] - 1
+
+        num_samples = sum(sample_index.shape[0] - 1 for _, sample_index in packed_parts)
+        while self.num_samples is not None and num_samples < self.num_samples:
+            packed_parts.append(
+                pack(_build_document_index(self.indices, 1, numpy_random_state, False))
+            )
+            num_samples += packed_parts[-1][1].shape[0] - 1
+            num_epochs += 1
+            separate_final_epoch = True
+
+        # Concatenate the packed parts, with the bounds of each offset by the previous pieces
+        document_index = numpy.concatenate([part for part, _ in packed_parts])
+        sample_index_offsets = numpy.cumsum([0] + [part.shape[0] for part, _ in packed_parts])
+        sample_index = numpy.concatenate(
+            [packed_parts[0][1]]
+            + [
+                sample_index[1:] + offset
+                for (_, sample_index), offset in zip(packed_parts[1:], sample_index_offsets[1:])
+            ]
+        ).astype(packed_parts[0][1].dtype)
+
+        shuffle_index = _build_shuffle_index(
+            num_samples_sans_final_epoch if separate_final_epoch else num_samples,
+            num_samples,
+            numpy_random_state,
+        )
+
+        num_tokens = numpy.minimum(
+            sample_length, sequence_lengths[document_index[:, 0]] - document_index[:, 1]
+        ).sum(dtype=numpy.int64)
+        log_single_rank(
+            logger,
+            logging.INFO,
+            f"> packing efficiency: {num_tokens / max(num_samples * sample_length, 1):.4f}",
+        )
+        log_single_rank(
+            logger,
+            logging.DEBUG,
+            f"> average number of documents per sample: "
+            f"{document_index.shape[0] / max(num_samples, 1):.2f}",
+        )
+
+        return document_index, sample_index, shuffle_index, num_epochs
+
+    def _build_indices_in_place(
+        self,
+        num_epochs: int,
+        num_tokens_per_epoch: int,
+        num_samples_sans_final_epoch: Optional[int],
+        paths: Optional[Tuple[str, str, str]],
+    ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Build the document index, the sample index, and the shuffle index with a single call
+        into the C++ helpers, which fills them in place
+
+        The documents are shuffled per epoch, which lets the helper build the epochs in parallel
+        and bounds its working memory independently of the number of epochs.
+
+        Args:
+            num_epochs (int): The number of epochs
+
+            num_tokens_per_epoch (int): The number of tokens in a single epoch
+
+            num_samples_sans_final_epoch (Optional[int]): The number of samples before the final
+            epoch, which is shuffled separately. When None, the final epoch is not separated.
+
+            paths (Optional[Tuple[str, str, str]]): The paths to which to memory-map the document
+            index, the sample index, and the shuffle index. When None, build them in memory.
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The document index, the sample index, and the shuffle index
+        """
+        from megatron.core.datasets import helpers
+
+        if self.index_split == Split.valid:
+            drop_last_partial_sequence = self.config.drop_last_partial_validation_sequence
+        else:
+            drop_last_partial_sequence = True
+
+        num_tokens = num_epochs * num_tokens_per_epoch - self.config.add_extra_token_to_sequence
+        if drop_last_partial_sequence:
+            num_samples = num_tokens // self.config.sequence_length
+        else:
+            num_samples = -(-num_tokens // self.config.sequence_length)
+
+        if num_samples_sans_final_epoch is None:
+            num_samples_sans_final_epoch = num_samples
+
+        shapes_and_dtypes = [
+            ((num_epochs * len(self.indices),), numpy.int32),
+            ((num_samples + 1, 2), numpy.int64),
+            (
+                (num_samples,),
+                (numpy.uint32 if num_samples < numpy.iinfo(numpy.uint32).max - 1 else numpy.int64),
+            ),
+        ]
+        if paths is None:
+            indices = [numpy.empty(shape, dtype=dtype) for shape, dtype in shapes_and_dtypes]
+        else:
+            os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+            indices = [
+                numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+                for path, (shape, dtype) in zip(paths, shapes_and_dtypes)
+            ]
+
+        assert self.dataset.sequence_lengths.dtype == numpy.int32
+        if indices[0].shape[0] * 2 > len(self.dataset.sequence_lengths):
+            # See _build_document_sample_shuffle_indices
+            sequence_lengths_for_cpp = self.dataset.sequence_lengths.copy()
+        else:
+            sequence_lengths_for_cpp = self.dataset.sequence_lengths
+
+        helpers.build_document_sample_shuffle_idx(
+            sequence_lengths_for_cpp,
+            self.indices.astype(numpy.int32, copy=False),
+            *indices,
+            self.config.sequence_length,
+            num_samples_sans_final_epoch,
+            self.config.add_extra_token_to_sequence,
+            self.config.random_seed,
+            os.cpu_count() or 1,
+        )
+
+        if paths is not None:
+            for index in indices:
+                index.flush()
+
+        return tuple(indices)
+
     def _get_num_tokens_per_epoch(self) -> int:
         """Calculate the number of tokens in a single epoch
 
@@ -616,6 +1050,197 @@ def _build_shuffle_index(
     return numpy.concatenate((shuffle_idx_first, shuffle_idx_last))
 
 
+class _FeistelPermutation:
+    """A pseudorandom permutation of the range [0, size) which may be evaluated at any point
+
+    The permutation is a balanced Feistel network over the smallest even number of bits which
+    covers the range, restricted to the range by cycle walking.
+
+    Args:
+        size (int): The size of the range to permute
+
+        seed (Tuple[int, ...]): The entropy from which to derive the round keys
+    """
+
+    def __init__(self, size: int, seed: Tuple[int, ...]) -> None:
+        self.size = size
+        self.half_bits = numpy.uint64(max(1, ((size - 1).bit_length() + 1) // 2))
+        self.mask = numpy.uint64((1 << int(self.half_bits)) - 1)
+        self.keys = numpy.random.SeedSequence(seed).generate_state(
+            _FEISTEL_ROUNDS, dtype=numpy.uint64
+        )
+
+    def __call__(self, x: numpy.ndarray) -> numpy.ndarray:
+        """Permute
+
+        Args:
+            x (numpy.ndarray): The points in the range [0, size) to permute
+
+        Returns:
+            numpy.ndarray: The permuted points
+        """
+        y = self._encrypt(numpy.array(x, dtype=numpy.uint64, ndmin=1))
+        out_of_range = y >= self.size
+        while out_of_range.any():
+            y[out_of_range] = self._encrypt(y[out_of_range])
+            out_of_range = y >= self.size
+        return y.astype(numpy.int64)
+
+    def _encrypt(self, x: numpy.ndarray) -> numpy.ndarray:
+        """Permute the range [0, 4 ** half_bits)
+
+        Args:
+            x (numpy.ndarray): The points to permute
+
+        Returns:
+            numpy.ndarray: The permuted points
+        """
+        left = x >> self.half_bits
+        right = x & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix_bits(right ^ key) & self.mask)
+        return (left << self.half_bits) | right
+
+
+def _mix_bits(x: numpy.ndarray) -> numpy.ndarray:
+    """The SplitMix64 finalizer, a bijective mixing of 64-bit integers
+
+    Args:
+        x (numpy.ndarray): The integers to mix, of type uint64
+
+    Returns:
+        numpy.ndarray: The mixed integers
+    """
+    x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return x ^ (x >> numpy.uint64(31))
+
+
+class _LazyIndex:
+    """An on-demand stand-in for the GPTDataset document, sample, and shuffle indices
+
+    Each epoch is its own token stream: the documents are permuted by a per-epoch pseudorandom
+    permutation and concatenated, and the stream is cut into consecutive samples. The samples of
+    an epoch are visited in the order of a second per-epoch pseudorandom permutation, and the
+    epochs are visited in order. Locating a sample requires the prefix sum of the document lengths
+    in the permuted order, which is computed on first access to the epoch and held for the most
+    recently accessed epochs.
+
+    Since no state depends on the total number of samples, the number of samples may change from
+    run to run without changing the samples themselves.
+
+    Args:
+        sequence_lengths (numpy.ndarray): The sequence lengths of the low level dataset
+
+        indices (numpy.ndarray): The set of the documents indices to expose
+
+        sequence_length (int): The sample sequence length
+
+        add_extra_token_to_sequence (bool): Whether to draw one extra token per sample
+
+        drop_last_partial_sequence (bool): Whether to drop the final, partial sample of an epoch
+
+        num_samples (Optional[int]): The number of samples. When None, one epoch of samples.
+
+        random_seed (int): The seed for the permutations
+    """
+
+    def __init__(
+        self,
+        sequence_lengths: numpy.ndarray,
+        indices: numpy.ndarray,
+        sequence_length: int,
+        add_extra_token_to_sequence: bool,
+        drop_last_partial_sequence: bool,
+        num_samples: Optional[int],
+        random_seed: int,
+    ) -> None:
+        self.sequence_lengths = sequence_lengths
+        self.indices = indices
+        self.sequence_length = sequence_length
+        self.add_extra_token_to_sequence = int(add_extra_token_to_sequence)
+        self.random_seed = random_seed
+
+        self.num_tokens_per_epoch = int(numpy.sum(sequence_lengths[indices], dtype=numpy.int64))
+        num_tokens = self.num_tokens_per_epoch - self.add_extra_token_to_sequence
+        if drop_last_partial_sequence:
+            self.num_samples_per_epoch = num_tokens // sequence_length
+        else:
+            self.num_samples_per_epoch = -(-num_tokens // sequence_length)
+        assert self.num_samples_per_epoch > 0, "lazy_index requires at least one sample per epoch"
+
+        self.num_samples = num_samples if num_samples is not None else self.num_samples_per_epoch
+
+        self.epochs = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def get_sample_parts(self, idx: int) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Get the document ids and, per document, the token offset and length of a sample
+
+        Args:
+            idx (int): The index into the dataset
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The document ids, offsets, and lengths
+        """
+        epoch, idx = divmod(int(idx), self.num_samples_per_epoch)
+        document_permutation, sample_permutation, document_offsets = self._get_epoch(epoch)
+
+        # Get the token range of the sample within the epoch
+        token_beg = int(sample_permutation(idx)[0]) * self.sequence_length
+        token_end = min(
+            token_beg + self.sequence_length + self.add_extra_token_to_sequence,
+            self.num_tokens_per_epoch,
+        )
+
+        # Get the range of positions of the documents which hold the token range
+        position_beg = numpy.searchsorted(document_offsets, token_beg, side="right") - 1
+        position_end = numpy.searchsorted(document_offsets, token_end - 1, side="right")
+        positions = numpy.arange(position_beg, position_end)
+
+        document_ids = self.indices[document_permutation(positions)].astype(numpy.int64)
+        offsets = numpy.maximum(document_offsets[positions], token_beg)
+        lengths = numpy.minimum(document_offsets[positions + 1], token_end) - offsets
+        offsets -= document_offsets[positions]
+
+        return document_ids, offsets, lengths
+
+    def _get_epoch(
+        self, epoch: int
+    ) -> Tuple[_FeistelPermutation, _FeistelPermutation, numpy.ndarray]:
+        """Get the document permutation, the sample permutation, and the document offsets of an
+        epoch
+
+        Args:
+            epoch (int): The epoch
+
+        Returns:
+            Tuple[_FeistelPermutation, _FeistelPermutation, numpy.ndarray]: The document permutation, the sample permutation, and the token offset of each document position, with the total number of tokens appended
+        """
+        if epoch in self.epochs:
+            self.epochs.move_to_end(epoch)
+            return self.epochs[epoch]
+
+        document_permutation = _FeistelPermutation(len(self.indices), (self.random_seed, epoch, 0))
+        sample_permutation = _FeistelPermutation(
+            self.num_samples_per_epoch, (self.random_seed, epoch, 1)
+        )
+        document_offsets = numpy.zeros(len(self.indices) + 1, dtype=numpy.int64)
+        numpy.cumsum(
+            self.sequence_lengths[
+                self.indices[document_permutation(numpy.arange(len(self.indices)))]
+            ],
+            out=document_offsets[1:],
+        )
+
+        self.epochs[epoch] = (document_permutation, sample_permutation, document_offsets)
+        while len(self.epochs) > _LAZY_INDEX_NUM_CACHED_EPOCHS:
+            self.epochs.popitem(last=False)
+        return self.epochs[epoch]
+
+
 def _get_ltor_masks_and_position_ids(
     data: torch.Tensor,
     eod_token: int,
@@ -692,6 +1317,104 @@ def _get_ltor_masks_and_position_ids(
     return attention_mask, loss_mask, position_ids
 
 
+def _get_packed_masks_and_position_ids(
+    data: torch.Tensor,
+    cu_seqlens: torch.Tensor,
+    eod_token: int,
+    reset_position_ids: bool,
+    reset_attention_mask: bool,
+    eod_mask_loss: bool,
+    create_attention_mask: bool,
+):
+    """Build masks and position id for left to right model from the document boundaries.
+
+    Equivalent to _get_ltor_masks_and_position_ids when every document ends with the EOD token,
+    but without a scan of the tokens for EOD.
+
+    Args:
+        data (torch.Tensor): The data tenor that holds the tokens from the dataset
+
+        cu_seqlens (torch.Tensor): The cumulative document lengths, padded with -1
+
+        eod_token (int): ID of the token to that is considered the EOD
+
+        reset_position_ids (bool): Switch to reset the document position ID's
+
+        reset_attention_mask (bool): Switch to reset the attention mask
+
+        eod_mask_loss (bool): Switch to enable the EOD mask loss
+
+        create_attention_mask (bool): Switch to enable the attention masks generation. Can be disabled if attention kernel generates masks by itself.
+
+    Returns:
+        torch.Tensor: Attention mask needed to be used for Attention
+
+        torch.Tensor: The mask used for loss value during training
+
+        torch.Tensor: The position ID's of the token
+    """
+    seq_length = data.numel()
+
+    cu_seqlens = cu_seqlens[cu_seqlens >= 0].long()
+    seqlens = cu_seqlens[1:] - cu_seqlens[:-1]
+
+    # Document index per token
+    segment_ids = torch.repeat_interleave(torch.arange(seqlens.numel()), seqlens)
+
+    if create_attention_mask:
+        attention_mask = torch.tril(
+            torch.ones((seq_length, seq_length), dtype=torch.bool, device=data.device)
+        )
+        if reset_attention_mask:
+            attention_mask &= segment_ids.unsqueeze(0) == segment_ids.unsqueeze(1)
+        # Convert attention mask to binary:
+        attention_mask = torch.logical_not(attention_mask).unsqueeze(0)
+    else:
+        attention_mask = None
+
+    # Loss mask.
+    loss_mask = torch.ones(seq_length, dtype=torch.float, device=data.device)
+    if eod_mask_loss:
+        loss_mask[data == eod_token] = 0.0
+
+    # Position ids.
+    position_ids = torch.arange(seq_length, dtype=torch.long, device=data.device)
+    if reset_position_ids:
+        position_ids -= cu_seqlens[segment_ids]
+
+    return attention_mask, loss_mask, position_ids
+
+
+def get_packed_seq_params(cu_seqlens: torch.Tensor) -> PackedSeqParams:
+    """Build the packed sequence parameters for a batch of GPTDataset samples
+
+    The samples of the batch are treated as a single packed sequence, i.e. the batch tokens are to
+    be viewed as [1, b * s].
+
+    Args:
+        cu_seqlens (torch.Tensor): The batched "cu_seqlens" of shape [b, s + 1]
+
+    Returns:
+        PackedSeqParams: The packed sequence parameters for the THD attention format
+    """
+    batch_size, seq_length = cu_seqlens.shape[0], cu_seqlens.shape[1] - 1
+    cu_seqlens_batch = [
+        cu_seqlens[i][cu_seqlens[i] >= 0][:-1] + i * seq_length for i in range(batch_size)
+    ]
+    cu_seqlens_batch.append(
+        torch.tensor([batch_size * seq_length], dtype=cu_seqlens.dtype, device=cu_seqlens.device)
+    )
+    cu_seqlens_batch = torch.cat(cu_seqlens_batch)
+    max_seqlen = (cu_seqlens_batch[1:] - cu_seqlens_batch[:-1]).max()
+    return PackedSeqParams(
+        qkv_format="thd",
+        cu_seqlens_q=cu_seqlens_batch,
+        cu_seqlens_kv=cu_seqlens_batch,
+        max_seqlen_q=max_seqlen,
+        max_seqlen_kv=max_seqlen,
+    )
+
+
 class MockGPTLowLevelDataset:
 
     seed: int = 0
@@ -720,6 +1443,29 @@ class MockGPTLowLevelDataset:
             length = self.sequence_lengths[idx] - offset
         return self[idx][offset : offset + length]
 
+    def get_many(
+        self,
+        indices: numpy.ndarray,
+        offsets: numpy.ndarray,
+        lengths: numpy.ndarray,
+        out: Optional[numpy.ndarray] = None,
+    ) -> numpy.ndarray:
+        parts = [self.get(*args) for args in zip(indices, offsets, lengths)]
+        count = sum(map(len, parts))
+        if out is None:
+            out = numpy.empty(count, dtype=numpy.int64)
+        if count > 0:
+            out[:count] = numpy.concatenate(parts)
+        return out[:count]
+
+    def prefetch(
+        self,
+        indices: numpy.ndarray,
+        offsets: Optional[numpy.ndarray] = None,
+        lengths: Optional[numpy.ndarray] = None,
+    ) -> None:
+        pass
+
 
 class MockGPTDataset(GPTDataset):
     """The mock GPT dataset
@@ -3,6 +3,7 @@
 /* Helper methods for fast index mapping builds */
 
 #include <algorithm>
+#include <atomic>
 #include <iostream>
 #include <limits>
 #include <math.h>
@@ -11,6 +12,9 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
 #include <random>
+#include <thread>
+#include <tuple>
+#include <vector>
 
 namespace py = pybind11;
 using namespace std;
@@ -139,6 +143,118 @@ void build_blending_indices(py::array_t<int16_t> &dataset_index,
   }
 }
 
+void build_scheduled_blending_indices(py::array_t<int16_t> &dataset_index,
+                                      py::array_t<int64_t> &dataset_sample_index,
+                                      py::array_t<int64_t> &current_samples,
+                                      const py::array_t<int64_t> &schedule_samples,
+                                      const py::array_t<double> &schedule_weights,
+                                      const py::array_t<double> &target_offsets,
+                                      const int32_t num_datasets,
+                                      const int64_t start,
+                                      const int64_t size)
+{
+  /* Build the blending indices of the samples [start, start + size) with weights which follow
+     a piecewise-linear schedule over the samples, given as breakpoints with non-decreasing
+     samples. The weights are constant before the first and after the last breakpoint.
+
+     The rule is that of build_blending_indices, with the target number of samples of each
+     dataset being the integral of its weight up to the sample, plus its target offset. With a
+     single breakpoint at sample 0 and no offset, the indices are those of
+     build_blending_indices. The number of samples drawn from each dataset before start is
+     read from, and the number drawn before start + size written back to, current_samples. */
+
+  auto dataset_index_ptr = dataset_index.mutable_unchecked<1>();
+  auto dataset_sample_index_ptr = dataset_sample_index.mutable_unchecked<1>();
+  auto current_samples_ptr = current_samples.mutable_unchecked<1>();
+  auto schedule_samples_ptr = schedule_samples.unchecked<1>();
+  auto schedule_weights_ptr = schedule_weights.unchecked<2>();
+  auto target_offsets_ptr = target_offsets.unchecked<1>();
+
+  const int64_t num_breakpoints = schedule_samples.shape(0);
+  if (num_breakpoints < 1)
+  {
+    throw std::invalid_argument("the schedule should have at least one breakpoint");
+  }
+
+  // The integral of the weights up to each breakpoint.
+  std::vector<double> breakpoint_targets(num_breakpoints * num_datasets);
+  for (int32_t dataset_idx = 0; dataset_idx < num_datasets; ++dataset_idx)
+  {
+    breakpoint_targets[dataset_idx] = schedule_weights_ptr(0, dataset_idx) *
+                                      static_cast<double>(schedule_samples_ptr[0]);
+    for (int64_t i = 1; i < num_breakpoints; ++i)
+    {
+      auto length = static_cast<double>(schedule_samples_ptr[i] - schedule_samples_ptr[i - 1]);
+      breakpoint_targets[i * num_datasets + dataset_idx] =
+          breakpoint_targets[(i - 1) * num_datasets + dataset_idx] +
+          length * 0.5 * (schedule_weights_ptr(i - 1, dataset_idx) +
+                          schedule_weights_ptr(i, dataset_idx));
+    }
+  }
+
+  std::vector<double> targets(num_datasets);
+  // The index of the last breakpoint at or before the current sample, or -1.
+  int64_t breakpoint_idx = -1;
+  for (int64_t i = 0; i < size; ++i)
+  {
+    const int64_t sample_idx = start + i;
+    auto sample_idx_double = std::max(static_cast<double>(sample_idx), 1.0);
+    while (breakpoint_idx + 1 < num_breakpoints &&
+           static_cast<double>(schedule_samples_ptr[breakpoint_idx + 1]) <= sample_idx_double)
+    {
+      ++breakpoint_idx;
+    }
+
+    // Determine the target number of samples of each dataset.
+    for (int32_t dataset_idx = 0; dataset_idx < num_datasets; ++dataset_idx)
+    {
+      double target;
+      if (breakpoint_idx < 0)
+      {
+        target = schedule_weights_ptr(0, dataset_idx) * sample_idx_double;
+      }
+      else
+      {
+        auto weight = schedule_weights_ptr(breakpoint_idx, dataset_idx);
+        auto offset = sample_idx_double - static_cast<double>(schedule_samples_ptr[breakpoint_idx]);
+        target = breakpoint_targets[breakpoint_idx * num_datasets + dataset_idx];
+        if (breakpoint_idx + 1 < num_breakpoints)
+        {
+          auto slope = (schedule_weights_ptr(breakpoint_idx + 1, dataset_idx) - weight) /
+                       static_cast<double>(schedule_samples_ptr[breakpoint_idx + 1] -
+                                           schedule_samples_ptr[breakpoint_idx]);
+          target += offset * (weight + 0.5 * slope * offset);
+        }
+        else
+        {
+          target += weight * offset;
+        }
+      }
+      targets[dataset_idx] = target + target_offsets_ptr[dataset_idx];
+    }
+
+    // Determine where the max error in sampling is happening.
+    int64_t max_error_index = 0;
+    double max_error = targets[0] - static_cast<double>(current_samples_ptr[0]);
+    for (int64_t dataset_idx = 1; dataset_idx < num_datasets; ++dataset_idx)
+    {
+      double error = targets[dataset_idx] - static_cast<double>(current_samples_ptr[dataset_idx]);
+      if (error > max_error)
+      {
+        max_error = error;
+        max_error_index = dataset_idx;
+      }
+    }
+
+    // Populate the indices.
+    dataset_index_ptr[i] = static_cast<int16_t>(max_error_index);
+    dataset_sample_index_ptr[i] = current_samples_ptr[max_error_index];
+
+    // Update the total samples.
+    current_samples_ptr[max_error_index] += 1;
+  }
+}
+
 py::array build_sample_idx(const py::array_t<int32_t> &sizes_,
                            const py::array_t<int32_t> &doc_idx_,
                            const int32_t seq_length,
@@ -239,6 +355,347 @@ py::array build_sample_idx(const py::array_t<int32_t> &sizes_,
                    free_when_done);                          // numpy array references
 }
 
+py::tuple build_packed_sample_idx(const py::array_t<int32_t> &sizes_,
+                                  const py::array_t<int32_t> &doc_idx_,
+                                  const int32_t seq_length,
+                                  const int add_extra_token_to_sequence,
+                                  const int64_t window_size)
+{
+  /* Build a sample index by packing whole documents into samples with the
+     best-fit decreasing heuristic.
+
+     The document index is consumed in consecutive windows of window_size
+     documents. Within a window, the documents are sorted by decreasing length
+     and each is placed into the open sample with the least remaining room
+     which fits it, or into a new sample if none does. The samples of a window
+     are closed at the end of the window. Documents longer than a sample are
+     first cut into full-sample pieces, each a sample of its own, and one
+     remaining piece, which is packed like any other document.
+
+     Returns (packed_doc_idx, sample_idx), where packed_doc_idx is a 2D array
+     of shape [number-of-pieces, 2] holding the document id and the starting
+     token offset of each piece, grouped by sample, and sample_idx is a 1D
+     array of shape [number-of-samples + 1] holding the bounds of each sample
+     in packed_doc_idx. The length of a piece is min(seq_length +
+     add_extra_token_to_sequence, size - offset). */
+
+  if (seq_length < 1 || window_size < 1)
+  {
+    throw std::invalid_argument("seq_length and window_size must be positive");
+  }
+
+  // Remove bound checks.
+  auto sizes = sizes_.unchecked<1>();
+  auto doc_idx = doc_idx_.unchecked<1>();
+
+  const int64_t num_documents = doc_idx_.shape(0);
+  const int32_t capacity = seq_length + add_extra_token_to_sequence;
+
+  std::vector<int32_t> packed_doc_idx;
+  std::vector<int64_t> sample_idx;
+  packed_doc_idx.reserve(2 * num_documents);
+  sample_idx.reserve(num_documents + 1);
+  sample_idx.push_back(0);
+
+  // The pieces of the current window, as (length, document id, offset).
+  std::vector<std::tuple<int32_t, int32_t, int32_t>> pieces;
+  // The samples of the current window, as lists of piece indices.
+  std::vector<std::vector<int64_t>> samples;
+  // The open samples of the current window, as (remaining room, sample index).
+  std::set<std::pair<int32_t, int64_t>> open_samples;
+
+  for (int64_t window_beg = 0; window_beg < num_documents; window_beg += window_size)
+  {
+    const int64_t window_end = std::min(window_beg + window_size, num_documents);
+
+    pieces.clear();
+    for (int64_t i = window_beg; i < window_end; ++i)
+    {
+      const int32_t doc_id = doc_idx[i];
+      const int32_t size = sizes[doc_id];
+      int32_t offset = 0;
+      // Cut the full-sample pieces, which overlap like consecutive samples.
+      while (size - offset > capacity)
+      {
+        packed_doc_idx.push_back(doc_id);
+        packed_doc_idx.push_back(offset);
+        sample_idx.push_back(static_cast<int64_t>(packed_doc_idx.size() / 2));
+        offset += seq_length;
+      }
+      // Skip a remaining piece which the preceding piece already covers.
+      if (size - offset > (offset > 0 ? add_extra_token_to_sequence : 0))
+      {
+        pieces.emplace_back(size - offset, doc_id, offset);
+      }
+    }
+
+    // Sort by decreasing length, breaking ties by position in the window.
+    std::vector<int64_t> order(pieces.size());
+    for (size_t i = 0; i < order.size(); ++i)
+    {
+      order[i] = static_cast<int64_t>(i);
+    }
+    std::stable_sort(order.begin(), order.end(), [&pieces](const int64_t a, const int64_t b)
+                     { return std::get<0>(pieces[a]) > std::get<0>(pieces[b]); });
+
+    samples.clear();
+    open_samples.clear();
+    for (const int64_t piece : order)
+    {
+      const int32_t length = std::get<0>(pieces[piece]);
+      auto best = open_samples.lower_bound(std::make_pair(length, static_cast<int64_t>(-1)));
+      int64_t sample;
+      int32_t remaining;
+      if (best == open_samples.end())
+      {
+        sample = static_cast<int64_t>(samples.size());
+        samples.emplace_back();
+        remaining = capacity - length;
+      }
+      else
+      {
+        sample = best->second;
+        remaining = best->first - length;
+        open_samples.erase(best);
+      }
+      samples[sample].push_back(piece);
+      if (remaining > 0)
+      {
+        open_samples.emplace(remaining, sample);
+      }
+    }
+
+    for (const auto &sample : samples)
+    {
+      for (const int64_t piece : sample)
+      {
+        packed_doc_idx.push_back(std::get<1>(pieces[piece]));
+        packed_doc_idx.push_back(std::get<2>(pieces[piece]));
+      }
+      sample_idx.push_back(static_cast<int64_t>(packed_doc_idx.size() / 2));
+    }
+  }
+
+  const int64_t num_pieces = static_cast<int64_t>(packed_doc_idx.size() / 2);
+  py::array_t<int32_t> packed_doc_idx_array(std::vector<int64_t>{num_pieces, 2});
+  std::copy(packed_doc_idx.begin(), packed_doc_idx.end(), packed_doc_idx_array.mutable_data());
+  py::array_t<int64_t> sample_idx_array(static_cast<py::ssize_t>(sample_idx.size()));
+  std::copy(sample_idx.begin(), sample_idx.end(), sample_idx_array.mutable_data());
+
+  return py::make_tuple(packed_doc_idx_array, sample_idx_array);
+}
+
+inline uint64_t get_random_below(std::mt19937_64 &rand64_gen, const uint64_t bound)
+{
+  /* Draw uniformly from [0, bound) by rejection sampling. Unlike
+     std::uniform_int_distribution, the result does not depend on the
+     standard library implementation. */
+  const uint64_t limit = std::numeric_limits<uint64_t>::max() -
+                         std::numeric_limits<uint64_t>::max() % bound;
+  uint64_t value = rand64_gen();
+  while (value >= limit)
+  {
+    value = rand64_gen();
+  }
+  return value % bound;
+}
+
+template <typename T>
+void shuffle_in_place(T *data, const int64_t size, std::mt19937_64 &rand64_gen)
+{
+  // Fisher-Yates shuffle.
+  for (int64_t i = size - 1; i > 0; --i)
+  {
+    const int64_t j = static_cast<int64_t>(get_random_below(rand64_gen, i + 1));
+    std::swap(data[i], data[j]);
+  }
+}
+
+template <typename T>
+void build_shuffle_idx_impl(T *shuffle_idx,
+                            const int64_t num_samples,
+                            const int64_t num_samples_sans_final_epoch,
+                            const int64_t seed)
+{
+  for (int64_t i = 0; i < num_samples; ++i)
+  {
+    shuffle_idx[i] = static_cast<T>(i);
+  }
+  std::seed_seq seed_first{static_cast<uint32_t>(seed), 1u, 0u};
+  std::mt19937_64 rand64_gen_first(seed_first);
+  shuffle_in_place(shuffle_idx, num_samples_sans_final_epoch, rand64_gen_first);
+  if (num_samples_sans_final_epoch < num_samples)
+  {
+    std::seed_seq seed_last{static_cast<uint32_t>(seed), 1u, 1u};
+    std::mt19937_64 rand64_gen_last(seed_last);
+    shuffle_in_place(shuffle_idx + num_samples_sans_final_epoch,
+                     num_samples - num_samples_sans_final_epoch,
+                     rand64_gen_last);
+  }
+}
+
+void build_document_sample_shuffle_idx(const py::array_t<int32_t> &sizes_,
+                                       const py::array_t<int32_t> &documents_,
+                                       py::array_t<int32_t> &doc_idx_,
+                                       py::array_t<int64_t> &sample_idx_,
+                                       py::array &shuffle_idx_,
+                                       const int32_t seq_length,
+                                       const int64_t num_samples_sans_final_epoch,
+                                       const int add_extra_token_to_sequence,
+                                       const int64_t seed,
+                                       const int32_t num_threads)
+{
+  /* Fused, multithreaded build of the document index (doc_idx), the sample
+     index (sample_idx), and the shuffle index (shuffle_idx) into
+     preallocated, typically memory-mapped, arrays.
+
+     The documents are shuffled per epoch rather than across all epochs. Each
+     epoch then covers a fixed range of the flattened token stream, so that
+     the epochs are built independently of one another, each by a single
+     thread which shuffles the epoch's slice of doc_idx and then records the
+     bounds of the samples which end in that slice. The shuffle index, which
+     depends on the number of samples only, is built concurrently. Beyond the
+     outputs themselves, memory usage is independent of the number of epochs.
+
+     The sample index matches that of build_sample_idx given the same doc_idx:
+     row k records the position in doc_idx and the offset of the token k *
+     seq_length, expressed relative to the document holding the final token of
+     sample k - 1. When the final sample is partial, its right bound is
+     clamped to the end of the final document. */
+
+  const int64_t num_documents = documents_.shape(0);
+  const int64_t num_samples = sample_idx_.shape(0) - 1;
+
+  if (num_documents == 0 || doc_idx_.shape(0) % num_documents != 0)
+  {
+    throw std::invalid_argument("doc_idx must hold a whole number of epochs");
+  }
+  if (sample_idx_.ndim() != 2 || sample_idx_.shape(1) != 2 || num_samples < 1)
+  {
+    throw std::invalid_argument("sample_idx must have shape [num_samples + 1, 2]");
+  }
+  if (shuffle_idx_.ndim() != 1 || shuffle_idx_.shape(0) != num_samples)
+  {
+    throw std::invalid_argument("shuffle_idx must have shape [num_samples]");
+  }
+  if (num_samples_sans_final_epoch > num_samples)
+  {
+    throw std::invalid_argument("num_samples_sans_final_epoch must not exceed num_samples");
+  }
+  const bool shuffle_idx_is_uint32 = py::isinstance<py::array_t<uint32_t>>(shuffle_idx_);
+  if (!shuffle_idx_is_uint32 && !py::isinstance<py::array_t<int64_t>>(shuffle_idx_))
+  {
+    throw std::invalid_argument("shuffle_idx must be of type uint32 or int64");
+  }
+
+  const int64_t num_epochs = doc_idx_.shape(0) / num_documents;
+  const int64_t extra = add_extra_token_to_sequence;
+
+  // Remove bound checks.
+  auto sizes = sizes_.unchecked<1>();
+  auto documents = documents_.unchecked<1>();
+  int32_t *doc_idx = doc_idx_.mutable_data();
+  int64_t *sample_idx = sample_idx_.mutable_data();
+  void *shuffle_idx = shuffle_idx_.mutable_data();
+
+  int64_t tokens_per_epoch = 0;
+  for (int64_t i = 0; i < num_documents; ++i)
+  {
+    tokens_per_epoch += sizes[documents[i]];
+  }
+  if (num_samples * seq_length + extra - 1 >= num_epochs * tokens_per_epoch + seq_length - 1)
+  {
+    throw std::invalid_argument("num_samples exceeds the number of tokens in doc_idx");
+  }
+
+  py::gil_scoped_release release;
+
+  std::atomic<int64_t> next_epoch(0);
+
+  auto build_epochs = [&]()
+  {
+    for (int64_t epoch = next_epoch++; epoch < num_epochs; epoch = next_epoch++)
+    {
+      // Build the document index for the epoch.
+      int32_t *epoch_doc_idx = doc_idx + epoch * num_documents;
+      for (int64_t i = 0; i < num_documents; ++i)
+      {
+        epoch_doc_idx[i] = documents[i];
+      }
+      std::seed_seq seed_epoch{static_cast<uint32_t>(seed), 0u, static_cast<uint32_t>(epoch)};
+      std::mt19937_64 rand64_gen(seed_epoch);
+      shuffle_in_place(epoch_doc_idx, num_documents, rand64_gen);
+
+      // Build the sample index rows whose preceding sample ends in the epoch.
+      const bool is_final_epoch = epoch == num_epochs - 1;
+      const int64_t token_end = (epoch + 1) * tokens_per_epoch;
+      const int64_t doc_idx_index_end = (epoch + 1) * num_documents;
+      int64_t doc_idx_index = epoch * num_documents;
+      int64_t doc_token_beg = epoch * tokens_per_epoch;
+      int64_t sample_index = (doc_token_beg - extra + seq_length) / seq_length;
+      if (epoch == 0)
+      {
+        sample_idx[0] = 0;
+        sample_idx[1] = 0;
+        sample_index = 1;
+      }
+      for (; sample_index <= num_samples; ++sample_index)
+      {
+        // The final token of the preceding sample.
+        const int64_t token = sample_index * seq_length + extra - 1;
+        if (token >= token_end && !is_final_epoch)
+        {
+          break;
+        }
+        while (doc_idx_index < doc_idx_index_end &&
+               doc_token_beg + sizes[doc_idx[doc_idx_index]] <= token)
+        {
+          doc_token_beg += sizes[doc_idx[doc_idx_index]];
+          ++doc_idx_index;
+        }
+        if (doc_idx_index == doc_idx_index_end)
+        {
+          // The final sample is partial.
+          sample_idx[2 * sample_index] = doc_idx_index_end - 1;
+          sample_idx[2 * sample_index + 1] = sizes[doc_idx[doc_idx_index_end - 1]] - extra;
+        }
+        else
+        {
+          sample_idx[2 * sample_index] = doc_idx_index;
+          sample_idx[2 * sample_index + 1] = token - doc_token_beg + 1 - extra;
+        }
+      }
+    }
+  };
+
+  auto build_shuffle_idx = [&]()
+  {
+    if (shuffle_idx_is_uint32)
+    {
+      build_shuffle_idx_impl(static_cast<uint32_t *>(shuffle_idx), num_samples,
+                             num_samples_sans_final_epoch, seed);
+    }
+    else
+    {
+      build_shuffle_idx_impl(static_cast<int64_t *>(shuffle_idx), num_samples,
+                             num_samples_sans_final_epoch, seed);
+    }
+  };
+
+  const int64_t num_epoch_threads = std::max<int64_t>(
+      1, std::min<int64_t>(num_threads - 1, num_epochs));
+  std::vector<std::thread> threads;
+  threads.emplace_back(build_shuffle_idx);
+  for (int64_t i = 0; i < num_epoch_threads; ++i)
+  {
+    threads.emplace_back(build_epochs);
+  }
+  for (auto &thread : threads)
+  {
+    thread.join();
+  }
+}
+
 inline int32_t get_target_sample_len(const int32_t short_seq_ratio,
                                      const int32_t max_length,
                                      std::mt19937 &rand32_gen)
@@ -834,6 +1291,9 @@ PYBIND11_MODULE(helpers, m)
   m.def("build_mapping", &build_mapping);
   m.def("build_blocks_mapping", &build_blocks_mapping);
   m.def("build_sample_idx", &build_sample_idx);
+  m.def("build_document_sample_shuffle_idx", &build_document_sample_shuffle_idx);
+  m.def("build_packed_sample_idx", &build_packed_sample_idx);
   m.def("build_blending_indices", &build_blending_indices);
+  m.def("build_scheduled_blending_indices", &build_scheduled_blending_indices);
   m.def("build_exhaustive_blending_indices", &build_exhaustive_blending_indices);
 }
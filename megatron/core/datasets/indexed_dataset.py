@@ -5,17 +5,21 @@
 
 # Essentially re-written in entirety
 
+import json
 import logging
 import os
 import shutil
 import struct
+import threading
 import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from functools import lru_cache
 from itertools import accumulate
 from types import TracebackType
-from typing import List, Optional, Tuple, Type, Union
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Type, Union
 
 try:
     import boto3
@@ -37,6 +41,16 @@ logger = logging.getLogger(__name__)
 
 _INDEX_HEADER = b"MMIDIDX\x00\x00"
 
+_WORD_STARTS_HEADER = b"MMIDWSB\x00\x00"
+
+_WORD_STARTS_CHUNK_NBYTES = 1 << 24
+
+_MANIFEST_VERSION = 1
+
+_MAX_OPEN_BIN_FILES = 64
+
+_COPY_FILE_RANGE_NBYTES = 1 << 30
+
 
 class DType(Enum):
     """The NumPy data type Enum for writing/reading the IndexedDataset indices"""
@@ -203,22 +217,22 @@ class _IndexWriter(object):
             self.idx_writer.write(sequence_modes.tobytes(order='C'))
             del sequence_modes
 
-    def _sequence_pointers(self, sequence_lengths: List[int]) -> List[int]:
+    def _sequence_pointers(self, sequence_lengths: List[int]) -> numpy.ndarray:
         """Build the sequence pointers per the sequence lengths and dtype size
 
         Args:
             sequence_lengths (List[int]): The length of each sequence
 
         Returns:
-            List[int]: The pointer to the beginning of each sequence
+            numpy.ndarray: The pointer to the beginning of each sequence
         """
         itemsize = DType.size(self.dtype)
-        curr_ptr = 0
-        list_ptr = []
-        for length in sequence_lengths:
-            list_ptr.append(curr_ptr)
-            curr_ptr += length * itemsize
-        return list_ptr
+        sequence_pointers = numpy.zeros(len(sequence_lengths), dtype=numpy.int64)
+        numpy.cumsum(
+            numpy.asarray(sequence_lengths, dtype=numpy.int64)[:-1] * itemsize,
+            out=sequence_pointers[1:],
+        )
+        return sequence_pointers
 
 
 class _IndexReader(object):
@@ -341,6 +355,114 @@ class _IndexReader(object):
         )
 
 
+class _WordStartsWriter(object):
+    """Object class to write the word starts (.wsb) file
+
+    The file holds one bit per token of the data (.bin) file, in the same order, set when the token
+    starts a word, e.g. when it is not a "##" piece in WordPiece tokenization. The bits are packed
+    eight to a byte, least significant bit first.
+
+    Args:
+        wsb_path (str): The path to the word starts file
+    """
+
+    def __init__(self, wsb_path: str) -> None:
+        self.wsb_path = wsb_path
+        self.wsb_writer = open(self.wsb_path, "wb")
+
+        # fixed, vestigial practice
+        self.wsb_writer.write(_WORD_STARTS_HEADER)
+
+        # fixed, vestigial practice
+        self.wsb_writer.write(struct.pack("<Q", 1))
+
+        # the token count, written on close
+        self.wsb_writer.write(struct.pack("<Q", 0))
+
+        self.token_count = 0
+        self.bits = numpy.empty(0, dtype=bool)
+
+    def write(self, word_starts: numpy.ndarray) -> None:
+        """Write the word starts of the next tokens
+
+        Args:
+            word_starts (numpy.ndarray): Whether each token starts a word
+        """
+        bits = numpy.concatenate([self.bits, numpy.asarray(word_starts, dtype=bool)])
+        nbits = bits.shape[0] - bits.shape[0] % 8
+        self.wsb_writer.write(numpy.packbits(bits[:nbits], bitorder="little").tobytes())
+        self.bits = bits[nbits:]
+        self.token_count += len(word_starts)
+
+    def append(self, wsb_path: str) -> None:
+        """Write the word starts of all the tokens of another word starts file
+
+        Args:
+            wsb_path (str): The path to the word starts file to append
+        """
+        reader = _WordStartsReader(wsb_path)
+        chunk_nbits = _WORD_STARTS_CHUNK_NBYTES * 8
+        for offset in range(0, reader.token_count, chunk_nbits):
+            self.write(reader.read(offset, min(chunk_nbits, reader.token_count - offset)))
+
+    def close(self) -> None:
+        """Write the remaining word starts and the token count and close the file"""
+        self.wsb_writer.write(numpy.packbits(self.bits, bitorder="little").tobytes())
+        self.wsb_writer.seek(len(_WORD_STARTS_HEADER) + 8)
+        self.wsb_writer.write(struct.pack("<Q", self.token_count))
+        self.wsb_writer.close()
+
+
+class _WordStartsReader(object):
+    """Object class to read the word starts (.wsb) file
+
+    See _WordStartsWriter for the file format. The bits are memory mapped and unpacked on read.
+
+    Args:
+        wsb_path (str): The path to the word starts file
+    """
+
+    def __init__(self, wsb_path: str) -> None:
+        with open(wsb_path, "rb") as stream:
+            header = stream.read(len(_WORD_STARTS_HEADER))
+            assert header == _WORD_STARTS_HEADER, f"bad header, cannot read: {wsb_path}"
+
+            version = struct.unpack("<Q", stream.read(8))[0]
+            assert version == 1, f"bad version, cannot read: {wsb_path}"
+
+            self.token_count = struct.unpack("<Q", stream.read(8))[0]
+
+            offset = stream.tell()
+
+        self.wsb_buffer_mmap = numpy.memmap(wsb_path, mode="r", order="C")
+        self.wsb_buffer = self.wsb_buffer_mmap[offset:]
+        assert self.wsb_buffer.shape[0] == (self.token_count + 7) // 8
+
+    def read(self, offset: int, count: int) -> numpy.ndarray:
+        """Read the word starts of a range of tokens
+
+        Args:
+            offset (int): The index of the first token
+
+            count (int): The number of tokens
+
+        Returns:
+            numpy.ndarray: Whether each token starts a word
+        """
+        assert 0 <= offset and offset + count <= self.token_count
+        bits = numpy.unpackbits(
+            self.wsb_buffer[offset // 8 : (offset + count + 7) // 8], bitorder="little"
+        )
+        return bits[offset % 8 : offset % 8 + count].view(bool)
+
+    def __del__(self) -> None:
+        """Clean up the object"""
+        if hasattr(self, "wsb_buffer_mmap"):
+            del self.wsb_buffer
+            self.wsb_buffer_mmap._mmap.close()
+            del self.wsb_buffer_mmap
+
+
 class _BinReader(ABC):
     """Abstract class to read the data (.bin) file"""
 
@@ -360,6 +482,16 @@ class _BinReader(ABC):
         """
         pass
 
+    def prefetch(self, offsets: numpy.ndarray, nbytes: numpy.ndarray) -> None:
+        """Hint that the given byte ranges will be read soon. Does nothing by default.
+
+        Args:
+            offsets (numpy.ndarray): The offset (in bytes) of each byte range
+
+            nbytes (numpy.ndarray): The size (in bytes) of each byte range
+        """
+        pass
+
 
 class _MMapBinReader(_BinReader):
     """A _BinReader that memory maps the data (.bin) file
@@ -429,46 +561,329 @@ class _FileBinReader(_BinReader):
         return sequence
 
 
+class _BinManifest(NamedTuple):
+    """The manifest of a multi-file IndexedDataset, i.e. an IndexedDataset whose data is spread
+    over an ordered list of data (.bin) files that share a single index (.idx) file
+
+    The sequence pointers in the shared index file are byte offsets into the logical
+    concatenation of the data files, exactly as if the data files had been concatenated on disk.
+
+    Attributes:
+        bin_paths (List[str]): The paths to the data (.bin) files, in order, either absolute or relative to the directory of the manifest file
+
+        bin_nbytes (List[int]): The size in bytes of each data (.bin) file
+    """
+
+    bin_paths: List[str]
+
+    bin_nbytes: List[int]
+
+    def save(self, manifest_path: str) -> None:
+        """Write the manifest file
+
+        Args:
+            manifest_path (str): The path to the manifest file
+        """
+        with open(manifest_path, "wt") as writer:
+            json.dump(
+                {
+                    "version": _MANIFEST_VERSION,
+                    "bin_paths": list(self.bin_paths),
+                    "bin_nbytes": [int(nbytes) for nbytes in self.bin_nbytes],
+                },
+                writer,
+                indent=4,
+            )
+
+    @staticmethod
+    def load(manifest_path: str) -> "_BinManifest":
+        """Read the manifest file and resolve the data (.bin) file paths
+
+        Args:
+            manifest_path (str): The path to the manifest file
+
+        Returns:
+            _BinManifest: The manifest, with the data (.bin) file paths made absolute
+        """
+        with open(manifest_path, "rt") as reader:
+            manifest = json.load(reader)
+        assert (
+            manifest["version"] == _MANIFEST_VERSION
+        ), f"bad version, cannot read: {manifest_path}"
+        assert len(manifest["bin_paths"]) == len(manifest["bin_nbytes"])
+        root = os.path.dirname(os.path.abspath(manifest_path))
+        return _BinManifest(
+            bin_paths=[os.path.join(root, bin_path) for bin_path in manifest["bin_paths"]],
+            bin_nbytes=manifest["bin_nbytes"],
+        )
+
+
+class _MultiBinReader(_BinReader):
+    """A _BinReader that reads from an ordered list of data (.bin) files as if they were one file
+
+    The data files are opened lazily, on first read. When mmap-ing, at most `max_open_bin_files`
+    data files are held open at once, with the least recently read data file released first. A
+    released data file is unmapped once no array returned by `read` references it anymore.
+
+    Args:
+        bin_paths (List[str]): The paths to the data (.bin) files
+
+        bin_nbytes (List[int]): The size in bytes of each data (.bin) file
+
+        mmap (bool): Whether to mmap the data (.bin) files or to use file pointers
+
+        max_open_bin_files (int): The maximum number of data (.bin) files to hold mmap-ed
+    """
+
+    def __init__(
+        self, bin_paths: List[str], bin_nbytes: List[int], mmap: bool, max_open_bin_files: int
+    ) -> None:
+        assert len(bin_paths) == len(bin_nbytes)
+        assert max_open_bin_files > 0
+        self._bin_paths = bin_paths
+        self._bin_offsets = numpy.zeros(len(bin_nbytes) + 1, dtype=numpy.int64)
+        numpy.cumsum(bin_nbytes, out=self._bin_offsets[1:])
+        self._mmap = mmap
+        self._max_open_bin_files = max_open_bin_files
+        self._bin_buffers = OrderedDict()
+
+    def _read_bin_file(
+        self, i: int, dtype: Type[numpy.number], count: int, offset: int
+    ) -> numpy.ndarray:
+        """Read bytes from a single data (.bin) file into a numpy array
+
+        Args:
+            i (int): The index of the data file
+
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            count (int): Number of items to read.
+
+            offset (int): Start reading from this offset (in bytes) into the data file.
+
+        Returns:
+            numpy.ndarray: An array with `count` items and data-type `dtype`
+        """
+        if not self._mmap:
+            return _FileBinReader(self._bin_paths[i]).read(dtype=dtype, count=count, offset=offset)
+        bin_buffer = self._bin_buffers.get(i)
+        if bin_buffer is None:
+            if len(self._bin_buffers) >= self._max_open_bin_files:
+                # Drop the reference only: arrays previously returned keep the mmap alive
+                self._bin_buffers.popitem(last=False)
+            bin_buffer = memoryview(numpy.memmap(self._bin_paths[i], mode="r", order="C"))
+            self._bin_buffers[i] = bin_buffer
+        else:
+            self._bin_buffers.move_to_end(i)
+        return numpy.frombuffer(bin_buffer, dtype=dtype, count=count, offset=offset)
+
+    def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
+        """Read bytes into a numpy array.
+
+        A request which spans the boundary between two data (.bin) files is served by reading
+        from each file in turn and concatenating the results.
+
+        Args:
+            dtype (Type[numpy.number]): Data-type of the returned array.
+
+            count (int): Number of items to read.
+
+            offset (int): Start reading from this offset (in bytes).
+
+        Returns:
+            numpy.ndarray: An array with `count` items and data-type `dtype` constructed from reading bytes from the data file starting at `offset`.
+        """
+        if count == 0:
+            return numpy.empty(0, dtype=dtype)
+        itemsize = DType.size(dtype)
+        # the index of the data file which contains the byte at offset
+        i = int(numpy.searchsorted(self._bin_offsets, offset, side="right")) - 1
+        local_offset = int(offset - self._bin_offsets[i])
+        if offset + count * itemsize <= self._bin_offsets[i + 1]:
+            return self._read_bin_file(i, dtype=dtype, count=count, offset=local_offset)
+        parts = []
+        while count > 0:
+            local_count = min(count, int(self._bin_offsets[i + 1] - offset) // itemsize)
+            parts.append(
+                self._read_bin_file(i, dtype=dtype, count=local_count, offset=local_offset)
+            )
+            count -= local_count
+            offset += local_count * itemsize
+            local_offset = 0
+            i += 1
+        return numpy.concatenate(parts)
+
+
 class _S3BinReader(_BinReader):
     """A _BinReader that reads from the data (.bin) file from S3
 
+    The data file is divided into chunks of `bin_chunk_nbytes` bytes, where chunk k covers the
+    bytes [k * `bin_chunk_nbytes`, (k + 1) * `bin_chunk_nbytes`). Up to `bin_chunk_cache_size`
+    chunks are held in an in-memory LRU cache. Runs of consecutive chunks which are missing from
+    the cache are downloaded with a single ranged GET request. Chunks can be requested ahead of
+    time through `prefetch`, in which case they are downloaded by a pool of `bin_prefetch_threads`
+    background threads and a `read` which needs a chunk still in flight waits on that download
+    rather than issuing another request.
+
     Args:
         bin_path (str): bin_path (str): The path to the data (.bin) file.
 
-        bin_chunk_nbytes (int, optional): If not None, then maintain an in-memory cache to speed up calls to the `read` method. Furthermore, on a cache miss, download this number of bytes to refresh the cache. Otherwise (None), do not maintain an in-memory cache. A class that inherits from _BinReader may not implement caching in which case it should assert that `bin_chunk_nbytes` is None at initialization.
+        bin_chunk_nbytes (int): The number of bytes per chunk.
+
+        bin_chunk_cache_size (int): The maximum number of chunks to cache. Defaults to 1.
+
+        bin_prefetch_threads (int): The number of background download threads. If 0, `prefetch` does nothing. Defaults to 0.
     """
 
-    def __init__(self, bin_path: str, bin_chunk_nbytes: int) -> None:
+    def __init__(
+        self,
+        bin_path: str,
+        bin_chunk_nbytes: int,
+        bin_chunk_cache_size: int = 1,
+        bin_prefetch_threads: int = 0,
+    ) -> None:
         assert bin_chunk_nbytes > 0
+        assert bin_chunk_cache_size > 0
+        assert bin_prefetch_threads >= 0
         self._client = boto3.client("s3")
         self._s3_bucket, self._s3_key = parse_s3_path(bin_path)
-        self._cache = None
-        self._cache_bytes_start = None
-        self._cache_bytes_end = None
+        self._cache = OrderedDict()
         self._cache_nbytes = bin_chunk_nbytes
+        self._cache_size = bin_chunk_cache_size
+        self._prefetch_threads = bin_prefetch_threads
+        # Created on first use, i.e. after any fork into data loader workers
+        self._executor = None
+        # The in-flight download per chunk
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._statistics = {
+            "read_hits": 0,
+            "read_misses": 0,
+            "read_wait_seconds": 0.0,
+            "prefetched_chunks": 0,
+            "get_requests": 0,
+            "get_nbytes": 0,
+            "get_seconds": 0.0,
+        }
+
+    @property
+    def statistics(self) -> Dict[str, Union[int, float]]:
+        """Get the cache and request counters
+
+        read_hits/read_misses count the calls to `read` which were served entirely from the cache
+        or not, read_wait_seconds is the total time `read` spent waiting on downloads,
+        prefetched_chunks counts the chunks scheduled for download by `prefetch`, and
+        get_requests/get_nbytes/get_seconds count the GET requests, the bytes they returned and
+        their total latency.
+
+        Returns:
+            Dict[str, Union[int, float]]: A copy of the counters
+        """
+        with self._lock:
+            return dict(self._statistics)
+
+    def _get_chunks(self, chunk_beg: int, chunk_end: int) -> Dict[int, bytes]:
+        """Download the chunks [`chunk_beg`, `chunk_end`) with a single GET request and cache them
+
+        Args:
+            chunk_beg (int): The index of the first chunk
+
+            chunk_end (int): The index of the chunk after the last chunk
 
-    def _extract_from_cache(self, offset: int, size: int) -> bytes:
-        """Extract `size` bytes starting at `offset` bytes into the cache"""
-        start = offset - self._cache_bytes_start
-        assert start >= 0
-        end = start + size
-        assert end <= len(self._cache)
-        return self._cache[start:end]
+        Returns:
+            Dict[int, bytes]: The downloaded chunks by index. The last chunk of the data file may be short.
+        """
+        t_beg = time.time()
+        data = self._client.get_object(
+            Bucket=self._s3_bucket,
+            Key=self._s3_key,
+            # Subtract 1, because the end of Range is inclusive.
+            Range=f'bytes={chunk_beg * self._cache_nbytes}-{chunk_end * self._cache_nbytes - 1}',
+        )['Body'].read()
+        t_end = time.time()
+        chunks = {
+            k: data[(k - chunk_beg) * self._cache_nbytes : (k - chunk_beg + 1) * self._cache_nbytes]
+            for k in range(chunk_beg, chunk_end)
+        }
+        with self._lock:
+            self._statistics["get_requests"] += 1
+            self._statistics["get_nbytes"] += len(data)
+            self._statistics["get_seconds"] += t_end - t_beg
+            for k, chunk in chunks.items():
+                self._cache[k] = chunk
+                self._cache.move_to_end(k)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return chunks
+
+    def _prefetch_chunks(self, chunk_beg: int, chunk_end: int) -> Dict[int, bytes]:
+        """Download the chunks [`chunk_beg`, `chunk_end`) in a background thread
+
+        Args:
+            chunk_beg (int): The index of the first chunk
+
+            chunk_end (int): The index of the chunk after the last chunk
+
+        Returns:
+            Dict[int, bytes]: The downloaded chunks by index
+        """
+        try:
+            return self._get_chunks(chunk_beg, chunk_end)
+        finally:
+            with self._lock:
+                for k in range(chunk_beg, chunk_end):
+                    self._pending.pop(k, None)
+
+    def prefetch(self, offsets: numpy.ndarray, nbytes: numpy.ndarray) -> None:
+        """Schedule the download of the chunks which cover the given byte ranges
+
+        Chunks which are cached or in flight are skipped, runs of consecutive chunks are coalesced
+        into a single GET request, and at most `bin_chunk_cache_size` chunks are scheduled per
+        call so that prefetched chunks do not evict one another.
+
+        Args:
+            offsets (numpy.ndarray): The offset (in bytes) of each byte range
+
+            nbytes (numpy.ndarray): The size (in bytes) of each byte range
+        """
+        if self._prefetch_threads == 0:
+            return
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        nbytes = numpy.asarray(nbytes, dtype=numpy.int64)
+        offsets, nbytes = offsets[nbytes > 0], nbytes[nbytes > 0]
+        chunk_begs = offsets // self._cache_nbytes
+        chunk_ends = (offsets + nbytes - 1) // self._cache_nbytes + 1
+        chunks = numpy.unique(
+            numpy.concatenate(
+                [numpy.arange(beg, end) for beg, end in zip(chunk_begs, chunk_ends)]
+                or [numpy.empty(0, dtype=numpy.int64)]
+            )
+        ).tolist()
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._prefetch_threads)
+
+        with self._lock:
+            chunks = [k for k in chunks if k not in self._cache and k not in self._pending]
+            chunks = chunks[: self._cache_size]
+            self._statistics["prefetched_chunks"] += len(chunks)
+            runs = []
+            for k in chunks:
+                if runs and runs[-1][1] == k:
+                    runs[-1][1] = k + 1
+                else:
+                    runs.append([k, k + 1])
+            for chunk_beg, chunk_end in runs:
+                future = self._executor.submit(self._prefetch_chunks, chunk_beg, chunk_end)
+                for k in range(chunk_beg, chunk_end):
+                    self._pending[k] = future
 
     def read(self, dtype: Type[numpy.number], count: int, offset: int) -> numpy.ndarray:
         """Read bytes into a numpy array.
 
-        Let `size` be the `count` * `DType.size(dtype)`. If the requested span of bytes [`offset`,
-        `offset` + `size`) is covered by the in-memory cache maintained by this class, then this
-        function extracts the requested span from that cache and returns it. Otherwise, this
-        function first refreshes the cache and then extracts the requested span from the refreshed
-        cache and returns it.
-
-        The cache is refreshed based on `offset` and `size`. In particular, we divide all the bytes
-        in an S3 object into blocks, where each block contains `bin_chunk_nbytes` bytes. We assign
-        each block an index starting from 0. We take the block with index (`offset` //
-        `bin_chunk_nbytes`) to refresh the cache. If this new block still does not cover the
-        requested span, we extend it just enough to include `offset` + `size`.
+        Let `size` be the `count` * `DType.size(dtype)`. The chunks which cover the requested span
+        of bytes [`offset`, `offset` + `size`) are taken from the cache, awaited if they are being
+        prefetched, or downloaded otherwise, and the requested span is extracted from them.
 
         Args:
             dtype (Type[numpy.number]): Data-type of the returned array.
@@ -481,36 +896,60 @@ class _S3BinReader(_BinReader):
             numpy.ndarray: An array with `count` items and data-type `dtype` constructed from reading bytes from the data file starting at `offset`.
         """
         size = count * DType.size(dtype)
-        if (
-            self._cache is not None
-            and offset >= self._cache_bytes_start
-            and offset + size <= self._cache_bytes_end
-        ):
-            return numpy.frombuffer(self._extract_from_cache(offset, size), dtype=dtype)
-
-        bytes_start = (offset // self._cache_nbytes) * self._cache_nbytes
-        assert bytes_start >= 0
-        assert offset >= bytes_start
-        bytes_end = max(bytes_start + self._cache_nbytes, offset + size)
-        assert bytes_end >= 1
-        self._cache = self._client.get_object(
-            Bucket=self._s3_bucket,
-            Key=self._s3_key,
-            # Subtract 1, because the end of Range is inclusive.
-            Range=f'bytes={bytes_start}-{bytes_end-1}',
-        )['Body'].read()
-        self._cache_bytes_start = bytes_start
-        self._cache_bytes_end = bytes_end
-        return numpy.frombuffer(self._extract_from_cache(offset, size), dtype=dtype)
+        if size == 0:
+            return numpy.empty(0, dtype=dtype)
+        chunk_beg = offset // self._cache_nbytes
+        chunk_end = (offset + size - 1) // self._cache_nbytes + 1
+
+        chunks = {}
+        futures = {}
+        missing = []
+        with self._lock:
+            for k in range(chunk_beg, chunk_end):
+                if k in self._cache:
+                    chunks[k] = self._cache[k]
+                    self._cache.move_to_end(k)
+                elif k in self._pending:
+                    futures[id(self._pending[k])] = self._pending[k]
+                else:
+                    missing.append(k)
+            is_hit = not futures and not missing
+            self._statistics["read_hits" if is_hit else "read_misses"] += 1
+
+        if not is_hit:
+            t_beg = time.time()
+            for future in futures.values():
+                chunks.update(future.result())
+            # Download runs of consecutive missing chunks with one request each
+            while missing:
+                run_end = 1
+                while run_end < len(missing) and missing[run_end] == missing[0] + run_end:
+                    run_end += 1
+                chunks.update(self._get_chunks(missing[0], missing[0] + run_end))
+                missing = missing[run_end:]
+            t_end = time.time()
+            with self._lock:
+                self._statistics["read_wait_seconds"] += t_end - t_beg
+
+        start = offset - chunk_beg * self._cache_nbytes
+        if chunk_end - chunk_beg == 1:
+            return numpy.frombuffer(chunks[chunk_beg], dtype=dtype, count=count, offset=start)
+        data = b"".join(chunks[k] for k in range(chunk_beg, chunk_end))
+        return numpy.frombuffer(data, dtype=dtype, count=count, offset=start)
 
     def __del__(self) -> None:
         """Clean up the object"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
         self._client.close()
 
 
 class IndexedDataset(torch.utils.data.Dataset):
     """The low-level interface dataset class
 
+    The data may be stored either in a single data (.bin) file or, for a multi-file dataset, in
+    the data (.bin) files listed in a manifest (.manifest) file. See IndexedDatasetManifestBuilder.
+
     Args:
         path_prefix (str): The index (.idx) and data (.bin) prefix
 
@@ -519,6 +958,8 @@ class IndexedDataset(torch.utils.data.Dataset):
         mmap (bool): Whether to mmap the .bin files. Defaults to True.
 
         s3_config (Optional[S3Config]): Supplied only for data stored on S3. IndexedDataset downloads the index (.idx) file to `s3_config.path_to_idx_cache` and streams data from the data (.bin) file in `s3_config.bin_chunk_nbytes` blocks. Note that `mmap` must be disabled for S3 data loading. Defaults to None.
+
+        max_open_bin_files (int): For a multi-file dataset, the maximum number of data (.bin) files to hold mmap-ed at once. Defaults to 64.
     """
 
     def __init__(
@@ -527,25 +968,33 @@ class IndexedDataset(torch.utils.data.Dataset):
         multimodal: bool = False,
         mmap: bool = True,
         s3_config: Optional[S3Config] = None,
+        max_open_bin_files: int = _MAX_OPEN_BIN_FILES,
     ) -> None:
         super().__init__()
         self.path_prefix = None
         self.multimodal = None
         self.mmap = None
         self.s3_config = None
+        self.max_open_bin_files = None
 
         self.index = None
         self.bin_reader = None
+        self.word_starts_reader = None
 
         if is_s3_path(path_prefix) and s3_config is not None:
             idx_path = get_idx_path(path_prefix)
             cache_idx_path = os.path.join(s3_config.path_to_idx_cache, os.path.basename(idx_path))
             maybe_download_file(idx_path, cache_idx_path)
 
-        self.initialize(path_prefix, multimodal, mmap, s3_config)
+        self.initialize(path_prefix, multimodal, mmap, s3_config, max_open_bin_files)
 
     def initialize(
-        self, path_prefix: str, multimodal: bool, mmap: bool, s3_config: Optional[S3Config]
+        self,
+        path_prefix: str,
+        multimodal: bool,
+        mmap: bool,
+        s3_config: Optional[S3Config],
+        max_open_bin_files: int = _MAX_OPEN_BIN_FILES,
     ) -> None:
         """Initialize the dataset
 
@@ -560,51 +1009,69 @@ class IndexedDataset(torch.utils.data.Dataset):
             mmap (bool): Whether to mmap the .bin file
 
             s3_config (Optional[S3Config]): See IndexedDataset docstring for details.
+
+            max_open_bin_files (int): See IndexedDataset docstring for details.
         """
         idx_path = get_idx_path(path_prefix)
         bin_path = get_bin_path(path_prefix)
+        manifest_path = get_manifest_path(path_prefix)
         if s3_config is None:
-            assert os.path.exists(idx_path) and os.path.exists(
-                bin_path
+            assert os.path.exists(idx_path) and (
+                os.path.exists(bin_path) or os.path.exists(manifest_path)
             ), f"One or both of the .idx and .bin files cannot be found at the path prefix {path_prefix}"
         self.path_prefix = path_prefix
         self.multimodal = multimodal
         self.mmap = mmap
         self.s3_config = s3_config
-        if mmap:
+        self.max_open_bin_files = max_open_bin_files
+        if s3_config is None and not os.path.exists(bin_path):
+            manifest = _BinManifest.load(manifest_path)
+            self.bin_reader = _MultiBinReader(
+                manifest.bin_paths, manifest.bin_nbytes, mmap, max_open_bin_files
+            )
+        elif mmap:
             assert not s3_config
             self.bin_reader = _MMapBinReader(bin_path)
         elif s3_config:
             assert not mmap
-            self.bin_reader = _S3BinReader(bin_path, s3_config.bin_chunk_nbytes)
+            self.bin_reader = _S3BinReader(
+                bin_path,
+                s3_config.bin_chunk_nbytes,
+                s3_config.bin_chunk_cache_size,
+                s3_config.bin_prefetch_threads,
+            )
             idx_path = os.path.join(
                 s3_config.path_to_idx_cache, os.path.basename(get_idx_path(path_prefix))
             )
         else:
             self.bin_reader = _FileBinReader(bin_path)
         self.index = _IndexReader(idx_path, self.multimodal)
+        self.word_starts_reader = None
+        if s3_config is None and os.path.exists(get_word_starts_path(path_prefix)):
+            self.word_starts_reader = _WordStartsReader(get_word_starts_path(path_prefix))
 
-    def __getstate__(self) -> Tuple[str, bool, bool, Optional[S3Config]]:
+    def __getstate__(self) -> Tuple[str, bool, bool, Optional[S3Config], int]:
         """Get the state during pickling
 
         Returns:
-            Tuple[str, bool, bool, Optional[S3Config]]: The state tuple
+            Tuple[str, bool, bool, Optional[S3Config], int]: The state tuple
         """
-        return self.path_prefix, self.multimodal, self.mmap, self.s3_config
+        return self.path_prefix, self.multimodal, self.mmap, self.s3_config, self.max_open_bin_files
 
-    def __setstate__(self, state: Tuple[str, bool, bool, Optional[S3Config]]) -> None:
+    def __setstate__(self, state: Tuple[str, bool, bool, Optional[S3Config], int]) -> None:
         """Set the state during un-pickling
 
         Args:
-            state (Tuple[str, bool, bool, Optional[S3Config]]): The state tuple
+            state (Tuple[str, bool, bool, Optional[S3Config], int]): The state tuple
         """
-        path_prefix, multimodal, mmap, s3_config = state
-        self.initialize(path_prefix, multimodal, mmap, s3_config)
+        path_prefix, multimodal, mmap, s3_config, max_open_bin_files = state
+        self.initialize(path_prefix, multimodal, mmap, s3_config, max_open_bin_files)
 
     def __del__(self) -> None:
         """Clean up the object"""
         del self.bin_reader
         del self.index
+        del self.word_starts_reader
 
     def __len__(self) -> int:
         """Return the length of the dataset i.e. the number of sequences in the index
@@ -682,6 +1149,137 @@ class IndexedDataset(torch.utils.data.Dataset):
         )
         return (sequence, sequence_mode) if sequence_mode is not None else sequence
 
+    def get_word_starts(
+        self, idx: int, offset: int = 0, length: Optional[int] = None
+    ) -> numpy.ndarray:
+        """Retrieve whether each token of a single item, or of a portion of it, starts a word
+
+        The word starts are read from the word starts (.wsb) file. See has_word_starts.
+
+        Args:
+            idx (Union[int, numpy.integer]): The index into the dataset
+
+            offset (int): The integer token offset in the sequence
+
+            length (int): The number of tokens to grab from the sequence
+
+        Returns:
+            numpy.ndarray: Whether each token starts a word
+        """
+        assert self.has_word_starts, f"no word starts file at the path prefix {self.path_prefix}"
+        sequence_pointer, sequence_length, _ = self.index[idx]
+        if length is None:
+            length = sequence_length - offset
+        token_offset = int(sequence_pointer) // DType.size(self.index.dtype) + offset
+        return self.word_starts_reader.read(token_offset, length)
+
+    def get_many(
+        self,
+        indices: numpy.ndarray,
+        offsets: Optional[numpy.ndarray] = None,
+        lengths: Optional[numpy.ndarray] = None,
+        out: Optional[Union[numpy.ndarray, torch.Tensor]] = None,
+    ) -> numpy.ndarray:
+        """Retrieve many (portions of) items from the dataset, back-to-back, into a single buffer
+
+        get_many(indices, offsets, lengths) holds the same tokens as the concatenation of
+        get(idx, offset, length) for each (idx, offset, length), but reads that are contiguous in
+        the data (.bin) file are coalesced into a single read, and the tokens are written directly
+        into `out` rather than into intermediate arrays. Sequence modes are not returned.
+
+        Args:
+            indices (numpy.ndarray): The indices into the dataset
+
+            offsets (Optional[numpy.ndarray]): The integer token offset in each sequence. Defaults to None, i.e. all zeros.
+
+            lengths (Optional[numpy.ndarray]): The number of tokens to grab from each sequence. Defaults to None, i.e. everything from the offset onwards.
+
+            out (Optional[Union[numpy.ndarray, torch.Tensor]]): A preallocated 1-D buffer, e.g. a view into a pinned CPU tensor, with room for at least sum(lengths) elements. The tokens are cast to its dtype. Defaults to None, in which case a buffer of the index dtype is allocated.
+
+        Returns:
+            numpy.ndarray: The first sum(lengths) elements of the buffer, as a numpy array
+        """
+        pointers, lengths = self._get_pointers_and_lengths(indices, offsets, lengths)
+
+        # the token offset of each read into the buffer
+        out_offsets = numpy.zeros(lengths.shape[0] + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=out_offsets[1:])
+        count = int(out_offsets[-1])
+
+        if out is None:
+            out = numpy.empty(count, dtype=self.index.dtype)
+        elif isinstance(out, torch.Tensor):
+            out = out.numpy()
+        assert out.ndim == 1 and out.shape[0] >= count
+
+        # Coalesce reads which pick up where the previous read left off
+        itemsize = DType.size(self.index.dtype)
+        is_contiguous = pointers[1:] == pointers[:-1] + lengths[:-1] * itemsize
+        run_begs = numpy.concatenate(([0], numpy.flatnonzero(~is_contiguous) + 1))
+        run_ends = numpy.concatenate((run_begs[1:], [pointers.shape[0]]))
+
+        for run_beg, run_end in zip(run_begs.tolist(), run_ends.tolist()):
+            out_beg = int(out_offsets[run_beg])
+            out_end = int(out_offsets[run_end])
+            if out_end > out_beg:
+                out[out_beg:out_end] = self.bin_reader.read(
+                    dtype=self.index.dtype, count=out_end - out_beg, offset=int(pointers[run_beg])
+                )
+
+        return out[:count]
+
+    def prefetch(
+        self,
+        indices: numpy.ndarray,
+        offsets: Optional[numpy.ndarray] = None,
+        lengths: Optional[numpy.ndarray] = None,
+    ) -> None:
+        """Hint that the given (portions of) items will be retrieved soon
+
+        The hint is forwarded to the data (.bin) file reader, of which only the S3 reader acts on
+        it. See get_many for the arguments.
+
+        Args:
+            indices (numpy.ndarray): The indices into the dataset
+
+            offsets (Optional[numpy.ndarray]): The integer token offset in each sequence. Defaults to None, i.e. all zeros.
+
+            lengths (Optional[numpy.ndarray]): The number of tokens to grab from each sequence. Defaults to None, i.e. everything from the offset onwards.
+        """
+        pointers, lengths = self._get_pointers_and_lengths(indices, offsets, lengths)
+        self.bin_reader.prefetch(pointers, lengths * DType.size(self.index.dtype))
+
+    def _get_pointers_and_lengths(
+        self,
+        indices: numpy.ndarray,
+        offsets: Optional[numpy.ndarray],
+        lengths: Optional[numpy.ndarray],
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Get the byte offset and the number of tokens of each (portion of an) item
+
+        Args:
+            indices (numpy.ndarray): The indices into the dataset
+
+            offsets (Optional[numpy.ndarray]): The integer token offset in each sequence, or None for all zeros
+
+            lengths (Optional[numpy.ndarray]): The number of tokens to grab from each sequence, or None for everything from the offset onwards
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The byte offsets into the data (.bin) file and the lengths
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        if offsets is None:
+            offsets = numpy.zeros(indices.shape[0], dtype=numpy.int64)
+        else:
+            offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        if lengths is None:
+            lengths = self.index.sequence_lengths[indices] - offsets
+        else:
+            lengths = numpy.asarray(lengths, dtype=numpy.int64)
+        assert indices.shape == offsets.shape == lengths.shape
+        pointers = self.index.sequence_pointers[indices] + offsets * DType.size(self.index.dtype)
+        return pointers, lengths
+
     @property
     def sequence_lengths(self) -> numpy.ndarray:
         """Get the sequence lengths
@@ -720,6 +1318,15 @@ class IndexedDataset(torch.utils.data.Dataset):
         """
         self.index.document_indices = document_indices
 
+    @property
+    def has_word_starts(self) -> bool:
+        """Get whether the dataset has a word starts (.wsb) file
+
+        Returns:
+            bool: Whether the word starts are available through get_word_starts
+        """
+        return self.word_starts_reader is not None
+
     @property
     def sequence_modes(self) -> numpy.ndarray:
         """Get the sequence modes
@@ -744,8 +1351,9 @@ class IndexedDataset(torch.utils.data.Dataset):
             return object_exists(s3_client, get_idx_path(path_prefix)) and object_exists(
                 s3_client, get_bin_path(path_prefix)
             )
-        return os.path.exists(get_idx_path(path_prefix)) and os.path.exists(
-            get_bin_path(path_prefix)
+        return os.path.exists(get_idx_path(path_prefix)) and (
+            os.path.exists(get_bin_path(path_prefix))
+            or os.path.exists(get_manifest_path(path_prefix))
         )
 
 
@@ -758,35 +1366,55 @@ class IndexedDatasetBuilder(object):
         dtype (Type[numpy.number], optional): The dtype of the index file. Defaults to numpy.int32.
 
         multimodal (bool, optional): Whether the dataset is multimodal. Defaults to False.
+
+        word_starts_path (Optional[str], optional): The path to the word starts (.wsb) file. When
+        given, the word starts of every item must be added along with it. Defaults to None.
     """
 
     def __init__(
-        self, bin_path: str, dtype: Type[numpy.number] = numpy.int32, multimodal: bool = False
+        self,
+        bin_path: str,
+        dtype: Type[numpy.number] = numpy.int32,
+        multimodal: bool = False,
+        word_starts_path: Optional[str] = None,
     ) -> None:
         self.data_file = open(bin_path, "wb")
         self.dtype = dtype
         self.multimodal = multimodal
+        self.word_starts_writer = (
+            _WordStartsWriter(word_starts_path) if word_starts_path is not None else None
+        )
 
         self.sequence_lengths = []
         self.document_indices = [0]
         self.sequence_modes = [] if self.multimodal else None
 
-    def add_item(self, tensor: torch.Tensor, mode: int = 0) -> None:
+    def add_item(
+        self, tensor: torch.Tensor, mode: int = 0, word_starts: Optional[numpy.ndarray] = None
+    ) -> None:
         """Add a single item to the dataset
 
         Args:
             tensor (torch.Tensor): The item to add to the data file
 
             mode (int, optional): The mode for the item. Defaults to 0.
+
+            word_starts (Optional[numpy.ndarray], optional): Whether each token of the item starts
+            a word, for a builder with a word starts file. Defaults to None.
         """
         np_array = numpy.array(tensor.numpy(), dtype=self.dtype)
         self.data_file.write(np_array.tobytes(order="C"))
         self.sequence_lengths.append(np_array.size)
         if self.multimodal:
             self.sequence_modes.append(mode)
+        self._add_word_starts(word_starts, np_array.size)
 
     def add_document(
-        self, tensor: torch.Tensor, lengths: List[int], modes: Optional[List[int]] = None
+        self,
+        tensor: torch.Tensor,
+        lengths: List[int],
+        modes: Optional[List[int]] = None,
+        word_starts: Optional[numpy.ndarray] = None,
     ) -> None:
         """Add an entire document to the dataset
 
@@ -796,6 +1424,8 @@ class IndexedDatasetBuilder(object):
             lengths (List[int]): The lengths of each item in the document
 
             modes (Optional[List[int]], optional): The modes for each item in the document. Defaults to None.
+
+            word_starts (Optional[numpy.ndarray], optional): Whether each token of the document starts a word, for a builder with a word starts file. Defaults to None.
         """
         np_array = numpy.array(tensor, dtype=self.dtype)
         self.data_file.write(np_array.tobytes(order="C"))
@@ -803,6 +1433,21 @@ class IndexedDatasetBuilder(object):
         self.document_indices.append(len(self.sequence_lengths))
         if self.multimodal:
             self.sequence_modes.extend(modes if modes is not None else [0] * lengths)
+        self._add_word_starts(word_starts, np_array.size)
+
+    def _add_word_starts(self, word_starts: Optional[numpy.ndarray], count: int) -> None:
+        """Write the word starts of the tokens just added, for a builder with a word starts file
+
+        Args:
+            word_starts (Optional[numpy.ndarray]): Whether each token starts a word
+
+            count (int): The number of tokens just added
+        """
+        if self.word_starts_writer is None:
+            return
+        assert word_starts is not None, "the word starts of every item are required"
+        assert len(word_starts) == count, "there must be one word start per token"
+        self.word_starts_writer.write(word_starts)
 
     def end_document(self) -> None:
         """Finalize the document, for use with IndexedDatasetBuilder.add_item"""
@@ -825,9 +1470,17 @@ class IndexedDatasetBuilder(object):
         if self.multimodal:
             self.sequence_modes.extend(index.sequence_modes)
 
-        # Concatenate data
-        with open(get_bin_path(path_prefix), "rb") as f:
-            shutil.copyfileobj(f, self.data_file)
+        # Concatenate data, from each data file of a multi-file IndexedDataset in turn
+        if os.path.exists(get_bin_path(path_prefix)):
+            bin_paths = [get_bin_path(path_prefix)]
+        else:
+            bin_paths = _BinManifest.load(get_manifest_path(path_prefix)).bin_paths
+        for bin_path in bin_paths:
+            with open(bin_path, "rb") as f:
+                _append_file(f, self.data_file)
+
+        if self.word_starts_writer is not None:
+            self.word_starts_writer.append(get_word_starts_path(path_prefix))
 
     def finalize(self, idx_path: str) -> None:
         """Clean up and write the index (.idx) file
@@ -836,10 +1489,155 @@ class IndexedDatasetBuilder(object):
             idx_path (str): The path to the index file
         """
         self.data_file.close()
+        if self.word_starts_writer is not None:
+            self.word_starts_writer.close()
         with _IndexWriter(idx_path, self.dtype) as writer:
             writer.write(self.sequence_lengths, self.sequence_modes, self.document_indices)
 
 
+class IndexedDatasetManifestBuilder(object):
+    """Builder class for the multi-file IndexedDataset
+
+    Unlike IndexedDatasetBuilder.add_index, which copies the data (.bin) file of every added
+    IndexedDataset, this builder only concatenates the index (.idx) metadata and records the data
+    (.bin) files in a manifest (.manifest) file. The cost of a merge is then proportional to the
+    number of sequences rather than to the number of tokens.
+
+    Args:
+        dtype (Type[numpy.number], optional): The dtype of the index file. Defaults to numpy.int32.
+
+        multimodal (bool, optional): Whether the dataset is multimodal. Defaults to False.
+
+        word_starts (bool, optional): Whether to write the word starts (.wsb) file, concatenated
+        from those of the added IndexedDataset instances. Unlike the data, the word starts are
+        copied, at one bit per token. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        dtype: Type[numpy.number] = numpy.int32,
+        multimodal: bool = False,
+        word_starts: bool = False,
+    ) -> None:
+        self.dtype = dtype
+        self.multimodal = multimodal
+        self.word_starts = word_starts
+
+        self.bin_paths = []
+        self.bin_nbytes = []
+        self.word_starts_paths = []
+
+        self.sequence_lengths = []
+        self.document_indices = [numpy.zeros(1, dtype=numpy.int64)]
+        self.sequence_modes = [] if self.multimodal else None
+        self.sequence_count = 0
+
+    def add_index(self, path_prefix: str) -> None:
+        """Add an entire IndexedDataset to the dataset by reference
+
+        The IndexedDataset may itself be a multi-file IndexedDataset, in which case its data (.bin)
+        files are referenced in order. To grow a multi-file IndexedDataset in place, add it first,
+        add the new IndexedDataset instances, and finalize to the original prefix.
+
+        Args:
+            path_prefix (str): The index (.idx) and data (.bin) prefix
+        """
+        index = _IndexReader(get_idx_path(path_prefix), multimodal=self.multimodal)
+        assert index.dtype == self.dtype
+
+        if os.path.exists(get_bin_path(path_prefix)):
+            manifest = _BinManifest(
+                [os.path.abspath(get_bin_path(path_prefix))],
+                [os.path.getsize(get_bin_path(path_prefix))],
+            )
+        else:
+            manifest = _BinManifest.load(get_manifest_path(path_prefix))
+
+        nbytes = int(numpy.sum(index.sequence_lengths, dtype=numpy.int64)) * DType.size(self.dtype)
+        assert (
+            sum(manifest.bin_nbytes) == nbytes
+        ), f"the .idx and .bin files at the path prefix {path_prefix} disagree on the data size"
+
+        # Skip empty data files, which cannot be mmap-ed
+        for bin_path, bin_nbytes in zip(manifest.bin_paths, manifest.bin_nbytes):
+            if bin_nbytes > 0:
+                self.bin_paths.append(bin_path)
+                self.bin_nbytes.append(bin_nbytes)
+
+        self.sequence_lengths.append(numpy.array(index.sequence_lengths))
+        self.document_indices.append(self.sequence_count + index.document_indices[1:])
+        self.sequence_count += len(index)
+
+        if self.multimodal:
+            self.sequence_modes.append(numpy.array(index.sequence_modes))
+
+        if self.word_starts:
+            assert os.path.exists(
+                get_word_starts_path(path_prefix)
+            ), f"no word starts file at the path prefix {path_prefix}"
+            self.word_starts_paths.append(get_word_starts_path(path_prefix))
+
+    def finalize(self, path_prefix: str) -> None:
+        """Write the index (.idx) file and the manifest (.manifest) file
+
+        The data (.bin) file paths are written relative to the directory of the manifest file.
+
+        Args:
+            path_prefix (str): The index (.idx) and manifest (.manifest) prefix
+        """
+        assert not os.path.exists(
+            get_bin_path(path_prefix)
+        ), f"a .bin file already exists at the path prefix {path_prefix}"
+        root = os.path.dirname(os.path.abspath(path_prefix))
+        if self.word_starts:
+            # Write aside, as the prefix may be one of the added IndexedDataset instances
+            wsb_path = get_word_starts_path(path_prefix)
+            writer = _WordStartsWriter(wsb_path + ".tmp")
+            for word_starts_path in self.word_starts_paths:
+                writer.append(word_starts_path)
+            writer.close()
+            os.replace(wsb_path + ".tmp", wsb_path)
+        _BinManifest(
+            [os.path.relpath(bin_path, root) for bin_path in self.bin_paths], self.bin_nbytes
+        ).save(get_manifest_path(path_prefix))
+        with _IndexWriter(get_idx_path(path_prefix), self.dtype) as writer:
+            writer.write(
+                numpy.concatenate(self.sequence_lengths or [numpy.empty(0, dtype=numpy.int32)]),
+                (
+                    numpy.concatenate(self.sequence_modes or [numpy.empty(0, dtype=numpy.int8)])
+                    if self.multimodal
+                    else None
+                ),
+                numpy.concatenate(self.document_indices),
+            )
+
+
+def _append_file(src: BinaryIO, dst: BinaryIO) -> None:
+    """Append the remainder of one file to another
+
+    Where the platform provides os.copy_file_range, the kernel copies the data without a round trip
+    through user space, and file systems which support it (e.g. XFS and Btrfs reflinks, NFS
+    server-side copy) share or copy the data blocks in place. Otherwise, or should the call be
+    refused, e.g. across file systems, fall back to a buffered copy from where it left off.
+
+    Args:
+        src (BinaryIO): The file to read, at the position from which to copy
+
+        dst (BinaryIO): The file to append to
+    """
+    dst.flush()
+    if hasattr(os, "copy_file_range"):
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), _COPY_FILE_RANGE_NBYTES) > 0:
+                pass
+            return
+        except OSError as e:
+            log_single_rank(
+                logger, logging.DEBUG, f"copy_file_range failed, fall back to a buffered copy: {e}"
+            )
+    shutil.copyfileobj(src, dst)
+
+
 def get_idx_path(path_prefix: str) -> str:
     """Get the path to the index file from the prefix
 
@@ -862,3 +1660,27 @@ def get_bin_path(path_prefix: str) -> str:
         str: The path to the data file
     """
     return path_prefix + ".bin"
+
+
+def get_manifest_path(path_prefix: str) -> str:
+    """Get the path to the multi-file data manifest from the prefix
+
+    Args:
+        path_prefix (str): The prefix
+
+    Returns:
+        str: The path to the manifest file
+    """
+    return path_prefix + ".manifest"
+
+
+def get_word_starts_path(path_prefix: str) -> str:
+    """Get the path to the word starts file from the prefix
+
+    Args:
+        path_prefix (str): The prefix
+
+    Returns:
+        str: The path to the word starts file
+    """
+    return path_prefix + ".wsb"
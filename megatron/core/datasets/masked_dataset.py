@@ -1,5 +1,6 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
 
+import bisect
 import logging
 import os
 import time
@@ -13,7 +14,7 @@ import torch
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
 from megatron.core.datasets.indexed_dataset import IndexedDataset
 from megatron.core.datasets.megatron_dataset import MegatronDataset
-from megatron.core.datasets.utils import Split
+from megatron.core.datasets.utils import Split, is_cache_builder
 from megatron.core.utils import log_single_rank
 
 logger = logging.getLogger(__name__)
@@ -110,6 +111,10 @@ class MaskedWordPieceDataset(MegatronDataset):
             indexed_dataset, dataset_path, indexed_indices, num_samples, index_split, config
         )
 
+        # The vocabulary word start bitmap and the N-gram size distribution, built on first use
+        self.word_start_lookup: Optional[numpy.ndarray] = None
+        self.ngram_cdf: Optional[List[float]] = None
+
     @staticmethod
     def numel_low_level_dataset(low_level_dataset: IndexedDataset) -> int:
         return low_level_dataset.document_indices.shape[0] - 1
@@ -169,7 +174,7 @@ class MaskedWordPieceDataset(MegatronDataset):
         else:
             num_epochs = 1
 
-        if not cache_hit and torch.distributed.get_rank() == 0:
+        if not cache_hit and is_cache_builder():
             log_single_rank(
                 logger,
                 logging.INFO,
@@ -238,13 +243,21 @@ class MaskedWordPieceDataset(MegatronDataset):
         token_ids: List[int],
         target_sequence_length: int,
         numpy_random_state: numpy.random.RandomState,
+        word_starts: Optional[numpy.ndarray] = None,
     ) -> Tuple[List[int], List[int], List[int], List[int], List[Tuple[List[int], List[int]]]]:
         """Creates the predictions for the masked LM objective
 
+        The candidates are built with NumPy from the word starts of the tokens, and each N-gram is
+        a slice of the flattened candidates, so that no per token Python structures are built. The
+        draws from the random state are those of the per candidate implementation, in the same
+        order, so that the predictions for a given sample index are unchanged.
+
         Args:
             token_ids (List[int]): The token ids
             target_sequence_length (int): The target sequence length
             numpy_random_state (numpy.random.RandomState): The NumPy random state
+            word_starts (Optional[numpy.ndarray]): Whether each token starts a word, see
+                _get_sequence_word_starts. Defaults to None, i.e. looked up in the vocabulary.
 
         Returns:
             Tuple[List[int], List[int], List[int], List[int], List[Tuple[List[int], List[int]]]]:
@@ -259,172 +272,229 @@ class MaskedWordPieceDataset(MegatronDataset):
         #    -> boundaries: [1, 1, 0, 0, 1, 0, 1, 1, 0, 1]
         #    -> candidates with whole word masking: [[1, 2, 3], [4, 5], [7, 8]]
         #    -> candidates sans whole word masking: [[1], [2], [3], [4], [5], [7], [8]]
-        boundaries = []
-        candidates = []
-        for i, token_id in enumerate(token_ids):
-            if token_id == self.config.tokenizer.cls or token_id == self.config.tokenizer.sep:
-                boundaries.append(1)
-            else:
-                if not self.config.tokenizer.inv_vocab[token_id].startswith("##"):
-                    boundaries.append(1)
-                    candidates.append([i])
-                else:
-                    boundaries.append(0)
-                    if self.config.masking_do_full_word and len(candidates) > 0:
-                        candidates[-1].append(i)
-                    else:
-                        candidates.append([i])
+        # The candidates are stored flattened
+        #    -> candidate_tokens: [1, 2, 3, 4, 5, 7, 8]
+        #    -> candidate_offsets with whole word masking: [0, 3, 5, 7]
+        #    -> candidate_offsets sans whole word masking: [0, 1, 2, 3, 4, 5, 6, 7]
+        token_ids_array = numpy.asarray(token_ids, dtype=numpy.int64)
+        is_special = (token_ids_array == self.config.tokenizer.cls) | (
+            token_ids_array == self.config.tokenizer.sep
+        )
+        if word_starts is None:
+            word_starts = self._lookup_word_starts(token_ids_array)
+        boundaries = is_special | numpy.asarray(word_starts, dtype=bool)
+        candidate_tokens = numpy.flatnonzero(~is_special)
+        if self.config.masking_do_full_word:
+            is_candidate_start = boundaries[candidate_tokens]
+            is_candidate_start[:1] = True
+            candidate_offsets = numpy.flatnonzero(is_candidate_start)
+        else:
+            candidate_offsets = numpy.arange(candidate_tokens.shape[0])
+        n_candidates = candidate_offsets.shape[0]
+        max_ngram = self.config.masking_max_ngram
+        # Pad the offsets so that the N-grams of the last candidates are truncated
+        candidate_offsets = numpy.append(
+            candidate_offsets, [candidate_tokens.shape[0]] * max_ngram
+        ).tolist()
+        candidate_tokens = candidate_tokens.tolist()
 
         n_maskings = min(
             self.config.masking_probability * target_sequence_length,
             max(1, int(round(len(token_ids) * self.config.masking_probability))),
         )
 
-        ngram_nvals = numpy.arange(self.config.masking_max_ngram, dtype=numpy.int64) + 1
-
-        # By default, the N-gram probabilites are inversely proportional to N
-        # e.g. N = 3
-        #    -> P = array([0.54545455, 0.27272727, 0.18181818])
-        nprobs = 1.0 / ngram_nvals
-        nprobs = nprobs / nprobs.sum(keepdims=True)
-        if self.config.masking_use_longer_ngrams:
-            nprobs = nprobs[::-1]
-
-        # Create a nested list of depth 3
-        #   layer 1: the candidate dimension
-        #   layer 2: the N-gram dimension
-        #   layer 3: the token dimension
-        candidate_ngrams = [
-            [candidates[idx : idx + n] for n in ngram_nvals] for idx in range(len(candidates))
-        ]
-        numpy_random_state.shuffle(candidate_ngrams)
+        ngram_cdf = self._get_ngram_cdf()
+
+        # Shuffle the candidates as a list of the same length would be shuffled
+        candidate_order = numpy.arange(n_candidates)
+        numpy_random_state.shuffle(candidate_order)
 
         masked_token_ids = list(token_ids)
-        masked_positions_and_labels = []
         masked_spans = []
-        masked_indices = set()
-        for candidate_idx in range(len(candidate_ngrams)):
-            n_ngrams = len(candidate_ngrams[candidate_idx])
-
+        is_masked = [False] * len(token_ids)
+        n_masked = 0
+        for candidate_idx in candidate_order.tolist():
             # Stop when we hit our desired number of maskings
-            if len(masked_positions_and_labels) >= n_maskings:
+            if n_masked >= n_maskings:
                 break
 
-            # Do nothing for candidates with no ngrams
-            if not candidate_ngrams[candidate_idx]:
-                continue
-
             # Choose the initial value of N
             if self.config.masking_use_geometric_distribution:
                 # Sample N from a geometric distribution with p = 0.2 and clip
                 # i.e. SpanBERT
                 #    -> https://arxiv.org/abs/1907.10529 (Section 3.1)
                 p = 0.2
-                n = min(numpy_random_state.geometric(p), self.config.masking_max_ngram)
+                n = min(numpy_random_state.geometric(p), max_ngram)
             else:
-                p = nprobs[:n_ngrams] / nprobs[:n_ngrams].sum(keepdims=True)
-                n = numpy_random_state.choice(ngram_nvals[:n_ngrams], p=p)
+                n = self._choose_ngram_size(numpy_random_state, ngram_cdf)
 
-            while True:
-                ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
-                n = n - 1
-                # Success: masking this N-gram puts us below the desired number of maskings
-                if n_maskings >= len(masked_positions_and_labels) + len(ngram_indices):
-                    skip_candidate = False
-                    break
-                # Failure: no N-grams remain for this candidate
-                if n == 0:
-                    skip_candidate = True
+            # Decrease N until masking the N-gram puts us below the desired number of maskings
+            idx_beg = candidate_offsets[candidate_idx]
+            while n > 0:
+                idx_end = candidate_offsets[candidate_idx + n]
+                if n_maskings >= n_masked + idx_end - idx_beg:
                     break
+                n = n - 1
 
             # Do nothing for candidates whose 1-gram is too long
-            if skip_candidate:
+            if n == 0:
                 continue
 
+            ngram_indices = candidate_tokens[idx_beg:idx_end]
+
             # Do nothing for candidate indices which have already been masked
-            if any(map(lambda idx: idx in masked_indices, ngram_indices)):
+            if any(is_masked[index] for index in ngram_indices):
                 continue
 
-            # Mask the tokens and record their original positions and values
+            # Mask the tokens
             for index in ngram_indices:
-                masked_indices.add(index)
+                is_masked[index] = True
                 mask = self._get_token_mask(numpy_random_state)
-                if mask is None:
-                    masked_token_ids[index] = token_ids[index]
-                else:
+                if mask is not None:
                     masked_token_ids[index] = mask
-                masked_positions_and_labels.append((index, token_ids[index]))
+            n_masked += len(ngram_indices)
 
             masked_spans.append((ngram_indices, [token_ids[index] for index in ngram_indices]))
 
-        assert len(masked_positions_and_labels) <= n_maskings
+        assert n_masked <= n_maskings
 
-        numpy_random_state.shuffle(candidate_ngrams)
+        numpy_random_state.shuffle(candidate_order)
 
+        is_permuted = [False] * len(token_ids)
         if self.config.masking_do_permutation:
 
             n_swappings = n_maskings
 
-            permuted_indices = set()
-            for candidate_idx in range(len(candidate_ngrams)):
-                n_ngrams = len(candidate_ngrams[candidate_idx])
-
-                if len(permuted_indices) >= n_swappings:
+            n_permuted = 0
+            for candidate_idx in candidate_order.tolist():
+                if n_permuted >= n_swappings:
                     break
 
-                # Do nothing for candidates with no ngrams
-                if not candidate_ngrams[candidate_idx]:
-                    continue
-
-                p = nprobs[:n_ngrams] / nprobs[:n_ngrams].sum(keepdims=True)
-                n = numpy.random.choice(ngram_nvals[:n_ngrams], p=p)
+                # NB: N is drawn from the global NumPy random state
+                n = self._choose_ngram_size(numpy.random, ngram_cdf)
 
-                while True:
-                    ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
-                    n = n - 1
-                    # Success: swapping this N-gram puts us below the desired number of swappings
-                    if n_swappings >= len(permuted_indices) + len(ngram_indices):
-                        skip_candidate = False
-                        break
-                    # Failure: no N-grams remain for this candidate
-                    if n == 0:
-                        skip_candidate = True
+                # Decrease N until swapping the N-gram puts us below the desired number of swappings
+                idx_beg = candidate_offsets[candidate_idx]
+                while n > 0:
+                    idx_end = candidate_offsets[candidate_idx + n]
+                    if n_swappings >= n_permuted + idx_end - idx_beg:
                         break
+                    n = n - 1
 
                 # Do nothing for candidates whose 1-gram is too long
-                if skip_candidate:
+                if n == 0:
                     continue
 
+                ngram_indices = candidate_tokens[idx_beg:idx_end]
+
                 # Do nothing for candidate indices which have already been masked or permuted
-                if any(
-                    map(lambda idx: idx in masked_indices or idx in permuted_indices, ngram_indices)
-                ):
+                if any(is_masked[index] or is_permuted[index] for index in ngram_indices):
                     continue
 
                 for index in ngram_indices:
-                    permuted_indices.add(index)
+                    is_permuted[index] = True
+                n_permuted += len(ngram_indices)
 
-            assert len(permuted_indices) <= n_swappings
+            assert n_permuted <= n_swappings
 
-            permuted_indices = sorted(permuted_indices)
+            permuted_indices = [index for index in range(len(token_ids)) if is_permuted[index]]
             permuted_indices_copy = list(permuted_indices)
             numpy_random_state.shuffle(permuted_indices_copy)
             masked_token_ids_copy = list(masked_token_ids)
 
             for idx, idx_copy in zip(permuted_indices, permuted_indices_copy):
                 masked_token_ids[idx] = masked_token_ids_copy[idx_copy]
-                masked_positions_and_labels.append((idx, masked_token_ids_copy[idx]))
 
-        masked_positions_and_labels = sorted(masked_positions_and_labels, key=lambda x: x[0])
-        masked_positions = []
-        masked_labels = []
-        for position, label in masked_positions_and_labels:
-            masked_positions.append(position)
-            masked_labels.append(label)
+        # The labels of both the masked and the permuted positions are the original token ids
+        masked_positions = numpy.flatnonzero(numpy.logical_or(is_masked, is_permuted)).tolist()
+        masked_labels = token_ids_array[masked_positions].tolist()
 
         masked_spans = sorted(masked_spans, key=lambda x: x[0][0])
 
-        return masked_token_ids, masked_positions, masked_labels, boundaries, masked_spans
+        return (
+            masked_token_ids,
+            masked_positions,
+            masked_labels,
+            boundaries.astype(numpy.int64).tolist(),
+            masked_spans,
+        )
+
+    def _get_sequence_word_starts(self, idx: int, sequence: numpy.ndarray) -> numpy.ndarray:
+        """Get whether each token of a sequence of the IndexedDataset starts a word
+
+        The word starts are read from the word starts (.wsb) file written at preprocessing time
+        when the IndexedDataset has one, else they are looked up in the vocabulary.
+
+        Args:
+            idx (int): The index of the sequence into the IndexedDataset
+
+            sequence (numpy.ndarray): The token ids of the sequence
+
+        Returns:
+            numpy.ndarray: The word start bitmap
+        """
+        if self.dataset.has_word_starts:
+            return self.dataset.get_word_starts(idx)
+        return self._lookup_word_starts(sequence)
+
+    def _lookup_word_starts(self, token_ids: numpy.ndarray) -> numpy.ndarray:
+        """Get whether each token starts a word, i.e. is not a "##" piece, from the vocabulary
+
+        Args:
+            token_ids (numpy.ndarray): The token ids
+
+        Returns:
+            numpy.ndarray: The word start bitmap
+        """
+        if self.word_start_lookup is None:
+            inv_vocab = self.config.tokenizer.inv_vocab
+            word_start_lookup = numpy.ones(max(inv_vocab) + 1, dtype=bool)
+            for token_id, token in inv_vocab.items():
+                if token.startswith("##"):
+                    word_start_lookup[token_id] = False
+            self.word_start_lookup = word_start_lookup
+        return self.word_start_lookup[token_ids]
+
+    def _get_ngram_cdf(self) -> List[float]:
+        """Get the cumulative distribution of the N-gram sizes 1 to masking_max_ngram
+
+        Returns:
+            List[float]: The cumulative distribution
+        """
+        if self.ngram_cdf is None:
+            ngram_nvals = numpy.arange(self.config.masking_max_ngram, dtype=numpy.int64) + 1
+
+            # By default, the N-gram probabilites are inversely proportional to N
+            # e.g. N = 3
+            #    -> P = array([0.54545455, 0.27272727, 0.18181818])
+            nprobs = 1.0 / ngram_nvals
+            nprobs = nprobs / nprobs.sum(keepdims=True)
+            if self.config.masking_use_longer_ngrams:
+                nprobs = nprobs[::-1]
+
+            # The normalizations of the N-gram size choice and of numpy.random.RandomState.choice
+            nprobs = nprobs / nprobs.sum(keepdims=True)
+            ngram_cdf = nprobs.cumsum()
+            ngram_cdf /= ngram_cdf[-1]
+            self.ngram_cdf = ngram_cdf.tolist()
+        return self.ngram_cdf
+
+    @staticmethod
+    def _choose_ngram_size(
+        numpy_random_state: numpy.random.RandomState, ngram_cdf: List[float]
+    ) -> int:
+        """Draw N as numpy.random.RandomState.choice draws from the N-gram sizes, with one uniform
+        sample
+
+        Args:
+            numpy_random_state (numpy.random.RandomState): The NumPy random state
+
+            ngram_cdf (List[float]): The cumulative distribution of the N-gram sizes
+
+        Returns:
+            int: The N-gram size
+        """
+        return bisect.bisect_right(ngram_cdf, numpy_random_state.random_sample()) + 1
 
     @abstractmethod
     def _get_token_mask(self, numpy_random_state: numpy.random.RandomState) -> Optional[int]:
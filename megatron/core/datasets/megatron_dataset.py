@@ -57,6 +57,9 @@ class MegatronDataset(ABC, torch.utils.data.Dataset):
         self.unique_identifiers["index_split"] = self.index_split.name
         for attr in self._key_config_attributes():
             self.unique_identifiers[attr] = getattr(self.config, attr)
+        for attr in self._optional_key_config_attributes():
+            if getattr(self.config, attr):
+                self.unique_identifiers[attr] = getattr(self.config, attr)
 
         self.unique_description = json.dumps(
             self.unique_identifiers, indent=4, default=lambda obj: obj.unique_identifiers
@@ -117,6 +120,19 @@ class MegatronDataset(ABC, torch.utils.data.Dataset):
         """
         return ["random_seed", "sequence_length", "split", "split_matrix", "tokenizer"]
 
+    @staticmethod
+    def _optional_key_config_attributes() -> List[str]:
+        """Return all config attributes which contribute to uniquely identifying the dataset only
+        when set.
+
+        Use these in place of the key config attributes for options added after the fact, so that
+        the dataset resources cached without the option remain valid.
+
+        Returns:
+            List[str]: The optional key config attributes
+        """
+        return []
+
     @abstractmethod
     def __len__(self) -> int:
         """Return the length of the dataset
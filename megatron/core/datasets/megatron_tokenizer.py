@@ -2,7 +2,7 @@
 import json
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import Any
+from typing import Any, List
 
 import numpy
 
@@ -43,6 +43,17 @@ class MegatronTokenizer(ABC):
         """
         pass
 
+    def tokenize_batch(self, texts: List[str]) -> List[numpy.ndarray]:
+        """Convert a batch of texts to embedding ids
+
+        Args:
+            texts (List[str]): The texts to convert
+
+        Returns:
+            List[numpy.ndarray]: The converted embedding ids, one per text
+        """
+        return [self.tokenize(text) for text in texts]
+
     def detokenize(self, ids: numpy.ndarray) -> str:
         """Convert embedding ids to text
 
@@ -0,0 +1,284 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+import gzip
+import json
+import logging
+from collections import deque
+from typing import IO, Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy
+import torch
+
+from megatron.core.datasets.gpt_dataset import GPTDatasetConfig, _get_ltor_masks_and_position_ids
+from megatron.core.utils import log_single_rank
+
+logger = logging.getLogger(__name__)
+
+_POSITION_KEY = "stream_position"
+
+
+class StreamingGPTDataset(torch.utils.data.IterableDataset):
+    """A GPT dataset which reads and tokenizes raw JSONL shards on the fly
+
+    The shards are dealt round-robin to the streams, one stream per data parallel rank and
+    DataLoader worker, so that the tokenization runs in the DataLoader workers. Each stream reads
+    its shards in order, tokenizes the documents, appends the EOD token to each, and cuts the
+    concatenated documents into samples as the GPTDataset does. A stream stops at the end of its
+    last shard, dropping its last partial sample.
+
+    Each sample carries, under "stream_position", the number of streams, the stream id, and the
+    position in the stream of the first token of the next sample: the shard, the byte offset of
+    the document in the shard, and the token offset into the document. Pass the samples, or the
+    batches collated from them, to record_position, in the order in which they were drawn, to
+    track the position of every stream. The state_dict then lets a new StreamingGPTDataset resume
+    every stream exactly, reading each shard from the byte offset on rather than from its
+    beginning. Resuming within a gzip-ed shard decompresses, but does not tokenize, the shard up
+    to the byte offset.
+
+    Args:
+        dataset_paths (List[str]): The paths to the JSONL shards, optionally gzip-ed with the
+        extension .gz
+
+        config (GPTDatasetConfig): The config, of which the tokenizer, the sequence length, and
+        the mask and position id options are used
+
+        json_key (str): The key of the document text in each JSON line. Defaults to "text".
+
+        rank (int): The data parallel rank. Defaults to 0.
+
+        world_size (int): The data parallel world size. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        dataset_paths: List[str],
+        config: GPTDatasetConfig,
+        json_key: str = "text",
+        rank: int = 0,
+        world_size: int = 1,
+    ) -> None:
+        super().__init__()
+        assert 0 <= rank < world_size
+
+        self.dataset_paths = list(dataset_paths)
+        self.config = config
+        self.json_key = json_key
+        self.rank = rank
+        self.world_size = world_size
+
+        # The stream id to the (shard, byte offset, token offset) position of the stream
+        self.positions: Dict[int, Tuple[int, int, int]] = {}
+
+        # The number of streams, known once the DataLoader workers are
+        self.num_streams: Optional[int] = None
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        """Abstract method implementation
+
+        Returns:
+            Iterator[Dict[str, torch.Tensor]]: The samples of the stream of the calling worker
+        """
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        worker_id = 0 if worker_info is None else worker_info.id
+
+        num_streams = self.world_size * num_workers
+        if self.num_streams is not None:
+            assert (
+                self.num_streams == num_streams
+            ), f"the state was recorded with {self.num_streams} streams, not {num_streams}"
+        stream_id = self.rank * num_workers + worker_id
+
+        shards = list(range(stream_id, len(self.dataset_paths), num_streams))
+        if not shards:
+            log_single_rank(
+                logger, logging.WARNING, f"No shard for stream {stream_id} of {num_streams}"
+            )
+            return iter(())
+
+        position = self.positions.get(stream_id, (shards[0], 0, 0))
+        return self._iterate(num_streams, stream_id, shards, position)
+
+    def record_position(self, sample: Dict[str, torch.Tensor]) -> None:
+        """Record the position of the stream which drew a sample or a batch of samples
+
+        Args:
+            sample (Dict[str, torch.Tensor]): The sample, or the batch collated from the samples
+        """
+        positions = sample[_POSITION_KEY].view(-1, 5).tolist()
+        for num_streams, stream_id, shard, byte_offset, token_offset in positions:
+            self.num_streams = num_streams
+            self.positions[stream_id] = (shard, byte_offset, token_offset)
+
+    def state_dict(self) -> Dict[str, Any]:
+        """Get the recorded stream positions
+
+        Returns:
+            Dict[str, Any]: The state
+        """
+        return {
+            "dataset_paths": list(self.dataset_paths),
+            "num_streams": self.num_streams,
+            "positions": dict(self.positions),
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        """Resume the streams from the recorded stream positions
+
+        Args:
+            state_dict (Dict[str, Any]): The state, from state_dict
+        """
+        assert (
+            state_dict["dataset_paths"] == self.dataset_paths
+        ), "the state was recorded over other shards"
+        self.num_streams = state_dict["num_streams"]
+        self.positions = {
+            int(stream_id): tuple(position)
+            for stream_id, position in state_dict["positions"].items()
+        }
+
+    def _iterate(
+        self, num_streams: int, stream_id: int, shards: List[int], position: Tuple[int, int, int]
+    ) -> Iterator[Dict[str, torch.Tensor]]:
+        """Iterate over the samples of a stream from a position on
+
+        Args:
+            num_streams (int): The number of streams
+
+            stream_id (int): The stream id
+
+            shards (List[int]): The shards of the stream, in order
+
+            position (Tuple[int, int, int]): The shard, byte offset, and token offset from which
+            to start
+
+        Returns:
+            Iterator[Dict[str, torch.Tensor]]: The samples
+        """
+        sequence_length = self.config.sequence_length
+        sample_length = sequence_length + self.config.add_extra_token_to_sequence
+
+        shard, byte_offset, token_offset = position
+        assert shard in shards, f"shard {shard} is not read by stream {stream_id}"
+
+        # The (shard, byte offset, token ids) of the documents which hold the buffered tokens
+        buffer: Deque[Tuple[int, int, numpy.ndarray]] = deque()
+        # The number of tokens of the first buffered document which were consumed already
+        buffer_offset = token_offset
+        num_buffered = 0
+
+        for shard in shards[shards.index(shard) :]:
+            for document_offset, next_document_offset, document in self._read_shard(
+                shard, byte_offset
+            ):
+                buffer.append((shard, document_offset, document))
+                num_buffered += document.shape[0]
+
+                while num_buffered - buffer_offset >= sample_length:
+                    parts = []
+                    offset, remaining = buffer_offset, sample_length
+                    for _, _, buffered in buffer:
+                        parts.append(buffered[offset : offset + remaining])
+                        remaining -= parts[-1].shape[0]
+                        offset = 0
+                        if remaining == 0:
+                            break
+                    text = numpy.concatenate(parts)
+
+                    # Step to the first token of the next sample
+                    buffer_offset += sequence_length
+                    while buffer and buffer_offset >= buffer[0][2].shape[0]:
+                        buffer_offset -= buffer[0][2].shape[0]
+                        num_buffered -= buffer[0][2].shape[0]
+                        buffer.popleft()
+                    if buffer:
+                        next_position = (buffer[0][0], buffer[0][1], buffer_offset)
+                    else:
+                        next_position = (shard, next_document_offset, buffer_offset)
+
+                    yield self._get_sample(text, (num_streams, stream_id) + next_position)
+            byte_offset = 0
+
+    def _read_shard(self, shard: int, byte_offset: int) -> Iterator[Tuple[int, int, numpy.ndarray]]:
+        """Read and tokenize the documents of a shard from a byte offset on
+
+        Args:
+            shard (int): The shard
+
+            byte_offset (int): The byte offset of the first document to read
+
+        Returns:
+            Iterator[Tuple[int, int, numpy.ndarray]]: The byte offset of each document, the byte
+            offset of the line which follows it, and its token ids, EOD included
+        """
+        path = self.dataset_paths[shard]
+        with _open_shard(path) as reader:
+            reader.seek(byte_offset)
+            for line in iter(reader.readline, b""):
+                document_offset = byte_offset
+                byte_offset += len(line)
+                if not line.strip():
+                    continue
+                text = json.loads(line)[self.json_key]
+                document = numpy.array(self.config.tokenizer.tokenize(text), dtype=numpy.int64)
+                document = numpy.append(document, self.config.tokenizer.eod)
+                yield document_offset, byte_offset, document
+
+    def _get_sample(
+        self, text: numpy.ndarray, position: Tuple[int, ...]
+    ) -> Dict[str, torch.Tensor]:
+        """Build a sample as the GPTDataset does
+
+        Args:
+            text (numpy.ndarray): The token ids of the sample
+
+            position (Tuple[int, ...]): The number of streams, the stream id, and the position of
+            the next sample
+
+        Returns:
+            Dict[str, torch.Tensor]: The sample information wrapped in a dictionary
+        """
+        text = torch.from_numpy(text)
+        if self.config.add_extra_token_to_sequence:
+            tokens = text[:-1].contiguous()
+            labels = text[1:].contiguous()
+        else:
+            tokens = text
+            labels = torch.roll(text, shifts=-1, dims=0)
+            labels[-1] = 0
+
+        attention_mask, loss_mask, position_ids = _get_ltor_masks_and_position_ids(
+            tokens,
+            self.config.tokenizer.eod,
+            self.config.reset_position_ids,
+            self.config.reset_attention_mask,
+            self.config.eod_mask_loss,
+            self.config.create_attention_mask,
+        )
+        if not self.config.add_extra_token_to_sequence:
+            loss_mask[-1] = 0.0
+
+        sample = {
+            "tokens": tokens,
+            "labels": labels,
+            "loss_mask": loss_mask,
+            "position_ids": position_ids,
+            _POSITION_KEY: torch.tensor(position, dtype=torch.int64),
+        }
+        if self.config.create_attention_mask:
+            sample["attention_mask"] = attention_mask
+        return sample
+
+
+def _open_shard(path: str) -> IO[bytes]:
+    """Open a JSONL shard for binary reading
+
+    Args:
+        path (str): The path to the shard, gzip-ed if it ends with .gz
+
+    Returns:
+        IO[bytes]: The reader
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
@@ -1,8 +1,10 @@
 # Copyright (c) 2022, NVIDIA CORPORATION. All rights reserved.
 
 import logging
+import threading
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
 import numpy
 import torch
@@ -11,6 +13,8 @@ from ..utils import log_single_rank
 
 logger = logging.getLogger(__name__)
 
+_cache_builder_state = threading.local()
+
 
 class Split(Enum):
     train = 0
@@ -19,8 +23,7 @@ class Split(Enum):
 
 
 def compile_helpers():
-    """Compile C++ helper functions at runtime. Make sure this is invoked on a single process.
-    """
+    """Compile C++ helper functions at runtime. Make sure this is invoked on a single process."""
     import os
     import subprocess
 
@@ -32,6 +35,94 @@ def compile_helpers():
         sys.exit(1)
 
 
+@contextmanager
+def build_cache_on_this_rank() -> Iterator[None]:
+    """Within the context, and on the calling thread only, let the dataset classes build and save
+    their indices on a cache miss regardless of the rank
+
+    The caller must ensure that no other rank builds the same dataset concurrently.
+    """
+    previous = getattr(_cache_builder_state, "enabled", False)
+    _cache_builder_state.enabled = True
+    try:
+        yield
+    finally:
+        _cache_builder_state.enabled = previous
+
+
+def is_cache_builder() -> bool:
+    """Return whether the dataset classes may build and save their indices on a cache miss
+
+    Returns:
+        bool: True when torch.distributed is not initialized, on rank 0, or within the
+        build_cache_on_this_rank context, otherwise False
+    """
+    if getattr(_cache_builder_state, "enabled", False):
+        return True
+    return not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0
+
+
+class RankPrefetchWindow:
+    """Track the upcoming samples which this rank reads, so as to prefetch each of them once
+
+    The pretraining sampler splits every micro_batch_size * data_parallel_size consecutive samples
+    into one micro batch per data parallel rank, and the data loader workers take the micro
+    batches of a rank in turns. The samples which a worker reads after a given sample are then
+    those at the same slot of every stride of micro_batch_size * data_parallel_size *
+    num_workers samples.
+
+    Args:
+        num_samples (int): The number of upcoming samples to return on each access
+
+        micro_batch_size (int): The micro batch size
+
+        data_parallel_size (int): The data parallel size
+    """
+
+    def __init__(self, num_samples: int, micro_batch_size: int, data_parallel_size: int) -> None:
+        assert num_samples > 0
+        assert micro_batch_size > 0
+        assert data_parallel_size > 0
+        self.num_samples = num_samples
+        self.micro_batch_size = micro_batch_size
+        self.data_parallel_size = data_parallel_size
+        # The slot, and the range of positions within the slot, returned by the previous access
+        self.slot = None
+        self.beg = 0
+        self.end = 0
+
+    def advance(self, idx: int, size: int) -> numpy.ndarray:
+        """Get the upcoming samples after a given sample which the previous accesses did not return
+
+        Args:
+            idx (int): The index of the sample being read
+
+            size (int): The number of samples in the dataset
+
+        Returns:
+            numpy.ndarray: The indices of the upcoming samples, in the order they are read
+        """
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        stride = self.micro_batch_size * self.data_parallel_size * num_workers
+
+        slot = idx % stride - idx % self.micro_batch_size
+        position = idx // stride * self.micro_batch_size + idx % self.micro_batch_size
+        end = position + 1 + self.num_samples
+        if slot == self.slot and self.beg <= position < self.end:
+            beg = self.end
+            end = max(end, self.end)
+        else:
+            beg = position + 1
+        self.slot, self.beg, self.end = slot, position, end
+
+        positions = numpy.arange(beg, end, dtype=numpy.int64)
+        indices = (
+            positions // self.micro_batch_size * stride + slot + positions % self.micro_batch_size
+        )
+        return indices[indices < size]
+
+
 def normalize(weights: List[float]) -> List[float]:
     """Do non-exponentiated normalization
 
@@ -51,7 +142,7 @@ def get_blend_from_list(
     blend: Optional[List[str]],
 ) -> Optional[Tuple[List[str], Optional[List[float]]]]:
     """Get the megatron.core.datasets.blended_megatron_dataset_config.BlendedMegatronDatasetConfig blend from the blend list
-    
+
     Args:
         blend (Optional[List[str]]): The blend list, which can be either (1) a list of prefixes, e.g. ["path/to/dataset_1_prefix", "path/to/dataset_2_prefix"], or (2) a flattened, zipped list of weights and prefixes, e.g. ["30", "path/to/dataset_1_prefix", "70", "path/to/dataset_2_prefix"]
 
@@ -86,3 +177,25 @@ def get_blend_from_list(
     prefix_per_dataset = [rppd.strip() for rppd in raw_prefix_per_dataset]
 
     return prefix_per_dataset, weight_per_dataset
+
+
+def get_blend_schedule_from_list(
+    blend_schedule: Optional[List[str]],
+) -> Optional[List[Tuple[int, List[float]]]]:
+    """Get the megatron.core.datasets.blended_megatron_dataset_config.BlendedMegatronDatasetConfig blend schedule from the blend schedule list
+
+    Args:
+        blend_schedule (Optional[List[str]]): The blend schedule list of breakpoints, each a sample and the weights at that sample, e.g. ["0:0.7,0.3", "1000000:0.5,0.5"]
+
+    Returns:
+        Optional[List[Tuple[int, List[float]]]]: The blend schedule, e.g. [(0, [0.7, 0.3]), (1000000, [0.5, 0.5])]
+    """
+    if blend_schedule is None:
+        return None
+
+    schedule = []
+    for breakpoint in blend_schedule:
+        sample, weights = breakpoint.split(":")
+        schedule.append((int(sample), [float(weight) for weight in weights.split(",")]))
+
+    return schedule
@@ -24,12 +24,20 @@ class S3Config(NamedTuple):
         path_to_idx_cache (str): The local directory where we will store the index (.idx) file
 
         bin_chunk_nbytes (int): If the number of bytes is too small, then we send a request to S3 at each call of the `read` method in _S3BinReader, which is slow, because each request has a fixed cost independent of the size of the byte range requested. If the number of bytes is too large, then we only rarely have to send requests to S3, but it takes a lot of time to complete the request when we do, which can block training. We've found that 256 * 1024 * 1024 (i.e., 256 MiB) has worked well (though we have not put that much effort into tuning it), so we default to it.
+
+        bin_chunk_cache_size (int): The number of `bin_chunk_nbytes` chunks of the data (.bin) file to hold in the in-memory cache, with the least recently used chunk evicted first. Defaults to 1.
+
+        bin_prefetch_threads (int): The number of background threads which download the chunks passed to `_S3BinReader.prefetch` ahead of time. If 0, do not prefetch. Defaults to 0.
     """
 
     path_to_idx_cache: str
 
     bin_chunk_nbytes: int = 256 * 1024 * 1024
 
+    bin_chunk_cache_size: int = 1
+
+    bin_prefetch_threads: int = 0
+
 
 class S3Client(Protocol):
     """The protocol which all s3 clients should abide by"""
@@ -1,4 +1,6 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import math
+from collections import OrderedDict
 from typing import Dict, List
 
 import torch
@@ -7,6 +9,7 @@ from megatron.core.inference.common_inference_params import CommonInferenceParam
 from megatron.core.inference.engines.abstract_engine import AbstractEngine
 from megatron.core.inference.inference_request import InferenceRequest
 from megatron.core.inference.scheduler import Scheduler
+from megatron.core.inference.scheduling_policies import SchedulingPolicy
 from megatron.core.inference.text_generation_controllers.simple_text_generation_controller import (
     SimpleTextGenerationController,
 )
@@ -18,6 +21,13 @@ class MCoreEngine(AbstractEngine):
         text_generation_controller: SimpleTextGenerationController,
         max_batch_size,
         random_seed: int = None,
+        kv_block_size: int = 16,
+        num_kv_blocks: int = None,
+        enable_prefix_caching: bool = False,
+        prefix_cache_max_blocks: int = None,
+        max_num_tokens_per_step: int = None,
+        scheduling_policy: SchedulingPolicy = None,
+        enable_preemption: bool = False,
     ):
         """The Megatron core backend constructor
 
@@ -27,13 +37,34 @@ class MCoreEngine(AbstractEngine):
             text_generation_controller (SimpleTextGenerationController): A text generation controller that will be used to define how to preprocess prompts, generate outputs and detokenizer the output tokens.
             max_batch_size : The maxinum number of requests to process at once
             random_seed (int, optional): Use a random seed if you want deterministic results. Defaults to None.
+            kv_block_size (int, optional): The number of tokens per block of the paged key-value memory of dynamic batching. Defaults to 16.
+            num_kv_blocks (int, optional): The number of blocks of the paged key-value memory of dynamic batching, including a padding block. Defaults to None, which fits max_batch_size requests of the maximum sequence length.
+            enable_prefix_caching (bool, optional): Set this to True to share the key-value memory of the common prompt prefixes across the requests of dynamic batching. Defaults to False.
+            prefix_cache_max_blocks (int, optional): The maximum number of blocks of the prefix cache, beyond those in use by the requests. Defaults to None, which bounds the cache only by the pool.
+            max_num_tokens_per_step (int, optional): The maximum number of tokens fed to the model per step of dynamic batching, see Scheduler. Defaults to None.
+            scheduling_policy (SchedulingPolicy, optional): The order in which the requests are served, see scheduling_policies.py. Defaults to None, which serves them in order of arrival.
+            enable_preemption (bool, optional): Set this to True to let the requests which the scheduling policy serves first preempt the active requests of dynamic batching, whose key-value memory is swapped to host memory until they resume. Defaults to False.
         """
 
         self.text_generation_controller = text_generation_controller
         self.random_seed = random_seed
-        self.scheduler = Scheduler(max_batch_size=max_batch_size)
-
-    def generate(self, prompts: List[str], common_inference_params: CommonInferenceParams) -> dict:
+        self.scheduler = Scheduler(
+            max_batch_size=max_batch_size,
+            max_num_tokens_per_step=max_num_tokens_per_step,
+            scheduling_policy=scheduling_policy,
+            enable_preemption=enable_preemption,
+        )
+        self.kv_block_size = kv_block_size
+        self.num_kv_blocks = num_kv_blocks
+        self.enable_prefix_caching = enable_prefix_caching
+        self.prefix_cache_max_blocks = prefix_cache_max_blocks
+
+    def generate(
+        self,
+        prompts: List[str],
+        common_inference_params: CommonInferenceParams,
+        dynamic_generation: bool = False,
+    ) -> dict:
         """The megatron core inference backend generate function
 
         This backend returns the output generations as a dictionary. It returns the prompt tokens along with the generated tokens, the prompt plus the generated string and the output log probabilities if requested
@@ -41,6 +72,7 @@ class MCoreEngine(AbstractEngine):
         Args:
             prompts (List[str]): All the prompts as a list of strings
             common_inference_params (CommonInferenceParams): The inference parameters
+            dynamic_generation (bool, optional): Set this to True to let requests join and leave the batch after every step, see run_engine. Defaults to False.
 
         Returns:
             List[InferenceRequest]: The output is list of inference requests containing the generated tokens, texts and log probs if required
@@ -57,36 +89,106 @@ class MCoreEngine(AbstractEngine):
                 inference_parameters=common_inference_params,
             )
 
-        self.run_engine()
+        self.run_engine(dynamic_generation=dynamic_generation)
 
         result: List[InferenceRequest] = self.scheduler.completed_request_pool.values()
         return result
 
-    def run_engine(self):
+    def run_engine(self, dynamic_generation: bool = False):
         """Main functionality to run inference
 
         Runs the engine until there are no requests in the queue.
 
+        With dynamic batching, the engine generates one token per request at a time. After every step, the completed requests leave the batch, and the waiting requests join it, with their prompts prefilled in the next step. The key-value memory is a pool of blocks of kv_block_size tokens, which the requests hold only for their own lengths, so that a smaller pool serves more requests at once. A long request thus no longer holds back the requests queued behind its batch.
+
+        With max_num_tokens_per_step, the long prompts are prefilled in chunks over several steps, so that they do not stall the requests which are generating.
+
+        With prefix caching, the blocks of the prompts stay cached after their requests complete, across calls, and the requests which start with the same tokens skip their prefill. See get_prefix_cache_metrics.
+
+        The requests are served in the order of the scheduling policy of the scheduler. With preemption, the waiting requests which the policy serves first take the place of the active requests it serves last, whose key-value memory is swapped to host memory with dynamic batching, and swapped back in once they are active again. See get_scheduler_metrics for the queue and completion times of the requests.
+
         Args:
             dynamic_generation (bool, optional): Set this to True, if you want to enable dynamic batching. Mainly used with an inference server. Defaults to False.
         """
+        if dynamic_generation:
+            pending_requests = list(self.scheduler.active_request_pool.values()) + list(
+                self.scheduler.waiting_request_pool.values()
+            )
+            if not pending_requests:
+                return
+            max_sequence_length = max(
+                len(request.prompt_tokens) + request.inference_parameters.num_tokens_to_generate
+                for request in pending_requests
+            )
+            num_kv_blocks = self.num_kv_blocks
+            if num_kv_blocks is None:
+                num_kv_blocks = (
+                    self.scheduler.max_batch_size
+                    * math.ceil(max_sequence_length / self.kv_block_size)
+                    + 1
+                )
+                # Keep a larger pool of the previous calls, and the prefix cache in it
+                kv_block_allocator = self.text_generation_controller.kv_block_allocator
+                if kv_block_allocator is not None:
+                    num_kv_blocks = max(num_kv_blocks, kv_block_allocator.num_blocks)
+            self.text_generation_controller.prep_for_dynamic_batch(
+                max_batch_size=self.scheduler.max_batch_size,
+                max_sequence_length=max_sequence_length,
+                kv_block_size=self.kv_block_size,
+                num_kv_blocks=num_kv_blocks,
+                enable_prefix_caching=self.enable_prefix_caching,
+                prefix_cache_max_blocks=self.prefix_cache_max_blocks,
+            )
+
+        sort_key = self.scheduler.scheduling_policy.get_sort_key
         while self.scheduler.have_requests_pending():
             active_requests: Dict[int, InferenceRequest] = self.scheduler.active_request_pool.copy()
-            result_dict: Dict[int, InferenceRequest] = (
-                self.text_generation_controller.generate_all_output_tokens_static_batch(
-                    active_requests
+            if dynamic_generation:
+                # The requests join the batch in the order of the scheduling policy
+                active_requests = OrderedDict(
+                    sorted(active_requests.items(), key=lambda item: sort_key(item[1]))
+                )
+                result_dict: Dict[int, InferenceRequest] = (
+                    self.text_generation_controller.generate_output_tokens_dynamic_batch(
+                        active_requests, max_num_tokens=self.scheduler.max_num_tokens_per_step
+                    )
+                )
+            else:
+                result_dict: Dict[int, InferenceRequest] = (
+                    self.text_generation_controller.generate_all_output_tokens_static_batch(
+                        active_requests
+                    )
                 )
-            )
 
             self.scheduler.update_requests_pools(result_dict=result_dict)
+            for request_id in self.scheduler.pop_preempted_request_ids():
+                if dynamic_generation:
+                    self.text_generation_controller.swap_out_dynamic_batch_request(
+                        request_id, self.scheduler.waiting_request_pool[request_id]
+                    )
 
-        # TODO: Later for dynamic batching we will do something like this
-        """ 
-            if dynamic_batching:
-                result_dict: Dict[
-                    int, InferenceRequest
-                ] = self.text_generation_controller.generate_output_tokens_one_step_dynamic_batch(
-                    active_requests
-                )
-            self.scheduler.update_requests_pools(result_dict=result_dict)         
+    def get_scheduler_metrics(self, reset: bool = True) -> dict:
+        """Get the percentiles of the queue and completion times of the requests, and the number of preemptions, since the last reset, see Scheduler.get_metrics
+
+        Args:
+            reset (bool, optional): Whether to reset the histograms and counters. Defaults to True.
+
+        Returns:
+            dict: The number of completed requests and of preemptions, and the p50, p90 and p99 queue and completion times in seconds
+        """
+        return self.scheduler.get_metrics(reset=reset)
+
+    def get_prefix_cache_metrics(self, reset: bool = True) -> dict:
+        """Get the metrics of the prefix cache of dynamic batching, since the last reset
+
+        The hit rate is the share of the prompt tokens read from the cache, and the saved tokens are the prompt tokens which were not prefilled.
+
+        Args:
+            reset (bool, optional): Whether to reset the counters. Defaults to True.
+
+        Returns:
+            dict: The number of requests, the hit rate, the number of saved tokens and the number of cached blocks
         """
+        prefix_cache = self.text_generation_controller.prefix_cache
+        assert prefix_cache is not None, "prefix caching is enabled with dynamic batching only"
+        return prefix_cache.get_metrics(reset=reset)
@@ -28,3 +28,8 @@ class InferenceRequest:
     generated_tokens: torch.Tensor = None
     generated_log_probs: torch.Tensor = None
     generated_length: int = 0
+    # For the scheduling policies, see scheduling_policies.py
+    priority: int = 0
+    deadline: float = None
+    admission_time: float = None
+    completion_time: float = None
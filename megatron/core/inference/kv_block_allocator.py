@@ -0,0 +1,62 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import math
+from collections import deque
+from typing import List
+
+
+class KVBlockAllocator:
+    def __init__(self, num_blocks: int, block_size: int):
+        """Allocator for the blocks of a paged key-value memory
+
+        The key-value memory of each layer is a pool of num_blocks blocks of block_size tokens. Each request holds a block table, the list of the blocks which store its tokens in order. Block 0 is never allocated, so that the block tables can be padded with it.
+
+        Args:
+            num_blocks (int): The number of blocks in the pool, including the padding block
+            block_size (int): The number of tokens per block
+        """
+        assert num_blocks > 1, "the pool should have at least one block besides the padding block"
+        assert block_size > 0
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.free_blocks = deque(range(1, num_blocks))
+
+    def get_num_blocks(self, num_tokens: int) -> int:
+        """Get the number of blocks needed to store a number of tokens
+
+        Args:
+            num_tokens (int): The number of tokens
+
+        Returns:
+            int: The number of blocks
+        """
+        return math.ceil(num_tokens / self.block_size)
+
+    def get_num_free_blocks(self) -> int:
+        """Get the number of blocks left to allocate
+
+        Returns:
+            int: The number of free blocks
+        """
+        return len(self.free_blocks)
+
+    def allocate(self, num_blocks: int) -> List[int]:
+        """Allocate blocks
+
+        Args:
+            num_blocks (int): The number of blocks to allocate
+
+        Returns:
+            List[int]: The allocated blocks
+        """
+        assert num_blocks <= len(
+            self.free_blocks
+        ), f"cannot allocate {num_blocks} blocks, only {len(self.free_blocks)} are free"
+        return [self.free_blocks.popleft() for _ in range(num_blocks)]
+
+    def free(self, blocks: List[int]):
+        """Free blocks, so that they can be allocated again
+
+        Args:
+            blocks (List[int]): The blocks to free
+        """
+        self.free_blocks.extend(blocks)
@@ -17,6 +17,8 @@ from megatron.core.inference.model_inference_wrappers.inference_wrapper_config i
 )
 from megatron.core.inference_params import InferenceParams
 from megatron.core.models.gpt.gpt_model import GPTModel
+from megatron.core.transformer.attention import Attention
+from megatron.core.transformer.dot_product_attention import DotProductAttention
 
 
 class AbstractModelInferenceWrapper(abc.ABC):
@@ -43,6 +45,7 @@ class AbstractModelInferenceWrapper(abc.ABC):
             if self.inference_wrapper_config.fp32_residual_connection
             else self.inference_wrapper_config.params_dtype
         )
+        self.inference_params = None
 
     def prep_model_for_inference(self, prompts_tokens: torch.Tensor):
         """A utility function for preparing model for inference
@@ -63,6 +66,55 @@ class AbstractModelInferenceWrapper(abc.ABC):
         batch_size, max_sequence_length = self.prompts_tokens.shape
         self.inference_params = InferenceParams(batch_size, max_sequence_length)
 
+    def prep_model_for_dynamic_inference(
+        self, max_batch_size: int, max_sequence_length: int, kv_block_size: int, num_kv_blocks: int
+    ) -> bool:
+        """A utility function for preparing model for inference on dynamic batches
+
+        The function gets called once before requests start to join and leave the batch. It puts the model in eval mode, and sets up a paged key-value memory of num_kv_blocks blocks of kv_block_size tokens, shared by the requests. See get_batch_for_dynamic_batch. The memory of the previous dynamic batches is kept if it has the same blocks, so that the blocks cached across requests stay valid.
+
+        The requests of a dynamic batch attend with a mask per query token, which only the local core attention (DotProductAttention) supports, so the model must be built without Transformer Engine attention, e.g. with get_gpt_layer_local_spec.
+
+        Args:
+            max_batch_size (int): The maximum number of requests in the batch at once
+            max_sequence_length (int): The maximum number of prompt and generated tokens of a request
+            kv_block_size (int): The number of tokens per block of the key-value memory
+            num_kv_blocks (int): The number of blocks of the key-value memory, see KVBlockAllocator
+
+        Returns:
+            bool: Whether the key-value memory of the previous dynamic batches was kept
+        """
+        for module in self.model.modules():
+            if isinstance(module, Attention):
+                assert isinstance(module.core_attention, DotProductAttention), (
+                    f"dynamic batches require the local core attention, but the model uses "
+                    f"{type(module.core_attention).__name__}, use --transformer-impl local"
+                )
+
+        self.model.eval()
+
+        # For TP only model both is_pp_first_stage and _is_pp_last_stage returns True
+        self.model_is_pipeline_parallel = not (
+            parallel_state.is_pipeline_first_stage() and parallel_state.is_pipeline_last_stage()
+        )
+        previous_inference_params = self.inference_params
+        self.inference_params = InferenceParams(
+            max_batch_size,
+            max_sequence_length,
+            kv_block_size=kv_block_size,
+            num_kv_blocks=num_kv_blocks,
+        )
+        keep_key_value_memory = (
+            previous_inference_params is not None
+            and previous_inference_params.kv_block_size == kv_block_size
+            and previous_inference_params.num_kv_blocks == num_kv_blocks
+        )
+        if keep_key_value_memory:
+            self.inference_params.key_value_memory_dict = (
+                previous_inference_params.key_value_memory_dict
+            )
+        return keep_key_value_memory
+
     @abc.abstractmethod
     def get_batch_for_context_window(self) -> List:
         """Returns the input data for inference
@@ -72,6 +124,28 @@ class AbstractModelInferenceWrapper(abc.ABC):
         """
         pass
 
+    def get_batch_for_dynamic_batch(
+        self,
+        tokens: torch.Tensor,
+        block_tables: torch.Tensor,
+        sequence_len_offsets: torch.Tensor,
+        sequence_lengths: torch.Tensor,
+    ) -> List:
+        """Returns the input data for a forward step on a dynamic batch
+
+        Each request of a dynamic batch has its own blocks of the paged key-value memory, and its tokens start at its own offset in the sequence. Implement this to build the model inputs of such a batch.
+
+        Args:
+            tokens (torch.Tensor): The next tokens of each request, of shape [batch_size, seq_len]
+            block_tables (torch.Tensor): The blocks of the paged key-value memory of each request, of shape [batch_size, num_blocks], padded with block 0 up to the end of the longest request
+            sequence_len_offsets (torch.Tensor): The position of the first token of each request, of shape [batch_size]
+            sequence_lengths (torch.Tensor): The length of each request after its tokens, the next ones being padding, of shape [batch_size]
+
+        Returns:
+            List: A list of inputs that will be used by your model in the forward step
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support dynamic batching")
+
     def forward_pass_without_pipeline_parallel(self, inference_input: List) -> torch.Tensor:
         """Utility to carry out simple forward pass for TP or no model parallel models
 
@@ -175,6 +249,10 @@ class AbstractModelInferenceWrapper(abc.ABC):
             end = min(start + micro_batch_size, batch_size)
             tokens2use = tokens[start:end, ...]
             position_ids2use = position_ids[start:end, ...]
+            # The attention mask of a dynamic batch differs per request
+            attention_mask2use = attention_mask
+            if attention_mask.size(0) == batch_size and batch_size > 1:
+                attention_mask2use = attention_mask[start:end, ...]
             current_micro_batch_size = end - start
 
             # Need to change recv buffer shape for the last partial microbatch (if exists)
@@ -186,7 +264,10 @@ class AbstractModelInferenceWrapper(abc.ABC):
 
             self.model.set_input_tensor(recv_buffer)
             output_tensor = self.model(
-                tokens2use, position_ids2use, attention_mask, inference_params=self.inference_params
+                tokens2use,
+                position_ids2use,
+                attention_mask2use,
+                inference_params=self.inference_params,
             )
 
             if not parallel_state.is_pipeline_last_stage():
@@ -83,3 +83,40 @@ class GPTInferenceWrapper(AbstractModelInferenceWrapper):
         ]
         data_at_step_idx = [tokens2use, positions2use, attention_mask2use]
         return data_at_step_idx
+
+    def get_batch_for_dynamic_batch(
+        self,
+        tokens: torch.Tensor,
+        block_tables: torch.Tensor,
+        sequence_len_offsets: torch.Tensor,
+        sequence_lengths: torch.Tensor,
+    ) -> List:
+        """Returns the inference data for a forward step on a dynamic batch
+
+        The position ids of each request start at its offset, and its attention mask hides the positions past each of its tokens, up to the end of the longest request. The padding tokens take the position of the last token of their request, so that they stay within the maximum sequence length.
+
+        Args:
+            tokens (torch.Tensor): The next tokens of each request, of shape [batch_size, seq_len]
+            block_tables (torch.Tensor): The blocks of the paged key-value memory of each request, of shape [batch_size, num_blocks], padded with block 0 up to the end of the longest request
+            sequence_len_offsets (torch.Tensor): The position of the first token of each request, of shape [batch_size]
+            sequence_lengths (torch.Tensor): The length of each request after its tokens, the next ones being padding, of shape [batch_size]
+
+        Returns:
+            List: A list of inputs that will be used by your model in the forward step
+        """
+        batch_size, seq_length = tokens.shape
+        position_ids = torch.minimum(
+            sequence_len_offsets.unsqueeze(1)
+            + torch.arange(seq_length, dtype=torch.long, device=tokens.device).unsqueeze(0),
+            sequence_lengths.unsqueeze(1) - 1,
+        )
+        sequence_end = int(sequence_lengths.max())
+        # [batch_size, 1, seq_length, sequence_end], True for the positions to hide
+        attention_mask = torch.arange(sequence_end, device=tokens.device).view(
+            1, 1, 1, sequence_end
+        ) > position_ids.view(batch_size, 1, seq_length, 1)
+
+        self.inference_params.set_dynamic_batch(
+            block_tables, sequence_len_offsets, sequence_lengths, sequence_end
+        )
+        return [tokens, position_ids, attention_mask]
@@ -0,0 +1,179 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import heapq
+from typing import Dict, List, Tuple
+
+from megatron.core.inference.kv_block_allocator import KVBlockAllocator
+
+
+class PrefixCacheNode:
+    def __init__(self, tokens: Tuple[int, ...], block: int, parent: "PrefixCacheNode"):
+        """A node of the prefix cache, holding one full block of the key-value memory
+
+        Args:
+            tokens (Tuple[int, ...]): The block_size tokens of the block
+            block (int): The block of the key-value memory, None for the root
+            parent (PrefixCacheNode): The node of the previous block of the prefix, None for the root
+        """
+        self.tokens = tokens
+        self.block = block
+        self.parent = parent
+        self.children: Dict[Tuple[int, ...], PrefixCacheNode] = {}
+        # The number of requests in flight which read the block
+        self.ref_count = 0
+        self.last_access = 0
+
+
+class PrefixCache:
+    def __init__(self, kv_block_allocator: KVBlockAllocator, max_num_blocks: int = None):
+        """A cache of the key-value memory blocks of prompt prefixes, shared across requests
+
+        The cache is a radix tree over the prompt tokens, with one node per full block of block_size tokens, so that a request whose prompt starts with the tokens of a path of the tree reads the blocks of that path instead of prefilling them. A block is only cached once its block_size tokens are all written, and is then never written again, so that it can be shared.
+
+        The requests in flight hold a reference to the nodes they read. When the allocator runs out of blocks, or the cache holds more than max_num_blocks blocks, the least recently used nodes without references and without children are evicted, and their blocks freed.
+
+        Args:
+            kv_block_allocator (KVBlockAllocator): The allocator of the blocks of the key-value memory
+            max_num_blocks (int, optional): The maximum number of blocks of the cache, beyond those in use by requests in flight. Defaults to None, which bounds the cache only by the pool.
+        """
+        self.kv_block_allocator = kv_block_allocator
+        self.block_size = kv_block_allocator.block_size
+        self.max_num_blocks = max_num_blocks
+        self.root = PrefixCacheNode((), None, None)
+        self.num_blocks = 0
+        self.clock = 0
+        self.reset_metrics()
+
+    def match(self, tokens: List[int], max_num_tokens: int) -> List[PrefixCacheNode]:
+        """Find the nodes of the longest cached prefix of a sequence, and take a reference to them
+
+        Args:
+            tokens (List[int]): The tokens of the sequence
+            max_num_tokens (int): The maximum number of tokens of the prefix
+
+        Returns:
+            List[PrefixCacheNode]: The nodes of the prefix, in order, whose blocks hold its first len(nodes) * block_size tokens
+        """
+        self.clock += 1
+        nodes = []
+        node = self.root
+        for start in range(0, max_num_tokens - self.block_size + 1, self.block_size):
+            node = node.children.get(tuple(tokens[start : start + self.block_size]))
+            if node is None:
+                break
+            node.ref_count += 1
+            node.last_access = self.clock
+            nodes.append(node)
+        return nodes
+
+    def insert(
+        self, tokens: List[int], blocks: List[int], nodes: List[PrefixCacheNode]
+    ) -> List[PrefixCacheNode]:
+        """Cache the full blocks of a sequence, after its tokens are written to them
+
+        The blocks of the prefixes which are already cached stay with the sequence, and are not cached twice.
+
+        Args:
+            tokens (List[int]): The tokens written to the blocks
+            blocks (List[int]): The blocks of the sequence, in order
+            nodes (List[PrefixCacheNode]): The nodes already referenced by the sequence, see match
+
+        Returns:
+            List[PrefixCacheNode]: The nodes referenced by the sequence, which now include those of its cached blocks
+        """
+        self.clock += 1
+        nodes = list(nodes)
+        node = nodes[-1] if nodes else self.root
+        for idx in range(len(nodes), len(tokens) // self.block_size):
+            key = tuple(tokens[idx * self.block_size : (idx + 1) * self.block_size])
+            child = node.children.get(key)
+            if child is None:
+                child = PrefixCacheNode(key, blocks[idx], node)
+                node.children[key] = child
+                self.num_blocks += 1
+            elif child.block != blocks[idx]:
+                # Another sequence cached the same prefix first, this one keeps its own block
+                child.last_access = self.clock
+                node = child
+                continue
+            child.ref_count += 1
+            child.last_access = self.clock
+            nodes.append(child)
+            node = child
+        if self.max_num_blocks is not None and self.num_blocks > self.max_num_blocks:
+            self.evict(self.num_blocks - self.max_num_blocks)
+        return nodes
+
+    def release(self, nodes: List[PrefixCacheNode]):
+        """Drop the references of a sequence to the nodes it read, see match and insert
+
+        Args:
+            nodes (List[PrefixCacheNode]): The nodes referenced by the sequence
+        """
+        for node in nodes:
+            assert node.ref_count > 0
+            node.ref_count -= 1
+
+    def evict(self, num_blocks: int) -> int:
+        """Evict the least recently used blocks which are not in use, and free them
+
+        Args:
+            num_blocks (int): The number of blocks to evict
+
+        Returns:
+            int: The number of blocks evicted, less than num_blocks if the others are in use
+        """
+        leaves = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children.values())
+            if node is not self.root and not node.children and node.ref_count == 0:
+                leaves.append((node.last_access, id(node), node))
+        heapq.heapify(leaves)
+
+        num_evicted = 0
+        while leaves and num_evicted < num_blocks:
+            _, _, node = heapq.heappop(leaves)
+            parent = node.parent
+            del parent.children[node.tokens]
+            self.kv_block_allocator.free([node.block])
+            self.num_blocks -= 1
+            num_evicted += 1
+            if parent is not self.root and not parent.children and parent.ref_count == 0:
+                heapq.heappush(leaves, (parent.last_access, id(parent), parent))
+        return num_evicted
+
+    def record_lookup(self, num_tokens: int, num_cached_tokens: int):
+        """Count the prompt tokens of a request, and those read from the cache
+
+        Args:
+            num_tokens (int): The number of prompt tokens of the request
+            num_cached_tokens (int): The number of its prompt tokens read from the cache
+        """
+        self.num_requests += 1
+        self.num_tokens += num_tokens
+        self.num_cached_tokens += num_cached_tokens
+
+    def get_metrics(self, reset: bool = True) -> Dict[str, float]:
+        """Get the share of the prompt tokens read from the cache and the number of prefill tokens saved, since the last reset
+
+        Args:
+            reset (bool, optional): Whether to reset the counters. Defaults to True.
+
+        Returns:
+            Dict[str, float]: The metrics
+        """
+        metrics = {
+            'requests': self.num_requests,
+            'hit-rate': self.num_cached_tokens / max(1, self.num_tokens),
+            'saved-tokens': self.num_cached_tokens,
+            'cached-blocks': self.num_blocks,
+        }
+        if reset:
+            self.reset_metrics()
+        return metrics
+
+    def reset_metrics(self):
+        self.num_requests = 0
+        self.num_tokens = 0
+        self.num_cached_tokens = 0
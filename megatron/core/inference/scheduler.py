@@ -8,30 +8,52 @@ import torch
 
 from megatron.core.inference.common_inference_params import CommonInferenceParams
 from megatron.core.inference.inference_request import InferenceRequest, Status
-from megatron.core.inference.utils import Counter
+from megatron.core.inference.scheduling_policies import FIFOPolicy, SchedulingPolicy
+from megatron.core.inference.utils import Counter, LatencyHistogram
 
 
 class Scheduler:
-    def __init__(self, max_batch_size: int):
+    def __init__(
+        self,
+        max_batch_size: int,
+        max_num_tokens_per_step: int = None,
+        scheduling_policy: SchedulingPolicy = None,
+        enable_preemption: bool = False,
+    ):
         """Scheduler for handling requests to inference engine
 
         This class is responsible for handing of all the incomign requests
 
         Args:
             max_batch_size (int): The max batch size that we can pass to the inference engine at a time.
+            max_num_tokens_per_step (int, optional): The max number of tokens that the inference engine feeds to the model per step with dynamic batching. The prompts are then prefilled in chunks between the generation steps of the active requests, which bounds the time between their tokens. Defaults to None, which prefills each prompt in one step.
+            scheduling_policy (SchedulingPolicy, optional): The order in which the waiting requests are admitted to the active pool. Defaults to None, which admits them in order of arrival.
+            enable_preemption (bool, optional): Set this to True to let a waiting request take the place of an active request that the scheduling policy serves after it. The preempted request goes back to the waiting pool, see pop_preempted_request_ids. Defaults to False.
         """
+        assert max_num_tokens_per_step is None or max_num_tokens_per_step > 0
         self.max_batch_size = max_batch_size
+        self.max_num_tokens_per_step = max_num_tokens_per_step
+        self.scheduling_policy = FIFOPolicy() if scheduling_policy is None else scheduling_policy
+        self.enable_preemption = enable_preemption
+        self.preempted_request_ids: List[str] = []
         self.active_request_pool: Dict[int, InferenceRequest] = OrderedDict()
         self.waiting_request_pool: Dict[int, InferenceRequest] = OrderedDict()
         self.completed_request_pool: Dict[int, InferenceRequest] = OrderedDict()
         self.request_counter = Counter()
 
+        # The time from the arrival of a request to its first admission and to its completion
+        self.queue_time_histogram = LatencyHistogram()
+        self.completion_time_histogram = LatencyHistogram()
+        self.num_preemptions = 0
+
     def add_request(
         self,
         prompt: str,
         prompt_tokens: torch.Tensor,
         inference_parameters: CommonInferenceParams,
         arrival_time: float = None,
+        priority: int = 0,
+        deadline: float = None,
     ):
         """Add an incoming request
 
@@ -42,29 +64,27 @@ class Scheduler:
             prompt_tokens (torch.Tensor): A torch tensor having the input prompts tokenized
             inference_parameters (CommonInferenceParams): The inference parameters
             arrival_time (float, optional): The incoming request time. Defaults to None.
+            priority (int, optional): The priority of the request, higher first, see PriorityPolicy. Defaults to 0.
+            deadline (float, optional): The time by which the request should complete, see EarliestDeadlineFirstPolicy. Defaults to None.
         """
         request_id = str(next(self.request_counter))
 
         if arrival_time is None:
             arrival_time = time.time()
 
-        status = (
-            Status.ACTIVE_BUT_NOT_GENERATING_TOKENS
-            if len(self.active_request_pool) < self.max_batch_size
-            else Status.WAITING_IN_QUEUE
-        )
-
         inference_request = InferenceRequest(
             request_id=request_id,
             prompt=prompt,
             inference_parameters=inference_parameters,
             arrival_time=arrival_time,
             prompt_tokens=prompt_tokens,
-            status=status,
+            status=Status.WAITING_IN_QUEUE,
+            priority=priority,
+            deadline=deadline,
         )
 
-        if status == status.ACTIVE_BUT_NOT_GENERATING_TOKENS:
-            self.active_request_pool[request_id] = inference_request
+        if len(self.active_request_pool) < self.max_batch_size:
+            self._add_request_to_active_pool(inference_request)
         else:
             self.waiting_request_pool[request_id] = inference_request
 
@@ -76,27 +96,70 @@ class Scheduler:
         num_requests_pending = len(self.active_request_pool) + len(self.waiting_request_pool)
         return num_requests_pending > 0
 
-    def add_earliest_waiting_request_to_active_pool(self):
+    def add_next_waiting_request_to_active_pool(self):
         """Utility to add the waiting request to active pool
 
-        This method will add the earliest request (FIFO) that is in the waiting request pool to the active request pool.
+        This method will add the request that is in the waiting request pool to the active request pool that the scheduling policy serves first, the earliest one by default (FIFO).
         """
         assert (
             len(self.active_request_pool) < self.max_batch_size
         ), "Active request pool is already full. Cant add any more requests"
         if len(self.waiting_request_pool) > 0:
-            (
-                earliest_waiting_request_request_id,
-                earliest_waiting_request,
-            ) = self.waiting_request_pool.popitem(last=False)
-            earliest_waiting_request.status = Status.ACTIVE_BUT_NOT_GENERATING_TOKENS
-            self.active_request_pool[earliest_waiting_request_request_id] = earliest_waiting_request
+            next_waiting_request = min(
+                self.waiting_request_pool.values(), key=self.scheduling_policy.get_sort_key
+            )
+            del self.waiting_request_pool[next_waiting_request.request_id]
+            self._add_request_to_active_pool(next_waiting_request)
+
+    def add_earliest_waiting_request_to_active_pool(self):
+        """Utility to add the waiting request to active pool
+
+        Kept for backward compatibility, see add_next_waiting_request_to_active_pool. The request added is the earliest one only with the default FIFO scheduling policy.
+        """
+        self.add_next_waiting_request_to_active_pool()
+
+    def _add_request_to_active_pool(self, request: InferenceRequest):
+        request.status = Status.ACTIVE_BUT_NOT_GENERATING_TOKENS
+        if request.admission_time is None:
+            request.admission_time = time.time()
+            self.queue_time_histogram.add(request.admission_time - request.arrival_time)
+        self.active_request_pool[request.request_id] = request
+
+    def preempt_active_requests(self):
+        """Utility to preempt the active requests served after waiting requests
+
+        While the scheduling policy serves a waiting request before an active request, this method will move the active request that it serves last back to the waiting request pool, and add the waiting request to the active request pool. The engine should then release the state of the preempted requests, see pop_preempted_request_ids.
+        """
+        sort_key = self.scheduling_policy.get_sort_key
+        while len(self.waiting_request_pool) > 0 and len(self.active_request_pool) > 0:
+            next_waiting_request = min(self.waiting_request_pool.values(), key=sort_key)
+            last_active_request = max(self.active_request_pool.values(), key=sort_key)
+            if sort_key(next_waiting_request) >= sort_key(last_active_request):
+                break
+            del self.active_request_pool[last_active_request.request_id]
+            last_active_request.status = Status.WAITING_IN_QUEUE
+            self.waiting_request_pool[last_active_request.request_id] = last_active_request
+            self.preempted_request_ids.append(last_active_request.request_id)
+            self.num_preemptions += 1
+            del self.waiting_request_pool[next_waiting_request.request_id]
+            self._add_request_to_active_pool(next_waiting_request)
+
+    def pop_preempted_request_ids(self) -> List[str]:
+        """Get the ids of the requests preempted since the last call
+
+        Returns:
+            List[str]: The ids of the preempted requests, in order of preemption
+        """
+        preempted_request_ids = self.preempted_request_ids
+        self.preempted_request_ids = []
+        return preempted_request_ids
 
     def update_requests_pools(self, result_dict: typing.OrderedDict[int, InferenceRequest] = None):
         """Update request pool status
 
         This method will full up the active request pool, if it has less than max batch size elements from the waiting request pool.
         If provided with a request dict, it will put the completed requests into the completed request pool and add waiting request into active pool.
+        With preemption, it then lets the waiting requests take the place of the active requests served after them.
 
         Args:
             result (typing.OrderedDict[int, InferenceRequest], optional): The result returned by the engine. A dictionary with keys as the request ids, and values as the requests. Defaults to None
@@ -107,11 +170,45 @@ class Scheduler:
             # If a request has completed put it into the completed request pool.
             if active_request.status == Status.COMPLETED:
                 completed_request = self.active_request_pool.pop(result_request_id)
+                completed_request.completion_time = time.time()
+                self.completion_time_histogram.add(
+                    completed_request.completion_time - completed_request.arrival_time
+                )
                 self.completed_request_pool[result_request_id] = completed_request
 
-        # If the active request pool is not full, add waiting requests in FIFO order
+        # If the active request pool is not full, add waiting requests in the order of the policy
         while (
             len(self.active_request_pool) < self.max_batch_size
             and len(self.waiting_request_pool) > 0
         ):
-            self.add_earliest_waiting_request_to_active_pool()
+            self.add_next_waiting_request_to_active_pool()
+
+        if self.enable_preemption:
+            self.preempt_active_requests()
+
+    def get_metrics(self, reset: bool = True) -> Dict[str, float]:
+        """Get the percentiles of the queue time and of the completion time of the requests, and the number of preemptions, since the last reset
+
+        The queue time of a request is the time from its arrival to its first admission to the active pool, and its completion time the time from its arrival to its completion. See queue_time_histogram and completion_time_histogram for the full histograms.
+
+        Args:
+            reset (bool, optional): Whether to reset the histograms and counters. Defaults to True.
+
+        Returns:
+            Dict[str, float]: The metrics, in seconds for the times
+        """
+        metrics = {
+            'completed-requests': self.completion_time_histogram.num_latencies,
+            'preemptions': self.num_preemptions,
+        }
+        for name, histogram in [
+            ('queue-time', self.queue_time_histogram),
+            ('completion-time', self.completion_time_histogram),
+        ]:
+            for percentile in [50, 90, 99]:
+                metrics[f'{name}-p{percentile}'] = histogram.get_percentile(percentile)
+        if reset:
+            self.queue_time_histogram.reset()
+            self.completion_time_histogram.reset()
+            self.num_preemptions = 0
+        return metrics
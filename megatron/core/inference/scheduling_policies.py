@@ -0,0 +1,57 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import abc
+from typing import Tuple
+
+from megatron.core.inference.inference_request import InferenceRequest
+
+
+class SchedulingPolicy(abc.ABC):
+    """The order in which the scheduler admits the waiting requests
+
+    The scheduler admits the waiting request with the smallest sort key first, and with preemption, a waiting request preempts an active request with a larger sort key. See Scheduler.
+    """
+
+    @abc.abstractmethod
+    def get_sort_key(self, request: InferenceRequest) -> Tuple:
+        """Get the sort key of a request
+
+        Args:
+            request (InferenceRequest): The request
+
+        Returns:
+            Tuple: The sort key, smaller for the requests to serve first
+        """
+        pass
+
+
+class FIFOPolicy(SchedulingPolicy):
+    """Serve the requests in order of arrival"""
+
+    def get_sort_key(self, request: InferenceRequest) -> Tuple:
+        return (request.arrival_time, int(request.request_id))
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """Serve the requests of higher priority first, and in order of arrival within a priority"""
+
+    def get_sort_key(self, request: InferenceRequest) -> Tuple:
+        return (-request.priority, request.arrival_time, int(request.request_id))
+
+
+class EarliestDeadlineFirstPolicy(SchedulingPolicy):
+    """Serve the requests of earlier deadline first, and the requests without deadline last"""
+
+    def get_sort_key(self, request: InferenceRequest) -> Tuple:
+        deadline = float('inf') if request.deadline is None else request.deadline
+        return (deadline, request.arrival_time, int(request.request_id))
+
+
+class ShortestJobFirstPolicy(SchedulingPolicy):
+    """Serve the requests with fewer tokens to generate first"""
+
+    def get_sort_key(self, request: InferenceRequest) -> Tuple:
+        return (
+            request.inference_parameters.num_tokens_to_generate,
+            request.arrival_time,
+            int(request.request_id),
+        )
@@ -1,5 +1,6 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
-from typing import List, OrderedDict, Tuple
+from dataclasses import dataclass
+from typing import Dict, List, OrderedDict, Tuple
 
 import torch
 import torch.nn.functional as F
@@ -8,9 +9,23 @@ from megatron.core import parallel_state
 from megatron.core.inference.common_inference_params import CommonInferenceParams
 from megatron.core.inference.communication_utils import broadcast_from_last_pipeline_stage
 from megatron.core.inference.inference_request import InferenceRequest, Status
+from megatron.core.inference.kv_block_allocator import KVBlockAllocator
 from megatron.core.inference.model_inference_wrappers.abstract_model_inference_wrapper import (
     AbstractModelInferenceWrapper,
 )
+from megatron.core.inference.prefix_cache import PrefixCache, PrefixCacheNode
+
+
+@dataclass
+class SwappedRequest:
+    """The key-value memory of a preempted request of a dynamic batch, in host memory"""
+
+    # The block table of the request, whose blocks at block_indices were freed
+    block_table: List[int]
+    block_indices: List[int]
+    # The blocks which were written, and their keys and values per layer, see InferenceParams
+    swapped_block_indices: List[int]
+    swapped_key_value_dict: Dict[int, Tuple[torch.Tensor, torch.Tensor]]
 
 
 class SimpleTextGenerationController:
@@ -31,6 +46,19 @@ class SimpleTextGenerationController:
             parallel_state.is_pipeline_first_stage() and parallel_state.is_pipeline_last_stage()
         )
 
+        # The state of the requests of the dynamic batch, see prep_for_dynamic_batch
+        self.max_sequence_length = None
+        self.kv_block_allocator: KVBlockAllocator = None
+        self.block_tables: Dict[str, List[int]] = {}
+        self.prefix_cache: PrefixCache = None
+        self.prefix_cache_nodes: Dict[str, List[PrefixCacheNode]] = {}
+        # The number of prompt tokens of each request in the key-value memory, while prefilling
+        self.sequence_len_offsets: Dict[str, int] = {}
+        self.sequence_tokens: Dict[str, List[int]] = {}
+        self.generated_log_probs: Dict[str, List[float]] = {}
+        # The preempted requests, see swap_out_dynamic_batch_request
+        self.swapped_requests: Dict[str, SwappedRequest] = {}
+
     def tokenize_prompt(self, prompt: str) -> Tuple[torch.Tensor, torch.Tensor]:
         """Utility to tokenize the input prompts
 
@@ -188,21 +216,433 @@ class SimpleTextGenerationController:
 
         return torch.tensor(batch_prompt_tokens_list).cuda()
 
+    def prep_for_dynamic_batch(
+        self,
+        max_batch_size: int,
+        max_sequence_length: int,
+        kv_block_size: int,
+        num_kv_blocks: int,
+        enable_prefix_caching: bool = False,
+        prefix_cache_max_blocks: int = None,
+    ):
+        """Prepare the model and the paged key-value memory for a dynamic batch
+
+        Call this once before calling generate_output_tokens_dynamic_batch, with at most max_batch_size requests in the batch at once. The requests share a pool of num_kv_blocks blocks of kv_block_size tokens, see KVBlockAllocator. With prefix caching, the blocks of the prompts are cached across requests, see PrefixCache, and the cache is kept across dynamic batches with the same key-value memory.
+
+        Args:
+            max_batch_size (int): The maximum number of requests in the batch at once
+            max_sequence_length (int): The maximum number of prompt and generated tokens of a request
+            kv_block_size (int): The number of tokens per block of the key-value memory
+            num_kv_blocks (int): The number of blocks of the key-value memory, including the padding block
+            enable_prefix_caching (bool, optional): Whether to share the blocks of the prompt prefixes across requests. Defaults to False.
+            prefix_cache_max_blocks (int, optional): The maximum number of blocks of the prefix cache, beyond those in use. Defaults to None, which bounds the cache only by the pool.
+        """
+        keep_key_value_memory = self.inference_wrapped_model.prep_model_for_dynamic_inference(
+            max_batch_size=max_batch_size,
+            max_sequence_length=max_sequence_length,
+            kv_block_size=kv_block_size,
+            num_kv_blocks=num_kv_blocks,
+        )
+        self.max_sequence_length = max_sequence_length
+        keep_prefix_cache = (
+            enable_prefix_caching
+            and keep_key_value_memory
+            and self.prefix_cache is not None
+            and not self.block_tables
+            and not self.swapped_requests
+        )
+        if keep_prefix_cache:
+            self.prefix_cache.max_num_blocks = prefix_cache_max_blocks
+        else:
+            self.kv_block_allocator = KVBlockAllocator(num_kv_blocks, kv_block_size)
+            self.prefix_cache = (
+                PrefixCache(self.kv_block_allocator, prefix_cache_max_blocks)
+                if enable_prefix_caching
+                else None
+            )
+        self.block_tables = {}
+        self.prefix_cache_nodes = {}
+        self.sequence_len_offsets = {}
+        self.swapped_requests = {}
+        self.sequence_tokens = {}
+        self.generated_log_probs = {}
+
     def generate_output_tokens_dynamic_batch(
         self,
         active_requests: OrderedDict[int, InferenceRequest],
+        max_num_tokens: int = None,
     ) -> OrderedDict[int, InferenceRequest]:
         """Utility to generate the output tokens and probabilities for the prompts
 
         This utility generates the output tokens for a dynamic batch. It will run one forward step at a time, and pass control back to the engine, which will update the request pool and call this method again.
 
+        Each step generates one token for each request which was already generating, and prefills the prompts of the requests which joined the batch, generating their first token. A request joins only once enough blocks of the key-value memory are free for all of its tokens; the requests behind it in active_requests wait too. A request which completes releases its blocks to the next requests to join. With prefix caching, a request reads the blocks of its longest cached prompt prefix, and prefills only the rest of its prompt.
+
+        With max_num_tokens, the prompts are prefilled in chunks, so that a long prompt does not stall the requests which are generating. The tokens of the generating requests come first, and the rest of the max_num_tokens tokens of the step go to the prompts, in the order of active_requests. A request generates its first token once its whole prompt is prefilled.
+
+        The requests which were preempted, see swap_out_dynamic_batch_request, are swapped back in before the new requests join, and carry on where they stopped.
+
         Args:
             active_requests (OrderedDict[int, InferenceRequest]): The input active requests.
+            max_num_tokens (int, optional): The maximum number of tokens fed to the model per step, not counting padding. Defaults to None, which prefills the prompts whole.
 
         Returns:
             OrderedDict[int, InferenceRequest]: The result for each of the incoming requests after running one forward step.
         """
-        raise Exception("Not implemented yet")
+        generating_requests = OrderedDict()
+        prefilling_requests = OrderedDict()
+        new_requests = OrderedDict()
+        # No request joins while a preempted request waits for blocks to swap back in
+        can_join = True
+        for request_id, request in active_requests.items():
+            if request.status == Status.ACTIVE_BUT_NOT_GENERATING_TOKENS and (
+                request_id in self.swapped_requests
+            ):
+                if not can_join or not self._swap_in_dynamic_batch_request(request_id, request):
+                    can_join = False
+                    continue
+            if request.status == Status.ACTIVE_AND_GENERATING_TOKENS:
+                generating_requests[request_id] = request
+            elif request.status == Status.ACTIVE_BUT_NOT_GENERATING_TOKENS:
+                if request_id in self.block_tables:
+                    prefilling_requests[request_id] = request
+                elif can_join:
+                    new_requests[request_id] = request
+        num_tokens_left = float('inf') if max_num_tokens is None else max_num_tokens
+
+        with torch.no_grad():
+            if generating_requests:
+                # Feed the last token of each request
+                tokens = [
+                    self.sequence_tokens[request_id][-1:] for request_id in generating_requests
+                ]
+                sequence_len_offsets = [
+                    len(self.sequence_tokens[request_id]) - 1 for request_id in generating_requests
+                ]
+                last_token_logits = self._run_dynamic_batch_forward_step(
+                    generating_requests, tokens, sequence_len_offsets, [1] * len(tokens)
+                )
+                self._update_dynamic_batch(generating_requests, last_token_logits)
+                num_tokens_left -= len(generating_requests)
+
+            # The requests which are prefilling go on first, then the new requests join
+            chunk_sizes = OrderedDict()
+            for request_id, request in list(prefilling_requests.items()) + list(
+                new_requests.items()
+            ):
+                if num_tokens_left <= 0:
+                    break
+                if request_id in new_requests:
+                    if not self._join_dynamic_batch(request_id, request):
+                        break
+                    prefilling_requests[request_id] = request
+                num_prompt_tokens_left = (
+                    len(self.sequence_tokens[request_id]) - self.sequence_len_offsets[request_id]
+                )
+                chunk_sizes[request_id] = min(num_prompt_tokens_left, num_tokens_left)
+                num_tokens_left -= chunk_sizes[request_id]
+
+            if chunk_sizes:
+                # Prefill the next chunk of the uncached part of the prompts, padded to the longest
+                chunk_requests = OrderedDict(
+                    (request_id, prefilling_requests[request_id]) for request_id in chunk_sizes
+                )
+                sequence_len_offsets = [
+                    self.sequence_len_offsets[request_id] for request_id in chunk_requests
+                ]
+                tokens = [
+                    self.sequence_tokens[request_id][offset : offset + chunk_sizes[request_id]]
+                    for request_id, offset in zip(chunk_requests, sequence_len_offsets)
+                ]
+                last_token_logits = self._run_dynamic_batch_forward_step(
+                    chunk_requests, tokens, sequence_len_offsets, list(chunk_sizes.values())
+                )
+
+                # The requests whose prompts are now whole generate their first token
+                prefilled_requests = OrderedDict()
+                prefilled_indices = []
+                for idx, (request_id, request) in enumerate(chunk_requests.items()):
+                    self.sequence_len_offsets[request_id] += chunk_sizes[request_id]
+                    if self.sequence_len_offsets[request_id] < len(
+                        self.sequence_tokens[request_id]
+                    ):
+                        continue
+                    if self.prefix_cache is not None:
+                        self.prefix_cache_nodes[request_id] = self.prefix_cache.insert(
+                            self.sequence_tokens[request_id],
+                            self.block_tables[request_id],
+                            self.prefix_cache_nodes[request_id],
+                        )
+                    request.status = Status.ACTIVE_AND_GENERATING_TOKENS
+                    prefilled_requests[request_id] = request
+                    prefilled_indices.append(idx)
+                if prefilled_requests:
+                    self._update_dynamic_batch(
+                        prefilled_requests, last_token_logits[prefilled_indices]
+                    )
+
+        return active_requests
+
+    def _join_dynamic_batch(self, request_id: str, request: InferenceRequest) -> bool:
+        """Reserve the key-value memory blocks of a request, if enough are free, for it to join the dynamic batch
+
+        The request reads the blocks of its longest cached prompt prefix, if any, and gets new blocks for the rest of its tokens. The unused blocks of the prefix cache are evicted as needed. The request then prefills the rest of its prompt, see generate_output_tokens_dynamic_batch.
+
+        Args:
+            request_id (str): The id of the request
+            request (InferenceRequest): The request
+
+        Returns:
+            bool: Whether the request joined the batch
+        """
+        prompt_tokens = list(request.prompt_tokens)
+        num_tokens = len(prompt_tokens) + request.inference_parameters.num_tokens_to_generate
+        assert num_tokens <= self.max_sequence_length, (
+            f"request {request_id} of {num_tokens} tokens exceeds the maximum sequence "
+            f"length {self.max_sequence_length}"
+        )
+        # The last generated token is never fed back, so it needs no key-value memory
+        num_blocks = self.kv_block_allocator.get_num_blocks(num_tokens - 1)
+        assert num_blocks < self.kv_block_allocator.num_blocks, (
+            f"request {request_id} needs {num_blocks} key-value memory blocks, more than "
+            f"the {self.kv_block_allocator.num_blocks - 1} of the pool"
+        )
+
+        nodes = []
+        if self.prefix_cache is not None:
+            # The last prompt token is always fed, for the logits of the first generated token
+            nodes = self.prefix_cache.match(prompt_tokens, len(prompt_tokens) - 1)
+            num_missing_blocks = (
+                num_blocks - len(nodes) - self.kv_block_allocator.get_num_free_blocks()
+            )
+            if num_missing_blocks > 0:
+                self.prefix_cache.evict(num_missing_blocks)
+        if num_blocks - len(nodes) > self.kv_block_allocator.get_num_free_blocks():
+            if self.prefix_cache is not None:
+                self.prefix_cache.release(nodes)
+            return False
+
+        sequence_len_offset = len(nodes) * self.kv_block_allocator.block_size
+        if self.prefix_cache is not None:
+            self.prefix_cache.record_lookup(len(prompt_tokens), sequence_len_offset)
+        self.block_tables[request_id] = [
+            node.block for node in nodes
+        ] + self.kv_block_allocator.allocate(num_blocks - len(nodes))
+        self.prefix_cache_nodes[request_id] = nodes
+        self.sequence_len_offsets[request_id] = sequence_len_offset
+        self.sequence_tokens[request_id] = prompt_tokens
+        self.generated_log_probs[request_id] = []
+        return True
+
+    def swap_out_dynamic_batch_request(self, request_id: str, request: InferenceRequest):
+        """Preempt a request of the dynamic batch, and swap its key-value memory to host memory
+
+        The keys and values written to the blocks of the request are copied to host memory, and its blocks are freed for the other requests. The blocks it reads from the prefix cache stay cached for it. Once the request is active again, the next call to generate_output_tokens_dynamic_batch swaps it back in, and it carries on where it stopped. A request which has not joined the batch yet has nothing to swap out.
+
+        Args:
+            request_id (str): The id of the request
+            request (InferenceRequest): The request
+        """
+        if request_id not in self.block_tables:
+            return
+        block_table = self.block_tables.pop(request_id)
+        if self.sequence_len_offsets[request_id] < len(request.prompt_tokens):
+            num_written_tokens = self.sequence_len_offsets[request_id]
+        else:
+            # The last sampled token is fed at the next step
+            num_written_tokens = len(self.sequence_tokens[request_id]) - 1
+        num_written_blocks = self.kv_block_allocator.get_num_blocks(num_written_tokens)
+
+        cached_blocks = set(node.block for node in self.prefix_cache_nodes[request_id])
+        block_indices = [idx for idx, block in enumerate(block_table) if block not in cached_blocks]
+        swapped_block_indices = [idx for idx in block_indices if idx < num_written_blocks]
+        swapped_key_value_dict = self.inference_wrapped_model.inference_params.swap_out_blocks(
+            [block_table[idx] for idx in swapped_block_indices]
+        )
+        self.kv_block_allocator.free([block_table[idx] for idx in block_indices])
+        self.swapped_requests[request_id] = SwappedRequest(
+            block_table=block_table,
+            block_indices=block_indices,
+            swapped_block_indices=swapped_block_indices,
+            swapped_key_value_dict=swapped_key_value_dict,
+        )
+
+    def _swap_in_dynamic_batch_request(self, request_id: str, request: InferenceRequest) -> bool:
+        """Swap the key-value memory of a preempted request back in, if enough blocks are free
+
+        The unused blocks of the prefix cache are evicted as needed. The request then goes on generating, or prefilling its prompt, see swap_out_dynamic_batch_request.
+
+        Args:
+            request_id (str): The id of the request
+            request (InferenceRequest): The request
+
+        Returns:
+            bool: Whether the request was swapped in
+        """
+        swapped_request = self.swapped_requests[request_id]
+        num_blocks = len(swapped_request.block_indices)
+        num_missing_blocks = num_blocks - self.kv_block_allocator.get_num_free_blocks()
+        if self.prefix_cache is not None and num_missing_blocks > 0:
+            self.prefix_cache.evict(num_missing_blocks)
+        if num_blocks > self.kv_block_allocator.get_num_free_blocks():
+            return False
+
+        del self.swapped_requests[request_id]
+        block_table = swapped_request.block_table
+        for idx, block in zip(
+            swapped_request.block_indices, self.kv_block_allocator.allocate(num_blocks)
+        ):
+            block_table[idx] = block
+        self.inference_wrapped_model.inference_params.swap_in_blocks(
+            [block_table[idx] for idx in swapped_request.swapped_block_indices],
+            swapped_request.swapped_key_value_dict,
+        )
+        self.block_tables[request_id] = block_table
+        if self.sequence_len_offsets[request_id] >= len(request.prompt_tokens):
+            request.status = Status.ACTIVE_AND_GENERATING_TOKENS
+        return True
+
+    def _get_model_device(self) -> torch.device:
+        """Get the device of the model parameters, on which to build the dynamic batch tensors
+
+        Returns:
+            torch.device: The device of the model
+        """
+        return next(self.inference_wrapped_model.model.parameters()).device
+
+    def _run_dynamic_batch_forward_step(
+        self,
+        requests: OrderedDict[int, InferenceRequest],
+        tokens: List[List[int]],
+        sequence_len_offsets: List[int],
+        num_tokens: List[int],
+    ) -> torch.Tensor:
+        """Run one forward step of a dynamic batch
+
+        Args:
+            requests (OrderedDict[int, InferenceRequest]): The requests of the batch
+            tokens (List[List[int]]): The tokens of each request to feed, padded to the longest
+            sequence_len_offsets (List[int]): The position of the first token of each request
+            num_tokens (List[int]): The number of tokens of each request, without the padding
+
+        Returns:
+            torch.Tensor: The logits of the last token of each request, of shape [batch_size, vocab_size]
+        """
+        max_num_tokens = max(num_tokens)
+        tokens = [
+            request_tokens + [self.tokenizer.eod] * (max_num_tokens - len(request_tokens))
+            for request_tokens in tokens
+        ]
+        device = self._get_model_device()
+        batch_tokens = torch.tensor(tokens, dtype=torch.long, device=device)
+        # The block tables cover the positions up to the end of the longest request
+        sequence_lengths = [
+            offset + request_num_tokens
+            for offset, request_num_tokens in zip(sequence_len_offsets, num_tokens)
+        ]
+        num_blocks = self.kv_block_allocator.get_num_blocks(max(sequence_lengths))
+        block_tables = [
+            (self.block_tables[request_id] + [0] * num_blocks)[:num_blocks]
+            for request_id in requests
+        ]
+        block_tables = torch.tensor(block_tables, dtype=torch.long, device=device)
+        sequence_len_offsets = torch.tensor(sequence_len_offsets, dtype=torch.long, device=device)
+        sequence_lengths = torch.tensor(sequence_lengths, dtype=torch.long, device=device)
+
+        inference_input = self.inference_wrapped_model.get_batch_for_dynamic_batch(
+            batch_tokens, block_tables, sequence_len_offsets, sequence_lengths
+        )
+        logits = self.inference_wrapped_model.run_one_forward_step(inference_input)
+        if self.model_is_pipeline_parallel:
+            logits = broadcast_from_last_pipeline_stage(
+                [len(requests), max_num_tokens, self.tokenizer.vocab_size],
+                dtype=torch.float32,
+                tensor=logits,
+            )
+
+        last_token_indices = torch.tensor(num_tokens, dtype=torch.long, device=logits.device) - 1
+        return logits[torch.arange(len(requests), device=logits.device), last_token_indices]
+
+    def _update_dynamic_batch(
+        self, requests: OrderedDict[int, InferenceRequest], last_token_logits: torch.Tensor
+    ):
+        """Sample the next token of each request of a dynamic batch and complete the finished ones
+
+        A request completes when it samples the end of document token, which is not part of its generated tokens, or when it has generated num_tokens_to_generate tokens. Its key-value memory blocks are then released.
+
+        Args:
+            requests (OrderedDict[int, InferenceRequest]): The requests of the batch
+            last_token_logits (torch.Tensor): The logits of the last token of each request, of shape [batch_size, vocab_size]
+        """
+        # The requests may each have their own inference parameters
+        groups = {}
+        for idx, request in enumerate(requests.values()):
+            parameters = request.inference_parameters
+            groups.setdefault(id(parameters), (parameters, []))[1].append(idx)
+        sampled_tokens = torch.empty(
+            len(requests), dtype=torch.long, device=last_token_logits.device
+        )
+        for common_inference_params, indices in groups.values():
+            indices = torch.tensor(indices, dtype=torch.long, device=last_token_logits.device)
+            sampled_tokens[indices] = self.sample_from_logits(
+                last_token_logits[indices], common_inference_params, self.tokenizer.vocab_size
+            ).long()
+
+        log_probs = None
+        if any(request.inference_parameters.return_log_probs for request in requests.values()):
+            log_probs = torch.gather(
+                F.log_softmax(last_token_logits, dim=1), 1, sampled_tokens.unsqueeze(1)
+            ).squeeze(1)
+            log_probs = log_probs.tolist()
+
+        for idx, (request_id, request) in enumerate(requests.items()):
+            token = int(sampled_tokens[idx])
+            reached_eod = token == self.tokenizer.eod
+            if not reached_eod:
+                self.sequence_tokens[request_id].append(token)
+                if log_probs is not None:
+                    self.generated_log_probs[request_id].append(log_probs[idx])
+            generated_length = len(self.sequence_tokens[request_id]) - len(request.prompt_tokens)
+            if reached_eod or (
+                generated_length >= request.inference_parameters.num_tokens_to_generate
+            ):
+                self._complete_dynamic_batch_request(request_id, request, generated_length)
+
+    def _complete_dynamic_batch_request(
+        self, request_id: str, request: InferenceRequest, generated_length: int
+    ):
+        """Complete a request of a dynamic batch and release its key-value memory blocks
+
+        Args:
+            request_id (str): The id of the request
+            request (InferenceRequest): The request
+            generated_length (int): The number of tokens generated for the request
+        """
+        sequence_tokens = self.sequence_tokens.pop(request_id)
+        generated_log_probs = self.generated_log_probs.pop(request_id)
+        # The cached blocks stay in the prefix cache for the next requests
+        nodes = self.prefix_cache_nodes.pop(request_id)
+        if self.prefix_cache is not None:
+            self.prefix_cache.release(nodes)
+        cached_blocks = set(node.block for node in nodes)
+        self.kv_block_allocator.free(
+            [block for block in self.block_tables.pop(request_id) if block not in cached_blocks]
+        )
+        self.sequence_len_offsets.pop(request_id)
+
+        request.generated_length = generated_length
+        request.generated_tokens = torch.tensor(
+            sequence_tokens[len(sequence_tokens) - generated_length :],
+            dtype=torch.long,
+            device=self._get_model_device(),
+        )
+        request.generated_log_probs = (
+            torch.tensor(generated_log_probs)
+            if request.inference_parameters.return_log_probs
+            else None
+        )
+        request.status = Status.COMPLETED
+        request.generated_text = self.detokenize_generations(request.generated_tokens)
 
     def generate_all_output_tokens_static_batch(
         self,
@@ -1,4 +1,7 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import bisect
+
+
 class Counter:
     """A simple counter class
 
@@ -15,3 +18,37 @@ class Counter:
 
     def reset(self) -> None:
         self.counter = 0
+
+
+class LatencyHistogram:
+    """A histogram of latencies, with exponentially growing buckets
+
+    The bucket i counts the latencies up to min_latency * growth_factor ** i seconds, and above the bound of bucket i - 1. The last bucket counts the latencies above all the bounds.
+    """
+
+    def __init__(
+        self, min_latency: float = 1e-3, growth_factor: float = 2.0, num_buckets: int = 24
+    ) -> None:
+        self.bounds = [min_latency * growth_factor**i for i in range(num_buckets)]
+        self.reset()
+
+    def add(self, latency: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.num_latencies += 1
+        self.max_latency = max(self.max_latency, latency)
+
+    def get_percentile(self, percentile: float) -> float:
+        """Get the upper bound of the bucket of a percentile of the latencies, capped by the
+        largest latency, or 0.0 if there is no latency"""
+        rank = percentile / 100 * self.num_latencies
+        num_latencies = 0
+        for bound, count in zip(self.bounds, self.counts):
+            num_latencies += count
+            if count > 0 and num_latencies >= rank:
+                return min(bound, self.max_latency)
+        return self.max_latency
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.num_latencies = 0
+        self.max_latency = 0.0
@@ -1,14 +1,74 @@
 # Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+import torch
+
+
 class InferenceParams:
     """Inference parameters that are passed to the main model in order
     to efficienly calculate and store the context during inference."""
 
-    def __init__(self, max_batch_size, max_sequence_length):
+    def __init__(self, max_batch_size, max_sequence_length, kv_block_size=None, num_kv_blocks=None):
         self.max_sequence_length = max_sequence_length
         self.max_batch_size = max_batch_size
         self.sequence_len_offset = 0
         self.batch_size_offset = 0
         self.key_value_memory_dict = {}
+        # For a paged key-value memory, a pool of num_kv_blocks blocks of kv_block_size tokens
+        self.kv_block_size = kv_block_size
+        self.num_kv_blocks = num_kv_blocks
+        # For dynamic batches, where each sequence has its own blocks and offset
+        self.batch_block_tables = None
+        self.batch_sequence_len_offsets = None
+        self.batch_sequence_lengths = None
+        self.batch_sequence_end = 0
+
+    def set_dynamic_batch(
+        self,
+        batch_block_tables,
+        batch_sequence_len_offsets,
+        batch_sequence_lengths,
+        batch_sequence_end,
+    ):
+        """Set the block table, the sequence offset and the sequence length after the forward pass
+        of each sequence of the next forward pass, so that sequences of different lengths can be
+        batched in a paged key-value memory. The tokens past the length of a sequence are padding,
+        whose keys and values are written to block 0. The block tables are padded with block 0,
+        and cover the positions up to batch_sequence_end, the end of the longest sequence, up to
+        which the keys and values are read. The attention mask must hide the positions past each
+        token of each sequence."""
+        assert self.kv_block_size is not None, "dynamic batches require a paged key-value memory"
+        self.batch_block_tables = batch_block_tables
+        self.batch_sequence_len_offsets = batch_sequence_len_offsets
+        self.batch_sequence_lengths = batch_sequence_lengths
+        self.batch_sequence_end = batch_sequence_end
+
+    def swap_out_blocks(self, blocks):
+        """Copy the keys and values of blocks of the paged key-value memory to host memory, so
+        that the blocks can be freed and given to other sequences, see swap_in_blocks. Returns
+        the copies, per layer."""
+        assert self.kv_block_size is not None, "only a paged key-value memory can be swapped"
+        swapped_key_value_dict = {}
+        for layer_number, (
+            inference_key_memory,
+            inference_value_memory,
+        ) in self.key_value_memory_dict.items():
+            index = torch.tensor(blocks, dtype=torch.long, device=inference_key_memory.device)
+            swapped_key_value_dict[layer_number] = (
+                inference_key_memory.index_select(1, index).cpu(),
+                inference_value_memory.index_select(1, index).cpu(),
+            )
+        return swapped_key_value_dict
+
+    def swap_in_blocks(self, blocks, swapped_key_value_dict):
+        """Copy the keys and values swapped out by swap_out_blocks back to blocks of the paged
+        key-value memory, which need not be the blocks they were swapped out from"""
+        for layer_number, (
+            inference_key_memory,
+            inference_value_memory,
+        ) in self.key_value_memory_dict.items():
+            swapped_key, swapped_value = swapped_key_value_dict[layer_number]
+            index = torch.tensor(blocks, dtype=torch.long, device=inference_key_memory.device)
+            inference_key_memory[:, index] = swapped_key.to(inference_key_memory.device)
+            inference_value_memory[:, index] = swapped_value.to(inference_value_memory.device)
 
     def swap_key_value_dict(self, batch_idx):
         "swap between batches"
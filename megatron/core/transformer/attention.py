@@ -193,12 +193,21 @@ class Attention(MegatronModule, ABC):
         if self.layer_number not in inference_params.key_value_memory_dict:
             inf_max_seq_length = inference_params.max_sequence_length
             inf_max_batch_size = inference_params.max_batch_size
+            if inference_params.kv_block_size is not None:
+                # A paged memory holds blocks as a dense memory holds sequences
+                inf_max_seq_length = inference_params.kv_block_size
+                inf_max_batch_size = inference_params.num_kv_blocks
             inference_key_memory = self._allocate_memory(
                 inf_max_seq_length, inf_max_batch_size, key.dtype
             )
             inference_value_memory = self._allocate_memory(
                 inf_max_seq_length, inf_max_batch_size, value.dtype
             )
+            if inference_params.kv_block_size is not None:
+                # The sequences of a dynamic batch read the memory up to the end of the longest
+                # one, and a masked position of NaN would still turn their attention to NaN
+                inference_key_memory.zero_()
+                inference_value_memory.zero_()
             inference_params.key_value_memory_dict[self.layer_number] = (
                 inference_key_memory,
                 inference_value_memory,
@@ -213,6 +222,17 @@ class Attention(MegatronModule, ABC):
 
         batch_start = inference_params.batch_size_offset
         batch_end = batch_start + key.size(1)
+        if inference_params.batch_block_tables is not None:
+            return self._adjust_key_value_for_dynamic_batch(
+                inference_params,
+                inference_key_memory,
+                inference_value_memory,
+                key,
+                value,
+                rotary_pos_emb,
+                batch_start,
+                batch_end,
+            )
         assert batch_end <= inference_key_memory.size(1)
         sequence_start = inference_params.sequence_len_offset
         sequence_end = sequence_start + key.size(0)
@@ -245,6 +265,66 @@ class Attention(MegatronModule, ABC):
 
         return key, value, rotary_pos_emb, attn_mask_type
 
+    def _adjust_key_value_for_dynamic_batch(
+        self,
+        inference_params,
+        inference_key_memory,
+        inference_value_memory,
+        key,
+        value,
+        rotary_pos_emb,
+        batch_start,
+        batch_end,
+    ):
+        """
+        Saves the generated key and value tensors of each sequence of a dynamic batch at its
+        offset in its blocks of the paged memory, see InferenceParams.set_dynamic_batch. Returns
+        the keys and values of each sequence up to the end of the longest one, and the
+        rotary_pos_emb of the position of each query.
+
+        Returns a tuple: (key, value, rotary_pos_emb, attn_mask_type)
+
+        """
+        block_tables = inference_params.batch_block_tables[batch_start:batch_end]
+        sequence_len_offsets = inference_params.batch_sequence_len_offsets[batch_start:batch_end]
+        sequence_lengths = inference_params.batch_sequence_lengths[batch_start:batch_end]
+        sequence_end = inference_params.batch_sequence_end
+        block_size = inference_params.kv_block_size
+
+        # The position of each token of each sequence, [sq, b]
+        positions = sequence_len_offsets.unsqueeze(0) + torch.arange(
+            key.size(0), device=key.device
+        ).unsqueeze(1)
+        # The padding tokens take the last position of their sequence, and write to block 0
+        is_padding = positions >= sequence_lengths.unsqueeze(0)
+        positions = torch.minimum(positions, sequence_lengths.unsqueeze(0) - 1)
+        # The memory is [block_size, num_blocks, ng, hn]
+        blocks = block_tables.gather(1, (positions // block_size).t()).t()
+        blocks = blocks.masked_fill(is_padding, 0)
+        inference_key_memory[positions % block_size, blocks] = key
+        inference_value_memory[positions % block_size, blocks] = value
+
+        # [block_size, b, num_blocks_per_sequence, ng, hn] -> [sequence_end, b, ng, hn]
+        key, value = [
+            memory[:, block_tables]
+            .permute(2, 0, 1, 3, 4)
+            .reshape(-1, block_tables.size(0), *memory.shape[2:])[:sequence_end]
+            for memory in (inference_key_memory, inference_value_memory)
+        ]
+
+        if rotary_pos_emb is not None:
+            assert not self.config.apply_rope_fusion, "dynamic batches require unfused RoPE"
+            q_pos_emb, k_pos_emb = rotary_pos_emb
+            # [max_seq_len, 1, 1, dim] -> [sq, b, 1, dim]
+            q_pos_emb = q_pos_emb[:, 0][positions]
+            k_pos_emb = k_pos_emb[:sequence_end, :, :, :]
+            rotary_pos_emb = (q_pos_emb, k_pos_emb)
+
+        # The attention mask is the only mask, as the sequences are at different positions. It is
+        # [b, 1, sq, skv], per query, which only the local DotProductAttention supports, see
+        # AbstractModelInferenceWrapper.prep_model_for_dynamic_inference
+        return key, value, rotary_pos_emb, AttnMaskType.padding
+
     @abstractmethod
     def get_query_key_value_tensors(self, hidden_states, key_value_states):
         """
@@ -3,11 +3,16 @@
 """Dataloaders."""
 
 
+import queue
 import random
+import time
 import torch
 import numpy as np
+from torch._utils import ExceptionWrapper
 from torch.utils.data import Dataset
+from torch.utils.data._utils.collate import default_collate
 from megatron.training import get_args
+from megatron.training.utils import print_rank_0
 from megatron.core import mpu
 
 
@@ -18,6 +23,12 @@ def build_pretraining_data_loader(dataset, consumed_samples):
         return None
     args = get_args()
 
+    # Compact blending indices redraw a whole block of samples on access out of the cached blocks
+    if args.dataloader_type == 'cyclic' and getattr(dataset, 'compact', False):
+        print_rank_0('WARNING: the random sampler of --dataloader-type cyclic accesses nearly '
+                     'every sample of the compact blending indices in another block, each '
+                     'redrawn on access, use --dataloader-type single instead')
+
     # Megatron sampler
     if args.dataloader_type == 'single':
         batch_sampler = MegatronPretrainingSampler(
@@ -26,6 +37,15 @@ def build_pretraining_data_loader(dataset, consumed_samples):
             micro_batch_size=args.micro_batch_size,
             data_parallel_rank=mpu.get_data_parallel_rank(),
             data_parallel_size=mpu.get_data_parallel_world_size())
+    elif args.dataloader_type == 'cyclic' and args.reshardable_sampler:
+        batch_sampler = MegatronPretrainingReshardableSampler(
+            dataset,
+            total_samples=len(dataset),
+            consumed_samples=consumed_samples,
+            micro_batch_size=args.micro_batch_size,
+            data_parallel_rank=mpu.get_data_parallel_rank(),
+            data_parallel_size=mpu.get_data_parallel_world_size(),
+            seed=args.seed)
     elif args.dataloader_type == 'cyclic':
         batch_sampler = MegatronPretrainingRandomSampler(
             dataset,
@@ -43,6 +63,15 @@ def build_pretraining_data_loader(dataset, consumed_samples):
         raise Exception('{} dataloader type is not supported.'.format(
                 args.dataloader_type))
 
+    # Megatron prefetching dataloader.
+    if args.prefetch_data_loader:
+        return MegatronPrefetchingDataLoader(dataset,
+                                             batch_sampler,
+                                             consumed_samples,
+                                             num_workers=args.num_workers,
+                                             prefetch_depth=args.prefetch_depth,
+                                             cyclic=args.dataloader_type == 'cyclic')
+
     # Torch dataloader.
     return torch.utils.data.DataLoader(dataset,
                                        batch_sampler=batch_sampler,
@@ -190,3 +219,334 @@ class MegatronPretrainingRandomSampler:
                 self.consumed_samples += self.micro_batch_times_data_parallel_size
                 yield batch
                 batch = []
+
+
+def _splitmix64(x):
+    """Mix the bits of an array of uint64, see https://prng.di.unimi.it/splitmix64.c"""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class MegatronPretrainingReshardableSampler:
+    """Random sampler whose global order of samples does not depend on the data parallel size.
+
+    The samples are drawn from one infinite global sequence, in which each epoch is a random
+    permutation of the dataset, and data parallel rank r takes the micro-batch at global position
+    consumed_samples + r * micro_batch_size. As the global batches are consecutive slices of the
+    global sequence, a job restarted from its consumed_samples with a different data parallel size
+    neither repeats nor skips samples. Epochs are not padded or truncated to whole batches, so a
+    batch may span two epochs.
+
+    The permutations are Feistel networks over the sample indices, with cycle walking, so that the
+    sample at any global position is computed in O(1) time and memory.
+    """
+
+    _NUM_ROUNDS = 4
+
+    def __init__(self, dataset, total_samples, consumed_samples, micro_batch_size,
+                 data_parallel_rank, data_parallel_size, seed=0):
+        # Keep a copy of input params for later use.
+        self.dataset = dataset
+        self.total_samples = total_samples
+        self.consumed_samples = consumed_samples
+        self.micro_batch_size = micro_batch_size
+        self.data_parallel_rank = data_parallel_rank
+        self.data_parallel_size = data_parallel_size
+        self.seed = seed
+        self.micro_batch_times_data_parallel_size = \
+            self.micro_batch_size * data_parallel_size
+
+        # Sanity checks.
+        assert self.total_samples > 0, \
+            'no sample to consume: {}'.format(self.total_samples)
+        assert self.micro_batch_size > 0
+        assert data_parallel_size > 0
+        assert self.data_parallel_rank < data_parallel_size, \
+            'data_parallel_rank should be smaller than data size: {}, ' \
+            '{}'.format(self.data_parallel_rank, data_parallel_size)
+
+        # The permutations are over the smallest domain of 2^(2 * half_bits) >= total_samples
+        self.half_bits = max(1, (int(self.total_samples - 1).bit_length() + 1) // 2)
+        self.half_mask = np.uint64((1 << self.half_bits) - 1)
+
+    def __len__(self):
+        return self.total_samples
+
+    def get_global_indices(self, position, count):
+        """Return the sample indices at the global positions [position, position + count)."""
+        positions = np.arange(position, position + count, dtype=np.uint64)
+        epochs = positions // np.uint64(self.total_samples)
+        indices = positions % np.uint64(self.total_samples)
+        for epoch in np.unique(epochs):
+            in_epoch = epochs == epoch
+            indices[in_epoch] = self._permute(indices[in_epoch], epoch)
+        return indices.astype(np.int64)
+
+    def _permute(self, indices, epoch):
+        epoch_key = _splitmix64(_splitmix64(np.array([self.seed], dtype=np.uint64))
+                                ^ np.uint64(epoch))
+        keys = _splitmix64(epoch_key + np.arange(self._NUM_ROUNDS, dtype=np.uint64))
+        # Cycle walking: permute again the indices which fall out of the dataset
+        walking = np.ones(len(indices), dtype=bool)
+        while walking.any():
+            left = indices[walking] >> np.uint64(self.half_bits)
+            right = indices[walking] & self.half_mask
+            for key in keys:
+                left, right = right, left ^ (_splitmix64(right ^ key) & self.half_mask)
+            indices[walking] = (left << np.uint64(self.half_bits)) | right
+            walking = indices >= np.uint64(self.total_samples)
+        return indices
+
+    def __iter__(self):
+        while True:
+            position = self.consumed_samples + self.data_parallel_rank * self.micro_batch_size
+            indices = self.get_global_indices(position, self.micro_batch_size)
+            if isinstance(self.dataset, RandomSeedDataset):
+                self.dataset.set_epoch(position // self.total_samples)
+            self.consumed_samples += self.micro_batch_times_data_parallel_size
+            yield indices.tolist()
+
+
+def _prefetching_worker_loop(dataset, task_queue, result_queue):
+    """Assemble micro-batches into the ring buffer slots, as dispatched by the main process."""
+    torch.set_num_threads(1)
+    slots = None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        if task[0] == 'slots':
+            slots = task[1]
+            continue
+        step, slot, indices, seed = task
+        if seed is not None:
+            dataset.curr_seed = seed
+        try:
+            if slot is None:
+                # The layout of the ring buffer is not known yet
+                result = default_collate([dataset[idx] for idx in indices])
+            else:
+                _assemble_batch(slots[slot], dataset, indices)
+                result = None
+        except Exception:
+            result = ExceptionWrapper(where='in prefetching data loader worker')
+        result_queue.put((step, slot, result))
+
+
+def _assemble_batch(batch, dataset, indices):
+    """Write the samples straight into the rows of a batch, with no collation copy."""
+    for row, idx in enumerate(indices):
+        sample = dataset[idx]
+        assert sample.keys() == batch.keys(), \
+            'sample keys do not match the batch: {}, {}'.format(
+                sorted(sample.keys()), sorted(batch.keys()))
+        for key, value in sample.items():
+            batch[key][row].copy_(torch.as_tensor(value))
+
+
+class MegatronPrefetchingDataLoader:
+    """Data loader which assembles whole micro-batches in worker processes.
+
+    The workers write the samples of each micro-batch into one slot of a ring buffer of shared
+    memory tensors, page-locked when CUDA is available, and the training loop receives the slot
+    with no collation copy. The tensors of a batch are therefore only valid until the next batch
+    is requested, after which their slot is reused. The samples must be dicts whose values have
+    the same shape in every sample.
+
+    Unlike the samplers, which run ahead of the training loop by the prefetch depth, the
+    consumed_samples cursor only counts the samples of the batches handed to the training loop,
+    so it can be used to restart exactly where training stopped.
+    """
+
+    def __init__(self, dataset, batch_sampler, consumed_samples, num_workers,
+                 prefetch_depth, cyclic=False):
+        assert prefetch_depth >= 2, \
+            'prefetch depth should be at least 2: {}'.format(prefetch_depth)
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.consumed_samples = consumed_samples
+        self.num_workers = num_workers
+        self.prefetch_depth = prefetch_depth if num_workers > 0 else 1
+        self.cyclic = cyclic
+        self.pin_memory = torch.cuda.is_available()
+        self.micro_batch_times_data_parallel_size = \
+            batch_sampler.micro_batch_times_data_parallel_size
+
+        self.slots = None
+        self.workers = []
+        self.task_queues = []
+        self.result_queue = None
+        self.sampler_iterator = None
+        self.reset_metrics()
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        if self.slots is not None and self.sampler_iterator is None:
+            # A new pass over the data, e.g. when cycling over it
+            self.sampler_iterator = iter(self.batch_sampler)
+        return self
+
+    def __next__(self):
+        t_beg = time.time()
+        if self.slots is None:
+            batch = self._start()
+        else:
+            # The training loop is done with the previous batch
+            if self.current_slot is not None:
+                self._release(self.current_slot)
+                self.current_slot = None
+            self._dispatch()
+            if self.next_step == self.dispatched_steps:
+                raise StopIteration
+            self.queue_depth_sum += len(self.ready)
+            while self.next_step not in self.ready:
+                self._receive()
+            self.current_slot = self.ready.pop(self.next_step)
+            self.next_step += 1
+            batch = self.slots[self.current_slot]
+        self.wait_time += time.time() - t_beg
+        self.num_batches += 1
+        self.consumed_samples += self.micro_batch_times_data_parallel_size
+        return batch
+
+    def get_metrics(self, reset=True):
+        """Return the time spent waiting for batches and the number of batches ready ahead of
+        each request, since the last reset.
+        """
+        metrics = {
+            'batches': self.num_batches,
+            'wait-time': self.wait_time,
+            'queue-depth': self.queue_depth_sum / max(1, self.num_batches),
+        }
+        if reset:
+            self.reset_metrics()
+        return metrics
+
+    def reset_metrics(self):
+        self.num_batches = 0
+        self.wait_time = 0.0
+        self.queue_depth_sum = 0
+
+    def _start(self):
+        """Start the workers and build the ring buffer from the layout of the first batch."""
+        self.sampler_iterator = iter(self.batch_sampler)
+        indices = next(self.sampler_iterator)
+        if self.num_workers > 0:
+            context = torch.multiprocessing.get_context()
+            self.result_queue = context.Queue()
+            for _ in range(self.num_workers):
+                task_queue = context.Queue()
+                worker = context.Process(target=_prefetching_worker_loop,
+                                         args=(self.dataset, task_queue, self.result_queue),
+                                         daemon=True)
+                worker.start()
+                self.workers.append(worker)
+                self.task_queues.append(task_queue)
+            self.task_queues[0].put((0, None, indices, self._get_seed()))
+            first_batch = self._get_result()[2]
+        else:
+            first_batch = default_collate([self.dataset[idx] for idx in indices])
+        assert isinstance(first_batch, dict), \
+            'samples should be dicts: {}'.format(type(first_batch))
+
+        self.slots = []
+        for _ in range(self.prefetch_depth):
+            slot = {}
+            for key, value in first_batch.items():
+                slot[key] = torch.empty_like(torch.as_tensor(value)).share_memory_()
+                if self.pin_memory:
+                    torch.cuda.cudart().cudaHostRegister(
+                        slot[key].data_ptr(), slot[key].numel() * slot[key].element_size(), 0)
+            self.slots.append(slot)
+        for task_queue in self.task_queues:
+            task_queue.put(('slots', self.slots))
+
+        self.ready = {}
+        self.release_events = {}
+        self.free_slots = list(range(1, self.prefetch_depth))
+        self.current_slot = 0
+        self.next_step = self.dispatched_steps = 1
+        for key, value in first_batch.items():
+            self.slots[0][key].copy_(torch.as_tensor(value))
+        self._dispatch()
+        return self.slots[0]
+
+    def _dispatch(self):
+        """Dispatch the next micro-batches to the free slots, in a round-robin over the workers."""
+        while self.free_slots and self.sampler_iterator is not None:
+            try:
+                indices = next(self.sampler_iterator)
+            except StopIteration:
+                if not self.cyclic:
+                    self.sampler_iterator = None
+                    return
+                self.sampler_iterator = iter(self.batch_sampler)
+                continue
+            slot = self.free_slots.pop(0)
+            if slot in self.release_events:
+                # Wait for the copies of the training loop out of the slot
+                self.release_events.pop(slot).synchronize()
+            step = self.dispatched_steps
+            self.dispatched_steps += 1
+            if self.num_workers > 0:
+                self.task_queues[step % self.num_workers].put(
+                    (step, slot, indices, self._get_seed()))
+            else:
+                _assemble_batch(self.slots[slot], self.dataset, indices)
+                self.ready[step] = slot
+
+    def _get_seed(self):
+        # The workers hold a copy of the dataset, which misses the epochs set by the sampler
+        if isinstance(self.dataset, RandomSeedDataset):
+            return self.dataset.curr_seed
+        return None
+
+    def _release(self, slot):
+        if self.pin_memory:
+            # The copies out of a pinned slot may still be in flight
+            self.release_events[slot] = torch.cuda.Event()
+            self.release_events[slot].record()
+        self.free_slots.append(slot)
+
+    def _receive(self):
+        step, slot, _ = self._get_result()
+        self.ready[step] = slot
+
+    def _get_result(self):
+        while True:
+            try:
+                step, slot, result = self.result_queue.get(timeout=5.0)
+                break
+            except queue.Empty:
+                dead_workers = [worker.pid for worker in self.workers if not worker.is_alive()]
+                if dead_workers:
+                    raise RuntimeError(
+                        'prefetching data loader workers exited unexpectedly: {}'.format(
+                            dead_workers))
+        if isinstance(result, ExceptionWrapper):
+            result.reraise()
+        return step, slot, result
+
+    def shutdown(self):
+        """Stop the workers and unregister the ring buffer."""
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.task_queues = []
+        if self.pin_memory and self.slots is not None:
+            for slot in self.slots:
+                for tensor in slot.values():
+                    torch.cuda.cudart().cudaHostUnregister(tensor.data_ptr())
+        self.slots = None
+
+    def __del__(self):
+        if hasattr(self, 'slots'):
+            self.shutdown()
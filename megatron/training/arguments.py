@@ -324,6 +324,7 @@ def validate_args(args, defaults={}):
 
     # data
     assert args.num_dataset_builder_threads > 0
+    assert args.num_dataset_builder_ranks > 0
 
     # Consumed tokens.
     args.consumed_train_samples = 0
@@ -1163,6 +1164,10 @@ def _add_training_args(parser):
     group.add_argument('--dataloader-type', type=str, default=None,
                        choices=['single', 'cyclic', 'external'],
                        help='Single pass vs multiple pass data loader')
+    group.add_argument('--reshardable-sampler', action='store_true',
+                       help='With the cyclic data loader, shuffle the samples in a global '
+                       'order which does not depend on the data parallel size, so that '
+                       'a job can be restarted with another data parallel size.')
     group.add_argument('--no-async-tensor-model-parallel-allreduce',
                        action='store_false',
                        help='DEPRECATED. This flag is ignored.',
@@ -1536,11 +1541,40 @@ def _add_data_args(parser):
     group.add_argument('--test-data-path', nargs='*', default=None,
                        help='The weight and prefix list for an independent test dataset. '
                        'Follows the same pattern rules as --data-path.')
+    group.add_argument('--blend-schedule', nargs='*', default=None,
+                       help='A piecewise-linear schedule of the train blend weights over the '
+                       'train samples, as a list of breakpoints sample:weight1,weight2,... '
+                       'e.g. 0:0.7,0.3 1000000:0.5,0.5. Changing the schedule on restart only '
+                       'rebuilds the cached blending indices from the consumed samples on.')
+    group.add_argument('--blend-block-size', type=int, default=1 << 16,
+                       help='Number of samples per block of the blending indices built with '
+                       '--blend-schedule or --compact-blending-indices.')
+    group.add_argument('--compact-blending-indices', action='store_true',
+                       help='Cache the blending indices as per-block sample counts and redraw '
+                       'the samples of a block on access, for blends of very many samples. '
+                       'Needs mostly in-order access, i.e. --dataloader-type single.')
+    group.add_argument('--compact-blending-cache-size', type=int, default=8,
+                       help='Number of blocks of --compact-blending-indices drawn on access '
+                       'to keep in memory.')
     group.add_argument('--data-cache-path', default=None,
                        help='Path to a directory to hold cached index files.')
     group.add_argument('--no-mmap-bin-files', action='store_false',
                        help='Disable mmap-ing of .bin files.',
                        dest='mmap_bin_files')
+    group.add_argument('--fused-index-build', action='store_true',
+                       help='Build the GPT dataset document, sample, and shuffle indices '
+                       'with a single multithreaded C++ routine which writes them straight '
+                       'to the cache. Documents are shuffled per epoch rather than across '
+                       'all epochs.')
+    group.add_argument('--lazy-index', action='store_true',
+                       help='Compute the GPT dataset sample bounds and shuffle mapping on '
+                       'demand rather than build and cache the dataset indices. Documents '
+                       'and samples are shuffled per epoch.')
+    group.add_argument('--bin-packing-window', type=int, default=0,
+                       help='Pack whole documents into GPT dataset samples with the best-fit '
+                       'decreasing heuristic, within windows of this many consecutive '
+                       'documents, rather than cut the concatenated documents into samples. '
+                       'Samples are padded as necessary. Disabled when 0.')
     group.add_argument('--mock-data', action='store_true',
                        help='Skip data loading and validation and opt for artificial '
                        'generation of mock data when an implementation is available.')
@@ -1572,6 +1606,12 @@ def _add_data_args(parser):
                        help='Probability of producing a short sequence.')
     group.add_argument('--num-workers', type=int, default=2,
                        help="Dataloader number of workers.")
+    group.add_argument('--prefetch-data-loader', action='store_true',
+                       help='Assemble whole micro-batches in the dataloader workers, '
+                       'into a ring buffer of pinned shared memory batches.')
+    group.add_argument('--prefetch-depth', type=int, default=4,
+                       help='Number of micro-batches in the ring buffer of the '
+                       'prefetching dataloader.')
     group.add_argument('--tokenizer-type', type=str,
                        default=None,
                        choices=['BertWordPieceLowerCase',
@@ -1606,8 +1646,22 @@ def _add_data_args(parser):
                        dest='create_attention_mask_in_dataloader')
     group.add_argument('--num-dataset-builder-threads', type=int, default=1,
                        help='Number of parallel threads per rank for dataset builder')
+    group.add_argument('--num-dataset-builder-ranks', type=int, default=1,
+                       help='Number of ranks, counting up from rank 0, across which to spread '
+                       'the building of blended dataset indices on cache miss. Requires '
+                       '--data-cache-path to be on a filesystem shared by all ranks.')
     group.add_argument('--s3-cache-path', type=str, default=None,
                        help='Path to cache index files when using s3 dataloader')
+    group.add_argument('--s3-bin-chunk-cache-size', type=int, default=1,
+                       help='Number of .bin file chunks to hold in memory per dataset '
+                       'when using s3 dataloader')
+    group.add_argument('--s3-bin-prefetch-threads', type=int, default=0,
+                       help='Number of background threads per dataset which prefetch '
+                       '.bin file chunks when using s3 dataloader. 0 disables prefetching.')
+    group.add_argument('--s3-prefetch-samples', type=int, default=0,
+                       help='Number of upcoming samples of this rank, under the pretraining '
+                       'sampler, whose data to prefetch on each sample access when using s3 '
+                       'dataloader')
     return parser
 
 
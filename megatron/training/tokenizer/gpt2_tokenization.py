@@ -20,9 +20,11 @@ from __future__ import (absolute_import, division, print_function,
 
 import sys
 import json
+import heapq
 import logging
 import os
 import regex as re
+from collections import OrderedDict
 from io import open
 
 try:
@@ -49,6 +51,7 @@ PRETRAINED_VOCAB_POSITIONAL_EMBEDDINGS_SIZE_MAP = {
 VOCAB_NAME = 'vocab.json'
 MERGES_NAME = 'merges.txt'
 SPECIAL_TOKENS_NAME = 'special_tokens.txt'
+BPE_CACHE_SIZE = 2**16
 
 
 @lru_cache()
@@ -154,7 +157,7 @@ class GPT2Tokenizer(object):
         return tokenizer
 
     def __init__(self, vocab_file, merges_file, errors='replace',
-                 special_tokens=None, max_len=None):
+                 special_tokens=None, max_len=None, cache_size=BPE_CACHE_SIZE):
         self.max_len = max_len if max_len is not None else int(1e12)
         self.encoder = json.load(open(vocab_file))
         self.decoder = {v: k for k, v in self.encoder.items()}
@@ -164,7 +167,9 @@ class GPT2Tokenizer(object):
         bpe_data = open(merges_file, encoding='utf-8').read().split('\n')[1:-1]
         bpe_merges = [tuple(merge.split()) for merge in bpe_data]
         self.bpe_ranks = dict(zip(bpe_merges, range(len(bpe_merges))))
-        self.cache = {}
+        # Least recently used words first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
         # Should haved added re.IGNORECASE so BPE merges can happen for
         # capitalized versions of contractions
@@ -194,45 +199,68 @@ class GPT2Tokenizer(object):
 
     def bpe(self, token):
         if token in self.cache:
+            self.cache.move_to_end(token)
             return self.cache[token]
-        word = tuple(token)
-        pairs = get_pairs(word)
-
-        if not pairs:
+        if len(token) < 2:
             return token
 
-        while True:
-            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except BaseException:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-                    new_word.append(first + second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
+        word = ' '.join(self._merge(token))
         self.cache[token] = word
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
         return word
 
+    def _merge(self, token):
+        """ Apply the BPE merges to a word, each merge to all of its occurrences at once,
+            lowest rank first.
+            The symbols form a linked list and the candidate pairs a heap keyed by
+            (rank, position), so a word of n symbols takes O(n log n) rather than O(n^2).
+        """
+        bpe_ranks = self.bpe_ranks
+        symbols = list(token)
+        size = len(symbols)
+        prevs = list(range(-1, size - 1))
+        nexts = list(range(1, size + 1))
+        nexts[-1] = -1
+
+        heap = []
+        for i in range(size - 1):
+            rank = bpe_ranks.get((symbols[i], symbols[i + 1]))
+            if rank is not None:
+                heap.append((rank, i))
+        heapq.heapify(heap)
+
+        while heap:
+            # Merge every occurrence of the lowest ranked pair, left to right, before
+            # considering the pairs which the merges create
+            rank = heap[0][0]
+            merged = []
+            while heap and heap[0][0] == rank:
+                _, i = heapq.heappop(heap)
+                j = nexts[i]
+                if symbols[i] is None or j == -1:
+                    continue
+                if bpe_ranks.get((symbols[i], symbols[j])) != rank:
+                    continue
+                symbols[i] += symbols[j]
+                symbols[j] = None
+                nexts[i] = nexts[j]
+                if nexts[i] != -1:
+                    prevs[nexts[i]] = i
+                merged.append(i)
+
+            for i in merged:
+                if symbols[i] is None:
+                    continue
+                for left in (prevs[i], i):
+                    if left == -1 or nexts[left] == -1:
+                        continue
+                    pair_rank = bpe_ranks.get((symbols[left], symbols[nexts[left]]))
+                    if pair_rank is not None:
+                        heapq.heappush(heap, (pair_rank, left))
+
+        return [symbol for symbol in symbols if symbol is not None]
+
     def tokenize(self, text):
         """ Tokenize a string. """
         bpe_tokens = []
@@ -244,6 +272,24 @@ class GPT2Tokenizer(object):
             bpe_tokens.extend(bpe_token for bpe_token in self.bpe(token).split(' '))
         return bpe_tokens
 
+    def tokenize_batch(self, texts):
+        """ Tokenize a list of strings.
+            Each distinct word of the batch goes through the BPE merges once, even if the
+            word cache is too small to hold the words of the batch.
+        """
+        words = {}
+        batch_bpe_tokens = []
+        for text in texts:
+            bpe_tokens = []
+            for token in re.findall(self.pat, text):
+                word = words.get(token)
+                if word is None:
+                    encoded = ''.join(self.byte_encoder[b] for b in token.encode('utf-8'))
+                    word = words[token] = self.bpe(encoded).split(' ')
+                bpe_tokens.extend(word)
+            batch_bpe_tokens.append(bpe_tokens)
+        return batch_bpe_tokens
+
     def convert_tokens_to_ids(self, tokens):
         """ Converts a sequence of tokens into ids using the vocab. """
         ids = []
@@ -280,6 +326,9 @@ class GPT2Tokenizer(object):
     def encode(self, text):
         return self.convert_tokens_to_ids(self.tokenize(text))
 
+    def encode_batch(self, texts):
+        return [self.convert_tokens_to_ids(tokens) for tokens in self.tokenize_batch(texts)]
+
     def decode(self, tokens):
         text = ''.join([self.decoder[token] for token in tokens])
         text = bytearray([self.byte_decoder[c] for c in text]).decode('utf-8', errors=self.errors)
@@ -293,6 +293,9 @@ class _GPT2BPETokenizer(MegatronTokenizer):
     def tokenize(self, text):
         return self.tokenizer.encode(text)
 
+    def tokenize_batch(self, texts):
+        return self.tokenizer.encode_batch(texts)
+
     def detokenize(self, token_ids):
         return self.tokenizer.decode(token_ids)
 
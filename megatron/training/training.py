@@ -32,7 +32,10 @@ from megatron.training.initialize import initialize_megatron
 from megatron.training.initialize import write_args_to_tensorboard
 from megatron.training.initialize import set_jit_fusion_options
 from megatron.training.optimizer_param_scheduler import OptimizerParamScheduler
-from megatron.legacy.data.data_samplers import build_pretraining_data_loader
+from megatron.legacy.data.data_samplers import (
+    MegatronPrefetchingDataLoader,
+    build_pretraining_data_loader,
+)
 from megatron.core.transformer.moe.moe_utils import track_moe_metrics
 from megatron.core.pipeline_parallel import get_forward_backward_func
 from megatron.core.num_microbatches_calculator import (
@@ -983,6 +986,50 @@ def save_checkpoint_and_time(iteration, model, optimizer, opt_param_scheduler,
     timers('interval-time', log_level=0).start(barrier=True)
 
 
+def log_data_loader_metrics(data_iterator, iteration):
+    """Log the time spent waiting for data and the number of batches ready ahead of it.
+
+    Called on all ranks, as the metrics of the ranks which load data are reduced across all
+    ranks, and logged once by the last rank.
+    """
+    args = get_args()
+    writer = get_tensorboard_writer()
+
+    data_loaders = data_iterator if isinstance(data_iterator, list) else [data_iterator]
+    data_loaders = [data_loader for data_loader in data_loaders
+                    if isinstance(data_loader, MegatronPrefetchingDataLoader)]
+    # Summed: the wait time, the batches, the mean queue depth, and the number of data loaders.
+    # Maxed: the wait time per batch and the consumed samples.
+    sums = torch.zeros(4, dtype=torch.float64, device='cuda')
+    maxs = torch.zeros(2, dtype=torch.float64, device='cuda')
+    for data_loader in data_loaders:
+        metrics = data_loader.get_metrics(reset=True)
+        wait_time_per_batch = metrics['wait-time'] / max(1, metrics['batches'])
+        sums += torch.tensor([metrics['wait-time'], metrics['batches'],
+                              metrics['queue-depth'], 1], dtype=torch.float64, device='cuda')
+        maxs = torch.maximum(maxs, torch.tensor([wait_time_per_batch,
+                                                 data_loader.consumed_samples],
+                                                dtype=torch.float64, device='cuda'))
+    torch.distributed.all_reduce(sums)
+    torch.distributed.all_reduce(maxs, op=torch.distributed.ReduceOp.MAX)
+    wait_time, batches, queue_depth, num_data_loaders = sums.tolist()
+    max_wait_time_per_batch, consumed_samples = maxs.tolist()
+    if num_data_loaders == 0:
+        return
+
+    wait_time_per_batch = wait_time / max(1, batches)
+    queue_depth = queue_depth / num_data_loaders
+    print_rank_last(' data loader | iteration {:8d} | consumed samples: {:12d} | '
+                    'wait time per batch (ms) mean/max: {:.1f}/{:.1f} | '
+                    'queue depth: {:.1f} |'.format(
+                        iteration, int(consumed_samples), wait_time_per_batch * 1000.0,
+                        max_wait_time_per_batch * 1000.0, queue_depth))
+    if writer and args.log_timers_to_tensorboard:
+        writer.add_scalar('data-loader-wait-time', wait_time_per_batch, iteration)
+        writer.add_scalar('data-loader-max-wait-time', max_wait_time_per_batch, iteration)
+        writer.add_scalar('data-loader-queue-depth', queue_depth, iteration)
+
+
 def train(forward_step_func, model, optimizer, opt_param_scheduler,
           train_data_iterator, valid_data_iterator,
           process_non_loss_data_func, config, checkpointing_context):
@@ -1156,6 +1203,10 @@ def train(forward_step_func, model, optimizer, opt_param_scheduler,
             stimer.report(total_flops, args.log_interval)
             total_flops = 0.0
 
+        # Prefetching data loader, reduced over the ranks which load data
+        if iteration % args.log_interval == 0 and args.prefetch_data_loader:
+            log_data_loader_metrics(train_data_iterator, iteration)
+
         if args.check_weight_hash_across_dp_replicas_interval is not None and \
                 iteration % args.check_weight_hash_across_dp_replicas_interval == 0:
             if args.use_distributed_optimizer and args.overlap_param_gather:
@@ -1567,6 +1618,9 @@ def build_train_valid_test_data_iterators(
         if dataloader_type == "single":
             return iter(dataloader)
         elif dataloader_type == "cyclic":
+            if isinstance(dataloader, MegatronPrefetchingDataLoader):
+                # Cycles over the data itself, so that its metrics stay reachable.
+                return iter(dataloader)
             return iter(cyclic_iter(dataloader))
         elif dataloader_type == "external":
             # External dataloader is passed through. User is expected to define how to iterate.
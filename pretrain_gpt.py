@@ -13,7 +13,7 @@ from megatron.training import get_tokenizer
 from megatron.core import mpu
 from megatron.core.enums import ModelType
 from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
-from megatron.core.datasets.utils import get_blend_from_list
+from megatron.core.datasets.utils import get_blend_from_list, get_blend_schedule_from_list
 from megatron.core.datasets.gpt_dataset import GPTDatasetConfig
 from megatron.core.datasets.gpt_dataset import MockGPTDataset, GPTDataset
 import megatron.legacy.model
@@ -196,7 +196,13 @@ def core_gpt_dataset_config_from_args(args):
             get_blend_from_list(args.test_data_path)
         ],
         split=args.split,
+        blend_schedule=get_blend_schedule_from_list(args.blend_schedule),
+        blend_schedule_consumed_samples=args.consumed_train_samples,
+        blend_block_size=args.blend_block_size,
+        compact_blending_indices=args.compact_blending_indices,
+        compact_blending_cache_size=args.compact_blending_cache_size,
         num_dataset_builder_threads=args.num_dataset_builder_threads,
+        num_dataset_builder_ranks=args.num_dataset_builder_ranks,
         path_to_cache=args.data_cache_path,
         mmap_bin_files=args.mmap_bin_files,
         tokenizer=tokenizer,
@@ -204,7 +210,15 @@ def core_gpt_dataset_config_from_args(args):
         reset_attention_mask=args.reset_attention_mask,
         eod_mask_loss=args.eod_mask_loss,
         create_attention_mask=args.create_attention_mask_in_dataloader,
-        s3_cache_path = args.s3_cache_path
+        fused_index_build=args.fused_index_build,
+        lazy_index=args.lazy_index,
+        bin_packing_window=args.bin_packing_window,
+        s3_cache_path = args.s3_cache_path,
+        s3_bin_chunk_cache_size=args.s3_bin_chunk_cache_size,
+        s3_bin_prefetch_threads=args.s3_bin_prefetch_threads,
+        s3_prefetch_samples=args.s3_prefetch_samples,
+        s3_prefetch_micro_batch_size=args.micro_batch_size,
+        s3_prefetch_data_parallel_size=args.data_parallel_size,
     )
 
 
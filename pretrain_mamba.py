@@ -13,7 +13,7 @@ from megatron.core import mpu
 # from megatron.core import parallel_state
 from megatron.core.enums import ModelType
 from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
-from megatron.core.datasets.utils import get_blend_from_list
+from megatron.core.datasets.utils import get_blend_from_list, get_blend_schedule_from_list
 from megatron.core.datasets.gpt_dataset import GPTDatasetConfig
 from megatron.core.datasets.gpt_dataset import MockGPTDataset, GPTDataset
 from megatron.core.models.mamba import MambaModel
@@ -187,7 +187,13 @@ def core_gpt_dataset_config_from_args(args):
             get_blend_from_list(args.test_data_path)
         ],
         split=args.split,
+        blend_schedule=get_blend_schedule_from_list(args.blend_schedule),
+        blend_schedule_consumed_samples=args.consumed_train_samples,
+        blend_block_size=args.blend_block_size,
+        compact_blending_indices=args.compact_blending_indices,
+        compact_blending_cache_size=args.compact_blending_cache_size,
         num_dataset_builder_threads=args.num_dataset_builder_threads,
+        num_dataset_builder_ranks=args.num_dataset_builder_ranks,
         path_to_cache=args.data_cache_path,
         mmap_bin_files=args.mmap_bin_files,
         tokenizer=tokenizer,
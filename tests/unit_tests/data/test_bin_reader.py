@@ -2,10 +2,14 @@ import os
 import random
 import sys
 import tempfile
+import time
 from types import ModuleType, SimpleNamespace
 from typing import Any, Dict
+from unittest import mock
 
 import nltk
+import numpy
+import torch
 
 try:
     import boto3
@@ -16,6 +20,8 @@ except ModuleNotFoundError:
     exceptions = ModuleType("botocore.exceptions")
     sys.modules[exceptions.__name__] = exceptions
 
+from megatron.core.datasets.blended_dataset import BlendedDataset
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
 from megatron.core.datasets.indexed_dataset import (
     IndexedDataset,
     S3Config,
@@ -23,13 +29,17 @@ from megatron.core.datasets.indexed_dataset import (
     _MMapBinReader,
     _S3BinReader,
 )
+from megatron.core.datasets.utils import Split, compile_helpers
 from megatron.core.datasets.utils_s3 import S3_PREFIX, S3Client
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+from tests.unit_tests.data.test_indexed_dataset import build_dummy_datasets
 from tests.unit_tests.data.test_preprocess_data import (
     build_datasets,
     dummy_jsonl,
     gpt2_merge,
     gpt2_vocab,
 )
+from tests.unit_tests.test_utilities import Utils
 
 ##
 # Overload client from boto3
@@ -61,7 +71,8 @@ class _LocalClient(S3Client):
 
         with open(filename, mode='rb', buffering=0) as bin_buffer_file:
             bin_buffer_file.seek(_range_beg)
-            _bytes = bin_buffer_file.read(_range_end - _range_beg)
+            # Add 1, because the end of Range is inclusive.
+            _bytes = bin_buffer_file.read(_range_end - _range_beg + 1)
 
         response = {"Body": SimpleNamespace(read=lambda: _bytes)}
 
@@ -158,5 +169,197 @@ def test_bin_reader():
                 assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
 
 
+def test_s3_bin_reader_cache():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_to_s3_cache = os.path.join(temp_dir, "s3_cache")
+        os.mkdir(path_to_s3_cache)
+
+        prefix = build_dummy_datasets(temp_dir)[0]
+        indexed_dataset_mmap = IndexedDataset(prefix, multimodal=False, mmap=True)
+
+        def build_s3_dataset(**kwargs):
+            return IndexedDataset(
+                S3_PREFIX + prefix,
+                multimodal=False,
+                mmap=False,
+                s3_config=S3Config(
+                    path_to_idx_cache=path_to_s3_cache, bin_chunk_nbytes=16, **kwargs
+                ),
+            )
+
+        # A read spanning several missing chunks downloads them with a single request
+        indexed_dataset_s3 = build_s3_dataset(bin_chunk_cache_size=16)
+        idx = int(numpy.argmax(indexed_dataset_s3.sequence_lengths))
+        assert indexed_dataset_s3.sequence_lengths[idx] * 2 > 3 * 16
+        assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        statistics = indexed_dataset_s3.bin_reader.statistics
+        assert statistics["get_requests"] == 1
+        assert statistics["read_misses"] == 1
+        assert statistics["read_hits"] == 1
+
+        # Random access through an LRU cache of a few chunks
+        indexed_dataset_s3 = build_s3_dataset(bin_chunk_cache_size=4)
+        indices = numpy.random.default_rng(seed=0).integers(0, len(indexed_dataset_s3), 200)
+        for idx in indices:
+            assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        statistics = indexed_dataset_s3.bin_reader.statistics
+        assert statistics["read_hits"] + statistics["read_misses"] == len(indices)
+        assert statistics["get_requests"] <= statistics["read_misses"]
+        assert len(indexed_dataset_s3.bin_reader._cache) <= 4
+
+        # Prefetched chunks are served from the cache
+        indexed_dataset_s3 = build_s3_dataset(bin_chunk_cache_size=64, bin_prefetch_threads=2)
+        indices = numpy.arange(10)
+        indexed_dataset_s3.prefetch(indices)
+        while indexed_dataset_s3.bin_reader._pending:
+            time.sleep(0.01)
+        for idx in indices:
+            assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        statistics = indexed_dataset_s3.bin_reader.statistics
+        assert statistics["prefetched_chunks"] > 0
+        assert statistics["read_hits"] == len(indices)
+        assert statistics["read_misses"] == 0
+
+        # Reads wait on in-flight prefetches rather than issuing requests of their own
+        indexed_dataset_s3 = build_s3_dataset(bin_chunk_cache_size=64, bin_prefetch_threads=2)
+        indexed_dataset_s3.prefetch(indices)
+        for idx in indices:
+            assert (indexed_dataset_s3[idx] == indexed_dataset_mmap[idx]).all()
+        statistics = indexed_dataset_s3.bin_reader.statistics
+        assert statistics["get_requests"] == 1
+
+
+def test_s3_prefetch_data_parallel():
+    if torch.distributed.is_available():
+        Utils.initialize_distributed()
+        if torch.distributed.get_rank() == 0:
+            compile_helpers()
+        torch.distributed.barrier()
+    else:
+        compile_helpers()
+
+    micro_batch_size, data_parallel_size, num_micro_batches = 2, 4, 8
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_to_s3_cache = os.path.join(temp_dir, "s3_cache")
+        os.mkdir(path_to_s3_cache)
+
+        prefix = build_dummy_datasets(temp_dir)[0]
+
+        def read_rank_samples(rank, **kwargs):
+            indexed_dataset = IndexedDataset(
+                S3_PREFIX + prefix,
+                multimodal=False,
+                mmap=False,
+                s3_config=S3Config(
+                    path_to_idx_cache=path_to_s3_cache,
+                    bin_chunk_nbytes=16,
+                    bin_chunk_cache_size=1 << 16,
+                    bin_prefetch_threads=2,
+                ),
+            )
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=8,
+                split="1,0,0",
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                tokenizer=_NullTokenizer(vocab_size=8192),
+                s3_bin_prefetch_threads=2,
+                s3_prefetch_samples=4,
+                **kwargs,
+            )
+            indices = numpy.arange(len(indexed_dataset), dtype=numpy.int32)
+            dataset = GPTDataset(indexed_dataset, prefix, indices, 1000, Split.train, config)
+
+            # The samples of the rank under the pretraining sampler
+            global_batch_size = micro_batch_size * data_parallel_size
+            samples = [
+                step * global_batch_size + rank * micro_batch_size + i
+                for step in range(num_micro_batches)
+                for i in range(micro_batch_size)
+            ]
+            for idx in samples:
+                dataset[idx]
+            while indexed_dataset.bin_reader._pending:
+                time.sleep(0.01)
+
+            # The bytes of the chunks which cover the samples read and the samples prefetched
+            # after them
+            samples += [
+                samples[-micro_batch_size]
+                + global_batch_size * (1 + i // micro_batch_size)
+                + i % micro_batch_size
+                for i in range(4)
+            ]
+            dtype_size = indexed_dataset.index.dtype_size
+            chunks = set()
+            for idx in samples:
+                for document_id, offset, length in zip(*dataset._get_shuffled_sample_parts(idx)):
+                    beg = indexed_dataset.index.sequence_pointers[document_id] + offset * dtype_size
+                    end = beg + length * dtype_size
+                    chunks.update(range(beg // 16, (end - 1) // 16 + 1))
+            return indexed_dataset.bin_reader.statistics["get_nbytes"], len(chunks) * 16
+
+        for rank in range(data_parallel_size):
+            # Prefetching the samples of the other ranks downloads data this rank never reads
+            get_nbytes_unaware, _ = read_rank_samples(rank)
+            get_nbytes, max_get_nbytes = read_rank_samples(
+                rank,
+                s3_prefetch_micro_batch_size=micro_batch_size,
+                s3_prefetch_data_parallel_size=data_parallel_size,
+            )
+            assert get_nbytes <= max_get_nbytes
+            assert get_nbytes < get_nbytes_unaware
+
+        # A blend prefetches the upcoming samples of the rank in its own order, in place of the
+        # blended datasets
+        indexed_dataset = IndexedDataset(prefix, multimodal=False, mmap=True)
+        indices = numpy.arange(len(indexed_dataset), dtype=numpy.int32)
+        config = GPTDatasetConfig(
+            random_seed=1234,
+            sequence_length=8,
+            split="1,0,0",
+            reset_position_ids=False,
+            reset_attention_mask=False,
+            eod_mask_loss=False,
+            tokenizer=_NullTokenizer(vocab_size=8192),
+            s3_bin_prefetch_threads=2,
+            s3_prefetch_samples=4,
+            s3_prefetch_micro_batch_size=micro_batch_size,
+            s3_prefetch_data_parallel_size=data_parallel_size,
+        )
+        datasets = [
+            GPTDataset(indexed_dataset, prefix, indices, 1000, Split.train, config)
+            for _ in range(2)
+        ]
+        blended_dataset = BlendedDataset(datasets, [1, 1], 1000, config)
+        assert all(dataset.prefetch_window is None for dataset in datasets)
+
+        with mock.patch.object(GPTDataset, "prefetch", autospec=True) as prefetch:
+            blended_dataset[micro_batch_size]
+        prefetched = {
+            (datasets.index(call.args[0]), int(idx))
+            for call in prefetch.call_args_list
+            for idx in call.args[1]
+        }
+        global_batch_size = micro_batch_size * data_parallel_size
+        upcoming = [micro_batch_size + 1] + [
+            global_batch_size + micro_batch_size + i for i in range(micro_batch_size)
+        ]
+        upcoming.append(2 * global_batch_size + micro_batch_size)
+        assert prefetched == {
+            (
+                int(blended_dataset.dataset_index[idx]),
+                int(blended_dataset.dataset_sample_index[idx]),
+            )
+            for idx in upcoming
+        }
+
+
 if __name__ == "__main__":
     test_bin_reader()
+    test_s3_bin_reader_cache()
+    test_s3_prefetch_data_parallel()
@@ -0,0 +1,334 @@
+##
+# Compile megatron.core.datasets.helpers dependencies before BlendedDataset import
+##
+
+import json
+import math
+import os
+import tempfile
+from typing import Dict, Optional
+from unittest import mock
+
+import numpy
+import pytest
+import torch
+
+from megatron.core.datasets.blended_dataset import (
+    _draw_blend_schedule_samples,
+    get_blend_schedule_targets,
+)
+from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
+from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
+from megatron.core.datasets.megatron_dataset import LowLevelDataset, MegatronDataset
+from megatron.core.datasets.utils import (
+    Split,
+    compile_helpers,
+    get_blend_schedule_from_list,
+    normalize,
+)
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+from tests.unit_tests.data.test_indexed_dataset import build_dummy_datasets
+from tests.unit_tests.test_utilities import Utils
+
+_NUM_DATASETS = 3
+
+_SIZE = 20000
+
+_BLOCK_SIZE = 1000
+
+_MOCK_VOCAB_SIZE = 8192
+
+
+class _DummyDataset(MegatronDataset):
+    def __init__(
+        self,
+        dataset: LowLevelDataset,
+        dataset_path: Optional[str],
+        indices: numpy.ndarray,
+        num_samples: Optional[int],
+        index_split: Split,
+        config: BlendedMegatronDatasetConfig,
+    ) -> None:
+        super().__init__(dataset, dataset_path, indices, num_samples, index_split, config)
+        if self.num_samples is None:
+            self.num_samples = len(self.indices)
+
+    @staticmethod
+    def numel_low_level_dataset(low_level_dataset: LowLevelDataset) -> int:
+        return len(low_level_dataset)
+
+    @staticmethod
+    def build_low_level_dataset(
+        dataset_path: str, config: BlendedMegatronDatasetConfig
+    ) -> LowLevelDataset:
+        return numpy.load(dataset_path)
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __getitem__(self, idx: int) -> Dict[str, numpy.ndarray]:
+        return {"text": self.dataset[self.indices[idx % len(self.indices)]]}
+
+
+def setup_module():
+    if torch.distributed.is_available():
+        Utils.initialize_distributed()
+        if torch.distributed.get_rank() == 0:
+            compile_helpers()
+        torch.distributed.barrier()
+    else:
+        compile_helpers()
+
+
+def build_blended_dataset(temp_dir, blend_schedule, path_to_cache=None, **kwargs):
+    paths = []
+    for i in range(_NUM_DATASETS):
+        path = os.path.join(temp_dir, f"dataset_{i}.npy")
+        numpy.save(path, numpy.arange(100 * (i + 1)))
+        paths.append(path)
+    config = BlendedMegatronDatasetConfig(
+        random_seed=1234,
+        sequence_length=1,
+        blend=(paths, [1.0, 2.0, 7.0]),
+        split="1,0,0",
+        blend_schedule=blend_schedule,
+        path_to_cache=path_to_cache,
+        **kwargs,
+    )
+    datasets = BlendedMegatronDatasetBuilder(
+        _DummyDataset, [_SIZE, 0, 0], lambda: True, config
+    ).build()
+    return datasets[Split.train.value]
+
+
+def test_blend_schedule():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # A constant schedule draws as the weights do
+        fixed = build_blended_dataset(temp_dir, None)
+        constant = build_blended_dataset(
+            temp_dir, [(0, [1.0, 2.0, 7.0])], blend_block_size=_BLOCK_SIZE
+        )
+        assert numpy.array_equal(fixed.dataset_index, constant.dataset_index)
+        assert numpy.array_equal(fixed.dataset_sample_index, constant.dataset_sample_index)
+
+        # A linear ramp, a step, and constant weights, with the blocks drawn as one
+        blend_schedule = get_blend_schedule_from_list(
+            ["2000:1,0,0", "10000:0,1,1", "10000:0,0,1", "16000:0,0,1", "16000:1,1,2"]
+        )
+        assert blend_schedule[1] == (10000, [0.0, 1.0, 1.0])
+        blended_dataset = build_blended_dataset(
+            temp_dir, blend_schedule, blend_block_size=_BLOCK_SIZE
+        )
+        one_block = build_blended_dataset(temp_dir, blend_schedule, blend_block_size=2 * _SIZE)
+        assert len(blended_dataset) == len(one_block) >= _SIZE
+        assert numpy.array_equal(blended_dataset.dataset_index, one_block.dataset_index)
+        assert numpy.array_equal(
+            blended_dataset.dataset_sample_index, one_block.dataset_sample_index
+        )
+
+        # Without a lazy index, each dataset is sized to the whole blend
+        assert [len(dataset) for dataset in blended_dataset.datasets] == [
+            math.ceil(len(blended_dataset) * 1.005)
+        ] * _NUM_DATASETS
+
+        dataset_index = blended_dataset.dataset_index
+        for beg, end, expected in [
+            (0, 2000, [2000, 0, 0]),
+            (2000, 10000, [4000, 2000, 2000]),
+            (10000, 16000, [0, 0, 6000]),
+            (16000, 20000, [1000, 1000, 2000]),
+        ]:
+            counts = numpy.bincount(dataset_index[beg:end], minlength=_NUM_DATASETS)
+            assert numpy.abs(counts - expected).max() <= 1
+        for i, dataset in enumerate(blended_dataset.datasets):
+            dataset_sample_index = blended_dataset.dataset_sample_index[dataset_index == i]
+            assert numpy.array_equal(dataset_sample_index, numpy.arange(len(dataset_sample_index)))
+            assert len(dataset_sample_index) <= len(dataset)
+
+        # Too many samples for the mid-level datasets, sized to another blend
+        with pytest.raises(RuntimeError, match="The blend schedule draws"):
+            type(blended_dataset)(
+                blended_dataset.datasets,
+                blended_dataset.weights,
+                2 * blended_dataset.size,
+                BlendedMegatronDatasetConfig(
+                    random_seed=1234,
+                    sequence_length=1,
+                    blend=([""] * _NUM_DATASETS, None),
+                    split="1,0,0",
+                    blend_schedule=[(0, [1.0, 0.0, 0.0])],
+                ),
+            )
+
+
+def test_blend_schedule_change():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_to_cache = os.path.join(temp_dir, "cache")
+        blend_schedule = [(0, [1.0, 1.0, 1.0]), (_SIZE, [0.0, 0.0, 1.0])]
+        blended_dataset = build_blended_dataset(
+            temp_dir, blend_schedule, path_to_cache, blend_block_size=_BLOCK_SIZE
+        )
+        assert blended_dataset.built_anew_on_cache_miss
+        dataset_index = numpy.array(blended_dataset.dataset_index)
+        dataset_sample_index = numpy.array(blended_dataset.dataset_sample_index)
+        assert not build_blended_dataset(
+            temp_dir, blend_schedule, path_to_cache, blend_block_size=_BLOCK_SIZE
+        ).built_anew_on_cache_miss
+
+        # Change the schedule on restart, after some samples have been consumed
+        consumed_samples = 7500
+        new_blend_schedule = [(0, [1.0, 1.0, 1.0]), (10000, [1.0, 0.0, 0.0])]
+        blended_dataset = build_blended_dataset(
+            temp_dir,
+            new_blend_schedule,
+            path_to_cache,
+            blend_schedule_consumed_samples=consumed_samples,
+            blend_block_size=_BLOCK_SIZE,
+        )
+        assert blended_dataset.built_anew_on_cache_miss
+        sample_beg = math.ceil(consumed_samples / _BLOCK_SIZE) * _BLOCK_SIZE
+        assert numpy.array_equal(
+            blended_dataset.dataset_index[:sample_beg], dataset_index[:sample_beg]
+        )
+        assert numpy.array_equal(
+            blended_dataset.dataset_sample_index[:sample_beg], dataset_sample_index[:sample_beg]
+        )
+        assert not numpy.array_equal(blended_dataset.dataset_index, dataset_index)
+
+        # No sample of a dataset is repeated or skipped across the change
+        for i in range(_NUM_DATASETS):
+            assert numpy.array_equal(
+                blended_dataset.dataset_sample_index[blended_dataset.dataset_index == i],
+                numpy.arange(numpy.sum(blended_dataset.dataset_index == i)),
+            )
+
+        # The weights of the new schedule apply to the new blocks
+        counts = numpy.bincount(blended_dataset.dataset_index[sample_beg:], minlength=3)
+        new_blend_schedule = [
+            (sample, normalize(weights)) for sample, weights in new_blend_schedule
+        ]
+        expected = get_blend_schedule_targets(
+            new_blend_schedule, len(blended_dataset)
+        ) - get_blend_schedule_targets(new_blend_schedule, sample_beg)
+        assert numpy.abs(counts - expected).max() <= 1
+
+        # The cache now holds the new schedule, after the old one
+        with open(
+            os.path.join(
+                path_to_cache,
+                f"{blended_dataset.unique_description_hash}-BlendedDataset-train-"
+                "blend_schedule.json",
+            )
+        ) as reader:
+            phases = json.load(reader)
+        assert [phase["start"] for phase in phases] == [0, sample_beg]
+        assert not build_blended_dataset(
+            temp_dir,
+            new_blend_schedule,
+            path_to_cache,
+            blend_schedule_consumed_samples=consumed_samples,
+            blend_block_size=_BLOCK_SIZE,
+        ).built_anew_on_cache_miss
+
+
+@pytest.mark.parametrize("lazy_index", [False, True])
+def test_blend_schedule_change_gpt_dataset(lazy_index):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefixes = build_dummy_datasets(temp_dir)
+
+        def build(blend_schedule, consumed_samples=0):
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=16,
+                blend=(prefixes, [1.0] * len(prefixes)),
+                split="1,0,0",
+                path_to_cache=os.path.join(temp_dir, "cache"),
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                tokenizer=_NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE),
+                lazy_index=lazy_index,
+                blend_schedule=blend_schedule,
+                blend_schedule_consumed_samples=consumed_samples,
+                blend_block_size=100,
+            )
+            return BlendedMegatronDatasetBuilder(
+                GPTDataset, [2000, 0, 0], lambda: True, config
+            ).build()[Split.train.value]
+
+        num_datasets = len(prefixes)
+        blended_dataset = build([(0, [1.0] * num_datasets)])
+        consumed_samples = 750
+        kept_samples = [blended_dataset[idx]["tokens"] for idx in range(consumed_samples)]
+
+        # Change the schedule to draw all from one dataset
+        blended_dataset = build([(0, [1.0] + [0.0] * (num_datasets - 1))], consumed_samples)
+
+        # The kept samples are the same, and no sample of a dataset is drawn twice
+        for idx in range(consumed_samples):
+            assert torch.equal(blended_dataset[idx]["tokens"], kept_samples[idx])
+        for i, dataset in enumerate(blended_dataset.datasets):
+            dataset_sample_index = blended_dataset.dataset_sample_index[
+                blended_dataset.dataset_index == i
+            ]
+            assert numpy.array_equal(dataset_sample_index, numpy.arange(len(dataset_sample_index)))
+
+
+def test_compact_blending_indices():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_to_cache = os.path.join(temp_dir, "cache")
+        blend_schedule = get_blend_schedule_from_list(["0:1,1,1", "15000:0,1,2"])
+        new_blend_schedule = get_blend_schedule_from_list(["0:1,1,1", "8000:2,1,0"])
+        for schedule in [None, blend_schedule]:
+            kwargs = dict(blend_block_size=_BLOCK_SIZE, path_to_cache=path_to_cache)
+            reference = build_blended_dataset(temp_dir, schedule, **kwargs)
+            for built_anew in [True, False]:
+                blended_dataset = build_blended_dataset(
+                    temp_dir, schedule, compact_blending_indices=True, **kwargs
+                )
+                assert blended_dataset.built_anew_on_cache_miss == built_anew
+                assert blended_dataset.dataset_index is None
+                num_blocks = math.ceil(len(reference) / _BLOCK_SIZE)
+                assert blended_dataset.block_samples.shape == (num_blocks + 1, _NUM_DATASETS)
+
+                # The samples are those of the full indices, in any order of access
+                assert len(blended_dataset) == len(reference)
+                order = numpy.random.default_rng(seed=0).permutation(len(reference))
+                for idx in numpy.concatenate([numpy.arange(len(reference)), order[:2000]]):
+                    sample = blended_dataset[idx]
+                    assert sample["dataset_id"] == reference.dataset_index[idx]
+                    assert numpy.array_equal(sample["text"], reference[idx]["text"])
+
+                # Interleaved in-order accesses to a few blocks each draw their block once
+                blended_dataset.cached_blocks.clear()
+                with mock.patch(
+                    "megatron.core.datasets.blended_dataset._draw_blend_schedule_samples",
+                    wraps=_draw_blend_schedule_samples,
+                ) as draw:
+                    for idx in range(_BLOCK_SIZE):
+                        for block in range(min(num_blocks, 4)):
+                            blended_dataset._query_compact_indices(
+                                min(block * _BLOCK_SIZE + idx, len(reference) - 1)
+                            )
+                assert draw.call_count == min(num_blocks, 4)
+                assert len(blended_dataset.cached_blocks) <= 8
+
+            assert not any(
+                name.startswith(blended_dataset.unique_description_hash)
+                and name.endswith("index.npy")
+                for name in os.listdir(path_to_cache)
+            )
+
+        # A change of schedule keeps the blocks before the consumed samples
+        kwargs["blend_schedule_consumed_samples"] = 5500
+        reference = build_blended_dataset(temp_dir, new_blend_schedule, **kwargs)
+        blended_dataset = build_blended_dataset(
+            temp_dir, new_blend_schedule, compact_blending_indices=True, **kwargs
+        )
+        assert [phase["start"] for phase in blended_dataset.phases] == [0, 6000]
+        for idx in range(len(reference)):
+            assert blended_dataset._query_compact_indices(idx) == (
+                reference.dataset_index[idx],
+                reference.dataset_sample_index[idx],
+            )
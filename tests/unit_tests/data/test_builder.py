@@ -13,8 +13,17 @@ import torch
 
 from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
 from megatron.core.datasets.blended_megatron_dataset_config import BlendedMegatronDatasetConfig
+from megatron.core.datasets.gpt_dataset import GPTDataset, GPTDatasetConfig
 from megatron.core.datasets.megatron_dataset import LowLevelDataset, MegatronDataset
-from megatron.core.datasets.utils import Split, compile_helpers, get_blend_from_list
+from megatron.core.datasets.utils import (
+    Split,
+    build_cache_on_this_rank,
+    compile_helpers,
+    get_blend_from_list,
+    is_cache_builder,
+)
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+from tests.unit_tests.data.test_indexed_dataset import build_dummy_datasets
 from tests.unit_tests.test_utilities import Utils
 
 _NUM_DATASETS = 10
@@ -355,5 +364,79 @@ def test_builder():
             assert len(datasets[2]) == 0
 
 
+def test_builder_num_dataset_builder_ranks():
+    if torch.distributed.is_available():
+        Utils.initialize_distributed()
+        if torch.distributed.get_rank() == 0:
+            compile_helpers()
+        torch.distributed.barrier()
+    else:
+        compile_helpers()
+
+    with build_cache_on_this_rank():
+        assert is_cache_builder()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The ranks must share the data cache
+        if torch.distributed.is_initialized():
+            temp_dirs = [temp_dir]
+            torch.distributed.broadcast_object_list(temp_dirs, src=0)
+            odir = temp_dirs[0]
+        else:
+            odir = temp_dir
+
+        if not torch.distributed.is_initialized() or torch.distributed.get_rank() == 0:
+            prefixes = build_dummy_datasets(odir)
+        else:
+            prefixes = None
+        if torch.distributed.is_initialized():
+            prefixes = [prefixes]
+            torch.distributed.broadcast_object_list(prefixes, src=0)
+            prefixes = prefixes[0]
+
+        def build(num_dataset_builder_ranks, path_to_cache):
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=16,
+                blend=(prefixes, [1.0, 2.0, 3.0]),
+                split="90,10,0",
+                num_dataset_builder_ranks=num_dataset_builder_ranks,
+                path_to_cache=path_to_cache,
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                tokenizer=_NullTokenizer(vocab_size=1000),
+            )
+            return BlendedMegatronDatasetBuilder(
+                GPTDataset, [1000, 100, 0], lambda: True, config
+            ).build()
+
+        world_size = torch.distributed.get_world_size() if torch.distributed.is_initialized() else 1
+
+        datasets_reference = build(1, os.path.join(odir, "cache_reference"))
+        datasets = build(world_size + 1, os.path.join(odir, "cache"))
+        for split in [Split.train, Split.valid]:
+            dataset_reference = datasets_reference[split.value]
+            dataset = datasets[split.value]
+            for megatron_dataset_reference, megatron_dataset in zip(
+                dataset_reference.datasets, dataset.datasets
+            ):
+                assert (
+                    megatron_dataset.unique_description_hash
+                    == megatron_dataset_reference.unique_description_hash
+                )
+            for idx in range(0, len(dataset), 7):
+                assert (dataset[idx]["tokens"] == dataset_reference[idx]["tokens"]).all()
+
+        # Every component was built and cached exactly once
+        datasets = build(world_size + 1, os.path.join(odir, "cache"))
+        for split in [Split.train, Split.valid]:
+            assert not any(x.built_anew_on_cache_miss for x in datasets[split.value].datasets)
+
+        if torch.distributed.is_initialized():
+            torch.distributed.barrier()
+
+
 if __name__ == "__main__":
     test_builder()
+    test_builder_num_dataset_builder_ranks()
@@ -0,0 +1,189 @@
+import numpy
+import pytest
+import torch
+
+# isort: off
+# megatron.training imports the data samplers, which import megatron.training back
+from megatron.training.training import cyclic_iter
+from megatron.legacy.data.data_samplers import (
+    MegatronPrefetchingDataLoader,
+    MegatronPretrainingRandomSampler,
+    MegatronPretrainingReshardableSampler,
+    MegatronPretrainingSampler,
+)
+
+# isort: on
+
+_NUM_SAMPLES = 203
+
+_SEQUENCE_LENGTH = 16
+
+_MICRO_BATCH_SIZE = 4
+
+
+class _DummyDataset(torch.utils.data.Dataset):
+    def __len__(self):
+        return _NUM_SAMPLES
+
+    def __getitem__(self, idx):
+        if idx == -1:
+            raise ValueError("bad sample")
+        tokens = numpy.arange(idx, idx + _SEQUENCE_LENGTH, dtype=numpy.int64)
+        return {
+            "tokens": tokens,
+            "loss_mask": torch.full((_SEQUENCE_LENGTH,), idx / _NUM_SAMPLES),
+            "index": numpy.int64(idx),
+        }
+
+
+def build_samplers(consumed_samples, data_parallel_rank, data_parallel_size):
+    kwargs = dict(
+        total_samples=_NUM_SAMPLES,
+        consumed_samples=consumed_samples,
+        micro_batch_size=_MICRO_BATCH_SIZE,
+        data_parallel_rank=data_parallel_rank,
+        data_parallel_size=data_parallel_size,
+    )
+    return (
+        MegatronPretrainingSampler(**kwargs),
+        MegatronPretrainingRandomSampler(_DummyDataset(), data_sharding=True, **kwargs),
+    )
+
+
+def assert_batches_equal(batches, batches_reference):
+    assert len(batches) == len(batches_reference)
+    for batch, batch_reference in zip(batches, batches_reference):
+        assert batch.keys() == batch_reference.keys()
+        for key in batch:
+            assert batch[key].dtype == batch_reference[key].dtype
+            assert torch.equal(batch[key], batch_reference[key])
+
+
+@pytest.mark.parametrize("num_workers", [0, 1, 3])
+def test_prefetching_data_loader(num_workers):
+    dataset = _DummyDataset()
+    for consumed_samples, data_parallel_rank, data_parallel_size in [(0, 0, 1), (24, 1, 3)]:
+        # The batches are identical to those of the torch data loader, across epochs if cyclic
+        for sampler_reference, sampler in zip(
+            build_samplers(consumed_samples, data_parallel_rank, data_parallel_size),
+            build_samplers(consumed_samples, data_parallel_rank, data_parallel_size),
+        ):
+            cyclic = isinstance(sampler, MegatronPretrainingRandomSampler)
+            reference = torch.utils.data.DataLoader(dataset, batch_sampler=sampler_reference)
+            loader = MegatronPrefetchingDataLoader(
+                dataset,
+                sampler,
+                consumed_samples,
+                num_workers=num_workers,
+                prefetch_depth=3,
+                cyclic=cyclic,
+            )
+            if cyclic:
+                num_batches = 3 * _NUM_SAMPLES // (_MICRO_BATCH_SIZE * data_parallel_size)
+                iterator_reference = cyclic_iter(reference)
+                batches_reference = [next(iterator_reference) for _ in range(num_batches)]
+                iterator = iter(loader)
+                # The batches are only valid until the next one is requested
+                batches = [
+                    {key: value.clone() for key, value in next(iterator).items()}
+                    for _ in range(num_batches)
+                ]
+            else:
+                batches_reference = list(reference)
+                batches = [{key: value.clone() for key, value in batch.items()} for batch in loader]
+            assert_batches_equal(batches, batches_reference)
+
+            # The cursor counts the samples handed to the training loop, not those prefetched
+            assert loader.consumed_samples == consumed_samples + len(batches) * (
+                _MICRO_BATCH_SIZE * data_parallel_size
+            )
+            metrics = loader.get_metrics()
+            assert metrics["batches"] == len(batches)
+            assert metrics["wait-time"] > 0.0
+            assert 0.0 <= metrics["queue-depth"] <= 2.0
+            assert loader.get_metrics()["batches"] == 0
+            loader.shutdown()
+
+        # A restart from the cursor resumes where the previous run stopped
+        sampler = build_samplers(consumed_samples, data_parallel_rank, data_parallel_size)[0]
+        loader = MegatronPrefetchingDataLoader(
+            dataset, sampler, consumed_samples, num_workers=num_workers, prefetch_depth=2
+        )
+        iterator = iter(loader)
+        for _ in range(5):
+            next(iterator)
+        last_index = next(iterator)["index"].clone()
+        loader.shutdown()
+        sampler = build_samplers(loader.consumed_samples, data_parallel_rank, data_parallel_size)[0]
+        loader = MegatronPrefetchingDataLoader(
+            dataset, sampler, loader.consumed_samples, num_workers=num_workers, prefetch_depth=2
+        )
+        assert torch.equal(
+            next(iter(loader))["index"], last_index + _MICRO_BATCH_SIZE * data_parallel_size
+        )
+        loader.shutdown()
+
+
+def test_prefetching_data_loader_errors():
+    dataset = _DummyDataset()
+
+    class _BadSampler(MegatronPretrainingSampler):
+        def __iter__(self):
+            for batch in super().__iter__():
+                yield batch if batch[0] < 40 else [-1] * len(batch)
+
+    sampler = _BadSampler(_NUM_SAMPLES, 0, _MICRO_BATCH_SIZE, 0, 1)
+    loader = MegatronPrefetchingDataLoader(dataset, sampler, 0, num_workers=2, prefetch_depth=4)
+    with pytest.raises(ValueError, match="bad sample"):
+        for _ in loader:
+            pass
+    loader.shutdown()
+
+
+def test_reshardable_sampler():
+    # Each epoch is a permutation of the dataset, with O(1) seek into the global order
+    for total_samples in [1, 2, 3, 64, 203, 1000]:
+        sampler = MegatronPretrainingReshardableSampler(None, total_samples, 0, 1, 0, 1, seed=7)
+        epochs = [
+            sampler.get_global_indices(epoch * total_samples, total_samples) for epoch in range(3)
+        ]
+        for indices in epochs:
+            assert sorted(indices.tolist()) == list(range(total_samples))
+        if total_samples > 3:
+            assert not numpy.array_equal(epochs[0], epochs[1])
+            assert not numpy.array_equal(epochs[0], numpy.arange(total_samples))
+        for position in [0, total_samples // 2, 2 * total_samples - 1]:
+            assert numpy.array_equal(
+                sampler.get_global_indices(position, total_samples),
+                numpy.concatenate(epochs)[position : position + total_samples],
+            )
+    sampler = MegatronPretrainingReshardableSampler(None, 10**12, 0, 1, 0, 1)
+    assert (sampler.get_global_indices(10**15 + 12345, 1000) < 10**12).all()
+
+    # The global order does not depend on the data parallel size, across restarts
+    global_batch_size = 24
+    sampler = MegatronPretrainingReshardableSampler(None, _NUM_SAMPLES, 0, 1, 0, 1)
+    global_order = sampler.get_global_indices(0, 10 * global_batch_size).tolist()
+    samples = []
+    consumed_samples = 0
+    for micro_batch_size, data_parallel_size, num_steps in [(2, 4, 3), (3, 2, 2), (1, 8, 5)]:
+        iterators = [
+            iter(
+                MegatronPretrainingReshardableSampler(
+                    None,
+                    _NUM_SAMPLES,
+                    consumed_samples,
+                    micro_batch_size,
+                    data_parallel_rank,
+                    data_parallel_size,
+                )
+            )
+            for data_parallel_rank in range(data_parallel_size)
+        ]
+        num_micro_batches = global_batch_size // (micro_batch_size * data_parallel_size)
+        for _ in range(num_steps * num_micro_batches):
+            for iterator in iterators:
+                samples.extend(next(iterator))
+        consumed_samples += num_steps * global_batch_size
+    assert samples == global_order
+    assert len(set(samples[:_NUM_SAMPLES])) == _NUM_SAMPLES
@@ -0,0 +1,101 @@
+import collections
+import json
+import os
+import random
+import tempfile
+
+import regex
+
+from megatron.training.tokenizer.gpt2_tokenization import GPT2Tokenizer, bytes_to_unicode
+from tools.benchmark_gpt2_tokenization import ReferenceGPT2Tokenizer
+
+_NUM_MERGES = 400
+
+# The pre-tokenization pattern of GPT2Tokenizer
+_PATTERN = regex.compile(
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+)
+
+
+def build_dummy_texts(num_texts):
+    rng = random.Random(0)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "aa", "a", "é", "ß", "你", "  ", "'s", "7"]
+    texts = []
+    for _ in range(num_texts):
+        words = [
+            "".join(rng.choice(syllables) for _ in range(rng.randint(1, 12)))
+            for _ in range(rng.randint(1, 40))
+        ]
+        texts.append(" ".join(words) + rng.choice(["", ".", "\n", " 123, 45!"]))
+    return texts
+
+
+def build_dummy_vocab_and_merges(odir, texts):
+    # Learn the merges from the byte-level words of the texts, most frequent pair first
+    byte_encoder = bytes_to_unicode()
+    counts = collections.Counter()
+    for text in texts:
+        for token in _PATTERN.findall(text):
+            counts[tuple(byte_encoder[b] for b in token.encode("utf-8"))] += 1
+
+    merges = []
+    for _ in range(_NUM_MERGES):
+        pairs = collections.Counter()
+        for word, count in counts.items():
+            for pair in zip(word[:-1], word[1:]):
+                pairs[pair] += count
+        if not pairs:
+            break
+        first, second = max(sorted(pairs), key=pairs.get)
+        merges.append((first, second))
+        merged_counts = collections.Counter()
+        for word, count in counts.items():
+            merged, i = [], 0
+            while i < len(word):
+                if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+                    merged.append(first + second)
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            merged_counts[tuple(merged)] += count
+        counts = merged_counts
+
+    # Shuffle part of the ranks, as a stress test beyond the learned merge order
+    rng = random.Random(1)
+    tail = merges[_NUM_MERGES // 2 :]
+    rng.shuffle(tail)
+    merges = merges[: _NUM_MERGES // 2] + tail
+
+    vocab = list(byte_encoder.values()) + [first + second for first, second in merges]
+    vocab = list(dict.fromkeys(vocab)) + ["<|endoftext|>"]
+    vocab_file = os.path.join(odir, "vocab.json")
+    merge_file = os.path.join(odir, "merges.txt")
+    with open(vocab_file, "w", encoding="utf-8") as writer:
+        json.dump({token: i for i, token in enumerate(vocab)}, writer)
+    with open(merge_file, "w", encoding="utf-8") as writer:
+        writer.write("#version: 0.2\n")
+        for first, second in merges:
+            writer.write(f"{first} {second}\n")
+    return vocab_file, merge_file
+
+
+def test_gpt2_tokenization():
+    texts = build_dummy_texts(200)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vocab_file, merge_file = build_dummy_vocab_and_merges(temp_dir, texts[:100])
+
+        reference = ReferenceGPT2Tokenizer(vocab_file, merge_file)
+        tokenizer = GPT2Tokenizer(vocab_file, merge_file, cache_size=16)
+
+        # The token ids are identical to those of the original merge loop
+        ids_reference = [reference.encode(text) for text in texts]
+        assert [tokenizer.encode(text) for text in texts] == ids_reference
+        assert tokenizer.encode_batch(texts) == ids_reference
+        assert tokenizer.encode_batch([]) == []
+        assert any(len(ids) < len(text.encode("utf-8")) for ids, text in zip(ids_reference, texts))
+        assert all(tokenizer.decode(ids) == text for ids, text in zip(ids_reference, texts))
+
+        # The word cache is bounded
+        assert len(tokenizer.cache) == 16
+        assert len(reference.cache) > 16
@@ -2,15 +2,26 @@
 # Compile megatron.core.datasets.helpers dependencies before BlendedDataset import
 ##
 
+import os
 import random
+import tempfile
+from unittest import mock
 
 import numpy
 import torch
 
 from megatron.core.datasets.blended_megatron_dataset_builder import BlendedMegatronDatasetBuilder
-from megatron.core.datasets.gpt_dataset import GPTDatasetConfig, MockGPTDataset
-from megatron.core.datasets.utils import compile_helpers
+from megatron.core.datasets.gpt_dataset import (
+    GPTDataset,
+    GPTDatasetConfig,
+    MockGPTDataset,
+    _FeistelPermutation,
+    get_packed_seq_params,
+)
+from megatron.core.datasets.indexed_dataset import IndexedDataset
+from megatron.core.datasets.utils import Split, compile_helpers
 from megatron.training.tokenizer.tokenizer import _NullTokenizer
+from tests.unit_tests.data.test_indexed_dataset import build_dummy_datasets
 from tests.unit_tests.test_utilities import Utils
 
 _MOCK_VOCAB_SIZE = 8192
@@ -106,5 +117,294 @@ def test_mock_gpt_dataset():
     assert not torch.any(sample['loss_mask'])
 
 
+def test_gpt_dataset_fused_index_build():
+    if torch.distributed.is_available():
+        Utils.initialize_distributed()
+        if torch.distributed.get_rank() == 0:
+            compile_helpers()
+        torch.distributed.barrier()
+    else:
+        compile_helpers()
+
+    from megatron.core.datasets import helpers
+
+    tokenizer = _NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefix = build_dummy_datasets(temp_dir)[0]
+        indexed_dataset = IndexedDataset(prefix)
+        sequence_lengths = indexed_dataset.sequence_lengths
+        indices = numpy.arange(10, len(indexed_dataset) - 10, dtype=numpy.int32)
+        num_tokens_per_epoch = int(sequence_lengths[indices].sum())
+
+        for sequence_length, num_samples, add_extra_token_to_sequence, index_split in [
+            (32, 8, True, Split.train),
+            (32, 1000, True, Split.train),
+            (17, 1000, False, Split.train),
+            (64, 777, True, Split.valid),
+            (64, 500, False, Split.valid),
+        ]:
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=sequence_length,
+                split="1,0,0",
+                path_to_cache=os.path.join(temp_dir, "cache"),
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                drop_last_partial_validation_sequence=False,
+                add_extra_token_to_sequence=add_extra_token_to_sequence,
+                fused_index_build=True,
+                tokenizer=tokenizer,
+            )
+            dataset = GPTDataset(
+                indexed_dataset, prefix, indices, num_samples, index_split, config
+            )
+            assert dataset.built_anew_on_cache_miss
+            assert len(dataset) >= num_samples
+
+            # Each epoch is a permutation of the documents
+            num_epochs = dataset.document_index.shape[0] // indices.shape[0]
+            assert num_epochs > 1 or num_samples == 8
+            for epoch_document_index in dataset.document_index.reshape(num_epochs, -1):
+                assert (numpy.sort(epoch_document_index) == indices).all()
+
+            # The sample index matches that of the default build over the same document index
+            sample_index = helpers.build_sample_idx(
+                sequence_lengths,
+                numpy.array(dataset.document_index),
+                sequence_length,
+                num_epochs,
+                num_tokens_per_epoch,
+                index_split != Split.valid,
+                add_extra_token_to_sequence,
+            )
+            assert (dataset.sample_index == sample_index).all()
+
+            # The shuffle index is a permutation which may keep the final epoch separate
+            assert (numpy.sort(dataset.shuffle_index) == numpy.arange(len(dataset))).all()
+
+            # Every sample is complete, save for the final validation sample
+            for idx in range(len(dataset) - 1):
+                text, _ = dataset._query_document_sample_shuffle_indices(
+                    dataset.shuffle_index.argsort()[idx]
+                )
+                assert (text != dataset._pad_token_id).all()
+
+            # The indices are cached, and the cache is distinct from that of the default build
+            dataset_cached = GPTDataset(
+                indexed_dataset, prefix, indices, num_samples, index_split, config
+            )
+            assert not dataset_cached.built_anew_on_cache_miss
+            assert (dataset_cached.document_index == dataset.document_index).all()
+            assert (dataset_cached.sample_index == dataset.sample_index).all()
+            assert (dataset_cached.shuffle_index == dataset.shuffle_index).all()
+
+            config.fused_index_build = False
+            dataset_default = GPTDataset(
+                indexed_dataset, prefix, indices, num_samples, index_split, config
+            )
+            assert "fused_index_build" not in dataset_default.unique_identifiers
+            assert dataset_default.unique_description_hash != dataset.unique_description_hash
+
+
+def test_gpt_dataset_lazy_index():
+    tokenizer = _NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE)
+
+    permutation = _FeistelPermutation(1000, (1234, 0))
+    assert (numpy.sort(permutation(numpy.arange(1000))) == numpy.arange(1000)).all()
+    assert (permutation(numpy.arange(1000)) != numpy.arange(1000)).any()
+    assert (_FeistelPermutation(1, (1234, 0))(numpy.arange(1)) == 0).all()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefix = build_dummy_datasets(temp_dir)[0]
+        indexed_dataset = IndexedDataset(prefix)
+        indices = numpy.arange(10, len(indexed_dataset) - 10, dtype=numpy.int32)
+
+        for sequence_length, add_extra_token_to_sequence, index_split in [
+            (32, True, Split.train),
+            (17, False, Split.train),
+            (64, True, Split.valid),
+        ]:
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=sequence_length,
+                split="1,0,0",
+                path_to_cache=os.path.join(temp_dir, "cache"),
+                reset_position_ids=False,
+                reset_attention_mask=False,
+                eod_mask_loss=False,
+                drop_last_partial_validation_sequence=False,
+                add_extra_token_to_sequence=add_extra_token_to_sequence,
+                lazy_index=True,
+                tokenizer=tokenizer,
+            )
+            dataset = GPTDataset(indexed_dataset, prefix, indices, 1000, index_split, config)
+            assert len(dataset) == 1000
+            assert dataset.shuffle_index is None
+            assert not os.path.exists(config.path_to_cache)
+
+            num_samples_per_epoch = dataset.lazy_index.num_samples_per_epoch
+            for epoch in range(1000 // num_samples_per_epoch):
+                # The documents and the samples are permuted per epoch
+                document_permutation, sample_permutation, _ = dataset.lazy_index._get_epoch(epoch)
+                document_ids = indices[document_permutation(numpy.arange(len(indices)))]
+                assert (numpy.sort(document_ids) == indices).all()
+                sample_ids = sample_permutation(numpy.arange(num_samples_per_epoch))
+                assert (numpy.sort(sample_ids) == numpy.arange(num_samples_per_epoch)).all()
+
+                # The samples are cut consecutively from the concatenated documents
+                stream = numpy.concatenate([indexed_dataset[i] for i in document_ids])
+                for idx, sample_id in enumerate(sample_ids):
+                    text, _ = dataset._query_document_sample_shuffle_indices(
+                        epoch * num_samples_per_epoch + idx
+                    )
+                    beg = sample_id * sequence_length
+                    expected = stream[beg : beg + sequence_length + add_extra_token_to_sequence]
+                    assert (text[: expected.shape[0]] == expected).all()
+                    assert (text[expected.shape[0] :] == dataset._pad_token_id).all()
+
+            # The samples do not depend on the number of samples
+            dataset_fewer = GPTDataset(indexed_dataset, prefix, indices, 500, index_split, config)
+            for idx in range(0, 500, 7):
+                assert (dataset_fewer[idx]["tokens"] == dataset[idx]["tokens"]).all()
+
+
+def test_gpt_dataset_packed_sequences():
+    tokenizer = _NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE)
+
+    datasets = {}
+    for packed_sequences in [False, True]:
+        config = GPTDatasetConfig(
+            random_seed=1234,
+            sequence_length=512,
+            split="990,9,1",
+            reset_position_ids=True,
+            reset_attention_mask=True,
+            eod_mask_loss=True,
+            drop_last_partial_validation_sequence=False,
+            packed_sequences=packed_sequences,
+            tokenizer=tokenizer,
+        )
+        datasets[packed_sequences] = BlendedMegatronDatasetBuilder(
+            MockGPTDataset, [100, None, None], lambda: True, config
+        ).build()
+
+    # The packed samples match those of the EOD scan
+    for dataset, dataset_packed in zip(datasets[False][:2], datasets[True][:2]):
+        for idx in list(range(0, len(dataset), len(dataset) // 20)) + [len(dataset) - 1, None]:
+            sample = dataset[idx]
+            with mock.patch.object(
+                dataset_packed,
+                "_get_shuffled_sample_parts",
+                wraps=dataset_packed._get_shuffled_sample_parts,
+            ) as get_shuffled_sample_parts:
+                sample_packed = dataset_packed[idx]
+            # The sample parts are looked up once for both the text and the boundaries
+            assert get_shuffled_sample_parts.call_count == 1
+            for key in sample:
+                assert (sample[key] == sample_packed[key]).all()
+
+            cu_seqlens = sample_packed["cu_seqlens"]
+            assert cu_seqlens.shape[0] == 513
+            cu_seqlens = cu_seqlens[cu_seqlens >= 0]
+            assert cu_seqlens[0] == 0 and cu_seqlens[-1] == 512
+            eod = torch.nonzero(sample["tokens"][:-1] == tokenizer.eod).flatten()
+            assert (cu_seqlens[1:-1] == eod + 1).all()
+
+    batch = torch.utils.data.default_collate([datasets[True][0][idx] for idx in range(4)])
+    packed_seq_params = get_packed_seq_params(batch["cu_seqlens"])
+    cu_seqlens = packed_seq_params.cu_seqlens_q
+    assert packed_seq_params.qkv_format == "thd"
+    assert cu_seqlens[0] == 0 and cu_seqlens[-1] == 4 * 512
+    assert (cu_seqlens[1:] > cu_seqlens[:-1]).all()
+    for i in range(4):
+        assert i * 512 in cu_seqlens
+    assert packed_seq_params.max_seqlen_q == (cu_seqlens[1:] - cu_seqlens[:-1]).max()
+
+
+def test_gpt_dataset_bin_packing():
+    from megatron.core.datasets import helpers
+
+    tokenizer = _NullTokenizer(vocab_size=_MOCK_VOCAB_SIZE)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefix = build_dummy_datasets(temp_dir)[0]
+        indexed_dataset = IndexedDataset(prefix)
+        indices = numpy.arange(len(indexed_dataset), dtype=numpy.int32)
+
+        for sequence_length, add_extra_token_to_sequence in [(64, True), (64, False), (24, True)]:
+            sample_length = sequence_length + add_extra_token_to_sequence
+            config = GPTDatasetConfig(
+                random_seed=1234,
+                sequence_length=sequence_length,
+                split="1,0,0",
+                path_to_cache=os.path.join(temp_dir, f"cache_{sample_length}"),
+                reset_position_ids=True,
+                reset_attention_mask=True,
+                eod_mask_loss=False,
+                add_extra_token_to_sequence=add_extra_token_to_sequence,
+                packed_sequences=True,
+                bin_packing_window=64,
+                tokenizer=tokenizer,
+            )
+            with mock.patch.object(
+                helpers, "build_packed_sample_idx", wraps=helpers.build_packed_sample_idx
+            ) as build_packed_sample_idx:
+                dataset = GPTDataset(indexed_dataset, prefix, indices, 200, Split.train, config)
+            assert len(dataset) >= 200
+
+            num_tokens = 0
+            for idx in range(len(dataset)):
+                document_ids, offsets, lengths = dataset._get_shuffled_sample_parts(idx)
+                assert lengths.sum() <= sample_length
+                assert (lengths > 0).all()
+                num_tokens += lengths.sum()
+
+                # The sample holds the pieces back-to-back followed by padding
+                text, _ = dataset._query_document_sample_shuffle_indices(idx)
+                expected = numpy.concatenate(
+                    [
+                        indexed_dataset.get(document_id, offset=offset, length=length)
+                        for document_id, offset, length in zip(document_ids, offsets, lengths)
+                    ]
+                )
+                assert (text[: expected.shape[0]] == expected).all()
+                assert (text[expected.shape[0] :] == dataset._pad_token_id).all()
+
+                # The boundaries are the ends of the pieces which end a document
+                sequence_lengths = indexed_dataset.sequence_lengths[document_ids]
+                is_document_end = offsets + lengths == sequence_lengths
+                is_document_end &= numpy.isin(document_ids + 1, indexed_dataset.document_indices)
+                boundaries = numpy.cumsum(lengths)[is_document_end]
+                boundaries = boundaries[boundaries < sequence_length]
+                cu_seqlens = dataset[idx]["cu_seqlens"]
+                assert (cu_seqlens[cu_seqlens >= 0][1:-1].numpy() == boundaries).all()
+
+            # Every document of every epoch is packed, and only documents longer than a sample
+            # are split
+            pieces = dataset.document_index
+            num_epochs = (pieces[:, 1] == 0).sum() // len(indices)
+            assert (numpy.bincount(pieces[pieces[:, 1] == 0, 0]) == num_epochs).all()
+            split_document_ids = pieces[pieces[:, 1] > 0, 0]
+            assert (indexed_dataset.sequence_lengths[split_document_ids] > sample_length).all()
+            assert num_tokens / (len(dataset) * sample_length) > 0.9
+
+            # Each epoch is packed once, plus the epoch which measures the packing efficiency
+            num_documents_packed = sum(
+                call.args[1].shape[0] for call in build_packed_sample_idx.call_args_list
+            )
+            assert num_documents_packed <= (num_epochs + 1) * len(indices)
+
+            # The packed samples are cached
+            dataset_cached = GPTDataset(indexed_dataset, prefix, indices, 200, Split.train, config)
+            assert not dataset_cached.built_anew_on_cache_miss
+            assert (dataset_cached.document_index == dataset.document_index).all()
+
+
 if __name__ == "__main__":
     test_mock_gpt_dataset()
+    test_gpt_dataset_fused_index_build()
+    test_gpt_dataset_lazy_index()
+    test_gpt_dataset_packed_sequences()
+    test_gpt_dataset_bin_packing()
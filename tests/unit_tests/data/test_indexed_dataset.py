@@ -0,0 +1,328 @@
+import json
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import numpy
+import torch
+
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    IndexedDatasetManifestBuilder,
+    _MultiBinReader,
+    get_bin_path,
+    get_idx_path,
+    get_manifest_path,
+    get_word_starts_path,
+)
+from tools.merge_datasets import main as merge_main
+from tools.preprocess_data import main as build_main
+
+_NUM_DATASETS = 3
+
+_NUM_DOCUMENTS = 50
+
+_VOCAB_SIZE = 1000
+
+
+def build_dummy_datasets(odir):
+    rng = numpy.random.default_rng(seed=0)
+    prefixes = []
+    for i in range(_NUM_DATASETS):
+        prefix = os.path.join(odir, f"dataset_{i}")
+        builder = IndexedDatasetBuilder(get_bin_path(prefix), dtype=numpy.uint16)
+        for _ in range(_NUM_DOCUMENTS):
+            lengths = rng.integers(low=1, high=64, size=rng.integers(low=1, high=4)).tolist()
+            document = rng.integers(low=0, high=_VOCAB_SIZE, size=sum(lengths))
+            builder.add_document(torch.from_numpy(document), lengths)
+        builder.finalize(get_idx_path(prefix))
+        prefixes.append(prefix)
+    return prefixes
+
+
+def assert_datasets_equal(dataset_a, dataset_b):
+    assert len(dataset_a) == len(dataset_b)
+    assert (dataset_a.sequence_lengths == dataset_b.sequence_lengths).all()
+    assert (dataset_a.index.sequence_pointers == dataset_b.index.sequence_pointers).all()
+    assert (dataset_a.document_indices == dataset_b.document_indices).all()
+    for idx in range(len(dataset_a)):
+        assert (dataset_a[idx] == dataset_b[idx]).all()
+    for sequence_a, sequence_b in zip(dataset_a[:], dataset_b[:]):
+        assert (sequence_a == sequence_b).all()
+
+
+def test_manifest_builder():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefixes = build_dummy_datasets(temp_dir)
+
+        # Merge by copy
+        path_to_copy = os.path.join(temp_dir, "merge_copy")
+        builder = IndexedDatasetBuilder(get_bin_path(path_to_copy), dtype=numpy.uint16)
+        for prefix in prefixes:
+            builder.add_index(prefix)
+        builder.finalize(get_idx_path(path_to_copy))
+
+        # Merge by reference
+        path_to_reference = os.path.join(temp_dir, "merge_reference")
+        builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16)
+        for prefix in prefixes:
+            builder.add_index(prefix)
+        builder.finalize(path_to_reference)
+
+        assert not os.path.exists(get_bin_path(path_to_reference))
+        assert IndexedDataset.exists(path_to_reference)
+        with open(get_manifest_path(path_to_reference)) as reader:
+            assert len(json.load(reader)["bin_paths"]) == _NUM_DATASETS
+
+        # The index is identical to that of the merge by copy
+        with open(get_idx_path(path_to_copy), "rb") as reader_copy:
+            with open(get_idx_path(path_to_reference), "rb") as reader_reference:
+                assert reader_copy.read() == reader_reference.read()
+
+        dataset_copy = IndexedDataset(path_to_copy)
+        for mmap in [True, False]:
+            dataset_reference = IndexedDataset(path_to_reference, mmap=mmap)
+            assert isinstance(dataset_reference.bin_reader, _MultiBinReader)
+            assert_datasets_equal(dataset_copy, dataset_reference)
+
+        # A multi-file dataset may itself be merged by reference
+        path_to_nested = os.path.join(temp_dir, "merge_nested")
+        builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16)
+        builder.add_index(path_to_reference)
+        builder.add_index(prefixes[0])
+        builder.finalize(path_to_nested)
+
+        dataset_nested = IndexedDataset(path_to_nested)
+        dataset_first = IndexedDataset(prefixes[0])
+        assert len(dataset_nested) == len(dataset_copy) + len(dataset_first)
+        assert (dataset_nested[len(dataset_copy)] == dataset_first[0]).all()
+
+
+def test_multi_bin_reader():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefixes = build_dummy_datasets(temp_dir)
+
+        # Grow a multi-file dataset in place, one dataset at a time
+        path_to_reference = os.path.join(temp_dir, "merge_reference")
+        for prefix in prefixes:
+            builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16)
+            if IndexedDataset.exists(path_to_reference):
+                builder.add_index(path_to_reference)
+            builder.add_index(prefix)
+            builder.finalize(path_to_reference)
+
+        path_to_copy = os.path.join(temp_dir, "merge_copy")
+        builder = IndexedDatasetBuilder(get_bin_path(path_to_copy), dtype=numpy.uint16)
+        for prefix in prefixes:
+            builder.add_index(prefix)
+        builder.finalize(get_idx_path(path_to_copy))
+
+        dataset_copy = IndexedDataset(path_to_copy)
+        dataset_reference = IndexedDataset(path_to_reference, max_open_bin_files=1)
+        assert_datasets_equal(dataset_copy, dataset_reference)
+
+        # The data files are mmap-ed lazily and at most max_open_bin_files are held open
+        dataset_reference = IndexedDataset(path_to_reference, max_open_bin_files=2)
+        assert len(dataset_reference.bin_reader._bin_buffers) == 0
+        sequences = []
+        for idx in numpy.random.default_rng(seed=0).permutation(len(dataset_reference)):
+            sequences.append((idx, dataset_reference[idx]))
+            assert len(dataset_reference.bin_reader._bin_buffers) <= 2
+
+        # Sequences read from released data files remain valid
+        for idx, sequence in sequences:
+            assert (sequence == dataset_copy[idx]).all()
+
+
+def test_get_many():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prefixes = build_dummy_datasets(temp_dir)
+
+        path_to_reference = os.path.join(temp_dir, "merge_reference")
+        builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16)
+        for prefix in prefixes:
+            builder.add_index(prefix)
+        builder.finalize(path_to_reference)
+
+        rng = numpy.random.default_rng(seed=0)
+        for dataset in [IndexedDataset(prefixes[0]), IndexedDataset(path_to_reference)]:
+            for _ in range(100):
+                # Runs of consecutive sequences, as in a GPTDataset sample, to exercise coalescing
+                beg = rng.integers(low=0, high=len(dataset))
+                indices = numpy.arange(beg, min(beg + rng.integers(low=1, high=8), len(dataset)))
+                indices = numpy.concatenate((indices, rng.integers(0, len(dataset), size=2)))
+                offsets = rng.integers(low=0, high=dataset.sequence_lengths[indices])
+                lengths = rng.integers(low=0, high=dataset.sequence_lengths[indices] - offsets + 1)
+
+                expected = numpy.concatenate(
+                    [
+                        dataset.get(idx, offset=offset, length=length)
+                        for idx, offset, length in zip(indices, offsets, lengths)
+                    ]
+                )
+
+                tokens = dataset.get_many(indices, offsets, lengths)
+                assert tokens.dtype == numpy.uint16
+                assert (tokens == expected).all()
+
+                # Any sequence of indices, offsets and lengths
+                tokens = dataset.get_many(indices.tolist(), offsets.tolist(), lengths.tolist())
+                assert (tokens == expected).all()
+
+                out = torch.full((expected.shape[0] + 5,), -1, dtype=torch.int64)
+                tokens = dataset.get_many(indices, offsets, lengths, out=out)
+                assert (tokens == expected).all()
+                assert (out[: expected.shape[0]].numpy() == expected).all()
+                assert (out[expected.shape[0] :] == -1).all()
+
+            # By default, read entire sequences
+            indices = numpy.arange(len(dataset))
+            assert (dataset.get_many(indices) == numpy.concatenate(dataset[:])).all()
+
+
+def test_preprocess_data_index_only_merge():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_to_raw = os.path.join(temp_dir, "numbers.jsonl")
+        with open(path_to_raw, "w") as writer:
+            for i in range(100):
+                writer.write(json.dumps({"text": " ".join(str(j + 1) for j in range(i + 1))}))
+                writer.write("\n")
+
+        null_args = [
+            "--input",
+            path_to_raw,
+            "--tokenizer-type",
+            "NullTokenizer",
+            "--vocab-size",
+            str(_VOCAB_SIZE),
+            "--append-eod",
+            "--workers",
+            "2",
+            "--partitions",
+            "2",
+        ]
+
+        prefix_copy = os.path.join(temp_dir, "copy")
+        sys.argv = [sys.argv[0], "--output-prefix", prefix_copy] + null_args
+        build_main()
+
+        prefix_reference = os.path.join(temp_dir, "reference")
+        sys.argv = [sys.argv[0], "--output-prefix", prefix_reference, "--index-only-merge"]
+        sys.argv += null_args
+        build_main()
+
+        dataset_copy = IndexedDataset(f"{prefix_copy}_text_document")
+        dataset_reference = IndexedDataset(f"{prefix_reference}_text_document")
+        assert isinstance(dataset_reference.bin_reader, _MultiBinReader)
+        assert_datasets_equal(dataset_copy, dataset_reference)
+
+
+def test_merge_datasets():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_dir = os.path.join(temp_dir, "input")
+        os.makedirs(input_dir)
+        prefixes = build_dummy_datasets(input_dir)
+
+        # The input may itself hold a multi-file dataset
+        path_to_reference = os.path.join(input_dir, "dataset_3")
+        builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16)
+        for prefix in prefixes[:2]:
+            builder.add_index(prefix)
+        builder.finalize(path_to_reference)
+
+        path_to_expected = os.path.join(temp_dir, "expected")
+        builder = IndexedDatasetBuilder(get_bin_path(path_to_expected), dtype=numpy.uint16)
+        for prefix in prefixes + prefixes[:2]:
+            builder.add_index(prefix)
+        builder.finalize(get_idx_path(path_to_expected))
+        dataset_expected = IndexedDataset(path_to_expected)
+
+        path_to_copy = os.path.join(temp_dir, "merge_copy")
+        sys.argv = [sys.argv[0], "--input", input_dir, "--output-prefix", path_to_copy]
+        merge_main()
+        assert_datasets_equal(dataset_expected, IndexedDataset(path_to_copy))
+
+        path_to_index_only = os.path.join(temp_dir, "merge_index_only")
+        sys.argv = [sys.argv[0], "--input", input_dir, "--output-prefix", path_to_index_only]
+        sys.argv += ["--index-only"]
+        merge_main()
+        assert not os.path.exists(get_bin_path(path_to_index_only))
+        assert_datasets_equal(dataset_expected, IndexedDataset(path_to_index_only))
+
+        # The data are copied all the same where copy_file_range is refused
+        path_to_fallback = os.path.join(temp_dir, "merge_fallback")
+        with mock.patch("os.copy_file_range", side_effect=OSError("refused"), create=True):
+            builder = IndexedDatasetBuilder(get_bin_path(path_to_fallback), dtype=numpy.uint16)
+            for prefix in prefixes + [path_to_reference]:
+                builder.add_index(prefix)
+            builder.finalize(get_idx_path(path_to_fallback))
+        with open(get_bin_path(path_to_expected), "rb") as reader_expected:
+            with open(get_bin_path(path_to_fallback), "rb") as reader_fallback:
+                assert reader_expected.read() == reader_fallback.read()
+
+
+def test_word_starts():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        rng = numpy.random.default_rng(seed=0)
+        prefixes, word_starts = [], []
+        for i in range(_NUM_DATASETS):
+            prefix = os.path.join(temp_dir, f"dataset_{i}")
+            builder = IndexedDatasetBuilder(
+                get_bin_path(prefix),
+                dtype=numpy.uint16,
+                word_starts_path=get_word_starts_path(prefix),
+            )
+            for _ in range(_NUM_DOCUMENTS):
+                # Odd lengths, so that the sequences do not start on a byte of the bitmap
+                lengths = rng.integers(low=1, high=13, size=rng.integers(low=1, high=4)).tolist()
+                document = rng.integers(low=0, high=_VOCAB_SIZE, size=sum(lengths))
+                document_word_starts = rng.random(sum(lengths)) < 0.5
+                builder.add_document(
+                    torch.from_numpy(document), lengths, word_starts=document_word_starts
+                )
+                word_starts.extend(numpy.split(document_word_starts, numpy.cumsum(lengths)[:-1]))
+            builder.finalize(get_idx_path(prefix))
+            prefixes.append(prefix)
+
+        # Merge by copy and by reference, growing the latter in place
+        path_to_copy = os.path.join(temp_dir, "merge_copy")
+        builder = IndexedDatasetBuilder(
+            get_bin_path(path_to_copy),
+            dtype=numpy.uint16,
+            word_starts_path=get_word_starts_path(path_to_copy),
+        )
+        for prefix in prefixes:
+            builder.add_index(prefix)
+        builder.finalize(get_idx_path(path_to_copy))
+
+        path_to_reference = os.path.join(temp_dir, "merge_reference")
+        for prefix in prefixes:
+            builder = IndexedDatasetManifestBuilder(dtype=numpy.uint16, word_starts=True)
+            if IndexedDataset.exists(path_to_reference):
+                builder.add_index(path_to_reference)
+            builder.add_index(prefix)
+            builder.finalize(path_to_reference)
+
+        for dataset in [IndexedDataset(path_to_copy), IndexedDataset(path_to_reference)]:
+            assert dataset.has_word_starts
+            assert len(dataset) == len(word_starts)
+            for idx in range(len(dataset)):
+                assert (dataset.get_word_starts(idx) == word_starts[idx]).all()
+                length = dataset.sequence_lengths[idx]
+                assert (dataset.get_word_starts(idx, 1, length - 1) == word_starts[idx][1:]).all()
+
+        # The word starts are optional
+        os.mkdir(os.path.join(temp_dir, "no_word_starts"))
+        prefix = build_dummy_datasets(os.path.join(temp_dir, "no_word_starts"))[0]
+        assert not IndexedDataset(prefix).has_word_starts
+
+
+if __name__ == "__main__":
+    test_manifest_builder()
+    test_multi_bin_reader()
+    test_get_many()
+    test_preprocess_data_index_only_merge()
+    test_merge_datasets()
+    test_word_starts()
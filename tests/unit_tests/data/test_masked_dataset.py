@@ -0,0 +1,137 @@
+import os
+import tempfile
+
+import numpy
+import torch
+
+from megatron.core.datasets.bert_dataset import BERTMaskedWordPieceDataset
+from megatron.core.datasets.indexed_dataset import (
+    IndexedDataset,
+    IndexedDatasetBuilder,
+    get_bin_path,
+    get_idx_path,
+    get_word_starts_path,
+)
+from megatron.core.datasets.t5_dataset import T5MaskedWordPieceDataset
+from megatron.core.datasets.utils import Split
+from tools.benchmark_masked_dataset import (
+    ReferenceBERTMaskedWordPieceDataset,
+    ReferenceT5MaskedWordPieceDataset,
+    get_config,
+)
+
+_NUM_WORDS = 200
+
+_NUM_PIECES = 100
+
+_NUM_DOCUMENTS = 100
+
+_NUM_SAMPLES = 300
+
+
+def build_dummy_vocab(odir):
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab += [f"w{i}" for i in range(_NUM_WORDS)] + [f"##p{i}" for i in range(_NUM_PIECES)]
+    vocab_file = os.path.join(odir, "vocab.txt")
+    with open(vocab_file, "w") as writer:
+        writer.write("\n".join(vocab) + "\n")
+    return vocab_file
+
+
+def build_dummy_dataset(odir, word_starts=False):
+    rng = numpy.random.default_rng(seed=0)
+    prefix = os.path.join(odir, "dataset_word_starts" if word_starts else "dataset")
+    builder = IndexedDatasetBuilder(
+        get_bin_path(prefix),
+        dtype=numpy.int32,
+        word_starts_path=get_word_starts_path(prefix) if word_starts else None,
+    )
+    for _ in range(_NUM_DOCUMENTS):
+        lengths = rng.integers(low=1, high=48, size=rng.integers(low=2, high=8)).tolist()
+        # Words followed by pieces, with a piece at the start of some sentences
+        is_piece = rng.random(sum(lengths)) < 0.4
+        document = numpy.where(
+            is_piece,
+            rng.integers(low=5 + _NUM_WORDS, high=5 + _NUM_WORDS + _NUM_PIECES, size=sum(lengths)),
+            rng.integers(low=5, high=5 + _NUM_WORDS, size=sum(lengths)),
+        )
+        builder.add_document(torch.from_numpy(document), lengths, word_starts=~is_piece)
+    builder.finalize(get_idx_path(prefix))
+    return prefix
+
+
+class _Args:
+    def __init__(self, vocab_file, model, **kwargs):
+        self.vocab_file = vocab_file
+        self.model = model
+        self.seq_length = 128
+        self.mask_prob = 0.15
+        self.max_ngram = 3
+        self.permutation = False
+        self.geometric = False
+        self.__dict__.update(kwargs)
+
+
+def test_masked_dataset():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        vocab_file = build_dummy_vocab(temp_dir)
+        prefix = build_dummy_dataset(temp_dir)
+        indexed_dataset = IndexedDataset(prefix)
+        indexed_indices = numpy.arange(_NUM_DOCUMENTS, dtype=numpy.int32)
+
+        # The same corpus with the word starts precomputed
+        prefix_word_starts = build_dummy_dataset(temp_dir, word_starts=True)
+        indexed_dataset_word_starts = IndexedDataset(prefix_word_starts)
+        assert indexed_dataset_word_starts.has_word_starts
+
+        for model, kwargs in [
+            ("bert", {}),
+            ("bert", {"permutation": True, "max_ngram": 4}),
+            ("bert", {"geometric": True, "mask_prob": 0.3}),
+            ("t5", {}),
+            ("t5", {"geometric": True, "max_ngram": 10}),
+        ]:
+            args = _Args(vocab_file, model, **kwargs)
+            config = get_config(args, os.path.join(temp_dir, "cache"))
+            if model == "t5":
+                dataset_classes = [ReferenceT5MaskedWordPieceDataset, T5MaskedWordPieceDataset]
+            else:
+                dataset_classes = [ReferenceBERTMaskedWordPieceDataset, BERTMaskedWordPieceDataset]
+            reference, dataset = [
+                dataset_class(
+                    indexed_dataset, prefix, indexed_indices, _NUM_SAMPLES, Split.train, config
+                )
+                for dataset_class in dataset_classes
+            ]
+            dataset_word_starts = dataset_classes[1](
+                indexed_dataset_word_starts,
+                prefix_word_starts,
+                indexed_indices,
+                _NUM_SAMPLES,
+                Split.train,
+                config,
+            )
+
+            # The samples are identical to those of the original masking loop
+            for idx in range(_NUM_SAMPLES):
+                numpy.random.seed(idx)
+                sample_reference = reference[idx]
+                for sample_dataset in [dataset, dataset_word_starts]:
+                    numpy.random.seed(idx)
+                    sample = sample_dataset[idx]
+                    assert sample.keys() == sample_reference.keys()
+                    for key in sample:
+                        assert numpy.array_equal(sample[key], sample_reference[key])
+            assert dataset_word_starts.word_start_lookup is None
+
+            # Check the masking of a sample with pieces after the sentence boundaries
+            tokens = [config.tokenizer.cls, 5, 5 + _NUM_WORDS, config.tokenizer.sep]
+            tokens += [5 + _NUM_WORDS, 6, 5 + _NUM_WORDS]
+            for idx in range(20):
+                predictions = dataset._create_masked_lm_predictions(
+                    tokens, 6, numpy.random.RandomState(idx)
+                )
+                predictions_reference = reference._create_masked_lm_predictions(
+                    tokens, 6, numpy.random.RandomState(idx)
+                )
+                assert predictions == predictions_reference
@@ -0,0 +1,118 @@
+import gzip
+import json
+import os
+import tempfile
+
+import numpy
+import torch
+
+from megatron.core.datasets.gpt_dataset import GPTDatasetConfig
+from megatron.core.datasets.streaming_gpt_dataset import StreamingGPTDataset
+from megatron.training.tokenizer.tokenizer import _NullTokenizer
+
+_NUM_SHARDS = 5
+
+_NUM_DOCUMENTS = 40
+
+_VOCAB_SIZE = 1000
+
+
+def build_dummy_shards(odir):
+    rng = numpy.random.default_rng(seed=0)
+    paths, documents = [], []
+    for i in range(_NUM_SHARDS):
+        path = os.path.join(odir, f"shard_{i}.jsonl" + (".gz" if i % 2 else ""))
+        shard = []
+        with (gzip.open(path, "wt") if i % 2 else open(path, "wt")) as writer:
+            for _ in range(_NUM_DOCUMENTS):
+                # Mix short documents with documents longer than a sample
+                length = rng.integers(low=1, high=200 if rng.random() < 0.2 else 20)
+                document = rng.integers(low=0, high=_VOCAB_SIZE - 1, size=length)
+                writer.write(json.dumps({"text": " ".join(map(str, document))}) + "\n")
+                shard.append(document)
+            writer.write("\n")
+        paths.append(path)
+        documents.append(shard)
+    return paths, documents
+
+
+def get_config(sequence_length, add_extra_token_to_sequence):
+    return GPTDatasetConfig(
+        random_seed=1234,
+        sequence_length=sequence_length,
+        reset_position_ids=False,
+        reset_attention_mask=False,
+        eod_mask_loss=False,
+        add_extra_token_to_sequence=add_extra_token_to_sequence,
+        tokenizer=_NullTokenizer(vocab_size=_VOCAB_SIZE),
+    )
+
+
+def test_streaming_gpt_dataset():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, documents = build_dummy_shards(temp_dir)
+
+        for sequence_length, add_extra_token_to_sequence in [(32, True), (16, False)]:
+            config = get_config(sequence_length, add_extra_token_to_sequence)
+            sample_length = sequence_length + add_extra_token_to_sequence
+            eod = config.tokenizer.eod
+
+            # The samples of a stream are cut from the concatenated documents of its shards
+            dataset = StreamingGPTDataset(paths, config, rank=1, world_size=2)
+            samples = list(dataset)
+            stream = numpy.concatenate(
+                [numpy.append(document, eod) for i in [1, 3] for document in documents[i]]
+            )
+            assert len(samples) == (stream.shape[0] - sample_length) // sequence_length + 1
+            for i, sample in enumerate(samples):
+                text = stream[i * sequence_length : i * sequence_length + sample_length]
+                assert (sample["tokens"].numpy() == text[:sequence_length]).all()
+                if add_extra_token_to_sequence:
+                    assert (sample["labels"].numpy() == text[1:]).all()
+
+            # Resume from every position
+            for num_drawn in range(0, len(samples), 7):
+                dataset = StreamingGPTDataset(paths, config, rank=1, world_size=2)
+                for sample in samples[:num_drawn]:
+                    dataset.record_position(sample)
+                state_dict = json.loads(json.dumps(dataset.state_dict()))
+
+                dataset_resumed = StreamingGPTDataset(paths, config, rank=1, world_size=2)
+                dataset_resumed.load_state_dict(state_dict)
+                samples_resumed = list(dataset_resumed)
+                assert len(samples_resumed) == len(samples) - num_drawn
+                for sample, sample_resumed in zip(samples[num_drawn:], samples_resumed):
+                    assert (sample["tokens"] == sample_resumed["tokens"]).all()
+
+
+def test_streaming_gpt_dataset_data_loader():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths, _ = build_dummy_shards(temp_dir)
+        config = get_config(32, True)
+
+        get_data_loader = lambda dataset: torch.utils.data.DataLoader(
+            dataset, batch_size=4, num_workers=2
+        )
+
+        dataset = StreamingGPTDataset(paths, config)
+        batches = list(get_data_loader(dataset))
+        stream_ids = set(batch["stream_position"][:, 1].tolist()[0] for batch in batches)
+        assert stream_ids == {0, 1}
+
+        # Record the positions of the batches drawn, then resume in a new data loader
+        num_drawn = 5
+        for batch in batches[:num_drawn]:
+            dataset.record_position(batch)
+        dataset_resumed = StreamingGPTDataset(paths, config)
+        dataset_resumed.load_state_dict(dataset.state_dict())
+        batches_resumed = list(get_data_loader(dataset_resumed))
+
+        tokens = lambda batches: sorted(
+            tuple(tokens.tolist()) for batch in batches for tokens in batch["tokens"]
+        )
+        assert tokens(batches_resumed) == tokens(batches[num_drawn:])
+
+
+if __name__ == "__main__":
+    test_streaming_gpt_dataset()
+    test_streaming_gpt_dataset_data_loader()
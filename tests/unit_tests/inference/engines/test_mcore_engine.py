@@ -8,6 +8,7 @@ from megatron.core.inference.common_inference_params import CommonInferenceParam
 from megatron.core.inference.engines.mcore_engine import MCoreEngine
 from megatron.core.inference.model_inference_wrappers.gpt.gpt_inference_wrapper import GPTInferenceWrapper
 from megatron.core.inference.inference_request import InferenceRequest, Status
+from megatron.core.inference.scheduling_policies import PriorityPolicy
 from megatron.core.inference.text_generation_controllers.simple_text_generation_controller import SimpleTextGenerationController
 from megatron.core.models.gpt.gpt_layer_specs import get_gpt_layer_local_spec
 from megatron.core.models.gpt.gpt_model import GPTModel
@@ -15,13 +16,15 @@ from megatron.core.tensor_parallel.random import model_parallel_cuda_manual_seed
 from megatron.core.transformer.transformer_config import TransformerConfig
 from tests.unit_tests.test_utilities import Utils
 from unittest import mock
+import pytest
 
 class TestMCoreEngine:
-    def setup_method(self, method):
+    def setup_method(self, method, position_embedding_type='learned_absolute'):
         Utils.initialize_model_parallel(tensor_model_parallel_size=1,pipeline_model_parallel_size=1)
         model_parallel_cuda_manual_seed(123)          
         self.batch_size = 4
-        self.hidden_size = 12
+        # RoPE needs an even head dim
+        self.hidden_size = 16 if position_embedding_type == 'rope' else 12
         self.vocab_size = 100
         self.sequence_length = 64
         transformer_config = TransformerConfig(num_layers=4, hidden_size=self.hidden_size, num_attention_heads=4, use_cpu_initialization=True)
@@ -31,7 +34,8 @@ class TestMCoreEngine:
             transformer_layer_spec=get_gpt_layer_local_spec(), 
             vocab_size=self.vocab_size, 
             max_sequence_length=self.sequence_length, 
-            parallel_output = True).cuda()
+            parallel_output = True,
+            position_embedding_type=position_embedding_type).cuda()
 
         inference_wrapper_config = InferenceWrapperConfig(
             hidden_size=self.hidden_size,
@@ -43,9 +47,9 @@ class TestMCoreEngine:
 
         inference_wrapped_model = GPTInferenceWrapper(gpt_model, inference_wrapper_config)
         self.mock_tokenizer = mock.Mock()
-        text_generation_controller = SimpleTextGenerationController(inference_wrapped_model=inference_wrapped_model, tokenizer=self.mock_tokenizer)       
+        self.text_generation_controller = SimpleTextGenerationController(inference_wrapped_model=inference_wrapped_model, tokenizer=self.mock_tokenizer)
 
-        self.mcore_engine = MCoreEngine(text_generation_controller=text_generation_controller, max_batch_size=4)
+        self.mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=4)
 
     def test_generate(self):
         self.mock_tokenizer.vocab_size = self.vocab_size
@@ -62,3 +66,179 @@ class TestMCoreEngine:
             assert result.status == Status.COMPLETED, f"Status should be completed but its {result.status}"
             assert result.generated_length > 0 , f"Generated length should be greater than zero"
             assert result.generated_text is not None , f'Generated text should not be None'
+
+    @pytest.mark.parametrize("position_embedding_type", ["learned_absolute", "rope"])
+    def test_generate_dynamic_batch(self, position_embedding_type):
+        self.setup_method(None, position_embedding_type=position_embedding_type)
+        self.mock_tokenizer.vocab_size = self.vocab_size
+        self.mock_tokenizer.eod = self.vocab_size - 1
+        # Prompts of mixed lengths, each with its own number of tokens to generate
+        prompts_tokens = {f"prompt {i}": [random.randint(0, self.vocab_size - 2) for _ in range(random.randint(3, 20))] for i in range(10)}
+        self.mock_tokenizer.tokenize.side_effect = lambda prompt: list(prompts_tokens[prompt])
+        self.mock_tokenizer.detokenize.side_effect = lambda tokens: ' '.join(map(str, tokens))
+        inference_parameters = {prompt: CommonInferenceParams(top_k=1, num_tokens_to_generate=random.randint(1, 15), return_log_probs=True) for prompt in prompts_tokens}
+
+        # Greedy generation gives the same tokens as a static batch of each request alone
+        expected_results = {}
+        for prompt in prompts_tokens:
+            mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=1)
+            expected_results[prompt] = list(mcore_engine.generate([prompt], inference_parameters[prompt]))[0]
+
+        # The default pool of key-value memory blocks, and a pool too small for a full batch, where the requests wait for blocks
+        small_pool_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=8, kv_block_size=4, num_kv_blocks=12)
+        for mcore_engine in [self.mcore_engine, small_pool_engine]:
+            for prompt in prompts_tokens:
+                mcore_engine.scheduler.add_request(prompt, self.mock_tokenizer.tokenize(prompt), inference_parameters[prompt])
+            mcore_engine.run_engine(dynamic_generation=True)
+
+            results = list(mcore_engine.scheduler.completed_request_pool.values())
+            assert len(results) == len(prompts_tokens)
+            for result in results:
+                expected_result = expected_results[result.prompt]
+                assert result.status == Status.COMPLETED
+                assert result.generated_length == expected_result.generated_length <= inference_parameters[result.prompt].num_tokens_to_generate
+                assert result.generated_tokens.tolist() == expected_result.generated_tokens.tolist()
+                assert result.generated_text == ' '.join(map(str, result.generated_tokens.tolist()))
+                assert result.generated_log_probs.shape == (result.generated_length,)
+                assert bool(torch.all(result.generated_log_probs <= 0))
+
+            # The key-value memory blocks of the completed requests were all released
+            kv_block_allocator = self.text_generation_controller.kv_block_allocator
+            assert kv_block_allocator.get_num_free_blocks() == kv_block_allocator.num_blocks - 1
+            assert not self.text_generation_controller.block_tables
+
+    def test_generate_dynamic_batch_prefix_caching(self):
+        self.mock_tokenizer.vocab_size = self.vocab_size
+        self.mock_tokenizer.eod = self.vocab_size - 1
+        # Prompts which share a few system prompts, some of them whole
+        system_prompts = [[random.randint(0, self.vocab_size - 2) for _ in range(random.randint(8, 20))] for _ in range(3)]
+        prompts_tokens = {f"prompt {i}": random.choice(system_prompts) + [random.randint(0, self.vocab_size - 2) for _ in range(random.randint(0, 6))] for i in range(12)}
+        self.mock_tokenizer.tokenize.side_effect = lambda prompt: list(prompts_tokens[prompt])
+        self.mock_tokenizer.detokenize.side_effect = lambda tokens: ' '.join(map(str, tokens))
+        inference_parameters = CommonInferenceParams(top_k=1, num_tokens_to_generate=8)
+
+        expected_results = {}
+        for prompt in prompts_tokens:
+            mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=1)
+            expected_results[prompt] = list(mcore_engine.generate([prompt], inference_parameters))[0]
+
+        # A pool too small to cache all the prompts, which evicts the least recently used blocks
+        mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=4, kv_block_size=4, num_kv_blocks=32, enable_prefix_caching=True)
+        for _ in range(2):
+            results = list(mcore_engine.generate(list(prompts_tokens), inference_parameters, dynamic_generation=True))
+            for result in results:
+                assert result.generated_tokens.tolist() == expected_results[result.prompt].generated_tokens.tolist()
+            mcore_engine.scheduler.completed_request_pool.clear()
+
+            # The blocks of the completed requests are either free or cached, and no longer in use
+            prefix_cache = self.text_generation_controller.prefix_cache
+            kv_block_allocator = self.text_generation_controller.kv_block_allocator
+            assert kv_block_allocator.get_num_free_blocks() + prefix_cache.num_blocks == kv_block_allocator.num_blocks - 1
+            assert not self.text_generation_controller.block_tables
+
+            metrics = mcore_engine.get_prefix_cache_metrics()
+            assert metrics["requests"] == len(prompts_tokens)
+            assert metrics["saved-tokens"] > 0
+            assert 0.0 < metrics["hit-rate"] < 1.0
+            assert mcore_engine.get_prefix_cache_metrics()["requests"] == 0
+
+    @pytest.mark.parametrize("position_embedding_type", ["learned_absolute", "rope"])
+    def test_generate_dynamic_batch_chunked_prefill(self, position_embedding_type):
+        self.setup_method(None, position_embedding_type=position_embedding_type)
+        self.mock_tokenizer.vocab_size = self.vocab_size
+        self.mock_tokenizer.eod = self.vocab_size - 1
+        # Long prompts among short ones, whose last chunks are padded past the maximum sequence length
+        prompts_tokens = {f"prompt {i}": [random.randint(0, self.vocab_size - 2) for _ in range(length)] for i, length in enumerate([40, 3, 5, 40, 12, 3, 40, 5, 12, 3])}
+        self.mock_tokenizer.tokenize.side_effect = lambda prompt: list(prompts_tokens[prompt])
+        self.mock_tokenizer.detokenize.side_effect = lambda tokens: ' '.join(map(str, tokens))
+        inference_parameters = CommonInferenceParams(top_k=1, num_tokens_to_generate=6)
+
+        expected_results = {}
+        for prompt in prompts_tokens:
+            mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=1)
+            expected_results[prompt] = list(mcore_engine.generate([prompt], inference_parameters))[0]
+
+        # Record the number of tokens fed to the model at each step
+        num_tokens_per_step = []
+        generate_step = self.text_generation_controller.generate_output_tokens_dynamic_batch
+        forward_step = self.text_generation_controller._run_dynamic_batch_forward_step
+        def record_generate_step(*args, **kwargs):
+            num_tokens_per_step.append(0)
+            return generate_step(*args, **kwargs)
+        def record_forward_step(requests, tokens, sequence_len_offsets, num_tokens):
+            num_tokens_per_step[-1] += sum(num_tokens)
+            return forward_step(requests, tokens, sequence_len_offsets, num_tokens)
+
+        mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=4, max_num_tokens_per_step=13)
+        with mock.patch.object(self.text_generation_controller, 'generate_output_tokens_dynamic_batch', side_effect=record_generate_step), \
+                mock.patch.object(self.text_generation_controller, '_run_dynamic_batch_forward_step', side_effect=record_forward_step):
+            results = list(mcore_engine.generate(list(prompts_tokens), inference_parameters, dynamic_generation=True))
+
+        assert len(results) == len(prompts_tokens)
+        for result in results:
+            assert result.generated_tokens.tolist() == expected_results[result.prompt].generated_tokens.tolist()
+        assert max(num_tokens_per_step) == 13
+        # Each prompt token is fed once, and each generated token but the last one, unless the request stopped at the end of document token
+        num_fed_generated_tokens = sum(result.generated_length - (result.generated_length == inference_parameters.num_tokens_to_generate) for result in results)
+        assert sum(num_tokens_per_step) == sum(len(tokens) for tokens in prompts_tokens.values()) + num_fed_generated_tokens
+
+        # A prompt with a cached prefix prefilled along a longer prompt, with its padding past the maximum sequence length
+        mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=4, kv_block_size=4, num_kv_blocks=64, enable_prefix_caching=True)
+        list(mcore_engine.generate(["prompt 4"], inference_parameters, dynamic_generation=True))
+        mcore_engine.scheduler.completed_request_pool.clear()
+        results = list(mcore_engine.generate(["prompt 4", "prompt 0"], inference_parameters, dynamic_generation=True))
+        assert mcore_engine.get_prefix_cache_metrics()["saved-tokens"] == 8
+        for result in results:
+            assert result.generated_tokens.tolist() == expected_results[result.prompt].generated_tokens.tolist()
+
+    @pytest.mark.parametrize("position_embedding_type", ["learned_absolute", "rope"])
+    def test_generate_dynamic_batch_preemption(self, position_embedding_type):
+        self.setup_method(None, position_embedding_type=position_embedding_type)
+        self.mock_tokenizer.vocab_size = self.vocab_size
+        self.mock_tokenizer.eod = self.vocab_size - 1
+        # Requests of higher priority which arrive while the batch is full of requests of lower priority, no longer than the first request, which sets the maximum sequence length
+        prompts_tokens = {f"prompt {i}": [random.randint(0, self.vocab_size - 2) for _ in range(20 if i == 0 else random.randint(3, 20))] for i in range(12)}
+        urgent_prompts = [f"prompt {i}" for i in range(8, 12)]
+        self.mock_tokenizer.tokenize.side_effect = lambda prompt: list(prompts_tokens[prompt])
+        self.mock_tokenizer.detokenize.side_effect = lambda tokens: ' '.join(map(str, tokens))
+        inference_parameters = CommonInferenceParams(top_k=1, num_tokens_to_generate=12)
+
+        expected_results = {}
+        for prompt in prompts_tokens:
+            mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=1)
+            expected_results[prompt] = list(mcore_engine.generate([prompt], inference_parameters))[0]
+
+        # Preempted requests which are generating, and with chunked prefill and prefix caching, which are prefilling
+        for engine_kwargs in [{}, {"max_num_tokens_per_step": 8, "enable_prefix_caching": True}]:
+            mcore_engine = MCoreEngine(text_generation_controller=self.text_generation_controller, max_batch_size=4, kv_block_size=4, num_kv_blocks=32, scheduling_policy=PriorityPolicy(), enable_preemption=True, **engine_kwargs)
+            for prompt in prompts_tokens:
+                if prompt not in urgent_prompts:
+                    mcore_engine.scheduler.add_request(prompt, self.mock_tokenizer.tokenize(prompt), inference_parameters)
+
+            num_steps = []
+            update_requests_pools = mcore_engine.scheduler.update_requests_pools
+            def add_urgent_requests(result_dict=None):
+                num_steps.append(1)
+                if len(num_steps) == 3:
+                    for prompt in urgent_prompts:
+                        mcore_engine.scheduler.add_request(prompt, self.mock_tokenizer.tokenize(prompt), inference_parameters, priority=1)
+                update_requests_pools(result_dict=result_dict)
+            with mock.patch.object(mcore_engine.scheduler, 'update_requests_pools', side_effect=add_urgent_requests):
+                mcore_engine.run_engine(dynamic_generation=True)
+
+            results = list(mcore_engine.scheduler.completed_request_pool.values())
+            assert len(results) == len(prompts_tokens)
+            for result in results:
+                assert result.generated_tokens.tolist() == expected_results[result.prompt].generated_tokens.tolist()
+            metrics = mcore_engine.get_scheduler_metrics()
+            assert metrics["completed-requests"] == len(prompts_tokens)
+            assert metrics["preemptions"] > 0
+            assert 0.0 <= metrics["queue-time-p50"] <= metrics["queue-time-p99"] <= metrics["completion-time-p99"]
+
+            # The swapped requests all resumed, and their blocks were all released
+            kv_block_allocator = self.text_generation_controller.kv_block_allocator
+            prefix_cache = self.text_generation_controller.prefix_cache
+            num_cached_blocks = 0 if prefix_cache is None else prefix_cache.num_blocks
+            assert kv_block_allocator.get_num_free_blocks() + num_cached_blocks == kv_block_allocator.num_blocks - 1
+            assert not self.text_generation_controller.block_tables
+            assert not self.text_generation_controller.swapped_requests
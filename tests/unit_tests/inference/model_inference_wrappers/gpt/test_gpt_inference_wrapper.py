@@ -7,6 +7,7 @@ from megatron.core.models.gpt.gpt_layer_specs import get_gpt_layer_local_spec, g
 from megatron.core.transformer.transformer_config import TransformerConfig
 from megatron.core.models.gpt.gpt_model import GPTModel
 from tests.unit_tests.test_utilities import Utils
+import pytest
 from megatron.core.tensor_parallel.random import model_parallel_cuda_manual_seed
 
 class TestGPTInferenceWrapper:
@@ -79,3 +80,11 @@ class TestGPTInferenceWrapper:
         
         assert logits.shape == (self.batch_size, 5, self.vocab_size), f"Shape mismatch . Expected {(self.batch_size, 5, self.vocab_size)}, but got {logits.shape}"
 
+    def test_prep_model_for_dynamic_inference(self):
+        self.setup_model(tensor_parallel_size=1, pipeline_parallel_size=1)
+        assert not self.inference_wrapped_model.prep_model_for_dynamic_inference(max_batch_size=4, max_sequence_length=self.sequence_length, kv_block_size=4, num_kv_blocks=33)
+
+        # Only the local core attention supports the attention mask of dynamic batches
+        self.inference_wrapped_model.model.decoder.layers[0].self_attention.core_attention = torch.nn.Module()
+        with pytest.raises(AssertionError, match="local core attention"):
+            self.inference_wrapped_model.prep_model_for_dynamic_inference(max_batch_size=4, max_sequence_length=self.sequence_length, kv_block_size=4, num_kv_blocks=33)
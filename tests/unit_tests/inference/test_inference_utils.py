@@ -1,4 +1,4 @@
-from megatron.core.inference.utils import Counter
+from megatron.core.inference.utils import Counter, LatencyHistogram
 
 class TestInferenceUtils:
 
@@ -9,3 +9,16 @@ class TestInferenceUtils:
         assert counter.counter == 1, f'Counter should be 1 but it is {counter.counter}'
         counter.reset()
         assert counter.counter == 0, f'Counter should be 0 but it is {counter.counter}'
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram(min_latency=0.1, growth_factor=2.0, num_buckets=4)
+        assert histogram.get_percentile(99) == 0.0, 'Percentile of an empty histogram should be 0.0'
+        for latency in [0.05] * 90 + [0.3] * 9 + [0.5]:
+            histogram.add(latency)
+        assert histogram.get_percentile(50) == 0.1, f'p50 should be the bound 0.1 but it is {histogram.get_percentile(50)}'
+        assert histogram.get_percentile(99) == 0.4, f'p99 should be the bound 0.4 but it is {histogram.get_percentile(99)}'
+        assert histogram.get_percentile(100) == 0.5, f'p100 should be capped by the max latency 0.5 but it is {histogram.get_percentile(100)}'
+        histogram.add(10.0)
+        assert histogram.get_percentile(100) == 10.0, f'Latencies above all the bounds should give the max latency but it is {histogram.get_percentile(100)}'
+        histogram.reset()
+        assert histogram.num_latencies == 0 and histogram.get_percentile(50) == 0.0
@@ -0,0 +1,30 @@
+import pytest
+
+from megatron.core.inference.kv_block_allocator import KVBlockAllocator
+
+
+class TestKVBlockAllocator:
+
+    def setup_method(self, method):
+        self.num_blocks = 8
+        self.block_size = 4
+        self.kv_block_allocator = KVBlockAllocator(self.num_blocks, self.block_size)
+
+    def test_kv_block_allocator(self):
+        assert self.kv_block_allocator.get_num_blocks(1) == 1
+        assert self.kv_block_allocator.get_num_blocks(4) == 1
+        assert self.kv_block_allocator.get_num_blocks(5) == 2
+
+        # Block 0 is kept for padding
+        assert self.kv_block_allocator.get_num_free_blocks() == self.num_blocks - 1
+        blocks = self.kv_block_allocator.allocate(3)
+        other_blocks = self.kv_block_allocator.allocate(4)
+        assert sorted(blocks + other_blocks) == list(range(1, self.num_blocks))
+        assert self.kv_block_allocator.get_num_free_blocks() == 0
+        with pytest.raises(AssertionError):
+            self.kv_block_allocator.allocate(1)
+
+        # The freed blocks are allocated again
+        self.kv_block_allocator.free(blocks)
+        assert self.kv_block_allocator.get_num_free_blocks() == 3
+        assert sorted(self.kv_block_allocator.allocate(3)) == sorted(blocks)
@@ -0,0 +1,64 @@
+from megatron.core.inference.kv_block_allocator import KVBlockAllocator
+from megatron.core.inference.prefix_cache import PrefixCache
+
+
+class TestPrefixCache:
+
+    def setup_method(self, method):
+        self.block_size = 4
+        self.kv_block_allocator = KVBlockAllocator(16, self.block_size)
+        self.prefix_cache = PrefixCache(self.kv_block_allocator, max_num_blocks=4)
+
+    def cache_sequence(self, tokens):
+        nodes = self.prefix_cache.match(tokens, len(tokens) - 1)
+        num_blocks = self.kv_block_allocator.get_num_blocks(len(tokens))
+        blocks = [node.block for node in nodes] + self.kv_block_allocator.allocate(
+            num_blocks - len(nodes)
+        )
+        return blocks, self.prefix_cache.insert(tokens, blocks, nodes)
+
+    def test_prefix_cache(self):
+        tokens = list(range(10))
+        blocks, nodes = self.cache_sequence(tokens)
+        # Only the full blocks are cached
+        assert [node.block for node in nodes] == blocks[:2]
+        assert self.prefix_cache.num_blocks == 2
+
+        # A sequence with the same first block reads it, up to the maximum number of tokens
+        other_tokens = tokens[:4] + [20, 21, 22, 23]
+        other_nodes = self.prefix_cache.match(other_tokens, len(other_tokens) - 1)
+        assert other_nodes == nodes[:1]
+        assert self.prefix_cache.match(tokens, 7) == nodes[:1]
+        assert self.prefix_cache.match(tokens, 8) == nodes
+        assert nodes[0].ref_count == 4
+        self.prefix_cache.release(nodes[:1] + nodes)
+
+        # The same prefix cached twice keeps the blocks of the first sequence
+        blocks_twice = self.kv_block_allocator.allocate(2)
+        assert self.prefix_cache.insert(tokens, blocks_twice, []) == []
+        self.kv_block_allocator.free(blocks_twice)
+
+        # The blocks in use are not evicted
+        assert self.prefix_cache.evict(2) == 0
+        self.prefix_cache.release(nodes + other_nodes)
+        self.prefix_cache.match(other_tokens, len(other_tokens))
+        self.prefix_cache.release(nodes[:1])
+
+        # Beyond the maximum number of blocks, the least recently used are evicted, leaves first
+        num_free_blocks = self.kv_block_allocator.get_num_free_blocks()
+        _, new_nodes = self.cache_sequence(list(range(30, 42)))
+        assert self.prefix_cache.num_blocks == 4
+        assert self.kv_block_allocator.get_num_free_blocks() == num_free_blocks - 3 + 1
+        assert self.prefix_cache.match(tokens, len(tokens)) == nodes[:1]
+        assert self.prefix_cache.evict(10) == 0
+        self.prefix_cache.release(nodes[:1] + new_nodes)
+        assert self.prefix_cache.evict(10) == 4
+        assert self.prefix_cache.num_blocks == 0
+
+        self.prefix_cache.record_lookup(10, 8)
+        self.prefix_cache.record_lookup(6, 0)
+        metrics = self.prefix_cache.get_metrics()
+        assert metrics["requests"] == 2
+        assert metrics["hit-rate"] == 0.5
+        assert metrics["saved-tokens"] == 8
+        assert self.prefix_cache.get_metrics()["requests"] == 0
@@ -3,6 +3,7 @@ import torch
 from megatron.core.inference.common_inference_params import CommonInferenceParams
 from megatron.core.inference.inference_request import InferenceRequest, Status
 from megatron.core.inference.scheduler import Scheduler
+from megatron.core.inference.scheduling_policies import EarliestDeadlineFirstPolicy, PriorityPolicy, ShortestJobFirstPolicy
 
 class TestScheduler:
 
@@ -57,7 +58,70 @@ class TestScheduler:
 
         assert self.scheduler.have_requests_pending() == False, "Scheduler should not have any requests pending"
 
-
-
-        
-    
\ No newline at end of file
+    def test_scheduling_policies(self):
+        prompt = "sample prompt"
+        prompt_tokens = torch.randn(5)
+        requests = [
+            # (arrival_time, priority, deadline, num_tokens_to_generate)
+            (1.0, 0, 9.0, 20),
+            (2.0, 2, None, 30),
+            (3.0, 1, 5.0, 10),
+            (4.0, 2, 7.0, 10),
+            (5.0, 0, 6.0, 5),
+        ]
+        expected_orders = {
+            None: ['1', '2', '3', '4', '5'],
+            PriorityPolicy(): ['2', '4', '3', '1', '5'],
+            EarliestDeadlineFirstPolicy(): ['3', '5', '4', '1', '2'],
+            ShortestJobFirstPolicy(): ['5', '3', '4', '1', '2'],
+        }
+        for scheduling_policy, expected_order in expected_orders.items():
+            scheduler = Scheduler(max_batch_size=1, scheduling_policy=scheduling_policy)
+            # The first request fills the active pool, which then admits the others in the order of the policy
+            scheduler.add_request(prompt, prompt_tokens, CommonInferenceParams(), arrival_time=0.0)
+            for arrival_time, priority, deadline, num_tokens_to_generate in requests:
+                scheduler.add_request(prompt, prompt_tokens, CommonInferenceParams(num_tokens_to_generate=num_tokens_to_generate), arrival_time=arrival_time, priority=priority, deadline=deadline)
+            order = []
+            while scheduler.have_requests_pending():
+                for request in scheduler.active_request_pool.values():
+                    request.status = Status.COMPLETED
+                scheduler.update_requests_pools(scheduler.active_request_pool.copy())
+                order.extend(scheduler.active_request_pool)
+            assert order == expected_order, f"{type(scheduling_policy).__name__} served the requests in order {order} instead of {expected_order}"
+
+    def test_preemption(self):
+        prompt = "sample prompt"
+        prompt_tokens = torch.randn(5)
+        inference_parameters = CommonInferenceParams()
+        scheduler = Scheduler(max_batch_size=2, scheduling_policy=PriorityPolicy(), enable_preemption=True)
+
+        for priority in [0, 1, 0]:
+            scheduler.add_request(prompt, prompt_tokens, inference_parameters, priority=priority)
+        assert list(scheduler.active_request_pool) == ['0', '1'] and list(scheduler.waiting_request_pool) == ['2']
+        for request in scheduler.active_request_pool.values():
+            request.status = Status.ACTIVE_AND_GENERATING_TOKENS
+
+        # A request of equal priority does not preempt, one of higher priority preempts the last active request of lowest priority
+        scheduler.update_requests_pools({})
+        assert scheduler.pop_preempted_request_ids() == []
+        scheduler.add_request(prompt, prompt_tokens, inference_parameters, priority=2)
+        scheduler.update_requests_pools({})
+        assert list(scheduler.active_request_pool) == ['1', '3'], f"Active request pool should be ['1', '3'], but it is {list(scheduler.active_request_pool)}"
+        assert scheduler.pop_preempted_request_ids() == ['0']
+        assert scheduler.pop_preempted_request_ids() == []
+        preempted_request = scheduler.waiting_request_pool['0']
+        assert preempted_request.status == Status.WAITING_IN_QUEUE
+
+        # The preempted request comes back before the later requests of its priority
+        for request_id in ['1', '3']:
+            scheduler.active_request_pool[request_id].status = Status.COMPLETED
+        scheduler.update_requests_pools(scheduler.active_request_pool.copy())
+        assert list(scheduler.active_request_pool) == ['0', '2']
+        assert preempted_request.status == Status.ACTIVE_BUT_NOT_GENERATING_TOKENS
+
+        metrics = scheduler.get_metrics()
+        assert metrics["preemptions"] == 1
+        assert metrics["completed-requests"] == 2
+        assert 0.0 <= metrics["queue-time-p50"] <= metrics["queue-time-p99"]
+        assert 0.0 <= metrics["completion-time-p50"] <= metrics["completion-time-p99"]
+        assert scheduler.get_metrics()["preemptions"] == 0
@@ -0,0 +1,126 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""Compare the throughput of the GPT2 BPE engine against the original O(n^2) merge loop."""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from megatron.training.tokenizer.gpt2_tokenization import GPT2Tokenizer, get_pairs
+
+
+class ReferenceGPT2Tokenizer(GPT2Tokenizer):
+    """GPT2Tokenizer with the original BPE merge loop and unbounded word cache."""
+
+    def bpe(self, token):
+        if token in self.cache:
+            return self.cache[token]
+        word = tuple(token)
+        pairs = get_pairs(word)
+
+        if not pairs:
+            return token
+
+        while True:
+            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float('inf')))
+            if bigram not in self.bpe_ranks:
+                break
+            first, second = bigram
+            new_word = []
+            i = 0
+            while i < len(word):
+                try:
+                    j = word.index(first, i)
+                    new_word.extend(word[i:j])
+                    i = j
+                except BaseException:
+                    new_word.extend(word[i:])
+                    break
+
+                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
+                    new_word.append(first + second)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            new_word = tuple(new_word)
+            word = new_word
+            if len(word) == 1:
+                break
+            else:
+                pairs = get_pairs(word)
+        word = ' '.join(word)
+        self.cache[token] = word
+        return word
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', type=str, required=True,
+                        help='Path to the input JSONL file, optionally gzip-ed')
+    parser.add_argument('--json-key', type=str, default='text',
+                        help='Key of the document text in each JSON line')
+    parser.add_argument('--vocab-file', type=str, required=True,
+                        help='Path to the GPT2 vocab file')
+    parser.add_argument('--merge-file', type=str, required=True,
+                        help='Path to the GPT2 BPE merge file')
+    parser.add_argument('--max-documents', type=int, default=10000,
+                        help='Number of documents to tokenize')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='Number of documents per tokenize_batch call')
+    return parser.parse_args()
+
+
+def read_documents(args):
+    open_input = gzip.open if args.input.endswith('.gz') else open
+    documents = []
+    with open_input(args.input, 'rt', encoding='utf-8') as reader:
+        for line in reader:
+            if len(documents) == args.max_documents:
+                break
+            if line.strip():
+                documents.append(json.loads(line)[args.json_key])
+    return documents
+
+
+def benchmark(name, tokenize, documents):
+    t_beg = time.time()
+    ids = tokenize(documents)
+    elapsed = time.time() - t_beg
+    num_tokens = sum(map(len, ids))
+    print(f'{name:>24}: {len(documents) / elapsed:10.1f} docs/s, '
+          f'{num_tokens / elapsed:12.1f} tokens/s')
+    return ids
+
+
+def main():
+    args = get_args()
+    documents = read_documents(args)
+    print(f'Tokenizing {len(documents)} documents')
+
+    reference = ReferenceGPT2Tokenizer(args.vocab_file, args.merge_file)
+    tokenizer = GPT2Tokenizer(args.vocab_file, args.merge_file)
+    tokenizer_batch = GPT2Tokenizer(args.vocab_file, args.merge_file)
+
+    ids_reference = benchmark(
+        'reference', lambda documents: list(map(reference.encode, documents)), documents)
+    ids = benchmark(
+        'encode', lambda documents: list(map(tokenizer.encode, documents)), documents)
+    ids_batch = benchmark(
+        'encode_batch',
+        lambda documents: [ids for i in range(0, len(documents), args.batch_size)
+                           for ids in tokenizer_batch.encode_batch(
+                               documents[i:i + args.batch_size])],
+        documents)
+
+    assert ids == ids_reference, 'encode differs from the reference'
+    assert ids_batch == ids_reference, 'encode_batch differs from the reference'
+    print('The token ids are identical')
+
+
+if __name__ == '__main__':
+    main()
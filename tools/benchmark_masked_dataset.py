@@ -0,0 +1,317 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""Compare the throughput of the masked WordPiece datasets against the original masking loop."""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import numpy
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from megatron.core.datasets.bert_dataset import (
+    BERTMaskedWordPieceDataset,
+    BERTMaskedWordPieceDatasetConfig,
+)
+from megatron.core.datasets.indexed_dataset import IndexedDataset
+from megatron.core.datasets.t5_dataset import (
+    T5MaskedWordPieceDataset,
+    T5MaskedWordPieceDatasetConfig,
+)
+from megatron.core.datasets.utils import Split
+from megatron.training.tokenizer.tokenizer import _BertWordPieceTokenizer
+
+
+class ReferenceMaskingMixin:
+    """Mixin with the original per candidate masking loop, for masked WordPiece datasets"""
+
+    def _create_masked_lm_predictions(
+        self,
+        token_ids: List[int],
+        target_sequence_length: int,
+        numpy_random_state: numpy.random.RandomState,
+        word_starts: Optional[numpy.ndarray] = None,
+    ) -> Tuple[List[int], List[int], List[int], List[int], List[Tuple[List[int], List[int]]]]:
+        """The original per candidate implementation, which ignores the word starts"""
+        # Build the token sentence and word boundaries and the masking candidates
+        # e.g. [cls, id, ##id, ##id, id, ##id, sep, id, ##id, sep]
+        #    -> boundaries: [1, 1, 0, 0, 1, 0, 1, 1, 0, 1]
+        #    -> candidates with whole word masking: [[1, 2, 3], [4, 5], [7, 8]]
+        #    -> candidates sans whole word masking: [[1], [2], [3], [4], [5], [7], [8]]
+        boundaries = []
+        candidates = []
+        for i, token_id in enumerate(token_ids):
+            if token_id == self.config.tokenizer.cls or token_id == self.config.tokenizer.sep:
+                boundaries.append(1)
+            else:
+                if not self.config.tokenizer.inv_vocab[token_id].startswith("##"):
+                    boundaries.append(1)
+                    candidates.append([i])
+                else:
+                    boundaries.append(0)
+                    if self.config.masking_do_full_word and len(candidates) > 0:
+                        candidates[-1].append(i)
+                    else:
+                        candidates.append([i])
+
+        n_maskings = min(
+            self.config.masking_probability * target_sequence_length,
+            max(1, int(round(len(token_ids) * self.config.masking_probability))),
+        )
+
+        ngram_nvals = numpy.arange(self.config.masking_max_ngram, dtype=numpy.int64) + 1
+
+        # By default, the N-gram probabilites are inversely proportional to N
+        # e.g. N = 3
+        #    -> P = array([0.54545455, 0.27272727, 0.18181818])
+        nprobs = 1.0 / ngram_nvals
+        nprobs = nprobs / nprobs.sum(keepdims=True)
+        if self.config.masking_use_longer_ngrams:
+            nprobs = nprobs[::-1]
+
+        # Create a nested list of depth 3
+        #   layer 1: the candidate dimension
+        #   layer 2: the N-gram dimension
+        #   layer 3: the token dimension
+        candidate_ngrams = [
+            [candidates[idx : idx + n] for n in ngram_nvals] for idx in range(len(candidates))
+        ]
+        numpy_random_state.shuffle(candidate_ngrams)
+
+        masked_token_ids = list(token_ids)
+        masked_positions_and_labels = []
+        masked_spans = []
+        masked_indices = set()
+        for candidate_idx in range(len(candidate_ngrams)):
+            n_ngrams = len(candidate_ngrams[candidate_idx])
+
+            # Stop when we hit our desired number of maskings
+            if len(masked_positions_and_labels) >= n_maskings:
+                break
+
+            # Do nothing for candidates with no ngrams
+            if not candidate_ngrams[candidate_idx]:
+                continue
+
+            # Choose the initial value of N
+            if self.config.masking_use_geometric_distribution:
+                # Sample N from a geometric distribution with p = 0.2 and clip
+                # i.e. SpanBERT
+                #    -> https://arxiv.org/abs/1907.10529 (Section 3.1)
+                p = 0.2
+                n = min(numpy_random_state.geometric(p), self.config.masking_max_ngram)
+            else:
+                p = nprobs[:n_ngrams] / nprobs[:n_ngrams].sum(keepdims=True)
+                n = numpy_random_state.choice(ngram_nvals[:n_ngrams], p=p)
+
+            while True:
+                ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
+                n = n - 1
+                # Success: masking this N-gram puts us below the desired number of maskings
+                if n_maskings >= len(masked_positions_and_labels) + len(ngram_indices):
+                    skip_candidate = False
+                    break
+                # Failure: no N-grams remain for this candidate
+                if n == 0:
+                    skip_candidate = True
+                    break
+
+            # Do nothing for candidates whose 1-gram is too long
+            if skip_candidate:
+                continue
+
+            # Do nothing for candidate indices which have already been masked
+            if any(map(lambda idx: idx in masked_indices, ngram_indices)):
+                continue
+
+            # Mask the tokens and record their original positions and values
+            for index in ngram_indices:
+                masked_indices.add(index)
+                mask = self._get_token_mask(numpy_random_state)
+                if mask is None:
+                    masked_token_ids[index] = token_ids[index]
+                else:
+                    masked_token_ids[index] = mask
+                masked_positions_and_labels.append((index, token_ids[index]))
+
+            masked_spans.append((ngram_indices, [token_ids[index] for index in ngram_indices]))
+
+        assert len(masked_positions_and_labels) <= n_maskings
+
+        numpy_random_state.shuffle(candidate_ngrams)
+
+        if self.config.masking_do_permutation:
+
+            n_swappings = n_maskings
+
+            permuted_indices = set()
+            for candidate_idx in range(len(candidate_ngrams)):
+                n_ngrams = len(candidate_ngrams[candidate_idx])
+
+                if len(permuted_indices) >= n_swappings:
+                    break
+
+                # Do nothing for candidates with no ngrams
+                if not candidate_ngrams[candidate_idx]:
+                    continue
+
+                p = nprobs[:n_ngrams] / nprobs[:n_ngrams].sum(keepdims=True)
+                n = numpy.random.choice(ngram_nvals[:n_ngrams], p=p)
+
+                while True:
+                    ngram_indices = sum(candidate_ngrams[candidate_idx][n - 1], [])
+                    n = n - 1
+                    # Success: swapping this N-gram puts us below the desired number of swappings
+                    if n_swappings >= len(permuted_indices) + len(ngram_indices):
+                        skip_candidate = False
+                        break
+                    # Failure: no N-grams remain for this candidate
+                    if n == 0:
+                        skip_candidate = True
+                        break
+
+                # Do nothing for candidates whose 1-gram is too long
+                if skip_candidate:
+                    continue
+
+                # Do nothing for candidate indices which have already been masked or permuted
+                if any(
+                    map(lambda idx: idx in masked_indices or idx in permuted_indices, ngram_indices)
+                ):
+                    continue
+
+                for index in ngram_indices:
+                    permuted_indices.add(index)
+
+            assert len(permuted_indices) <= n_swappings
+
+            permuted_indices = sorted(permuted_indices)
+            permuted_indices_copy = list(permuted_indices)
+            numpy_random_state.shuffle(permuted_indices_copy)
+            masked_token_ids_copy = list(masked_token_ids)
+
+            for idx, idx_copy in zip(permuted_indices, permuted_indices_copy):
+                masked_token_ids[idx] = masked_token_ids_copy[idx_copy]
+                masked_positions_and_labels.append((idx, masked_token_ids_copy[idx]))
+
+        masked_positions_and_labels = sorted(masked_positions_and_labels, key=lambda x: x[0])
+        masked_positions = []
+        masked_labels = []
+        for position, label in masked_positions_and_labels:
+            masked_positions.append(position)
+            masked_labels.append(label)
+
+        masked_spans = sorted(masked_spans, key=lambda x: x[0][0])
+
+        return masked_token_ids, masked_positions, masked_labels, boundaries, masked_spans
+
+
+class ReferenceBERTMaskedWordPieceDataset(ReferenceMaskingMixin, BERTMaskedWordPieceDataset):
+    pass
+
+
+class ReferenceT5MaskedWordPieceDataset(ReferenceMaskingMixin, T5MaskedWordPieceDataset):
+    pass
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-path', type=str, required=True,
+                        help='Path prefix to the WordPiece tokenized .bin/.idx dataset')
+    parser.add_argument('--vocab-file', type=str, required=True,
+                        help='Path to the WordPiece vocab file')
+    parser.add_argument('--model', type=str, default='bert', choices=['bert', 't5'],
+                        help='Dataset to benchmark')
+    parser.add_argument('--seq-length', type=int, default=512,
+                        help='Sequence length, of the encoder for T5')
+    parser.add_argument('--num-samples', type=int, default=2000,
+                        help='Number of samples to draw')
+    parser.add_argument('--mask-prob', type=float, default=0.15,
+                        help='Probability of masking a candidate N-gram')
+    parser.add_argument('--max-ngram', type=int, default=3,
+                        help='Maximum length of the masked N-grams')
+    parser.add_argument('--permutation', action='store_true',
+                        help='Permute a subset of the candidate N-grams in addition')
+    parser.add_argument('--geometric', action='store_true',
+                        help='Draw the N-gram sizes from a geometric distribution')
+    return parser.parse_args()
+
+
+def get_config(args, path_to_cache):
+    tokenizer = _BertWordPieceTokenizer(
+        args.vocab_file, lower_case=True, vocab_extra_ids=100 if args.model == 't5' else 0
+    )
+    kwargs = dict(
+        random_seed=1234,
+        sequence_length=args.seq_length,
+        path_to_cache=path_to_cache,
+        tokenizer=tokenizer,
+        masking_probability=args.mask_prob,
+        short_sequence_probability=0.1,
+        masking_max_ngram=args.max_ngram,
+        masking_do_full_word=True,
+        masking_do_permutation=args.permutation,
+        masking_use_longer_ngrams=False,
+        masking_use_geometric_distribution=args.geometric,
+    )
+    if args.model == 't5':
+        return T5MaskedWordPieceDatasetConfig(sequence_length_decoder=128, **kwargs)
+    return BERTMaskedWordPieceDatasetConfig(classification_head=True, **kwargs)
+
+
+def get_sample(dataset, idx):
+    # The permutation draws from the global NumPy random state
+    numpy.random.seed(idx)
+    return dataset[idx]
+
+
+def benchmark(name, dataset, num_samples):
+    t_beg = time.time()
+    for idx in range(num_samples):
+        get_sample(dataset, idx)
+    elapsed = time.time() - t_beg
+    print(f'{name:>24}: {num_samples / elapsed:10.1f} samples/s')
+
+
+def main():
+    args = get_args()
+    indexed_dataset = IndexedDataset(args.data_path)
+    indexed_indices = numpy.arange(len(indexed_dataset.document_indices) - 1, dtype=numpy.int32)
+
+    if args.model == 't5':
+        dataset_classes = [ReferenceT5MaskedWordPieceDataset, T5MaskedWordPieceDataset]
+    else:
+        dataset_classes = [ReferenceBERTMaskedWordPieceDataset, BERTMaskedWordPieceDataset]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = get_config(args, temp_dir)
+        reference, dataset = [
+            dataset_class(
+                indexed_dataset,
+                args.data_path,
+                indexed_indices,
+                args.num_samples,
+                Split.train,
+                config,
+            )
+            for dataset_class in dataset_classes
+        ]
+        num_samples = min(args.num_samples, len(dataset))
+        print(f'Drawing {num_samples} {args.model} samples')
+
+        benchmark('reference', reference, num_samples)
+        benchmark('vectorized', dataset, num_samples)
+
+        for idx in range(num_samples):
+            sample_reference = get_sample(reference, idx)
+            sample = get_sample(dataset, idx)
+            assert sample_reference.keys() == sample.keys()
+            for key in sample:
+                assert numpy.array_equal(sample_reference[key], sample[key]), f'{key} differs'
+    print('The samples are identical')
+
+if __name__ == '__main__':
+    main()
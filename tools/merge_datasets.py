@@ -10,8 +10,10 @@ sys.path.append(
 from megatron.core.datasets.indexed_dataset import (
     IndexedDataset,
     IndexedDatasetBuilder,
+    IndexedDatasetManifestBuilder,
     get_bin_path,
     get_idx_path,
+    get_word_starts_path,
 )
 
 
@@ -40,6 +42,12 @@ def get_args():
         action="store_true",
         help="Whether the datasets are assumed to be multimodal"
     )
+    group.add_argument(
+        "--index-only",
+        action="store_true",
+        help="Merge only the index (.idx) files and reference the data (.bin) files from a "
+        "manifest (.manifest) file instead of copying them into a single data (.bin) file",
+    )
 
     args = parser.parse_args()
 
@@ -67,25 +75,47 @@ def main():
         if not os.path.isfile(os.path.join(args.input, basename)):
             continue
 
-        ext_pair = ".bin" if ext == ".idx" else ".idx"
-        assert os.path.isfile(
-            os.path.join(args.input, prefix) + ext_pair
-        ), f"ERROR: {ext_pair} file not provided for {os.path.join(args.input, prefix)}"
+        # A dataset is an .idx file with either a .bin file or, if multi-file, a .manifest file
+        path_prefix = os.path.join(args.input, prefix)
+        assert IndexedDataset.exists(
+            path_prefix
+        ), f"ERROR: .idx and .bin or .manifest file not provided for {path_prefix}"
 
         prefixes.add(prefix)
 
+    # Merge the word starts (.wsb) files only if every dataset has one
+    word_starts = all(
+        os.path.exists(get_word_starts_path(os.path.join(args.input, prefix)))
+        for prefix in prefixes
+    )
+
     builder = None
     for prefix in sorted(prefixes):
         if builder is None:
             dataset = IndexedDataset(os.path.join(args.input, prefix), multimodal=args.multimodal)
-            builder = IndexedDatasetBuilder(
-                get_bin_path(args.output_prefix), dtype=dataset.index.dtype, multimodal=args.multimodal
-            )
+            if args.index_only:
+                builder = IndexedDatasetManifestBuilder(
+                    dtype=dataset.index.dtype,
+                    multimodal=args.multimodal,
+                    word_starts=word_starts,
+                )
+            else:
+                builder = IndexedDatasetBuilder(
+                    get_bin_path(args.output_prefix),
+                    dtype=dataset.index.dtype,
+                    multimodal=args.multimodal,
+                    word_starts_path=(
+                        get_word_starts_path(args.output_prefix) if word_starts else None
+                    ),
+                )
             del dataset
 
         builder.add_index(os.path.join(args.input, prefix))
 
-    builder.finalize(get_idx_path(args.output_prefix))
+    if args.index_only:
+        builder.finalize(args.output_prefix)
+    else:
+        builder.finalize(get_idx_path(args.output_prefix))
 
 
 if __name__ == '__main__':
@@ -7,16 +7,26 @@ with more than 10 splits got filtered as well.
 """
 
 import argparse
-from functools import partial
+from functools import lru_cache, partial
+import hashlib
 import json
 import multiprocessing
 import nltk
+import numpy as np
+import os
 import pickle
 import re
 import string
 import sys
+import tempfile
 import time
 
+# The multiplier of the polynomial rolling hash of word sequences
+_NGRAM_HASH_BASE = np.uint64(1099511628211)
+
+# The sorted hashes of the ngrams, memory-mapped by every worker
+_ngram_index = None
+
 def get_words(text):
     # get all the lowercase words from text
     words, positions = [], []
@@ -53,37 +63,130 @@ def check_and_clean_text(args, words, ngrams, text, start_position, \
 
     seq = " ".join(words)
     if seq in ngrams:
-        print(" [matched]: {}".format(seq), flush=True)
-
-        if args.get_ngram_freq_only:
-            # increase freq of this seq and then only consider the later part
-            # of the text for further processing
-            if seq in local_ngram:
-                local_ngram[seq] += 1
-            else:
-                local_ngram[seq] = 1
-            #print(" [increased]: {} {}".format(seq, ngrams[seq]), flush=True)
-            if (start_position + len(seq) + 1) < len(text):
-                text_buf.append(text[start_position + len(seq) + 1:len(text)])
-            return False            
-
-        # split the text
-        text_first, text_second = split_text(text, start_position, \
-            args.remove_char_each_side, seq)
-
-        # first part of ngrams free
-        if len(text_first) > args.filter_text_char_len:
-            text_buf_ngram_free.append(text_first)
-
-        # add second part for further processing
-        if len(text_second) > args.filter_text_char_len:
-            text_buf.append(text_second)
-
+        clean_text(args, seq, text, start_position, text_buf_ngram_free, \
+            text_buf, local_ngram)
         return False # not ngram free
 
     # ngram free
     return True
 
+def clean_text(args, seq, text, start_position, text_buf_ngram_free, \
+    text_buf, local_ngram):
+    # record the matched seq, or split the text around it
+    print(" [matched]: {}".format(seq), flush=True)
+
+    if args.get_ngram_freq_only:
+        # increase freq of this seq and then only consider the later part
+        # of the text for further processing
+        if seq in local_ngram:
+            local_ngram[seq] += 1
+        else:
+            local_ngram[seq] = 1
+        #print(" [increased]: {} {}".format(seq, ngrams[seq]), flush=True)
+        if (start_position + len(seq) + 1) < len(text):
+            text_buf.append(text[start_position + len(seq) + 1:len(text)])
+        return
+
+    # split the text
+    text_first, text_second = split_text(text, start_position, \
+        args.remove_char_each_side, seq)
+
+    # first part of ngrams free
+    if len(text_first) > args.filter_text_char_len:
+        text_buf_ngram_free.append(text_first)
+
+    # add second part for further processing
+    if len(text_second) > args.filter_text_char_len:
+        text_buf.append(text_second)
+
+
+# 64-bit hash of a word, cached as the same words recur across documents
+@lru_cache(maxsize=1 << 20)
+def get_word_hash(word):
+    digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def get_word_hashes(words):
+    return np.fromiter((get_word_hash(word) for word in words), \
+        dtype=np.uint64, count=len(words))
+
+# rolling hashes of all the ngrams of the given lengths along the last axis
+# of word_hashes, salted by the ngram length
+def get_ngram_hashes(word_hashes, ngram_lens):
+    ngram_hashes = {}
+    hashes = word_hashes
+    for ngram_len in range(1, max(ngram_lens) + 1):
+        if ngram_len > 1:
+            hashes = hashes[..., :-1] * _NGRAM_HASH_BASE + \
+                word_hashes[..., ngram_len - 1:]
+        if ngram_len in ngram_lens:
+            salt = np.uint64((ngram_len * 0x9E3779B97F4A7C15) & (2**64 - 1))
+            ngram_hashes[ngram_len] = hashes ^ salt
+    return ngram_hashes
+
+# save the sorted hashes of the ngrams keys
+def build_ngram_index(ngrams, index_file):
+    start_time = time.time()
+    keys_by_len = {}
+    for ngram_key in ngrams.keys():
+        words = ngram_key.split()
+        keys_by_len.setdefault(len(words), []).append(words)
+
+    index = [np.zeros(0, dtype=np.uint64)]
+    for ngram_len, keys in keys_by_len.items():
+        word_hashes = get_word_hashes([word for words in keys for word in \
+            words]).reshape(len(keys), ngram_len)
+        index.append(get_ngram_hashes(word_hashes, [ngram_len])[ngram_len][:, 0])
+    index = np.unique(np.concatenate(index))
+    np.save(index_file, index)
+    print(" Ngram index of {} hashes saved to {} in {:.2f} seconds".format(\
+        index.shape[0], index_file, time.time() - start_time), flush=True)
+
+# initializer of the workers
+def load_ngram_index(index_file):
+    global _ngram_index
+    _ngram_index = np.load(index_file, mmap_mode='r')
+
+def in_ngram_index(hashes):
+    if _ngram_index.shape[0] == 0:
+        return np.zeros(hashes.shape, dtype=bool)
+    pos = np.searchsorted(_ngram_index, hashes)
+    pos[pos == _ngram_index.shape[0]] = 0
+    return _ngram_index[pos] == hashes
+
+# find the (start, length) of the first ngram of the index, in the order
+# in which free_ngram checks the dictionary
+def find_first_ngram(words, max_ngram_size, ngrams_freq_sorted):
+    num_starts = len(words) - max_ngram_size + 1
+    if num_starts <= 0:
+        return None
+    ngram_lens = [ngram_len for ngram_len, _ in ngrams_freq_sorted]
+    ngram_hashes = get_ngram_hashes(get_word_hashes(words), ngram_lens)
+
+    # each max ngram start, with the max ngram first then the lower ngrams,
+    # all looked up at once
+    found = in_ngram_index(np.concatenate([ngram_hashes[ngram_len][\
+        :num_starts] for ngram_len in ngram_lens])).reshape(-1, num_starts)
+    starts = np.flatnonzero(found.any(axis=0))
+    if starts.shape[0] > 0:
+        start = starts[0]
+        if max_ngram_size in ngram_lens and \
+            found[ngram_lens.index(max_ngram_size), start]:
+            return start, max_ngram_size
+        return start, ngram_lens[np.argmax(found[:, start])]
+
+    # the lower ngrams within the last max ngram
+    if num_starts > 1:
+        last_start = num_starts - 1
+        for ngram_len in ngram_lens:
+            if ngram_len == max_ngram_size:
+                continue
+            found = in_ngram_index(ngram_hashes[ngram_len][last_start:\
+                last_start + max_ngram_size - ngram_len + 1])
+            if found.any():
+                return last_start + np.argmax(found), ngram_len
+    return None
+
 
 def free_ngram(line, args, key, ngrams, ngrams_freq_sorted):
     # remove all the ngrams
@@ -102,7 +205,19 @@ def free_ngram(line, args, key, ngrams, ngrams_freq_sorted):
         # get the first one from the buffer
         text = text_buf.pop(0)
         words, positions = get_words(text)
-        
+
+        if args.ngram_lookup == 'index':
+            match = find_first_ngram(words, args.max_ngram_size, \
+                ngrams_freq_sorted)
+            if match is not None:
+                start, ngram_len = match
+                clean_text(args, " ".join(words[start:start+ngram_len]), \
+                    text, positions[start], text_buf_ngram_free, text_buf, \
+                    local_ngram)
+            elif not args.get_ngram_freq_only:
+                text_buf_ngram_free.append(text)
+            continue
+
         ngram_free = True
         # find each max n-grams and check dictionary
         for i in range(len(words) - args.max_ngram_size + 1):
@@ -283,6 +398,18 @@ def compute_ngram_freq_sorted(args, ngrams):
             ngrams_freq_sorted) -1 ][0]), flush=True)
     return ngrams_freq_sorted
 
+# create the pool of workers, which look up the ngrams in an index built
+# from the dictionary unless the dictionary lookup is used
+def create_pool(args, ngrams, index_name):
+    if args.ngram_lookup == 'dict':
+        return multiprocessing.Pool(args.num_threads), ngrams
+
+    index_file = os.path.join(args.ngram_index_dir, index_name + '.npy')
+    build_ngram_index(ngrams, index_file)
+    pool = multiprocessing.Pool(args.num_threads, \
+        initializer=load_ngram_index, initargs=(index_file,))
+    return pool, None
+
 def get_ngrams_below_threshold(args, ngrams, ngrams_below_threshold, \
     dedup_file, dedup_key, ngrams_freq_sorted):
 
@@ -291,26 +418,28 @@ def get_ngrams_below_threshold(args, ngrams, ngrams_below_threshold, \
     args.get_ngram_freq_only = True
  
     # Open the large file to process in parallel
-    num_workers = args.num_threads 
-    pool = multiprocessing.Pool(num_workers)
+    pool, worker_ngrams = create_pool(args, ngrams, 'ngrams')
     fin = open(dedup_file, 'r', encoding='utf-8')
     free_ngram_abt_partial=partial(free_ngram, args=args, key=dedup_key, \
-        ngrams=ngrams, ngrams_freq_sorted=ngrams_freq_sorted)
+        ngrams=worker_ngrams, ngrams_freq_sorted=ngrams_freq_sorted)
     free_ngrams_abt = pool.imap(free_ngram_abt_partial, fin, 500)
  
     counter = 0
     for _, _, _, local_ngram in free_ngrams_abt:
         counter += 1
         if counter % 1000 == 0:
-            print(' [compute_stat]> processed {} documents in {:.2f} seconds ...'.
-                    format(counter, time.time() - start_time), flush=True)
+            elapsed = time.time() - start_time
+            print(' [compute_stat]> processed {} documents in {:.2f} seconds '
+                '({:.1f} docs/s) ...'.format(counter, elapsed, counter / \
+                elapsed), flush=True)
         for local_key in local_ngram:
             if local_key in ngrams:
                 ngrams[local_key] += 1
         local_ngram = {}
 
-    print(' Time taken to compute statistics {:.2f} seconds'.format(time.time() - \
-        start_time), flush=True)
+    elapsed = time.time() - start_time
+    print(' Time taken to compute statistics {:.2f} seconds ({:.1f} docs/s)'.\
+        format(elapsed, counter / max(elapsed, 1e-9)), flush=True)
     pool.close()
     pool.join()
 
@@ -340,11 +469,11 @@ def clean_ngrams_below_threshold(args, ngrams_below_threshold, dedup_file, \
 
     # Open the large file to process in parallel
     counter = splitted = ignored = split_mt_thld = trimmed_count = 0
-    num_workers = args.num_threads
-    pool = multiprocessing.Pool(num_workers)
+    pool, worker_ngrams = create_pool(args, ngrams_below_threshold, \
+        'ngrams_below_threshold')
     fin = open(dedup_file, 'r', encoding='utf-8')
     free_ngram_clean_partial=partial(free_ngram, args=args, key=dedup_key, \
-        ngrams=ngrams_below_threshold, ngrams_freq_sorted=ngrams_freq_sorted)
+        ngrams=worker_ngrams, ngrams_freq_sorted=ngrams_freq_sorted)
     free_ngrams_clean = pool.imap(free_ngram_clean_partial, fin, 500)
  
     out_f = open(args.output, 'wb')
@@ -383,13 +512,17 @@ def clean_ngrams_below_threshold(args, ngrams_below_threshold, dedup_file, \
                     out_f.write('\n'.encode('utf-8'))
 
             if counter % 1000 == 0:
-                print(' [final]> processed {} documents in {:.2f} seconds ...'.
-                    format(counter, time.time() - start_time), flush=True)
+                elapsed = time.time() - start_time
+                print(' [final]> processed {} documents in {:.2f} seconds '
+                    '({:.1f} docs/s) ...'.format(counter, elapsed, counter / \
+                    elapsed), flush=True)
         except Exception as e:
             print('Error:', e)
 
-    print(' [final]> processed {} documents in {:.2f} seconds ...'.
-        format(counter, time.time() - start_time), flush=True)
+    elapsed = time.time() - start_time
+    print(' [final]> processed {} documents in {:.2f} seconds ({:.1f} docs/s)'\
+        ' ...'.format(counter, elapsed, counter / max(elapsed, 1e-9)), \
+        flush=True)
     
     print(' Total docs {} splitted {} ignored {} splits > theshold {} trimmed'\
         ' {}'.format(counter, splitted, ignored, split_mt_thld, trimmed_count)\
@@ -439,6 +572,14 @@ if __name__ == '__main__':
                        help='Remove any documents more than this many splits')
     parser.add_argument('--remove-char-each-side', type=int, default=200,
                        help='Maximum size of ngram to use.')
+    parser.add_argument('--ngram-lookup', type=str, default='index',
+                       choices=['index', 'dict'],
+                       help='Look up the ngrams of the documents in a sorted'
+                       ' array of 64-bit ngram hashes, memory-mapped by every'
+                       ' worker, or in the ngram dictionary')
+    parser.add_argument('--ngram-index-dir', type=str, default=None,
+                       help='Directory of the ngram index files, a temporary'
+                       ' directory by default')
 
     args = parser.parse_args()
 
@@ -446,6 +587,10 @@ if __name__ == '__main__':
     dedup_file = args.dedup_dataset[0]
     dedup_key = args.dedup_dataset[1]
 
+    if args.ngram_lookup == 'index' and args.ngram_index_dir is None:
+        ngram_index_dir = tempfile.TemporaryDirectory()
+        args.ngram_index_dir = ngram_index_dir.name
+
     # Setup multi-processing
     num_workers = args.num_threads
     if args.load_dictionary is None:
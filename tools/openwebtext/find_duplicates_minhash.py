@@ -0,0 +1,362 @@
+# Copyright (c) 2024, NVIDIA CORPORATION. All rights reserved.
+
+"""Find possible duplicate documents with MinHash-LSH, out of core and in parallel.
+
+The pipeline runs in three stages, each of which reports its throughput:
+
+1. signatures: for every input shard, hash the character n-grams of each document and compute
+   its MinHash signature in a process pool. Per shard, write the byte offset of each document
+   and, per LSH band, the run of (band hash, document) pairs sorted by band hash. A shard whose
+   outputs exist is skipped, so an interrupted run resumes with the first shard not done.
+2. buckets: per band, merge the sorted runs of all shards chunk by chunk and collect the buckets
+   of documents which share a band hash.
+3. verify: in a process pool, read the documents of each bucket back from the input shards and
+   compare them by the Jaccard similarity of their hashed n-grams.
+
+Only the buckets, i.e. the candidate duplicates, are held in memory. The output has the format of
+find_duplicates.py, for use with group_duplicate_url.py.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from functools import partial
+
+import numpy as np
+
+# A prime above 2**32, the modulus of the MinHash permutations
+_PRIME = (1 << 32) + 15
+
+_FNV_PRIME = np.uint64(1099511628211)
+
+_RUN_DTYPE = np.dtype([('hash', '<u8'), ('document', '<u8')])
+
+_SHARD_BITS = 32
+
+
+def hash_shingles(text, char_ngram):
+    """Return the sorted, unique 32-bit hashes of the byte n-grams of a text."""
+    data = np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+    if data.shape[0] == 0:
+        return np.zeros(0, dtype=np.uint64)
+    num_shingles = max(data.shape[0] - char_ngram + 1, 1)
+    hashes = np.zeros(num_shingles, dtype=np.uint64)
+    for k in range(min(char_ngram, data.shape[0])):
+        hashes = hashes * _FNV_PRIME + data[k:k + num_shingles]
+    return np.unique((hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF))
+
+
+def get_permutations(seed, num_seeds):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_seeds, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_seeds, dtype=np.uint64)
+    return a, b
+
+
+def minhash(shingles, a, b, chunk_size=4096):
+    """Return the 32-bit MinHash signature of a set of hashed shingles, one value per
+    permutation."""
+    signature = np.full(a.shape[0], _PRIME, dtype=np.uint64)
+    for beg in range(0, shingles.shape[0], chunk_size):
+        chunk = shingles[None, beg:beg + chunk_size]
+        values = (a[:, None] * chunk + b[:, None]) % np.uint64(_PRIME)
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return np.minimum(signature, np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+def band_hashes(signatures, num_bands):
+    """Return the hash of every band of every signature, of shape [documents, bands]."""
+    signatures = signatures.reshape(signatures.shape[0], num_bands, -1).astype(np.uint64)
+    hashes = np.full(signatures.shape[:2], num_bands, dtype=np.uint64)
+    for row in range(signatures.shape[2]):
+        hashes = hashes * _FNV_PRIME + signatures[:, :, row]
+    # Tell the bands apart, so that equal rows in different bands do not collide
+    return hashes * _FNV_PRIME + np.arange(num_bands, dtype=np.uint64)
+
+
+def compute_signature(line, key, args, a, b):
+    try:
+        myjson = json.loads(line)
+        # The document is reported by its id, so it must have one
+        myjson[key]
+        shingles = hash_shingles(myjson['text'], args.char_ngram)
+    except Exception as e:
+        print('Error:', e)
+        return None
+    # Empty documents would all share a bucket, and are never similar
+    if shingles.shape[0] == 0:
+        return None
+    return minhash(shingles, a, b)
+
+
+def get_shard_dir(args, shard):
+    return os.path.join(args.work_dir, 'shard_{:05d}'.format(shard))
+
+
+def compute_shard_signatures(args, shard, input_file, key, pool, a, b):
+    """Stage 1 for one shard. Return the number of documents of the shard."""
+    shard_dir = get_shard_dir(args, shard)
+    if os.path.isdir(shard_dir):
+        num_documents = np.load(os.path.join(shard_dir, 'offsets.npy'), mmap_mode='r').shape[0]
+        print(' [signatures]> shard {} is done, skipping it'.format(input_file), flush=True)
+        return num_documents
+
+    # The byte offset of every line fed to the pool, in order
+    offsets = []
+
+    def read_lines(fin):
+        offset = 0
+        for line in fin:
+            if line.strip():
+                offsets.append(offset)
+                yield line
+            offset += len(line)
+
+    signature_partial = partial(compute_signature, key=key, args=args, a=a, b=b)
+    signatures = []
+    kept_offsets = []
+    with open(input_file, 'rb') as fin:
+        for i, signature in enumerate(pool.imap(signature_partial, read_lines(fin), 64)):
+            if signature is not None:
+                kept_offsets.append(offsets[i])
+                signatures.append(signature)
+    signatures = np.array(signatures, dtype=np.uint32).reshape(-1, args.num_seeds)
+
+    # Write the outputs to a temporary directory and rename it when done
+    shard_dir_tmp = shard_dir + '.tmp'
+    shutil.rmtree(shard_dir_tmp, ignore_errors=True)
+    os.makedirs(shard_dir_tmp)
+    np.save(os.path.join(shard_dir_tmp, 'offsets.npy'), np.array(kept_offsets, dtype=np.int64))
+    hashes = band_hashes(signatures, args.num_bands)
+    documents = (np.uint64(shard) << np.uint64(_SHARD_BITS)) + np.arange(
+        signatures.shape[0], dtype=np.uint64)
+    for band in range(args.num_bands):
+        run = np.empty(signatures.shape[0], dtype=_RUN_DTYPE)
+        run['hash'] = hashes[:, band]
+        run['document'] = documents
+        run.sort(order=['hash', 'document'])
+        np.save(os.path.join(shard_dir_tmp, 'band_{:03d}.npy'.format(band)), run)
+    os.rename(shard_dir_tmp, shard_dir)
+    return signatures.shape[0]
+
+
+def merge_sorted_runs(runs, chunk_size):
+    """Merge runs sorted by hash into blocks sorted by hash, holding back the pairs of the last
+    hash of each block until the next, so that no hash spans two blocks."""
+    positions = [0] * len(runs)
+    carry = np.empty(0, dtype=_RUN_DTYPE)
+    while True:
+        chunks = [run[pos:pos + chunk_size] for run, pos in zip(runs, positions)]
+        active = [i for i, chunk in enumerate(chunks) if chunk.shape[0] > 0]
+        if not active:
+            break
+        # No run holds a hash below the bound beyond its current chunk
+        bound = min(chunks[i]['hash'][-1] for i in active)
+        parts = [carry]
+        for i in active:
+            end = np.searchsorted(chunks[i]['hash'], bound, side='right')
+            parts.append(chunks[i][:end])
+            positions[i] += end
+        block = np.concatenate(parts)
+        block.sort(order=['hash', 'document'])
+        # The runs may hold more pairs of the bound hash
+        last = np.searchsorted(block['hash'], bound, side='left')
+        carry = block[last:]
+        if last > 0:
+            yield block[:last]
+    if carry.shape[0] > 0:
+        yield carry
+
+
+def find_buckets(args, num_shards):
+    """Stage 2. Return the set of buckets, as sorted tuples of documents, of size above one."""
+    buckets = set()
+    for band in range(args.num_bands):
+        runs = [
+            np.load(os.path.join(get_shard_dir(args, shard), 'band_{:03d}.npy'.format(band)),
+                    mmap_mode='r')
+            for shard in range(num_shards)
+        ]
+        for block in merge_sorted_runs(runs, args.merge_chunk_size):
+            starts = np.flatnonzero(np.concatenate(
+                ([True], block['hash'][1:] != block['hash'][:-1])))
+            sizes = np.diff(np.append(starts, block.shape[0]))
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                buckets.add(tuple(block['document'][start:start + size].tolist()))
+    return buckets
+
+
+def jaccard(set_a, set_b, args):
+    if len(set_a) < 1 or len(set_b) < 1:
+        return 0.0
+
+    intersection = np.intersect1d(set_a, set_b, assume_unique=True).shape[0]
+
+    if args.jaccard == 'min':
+        return intersection / min(len(set_a), len(set_b))
+    elif args.jaccard == 'max':
+        return intersection / max(len(set_a), len(set_b))
+    else:
+        return intersection / (len(set_a) + len(set_b) - intersection)
+
+
+_shard_offsets = {}
+
+
+def read_document(args, inputs, document):
+    """Read the id and the hashed shingles of a document back from its input shard."""
+    shard, index = int(document) >> _SHARD_BITS, int(document) & ((1 << _SHARD_BITS) - 1)
+    if shard not in _shard_offsets:
+        _shard_offsets[shard] = np.load(
+            os.path.join(get_shard_dir(args, shard), 'offsets.npy'), mmap_mode='r')
+    input_file, key = inputs[shard]
+    with open(input_file, 'rb') as fin:
+        fin.seek(int(_shard_offsets[shard][index]))
+        myjson = json.loads(fin.readline())
+    return myjson[key], hash_shingles(myjson['text'], args.char_ngram)
+
+
+def verify_bucket(bucket, args, inputs):
+    """Stage 3 for one bucket, as url_pairs_to_remove of find_duplicates.py."""
+    rng = np.random.default_rng([args.seed, *bucket[:2]])
+    documents = dict(read_document(args, inputs, document) for document in bucket)
+    bucket_urls = list(documents)
+
+    remove_urls_list = []
+    deduped_local, counter_local = 0, 0
+    iteration = 0
+    while len(bucket_urls) > 1:
+        if args.heuristic_iter != -1 and iteration == args.heuristic_iter:
+            break
+
+        main_url = bucket_urls[rng.integers(0, len(bucket_urls))]
+        remove_urls = []
+        remaining_urls = []
+        for other_url in bucket_urls:
+            counter_local += 1
+            if other_url == main_url:
+                continue
+            jaccard_sim = jaccard(documents[main_url], documents[other_url], args)
+            if jaccard_sim > args.jaccard_threshold:
+                remove_urls.append({other_url: jaccard_sim})
+                deduped_local += 1
+            else:
+                remaining_urls.append(other_url)
+        bucket_urls = remaining_urls
+
+        if len(remove_urls) > 0:
+            remove_urls_list.append({main_url: remove_urls})
+        iteration += 1
+    return remove_urls_list, deduped_local, counter_local
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs', nargs='*', required=True,
+                        help='Pairwise list of the input shards and keys, '
+                        'e.g. --inputs cc_0.json cc_id cc_1.json cc_id news.json news_id')
+    parser.add_argument('--work-dir', type=str, required=True,
+                        help='Directory to hold the signatures and band runs of every shard. '
+                        'Rerun with the same directory to resume.')
+    parser.add_argument('--output', type=str, required=True,
+                        help='Output file name that consists of all ids'
+                        ' with matching similarities')
+    parser.add_argument('--num-workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--seed', type=int, default=1234,
+                        help='Random seed of the MinHash permutations and heuristics')
+    parser.add_argument('--char-ngram', type=int, default=5,
+                        help='Length in bytes of the shingles')
+    parser.add_argument('--num-seeds', type=int, default=100,
+                        help='Number of MinHash permutations. Note that'
+                        ' this value should be divisible by num-bands')
+    parser.add_argument('--num-bands', type=int, default=10,
+                        help='Number of LSH bands')
+    parser.add_argument('--jaccard', type=str, default='union',
+                        choices=['union', 'min', 'max'], help='Jaccard'
+                        ' similarity computation')
+    parser.add_argument('--jaccard-threshold', type=float, default=0.5,
+                        help='Similarity above which to report a pair')
+    parser.add_argument('--heuristic-iter', type=int, default=1,
+                        help='Number of iterations to run the heuristics'
+                        ': use -1 for exact')
+    parser.add_argument('--merge-chunk-size', type=int, default=1 << 20,
+                        help='Number of pairs to read at a time from each band run')
+    args = parser.parse_args()
+
+    assert len(args.inputs) % 2 == 0
+    assert args.num_seeds % args.num_bands == 0
+    assert len(args.inputs) // 2 < (1 << _SHARD_BITS)
+    return args
+
+
+def main():
+    args = get_args()
+    inputs = list(zip(args.inputs[::2], args.inputs[1::2]))
+
+    # The shard outputs may only be reused with the same parameters
+    os.makedirs(args.work_dir, exist_ok=True)
+    config = {
+        'seed': args.seed,
+        'char_ngram': args.char_ngram,
+        'num_seeds': args.num_seeds,
+        'num_bands': args.num_bands,
+        'inputs': inputs,
+    }
+    config_path = os.path.join(args.work_dir, 'config.json')
+    if os.path.exists(config_path):
+        with open(config_path) as reader:
+            saved = json.load(reader)
+        saved['inputs'] = [tuple(pair) for pair in saved['inputs']]
+        assert saved == config, 'the work directory holds the outputs of other parameters'
+    else:
+        with open(config_path, 'w') as writer:
+            json.dump(config, writer)
+
+    a, b = get_permutations(args.seed, args.num_seeds)
+    pool = multiprocessing.Pool(args.num_workers)
+
+    print('computing signatures ...', flush=True)
+    start_time = time.time()
+    num_documents = 0
+    for shard, (input_file, key) in enumerate(inputs):
+        num_documents += compute_shard_signatures(args, shard, input_file, key, pool, a, b)
+        elapsed = time.time() - start_time
+        print(' [signatures]> processed {} documents in {:.2f} seconds ({:.1f} docs/s)'.format(
+            num_documents, elapsed, num_documents / elapsed), flush=True)
+
+    print('finding buckets ...', flush=True)
+    start_time = time.time()
+    buckets = find_buckets(args, len(inputs))
+    elapsed = time.time() - start_time
+    print(' [buckets]> found {} buckets among {} documents in {:.2f} seconds '
+          '({:.1f} docs/s)'.format(len(buckets), num_documents, elapsed,
+                                   num_documents / elapsed), flush=True)
+
+    print('verifying buckets ...', flush=True)
+    start_time = time.time()
+    deduped, counter = 0, 0
+    verify_partial = partial(verify_bucket, args=args, inputs=inputs)
+    with open(args.output, 'wb') as f_out:
+        for remove_urls_list, deduped_local, counter_local in pool.imap_unordered(
+                verify_partial, sorted(buckets), 16):
+            deduped += deduped_local
+            counter += counter_local
+            for each_url_remove in remove_urls_list:
+                f_out.write(json.dumps(each_url_remove, ensure_ascii=False).encode('utf-8'))
+                f_out.write('\n'.encode('utf-8'))
+    elapsed = time.time() - start_time
+    print(' [verify]> compared {} documents in {:.2f} seconds ({:.1f} docs/s) and deduped {} '
+          'documents'.format(counter, elapsed, counter / max(elapsed, 1e-9), deduped), flush=True)
+
+    pool.close()
+    pool.join()
+    print('done :-)')
+
+
+if __name__ == '__main__':
+
+    main()
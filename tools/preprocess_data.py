@@ -51,6 +51,13 @@ class Encoder(object):
     def initializer(self):
         # Use Encoder class as a container for global data
         Encoder.tokenizer = build_tokenizer(self.args)
+        if self.args.word_starts:
+            # A token starts a word unless it is a WordPiece "##" piece
+            inv_vocab = Encoder.tokenizer.inv_vocab
+            Encoder.word_start_lookup = np.ones(max(inv_vocab) + 1, dtype=bool)
+            for token_id, token in inv_vocab.items():
+                if token.startswith("##"):
+                    Encoder.word_start_lookup[token_id] = False
         if self.args.split_sentences:
             if not nltk_available:
                 print("NLTK is not available to split sentences.")
@@ -87,6 +94,7 @@ class Encoder(object):
         data = json.loads(json_line)
         ids = {}
         lens = {}
+        word_starts = {}
         for key in self.args.json_keys:
             text = data[key]
             if isinstance(text, list):
@@ -95,8 +103,11 @@ class Encoder(object):
                 sentences = [text]
             doc_ids = []
             sentence_lens = []
-            for sentence in sentences:
-                sentence_ids = Encoder.tokenizer.tokenize(sentence)
+            if hasattr(Encoder.tokenizer, "tokenize_batch"):
+                sentences_ids = Encoder.tokenizer.tokenize_batch(sentences)
+            else:
+                sentences_ids = [Encoder.tokenizer.tokenize(sentence) for sentence in sentences]
+            for sentence_ids in sentences_ids:
                 if len(sentence_ids) > 0:
                     doc_ids.extend(sentence_ids)
                     sentence_lens.append(len(sentence_ids))
@@ -105,7 +116,11 @@ class Encoder(object):
                 sentence_lens[-1] += 1
             ids[key] = doc_ids
             lens[key] = sentence_lens
-        return ids, lens, len(json_line)
+            if self.args.word_starts:
+                word_starts[key] = Encoder.word_start_lookup[np.array(doc_ids, dtype=np.int64)]
+            else:
+                word_starts[key] = None
+        return ids, lens, word_starts, len(json_line)
 
 
 class Partition(object):
@@ -160,6 +175,7 @@ class Partition(object):
 
         output_bin_files = {}
         output_idx_files = {}
+        output_wsb_files = {}
         builders = {}
 
         for key in self.args.json_keys:
@@ -167,23 +183,29 @@ class Partition(object):
                                                           key, level)
             output_idx_files[key] = "{}_{}_{}.idx".format(output_prefix,
                                                           key, level)
+            output_wsb_files[key] = "{}_{}_{}.wsb".format(output_prefix,
+                                                          key, level)
             builders[key] = indexed_dataset.IndexedDatasetBuilder(
                 output_bin_files[key],
                 dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
+                word_starts_path=output_wsb_files[key] if self.args.word_starts else None,
             )
 
         startup_end = time.time()
         proc_start = time.time()
         total_bytes_processed = 0
         print("Time to startup:", startup_end - startup_start)
-        for i, (doc, sentence_lens, bytes_processed) in enumerate(encoded_docs, start=1):
+        for i, (doc, sentence_lens, word_starts, bytes_processed) in enumerate(encoded_docs,
+                                                                               start=1):
             total_bytes_processed += bytes_processed
             for key in doc.keys():
-                builders[key].add_document(doc[key], sentence_lens[key])
+                builders[key].add_document(doc[key], sentence_lens[key],
+                                           word_starts=word_starts[key])
             self.print_processing_stats(i, proc_start, total_bytes_processed)
 
         fin.close()
-        builders[key].finalize(output_idx_files[key])
+        for key in builders.keys():
+            builders[key].finalize(output_idx_files[key])
 
 
 def get_args():
@@ -215,6 +237,12 @@ def get_args():
                        help='Path to the BPE merge file (if necessary).')
     group.add_argument('--append-eod', action='store_true',
                        help='Append an <eod> token to the end of a document.')
+    group.add_argument('--word-starts', action='store_true',
+                       help='Also write a .wsb file next to the .bin and .idx '
+                            'files with a bitmap of the tokens which start a '
+                            'word, i.e. which are not "##" pieces, for the '
+                            'masked WordPiece datasets. Only for the '
+                            'BertWordPiece tokenizers.')
     group.add_argument('--lang', type=str, default='english',
                        help='Language to use for NLTK-powered sentence splitting.')
     group = parser.add_argument_group(title='output data')
@@ -233,12 +261,21 @@ def get_args():
     group.add_argument('--keep-sequential-samples', action='store_true',
                        help='Ensure ordering of samples in .jsonl files is '
                             'preserved when using partitions>1.')
+    group.add_argument('--index-only-merge', action='store_true',
+                       help='When using partitions>1, merge only the partition '
+                            '.idx files and reference the partition .bin files '
+                            'from a .manifest file instead of copying them into '
+                            'a single .bin file.')
     args = parser.parse_args()
     args.keep_empty = False
 
     if args.tokenizer_type.lower().startswith('bert') and not args.split_sentences:
         print("Are you sure you don't want to split sentences?")
 
+    if args.word_starts:
+        assert args.tokenizer_type.lower().startswith('bert'), \
+            '--word-starts is only supported for the BertWordPiece tokenizers'
+
     # some default/dummy values for the tokenizer
     args.rank = 1
     args.make_vocab_size_divisible_by = 128
@@ -388,21 +425,30 @@ def main():
     tokenizer = build_tokenizer(args)
 
     for key in args.json_keys:
-        output_bin_files[key] = "{}_{}_{}.bin".format(args.output_prefix,
-                                                      key, level)
-        output_idx_files[key] = "{}_{}_{}.idx".format(args.output_prefix,
-                                                      key, level)
-        builders[key] = indexed_dataset.IndexedDatasetBuilder(
-            output_bin_files[key],
-            dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
-        )
+        output_prefix = "{}_{}_{}".format(args.output_prefix, key, level)
+        output_bin_files[key] = "{}.bin".format(output_prefix)
+        output_idx_files[key] = "{}.idx".format(output_prefix)
+        if args.index_only_merge:
+            builders[key] = indexed_dataset.IndexedDatasetManifestBuilder(
+                dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
+                word_starts=args.word_starts,
+            )
+        else:
+            builders[key] = indexed_dataset.IndexedDatasetBuilder(
+                output_bin_files[key],
+                dtype=indexed_dataset.DType.optimal_dtype(tokenizer.vocab_size),
+                word_starts_path="{}.wsb".format(output_prefix) if args.word_starts else None,
+            )
 
         for name in in_ss_out_names:
             parition_output_prefix = name['output_prefix']
             full_partition_output_prefix = "{}_{}_{}".format(parition_output_prefix,
                                                              key, level)
             builders[key].add_index(full_partition_output_prefix)
-        builders[key].finalize(output_idx_files[key])
+        if args.index_only_merge:
+            builders[key].finalize(output_prefix)
+        else:
+            builders[key].finalize(output_idx_files[key])
 
 
 if __name__ == '__main__':